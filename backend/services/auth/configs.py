@@ -10,6 +10,7 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "changeme-in-production-generate-with-secrets-token-hex-32"
     ALGORITHM: str = "HS256"
     ALLOWED_ORIGINS: str =  "http://localhost:5173,http://13.50.234.104:5173"
+    REDIS_URL: str = "redis://redis:6379"   # session-cache invalidation for other services
 
 
     model_config = SettingsConfigDict(
@@ -4,14 +4,27 @@ from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta, timezone
+import hashlib
+import logging
+import redis.asyncio as aioredis
 import models
 import schemas
 import crud
 from authenticate import verify_password, create_session, expire_session, decode_access_token
-from configs import get_db, Base, engine, ALLOWED_ORIGINS
+from configs import get_db, settings, Base, engine, ALLOWED_ORIGINS
 from sqlalchemy import text
 
 
+_log = logging.getLogger(__name__)
+
+# ── Redis client (initialized in lifespan) ────────────────────────────────────
+# Services that cache validated sessions (sensor) listen on this channel.
+_redis: aioredis.Redis | None = None
+
+_SESSION_KEY_PREFIX      = "viq:session:"
+_SESSION_INVALIDATE_CHAN = "viq:session:invalidate"
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     Base.metadata.create_all(bind=engine)
@@ -23,8 +36,20 @@ async def lifespan(app: FastAPI):
             "ELSE last_value END FROM tenants_tenant_id_seq"
         ))
         conn.commit()
+
+    global _redis
+    try:
+        _redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+        await _redis.ping()
+    except Exception as exc:
+        _log.warning("Redis unavailable — session invalidation broadcasts disabled: %s", exc)
+        _redis = None
+
     yield
 
+    if _redis:
+        await _redis.aclose()
+
 
 app = FastAPI(title="VerdantIQ Auth Service", version="1.0.0", lifespan=lifespan)
 
@@ -37,6 +62,18 @@ app.add_middleware(
 )
 
 
+async def broadcast_session_invalidation(token: str) -> None:
+    """Drop the token from shared session caches and tell replicas to evict it."""
+    if not _redis:
+        return
+    key = hashlib.sha256(token.encode()).hexdigest()
+    try:
+        await _redis.delete(_SESSION_KEY_PREFIX + key)
+        await _redis.publish(_SESSION_INVALIDATE_CHAN, key)
+    except Exception as exc:
+        _log.warning("Session invalidation broadcast failed: %s", exc)
+
+
 # ─── Auth dependency ──────────────────────────────────────────────────────────
 
 async def get_current_user(request: Request, db: Session = Depends(get_db)):
@@ -122,6 +159,7 @@ async def logout_user(
         ).first()
         if db_session:
             expire_session(db, db_session.session_id, current_user.user_id)
+        await broadcast_session_invalidation(token)
     response.delete_cookie("access_token")
     crud.log_activity(db, current_user.user_id, current_user.tenant_id, "logout", {})
     return {"message": "Logged out successfully"}
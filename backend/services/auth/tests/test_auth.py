@@ -105,6 +105,24 @@ def test_logout(client, user_data, login_data):
     assert response.status_code == 401
 
 
+def test_logout_broadcasts_session_invalidation(client, user_data, login_data, monkeypatch):
+    """Logout evicts the token from shared session caches (keyed by sha256)."""
+    import hashlib
+    from unittest.mock import AsyncMock
+    import main
+
+    fake_redis = AsyncMock()
+    monkeypatch.setattr(main, "_redis", fake_redis)
+    client.post("/register", json=user_data)
+    client.post("/login", json=login_data)
+    token = client.cookies.get("access_token")
+
+    assert client.post("/logout").status_code == 200
+    key = hashlib.sha256(token.encode()).hexdigest()
+    fake_redis.delete.assert_awaited_once_with(f"viq:session:{key}")
+    fake_redis.publish.assert_awaited_once_with("viq:session:invalidate", key)
+
+
 def test_health(client):
     response = client.get("/health")
     assert response.status_code == 200
@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import UTC, datetime
+from typing import Any, Protocol
+
+import redis.asyncio as aioredis
+
+_log = logging.getLogger(__name__)
+
+# Redis key / channel shared with the auth service (it publishes on logout)
+SESSION_KEY_PREFIX      = "viq:session:"
+SESSION_INVALIDATE_CHAN = "viq:session:invalidate"
+# Channel the tenant service publishes a tenant_id on when billing status may change
+BILLING_INVALIDATE_CHAN = "viq:billing:invalidate"
+# Catalog name published when Iceberg DDL changes the /query/schema tree
+SCHEMA_INVALIDATE_CHAN  = "viq:schema:invalidate"
+# Newest readings per sensor, kept by the data service's hot state consumer
+HOT_READINGS_KEY        = "viq:hot:readings:{tenant_id}:{sensor_id}"
+# Set once a sensor's readings were filled from Trino: the sorted set then
+# holds everything Trino would return, however few readings there are
+HOT_WARM_KEY            = "viq:hot:warm:{tenant_id}:{sensor_id}"
+
+
+def token_hash(token: str) -> str:
+    """Stable cache key for a JWT — the raw token never leaves the request."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+# ── Generic in-process LRU + TTL cache ────────────────────────────────────────
+
+class TTLCache:
+    """Bounded LRU cache with a per-entry time-to-live. Thread-safe.
+
+    Every pop() or clear() bumps generation. A fill that read its value before
+    an invalidation passes the generation it started at to set(), which then
+    drops the value instead of caching what the invalidation meant to evict.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float | None = None,
+            generation: int | None = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# ── Session validation cache ──────────────────────────────────────────────────
+
+class SessionCache:
+    """Caches validated sessions for get_current_user.
+
+    Tier 1 is an in-process TTLCache, tier 2 an optional Redis key shared by all
+    sensor replicas. Entries are keyed by sha256(token) and never outlive the
+    session's own expires_at. last_active bumps are recorded in memory and
+    drained in one batch by drain_touches().
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.local = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.redis: aioredis.Redis | None = None
+        # session_id → most recent activity, drained by the periodic flush
+        self._touches: dict[int, datetime] = {}
+        self._touch_lock = threading.Lock()
+
+    def _entry_ttl(self, entry: dict) -> float:
+        remaining = (datetime.fromisoformat(entry["expires_at"]) - _utcnow()).total_seconds()
+        return min(self.ttl, remaining)
+
+    async def get(self, token_key: str) -> dict | None:
+        entry: dict | None = self.local.get(token_key)
+        if entry is None and self.redis:
+            try:
+                raw = await self.redis.get(SESSION_KEY_PREFIX + token_key)
+            except Exception as exc:
+                _log.warning("Session cache Redis read failed: %s", exc)
+                raw = None
+            if raw:
+                entry = json.loads(raw)
+                ttl = self._entry_ttl(entry)
+                if ttl > 0:
+                    self.local.set(token_key, entry, ttl)
+        if entry is None:
+            return None
+        if datetime.fromisoformat(entry["expires_at"]) < _utcnow():
+            await self.invalidate(token_key)
+            return None
+        return entry
+
+    async def set(self, token_key: str, entry: dict) -> None:
+        ttl = self._entry_ttl(entry)
+        if ttl <= 0:
+            return
+        self.local.set(token_key, entry, ttl)
+        if self.redis:
+            try:
+                await self.redis.set(
+                    SESSION_KEY_PREFIX + token_key, json.dumps(entry), ex=max(1, int(ttl))
+                )
+            except Exception as exc:
+                _log.warning("Session cache Redis write failed: %s", exc)
+
+    async def invalidate(self, token_key: str) -> None:
+        self.local.pop(token_key)
+        if self.redis:
+            try:
+                await self.redis.delete(SESSION_KEY_PREFIX + token_key)
+            except Exception as exc:
+                _log.warning("Session cache Redis delete failed: %s", exc)
+
+    def clear(self) -> None:
+        self.local.clear()
+        with self._touch_lock:
+            self._touches.clear()
+
+    # ── last_active coalescing ───────────────────────────────────────────────
+
+    def touch(self, session_id: int) -> None:
+        with self._touch_lock:
+            self._touches[session_id] = _utcnow()
+
+    def drain_touches(self) -> dict[int, datetime]:
+        with self._touch_lock:
+            touches, self._touches = self._touches, {}
+        return touches
+
+
+# ── Hot sensor readings ───────────────────────────────────────────────────────
+
+def _parse_timestamp(timestamp: str) -> datetime | None:
+    """An aware datetime from ISO-8601 or Trino's text form (naive = UTC)."""
+    text = timestamp.strip().removesuffix(" UTC").replace("Z", "+00:00")
+    try:
+        ts = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=UTC)
+
+
+def reading_timestamp(value: datetime | str) -> str:
+    """A reading timestamp as ISO-8601 UTC with milliseconds, the format the
+    data service writes to the hot readings sets; unparseable text as is."""
+    text = value.isoformat() if isinstance(value, datetime) else value
+    ts = _parse_timestamp(text)
+    if ts is None:
+        return text
+    return ts.astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def _epoch_ms(timestamp: str) -> float:
+    """Sort score for a reading timestamp."""
+    ts = _parse_timestamp(timestamp)
+    return ts.timestamp() * 1000 if ts else 0.0
+
+
+class HotReadings:
+    """A sensor's newest readings from the Redis sorted set the data service
+    keeps (data-services/data_service/hot_state.py). A no-op without Redis.
+
+    A set holding fewer than limit readings may just have started filling
+    after older readings reached Iceberg, so it is only served once it is
+    full or was filled from Trino (fill()); anything else is a cold miss.
+    """
+
+    def __init__(self, limit: int, ttl: int):
+        self.limit = limit
+        self.ttl = ttl
+        self.redis: aioredis.Redis | None = None
+
+    async def latest(self, tenant_id: int, sensor_id: str) -> list[dict] | None:
+        """Newest-first {"timestamp", "value"} dicts, or None on a cold miss."""
+        if not self.redis:
+            return None
+        ids = {"tenant_id": tenant_id, "sensor_id": sensor_id}
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.zrevrange(HOT_READINGS_KEY.format(**ids), 0, -1, withscores=True)
+            pipe.exists(HOT_WARM_KEY.format(**ids))
+            members, warm = await pipe.execute()
+        except Exception as exc:
+            _log.warning("Hot readings Redis read failed: %s", exc)
+            return None
+        points, last_score = [], None
+        for member, score in members:
+            # A reading both filled from Trino and added by the consumer
+            if score == last_score:
+                continue
+            last_score = score
+            item = json.loads(member)
+            points.append({"timestamp": item["timestamp"], "value": item["payload"]})
+        if len(points) < self.limit and not warm:
+            return None
+        return points[:self.limit]
+
+    async def fill(self, tenant_id: int, sensor_id: str, points: list[dict]) -> None:
+        """Seed the set from a Trino read and mark it warm."""
+        if not self.redis:
+            return
+        ids = {"tenant_id": tenant_id, "sensor_id": sensor_id}
+        key = HOT_READINGS_KEY.format(**ids)
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            if points:
+                pipe.zadd(key, {
+                    json.dumps({"timestamp": p["timestamp"], "payload": p["value"]}):
+                        _epoch_ms(p["timestamp"])
+                    for p in points
+                })
+                pipe.zremrangebyrank(key, 0, -(self.limit + 1))
+                pipe.expire(key, self.ttl)
+            pipe.set(HOT_WARM_KEY.format(**ids), "1", ex=self.ttl)
+            await pipe.execute()
+        except Exception as exc:
+            _log.warning("Hot readings Redis write failed: %s", exc)
+
+
+# ── Pub/sub invalidation ──────────────────────────────────────────────────────
+
+class LocalCache(Protocol):
+    """What listen_for_invalidations() needs from a local cache."""
+
+    def pop(self, key: str, /) -> None: ...
+
+    def clear(self) -> None: ...
+
+
+async def listen_for_invalidations(
+    redis: aioredis.Redis, caches: dict[str, LocalCache], retry_delay: float = 5.0
+) -> None:
+    """Evict the key published on each channel from that channel's local cache.
+
+    Runs until cancelled. While the subscription is down, invalidations could
+    be missed, so every (re)subscribe starts from empty local caches.
+    """
+    while True:
+        try:
+            pubsub = redis.pubsub()
+            await pubsub.subscribe(*caches)
+            for cache in caches.values():
+                cache.clear()
+            try:
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        caches[message["channel"]].pop(message["data"])
+            finally:
+                await pubsub.aclose()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            _log.warning("Cache invalidation listener dropped: %s", exc)
+        await asyncio.sleep(retry_delay)
@@ -16,6 +16,46 @@ class Settings(BaseSettings):
     TRINO_USER: str = "user"
     TRINO_CATALOG: str = "iceberg"
     TRINO_SCHEMA: str = "sensors"
+    # Query engine pool (blocking Trino calls run on a bounded executor)
+    TRINO_MAX_CONCURRENCY: int = 8          # queries in flight per replica
+    TRINO_TENANT_CONCURRENCY: int = 2       # of which any one tenant may hold
+    TRINO_MAX_QUEUE: int = 64               # waiting callers before 429s
+    TRINO_QUEUE_TIMEOUT: float = 10.0       # seconds to wait for a slot
+    TRINO_REQUEST_TIMEOUT: float = 30.0
+    # /query/ result cache (Redis), validated against Iceberg snapshot ids
+    QUERY_CACHE_TTL: int = 3_600
+    QUERY_CACHE_MAX_BYTES: int = 1_000_000  # larger results are never cached
+    QUERY_CACHE_HIT_QU_FACTOR: float = 0.1  # share of the original QU billed on a hit; 0 = free
+    # Incremental /query/results pages and /query/stream exports
+    QUERY_RESULT_IDLE_SECONDS: int = 120    # an unpaged result token is closed after this
+    QUERY_RESULT_REAP_SECONDS: int = 15
+    QUERY_RESULT_MAX_OPEN: int = 4          # open result tokens per tenant
+    # /query/schema tree, refreshed on DDL notifications from the streaming job
+    QUERY_SCHEMA_MAX_AGE: int = 900         # safety-net refresh for missed notifications
+    QUERY_ROLLUP_REWRITE: bool = True       # route eligible aggregates to {type}_rollup_* tables
+    # Session validation cache (get_current_user)
+    SESSION_CACHE_TTL: int = 60             # seconds a validated session is trusted
+    SESSION_CACHE_MAX: int = 10_000         # in-process LRU capacity
+    SESSION_TOUCH_FLUSH_SECONDS: int = 30   # last_active write-back interval
+    # Billing-status cache (check_billing_active); tenant service pushes invalidations
+    BILLING_CACHE_TTL: int = 15
+    BILLING_CACHE_MAX: int = 10_000
+    # Hot readings for GET /sensors/{id}/data, kept in Redis by the data service
+    HOT_READINGS_LIMIT: int = 100           # readings returned, as the Trino query's LIMIT
+    HOT_READINGS_TTL: int = 7 * 86_400      # a Trino fill is trusted this long
+    # Row totals reported alongside cursor-paginated lists
+    PAGE_COUNT_CACHE_TTL: int = 30
+    PAGE_COUNT_CACHE_MAX: int = 10_000
+    # Inter-service HTTP client (one pooled client per process)
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_HTTP2: bool = True                 # only takes effect when h2 is installed
+    HTTP_RETRIES: int = 2
+    HTTP_BACKOFF_BASE: float = 0.1
+    HTTP_BACKOFF_MAX: float = 2.0
+    TENANT_SERVICE_TIMEOUT: float = 5.0
+    DATA_SERVICE_TIMEOUT: float = 10.0
 
     model_config = SettingsConfigDict(
         env_file=".env",
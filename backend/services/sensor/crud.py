@@ -1,14 +1,102 @@
-from sqlalchemy.orm import Session
-import models
-import schemas
-import trino
-import trino.exceptions
-import uuid
+import base64
+import json
+import logging
 import math
 import re
+import uuid
+from datetime import UTC, datetime
+from itertools import groupby
+from typing import Any
+
+import trino
+import trino.exceptions
+from sqlalchemy import Column, Integer, String, case, column, literal, tuple_, update, values
+from sqlalchemy.orm import Query, Session
+
+import models
+import schemas
+from cache import TTLCache, reading_timestamp
 from configs import settings
-from typing import List, Optional
-from datetime import datetime, timezone
+from query_engine import QueryCancelledError, TrinoPool
+from rollup_rewrite import ROLLUP_COMPLETE_FROM
+
+_log = logging.getLogger(__name__)
+
+# ── Pagination helpers ────────────────────────────────────────────────────────
+
+# Totals reported with cursor pages. COUNT(*) is the expensive half of a deep
+# page request, so it is reused per (table, scope) for a short TTL.
+_count_cache = TTLCache(settings.PAGE_COUNT_CACHE_MAX, settings.PAGE_COUNT_CACHE_TTL)
+
+
+def encode_cursor(created_at: datetime, key: Any) -> str:
+    raw = json.dumps([created_at.isoformat(), key]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, key_type: type) -> tuple[datetime, Any]:
+    """Inverse of encode_cursor. Raises ValueError for anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, key = json.loads(raw)
+        if not isinstance(key, (int, str)) or isinstance(key, bool):
+            raise TypeError(key)
+        return datetime.fromisoformat(created_at), key_type(key)
+    except (ValueError, TypeError) as exc:
+        raise ValueError("Invalid pagination cursor") from exc
+
+
+def _paginate(
+    query: Query,
+    created_col: Column[datetime],
+    key_col: Column[Any],
+    page: int,
+    per_page: int,
+    cursor: str | None,
+    count_key: str,
+) -> tuple[list, dict]:
+    """Newest-first page of `query` → (rows, remaining *Page fields).
+
+    cursor=None keeps offset/limit paging. Any string (empty for the first
+    page) switches to keyset paging: seek past the cursor's (created_at, key)
+    on the composite index and fetch one extra row to learn whether another
+    page exists — no OFFSET scan, and the total comes from _count_cache.
+    """
+    ordered = query.order_by(created_col.desc(), key_col.desc())
+    if cursor is None:
+        total = query.count()
+        rows = ordered.offset((page - 1) * per_page).limit(per_page).all()
+        has_more = page * per_page < total
+        total_exact = True
+    else:
+        if cursor:
+            created_at, key = decode_cursor(cursor, key_col.type.python_type)
+            ordered = ordered.filter(
+                tuple_(created_col, key_col) < tuple_(literal(created_at), literal(key))
+            )
+        rows = ordered.limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        cached = _count_cache.get(count_key)
+        total_exact = cached is None
+        if cached is None:
+            total = query.count()
+            _count_cache.set(count_key, total)
+        else:
+            total = cached
+
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, created_col.key), getattr(last, key_col.key))
+    return rows, {
+        "total":       total,
+        "page":        page,
+        "per_page":    per_page,
+        "pages":       max(1, math.ceil(total / per_page)),
+        "next_cursor": next_cursor,
+        "total_exact": total_exact,
+    }
 
 
 # ── Audit helper ──────────────────────────────────────────────────────────────
@@ -16,11 +104,11 @@ from datetime import datetime, timezone
 def log_audit(
     db: Session,
     tenant_id: int,
-    sensor_id: Optional[str],
+    sensor_id: str | None,
     sensor_name: str,
     action: str,
     performed_by: int,
-    details: Optional[dict] = None,
+    details: dict | None = None,
 ) -> None:
     entry = models.SensorAuditLog(
         tenant_id=tenant_id,
@@ -42,8 +130,8 @@ def log_connection_event(
     tenant_id: int,
     event_type: str,
     status: str = "success",
-    message: Optional[str] = None,
-    details: Optional[dict] = None,
+    message: str | None = None,
+    details: dict | None = None,
 ) -> None:
     entry = models.SensorConnectionEvent(
         sensor_id=sensor_id,
@@ -95,13 +183,13 @@ def create_sensor(db: Session, sensor: schemas.SensorCreate, user_id: int) -> mo
     return db_sensor
 
 
-def get_sensor(db: Session, sensor_id: str) -> Optional[models.Sensor]:
+def get_sensor(db: Session, sensor_id: str) -> models.Sensor | None:
     return db.query(models.Sensor).filter(models.Sensor.sensor_id == sensor_id).first()
 
 
 def get_sensors_by_tenant(
     db: Session, tenant_id: int, skip: int = 0, limit: int = 100
-) -> List[models.Sensor]:
+) -> list[models.Sensor]:
     return (
         db.query(models.Sensor)
         .filter(models.Sensor.tenant_id == tenant_id)
@@ -113,27 +201,19 @@ def get_sensors_by_tenant(
 
 
 def get_sensors_paginated(
-    db: Session, tenant_id: int, page: int = 1, per_page: int = 10
+    db: Session, tenant_id: int, page: int = 1, per_page: int = 10, cursor: str | None = None
 ) -> schemas.SensorPage:
-    query = (
-        db.query(models.Sensor)
-        .filter(models.Sensor.tenant_id == tenant_id)
-        .order_by(models.Sensor.created_at.desc())
-    )
-    total = query.count()
-    items = query.offset((page - 1) * per_page).limit(per_page).all()
-    return schemas.SensorPage(
-        items=items,
-        total=total,
-        page=page,
-        per_page=per_page,
-        pages=max(1, math.ceil(total / per_page)),
+    query = db.query(models.Sensor).filter(models.Sensor.tenant_id == tenant_id)
+    items, meta = _paginate(
+        query, models.Sensor.created_at, models.Sensor.sensor_id,
+        page, per_page, cursor, count_key=f"sensors:{tenant_id}",
     )
+    return schemas.SensorPage(items=items, **meta)
 
 
 def update_sensor(
     db: Session, sensor_id: str, update: schemas.SensorUpdate, performed_by: int
-) -> Optional[models.Sensor]:
+) -> models.Sensor | None:
     db_sensor = db.query(models.Sensor).filter(models.Sensor.sensor_id == sensor_id).first()
     if not db_sensor:
         return None
@@ -172,7 +252,7 @@ def update_sensor(
 
 def rename_sensor(
     db: Session, sensor_id: str, sensor_name: str, performed_by: int
-) -> Optional[models.Sensor]:
+) -> models.Sensor | None:
     db_sensor = db.query(models.Sensor).filter(models.Sensor.sensor_id == sensor_id).first()
     if db_sensor:
         old_name = db_sensor.sensor_name
@@ -189,7 +269,7 @@ def rename_sensor(
 
 def update_sensor_status(
     db: Session, sensor_id: str, new_status: models.SensorStatus, performed_by: int
-) -> Optional[models.Sensor]:
+) -> models.Sensor | None:
     db_sensor = db.query(models.Sensor).filter(models.Sensor.sensor_id == sensor_id).first()
     if db_sensor:
         old_status = db_sensor.status.value
@@ -204,7 +284,7 @@ def update_sensor_status(
     return db_sensor
 
 
-def delete_sensor(db: Session, sensor_id: str, performed_by: int) -> Optional[models.Sensor]:
+def delete_sensor(db: Session, sensor_id: str, performed_by: int) -> models.Sensor | None:
     db_sensor = db.query(models.Sensor).filter(models.Sensor.sensor_id == sensor_id).first()
     if db_sensor:
         log_audit(
@@ -217,12 +297,12 @@ def delete_sensor(db: Session, sensor_id: str, performed_by: int) -> Optional[mo
     return db_sensor
 
 
-def increment_sensor_messages(db: Session, sensor_id: str, increment: int) -> Optional[models.Sensor]:
+def increment_sensor_messages(db: Session, sensor_id: str, increment: int) -> models.Sensor | None:
     db_sensor = db.query(models.Sensor).filter(models.Sensor.sensor_id == sensor_id).first()
     if db_sensor:
         was_pending = db_sensor.status == models.SensorStatus.pending
         db_sensor.message_count += increment
-        db_sensor.last_message_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        db_sensor.last_message_at = datetime.now(UTC).replace(tzinfo=None)
         if was_pending:
             db_sensor.status = models.SensorStatus.active
             log_connection_event(
@@ -236,18 +316,67 @@ def increment_sensor_messages(db: Session, sensor_id: str, increment: int) -> Op
     return db_sensor
 
 
+def bulk_increment_sensor_messages(db: Session, increments: dict[str, int]) -> dict[int, int]:
+    """Apply many per-sensor increments in one UPDATE ... FROM (VALUES ...).
+
+    Pending sensors flip to active and get their data_received event, as in
+    increment_sensor_messages. Unknown sensor ids are skipped. Returns the
+    increments actually applied, folded per tenant.
+    """
+    increments = {sid: n for sid, n in increments.items() if n > 0}
+    if not increments:
+        return {}
+    now = datetime.now(UTC).replace(tzinfo=None)
+    batch = values(
+        column("sensor_id", String), column("inc", Integer), name="batch"
+    ).data(list(increments.items()))
+
+    # Usually empty — only sensors receiving their very first messages
+    pending = db.query(models.Sensor.sensor_id, models.Sensor.tenant_id).filter(
+        models.Sensor.sensor_id.in_(increments),
+        models.Sensor.status == models.SensorStatus.pending,
+    ).with_for_update().all()
+
+    rows = db.execute(
+        update(models.Sensor)
+        .where(models.Sensor.sensor_id == batch.c.sensor_id)
+        .values(
+            message_count=models.Sensor.message_count + batch.c.inc,
+            last_message_at=now,
+            status=case(
+                (models.Sensor.status == models.SensorStatus.pending, models.SensorStatus.active),
+                else_=models.Sensor.status,
+            ),
+        )
+        .returning(models.Sensor.tenant_id, batch.c.inc),
+        execution_options={"synchronize_session": False},
+    ).all()
+
+    for sensor_id, tenant_id in pending:
+        log_connection_event(
+            db, sensor_id, tenant_id,
+            event_type="data_received",
+            message="First data message received. Sensor is now active.",
+            details={"messages": increments[sensor_id]},
+        )
+    db.commit()
+
+    per_tenant: dict[int, int] = {}
+    for tenant_id, inc in rows:
+        per_tenant[tenant_id] = per_tenant.get(tenant_id, 0) + inc
+    return per_tenant
+
+
 # ── Audit log queries ─────────────────────────────────────────────────────────
 
 def get_audit_logs(
-    db: Session, tenant_id: int, page: int = 1, per_page: int = 20
+    db: Session, tenant_id: int, page: int = 1, per_page: int = 20, cursor: str | None = None
 ) -> schemas.SensorAuditPage:
-    query = (
-        db.query(models.SensorAuditLog)
-        .filter(models.SensorAuditLog.tenant_id == tenant_id)
-        .order_by(models.SensorAuditLog.created_at.desc())
+    query = db.query(models.SensorAuditLog).filter(models.SensorAuditLog.tenant_id == tenant_id)
+    rows, meta = _paginate(
+        query, models.SensorAuditLog.created_at, models.SensorAuditLog.id,
+        page, per_page, cursor, count_key=f"sensor_audit_logs:{tenant_id}",
     )
-    total = query.count()
-    rows = query.offset((page - 1) * per_page).limit(per_page).all()
 
     # Resolve user first names in one query
     user_ids = {r.performed_by for r in rows}
@@ -270,13 +399,7 @@ def get_audit_logs(
         )
         for r in rows
     ]
-    return schemas.SensorAuditPage(
-        items=items,
-        total=total,
-        page=page,
-        per_page=per_page,
-        pages=max(1, math.ceil(total / per_page)),
-    )
+    return schemas.SensorAuditPage(items=items, **meta)
 
 
 # ── Connection event queries ───────────────────────────────────────────────────
@@ -300,50 +423,56 @@ def initiate_connection(
 
 
 def get_connection_events(
-    db: Session, sensor_id: str, page: int = 1, per_page: int = 20
+    db: Session, sensor_id: str, page: int = 1, per_page: int = 20, cursor: str | None = None
 ) -> schemas.SensorConnectionEventPage:
-    query = (
-        db.query(models.SensorConnectionEvent)
-        .filter(models.SensorConnectionEvent.sensor_id == sensor_id)
-        .order_by(models.SensorConnectionEvent.created_at.desc())
+    query = db.query(models.SensorConnectionEvent).filter(
+        models.SensorConnectionEvent.sensor_id == sensor_id
     )
-    total = query.count()
-    items = query.offset((page - 1) * per_page).limit(per_page).all()
-    return schemas.SensorConnectionEventPage(
-        items=items,
-        total=total,
-        page=page,
-        per_page=per_page,
-        pages=max(1, math.ceil(total / per_page)),
+    items, meta = _paginate(
+        query, models.SensorConnectionEvent.created_at, models.SensorConnectionEvent.id,
+        page, per_page, cursor, count_key=f"sensor_connection_events:{sensor_id}",
     )
+    return schemas.SensorConnectionEventPage(items=items, **meta)
 
 
 # ── Trino sensor data ─────────────────────────────────────────────────────────
 
-def get_sensor_data(sensor_id: str, tenant_id: int) -> List[schemas.SensorDataPoint]:
-    """Query Trino for recent sensor readings. Raises trino.exceptions.DatabaseError on failure."""
-    conn = trino.dbapi.connect(
-        host=settings.TRINO_HOST,
-        port=settings.TRINO_PORT,
-        user=settings.TRINO_USER,
-        catalog=settings.TRINO_CATALOG,
-        schema=settings.TRINO_SCHEMA,
-    )
+# Blocking Trino calls below are meant to run via trino_pool.run(), which keeps
+# them off the event loop and applies the per-tenant concurrency limits.
+trino_pool = TrinoPool(
+    host=settings.TRINO_HOST,
+    port=settings.TRINO_PORT,
+    user=settings.TRINO_USER,
+    catalog=settings.TRINO_CATALOG,
+    schema=settings.TRINO_SCHEMA,
+    max_concurrency=settings.TRINO_MAX_CONCURRENCY,
+    tenant_concurrency=settings.TRINO_TENANT_CONCURRENCY,
+    max_queue=settings.TRINO_MAX_QUEUE,
+    queue_timeout=settings.TRINO_QUEUE_TIMEOUT,
+    request_timeout=settings.TRINO_REQUEST_TIMEOUT,
+)
+
+
+def get_sensor_data(sensor_id: str, tenant_id: int) -> list[schemas.SensorDataPoint]:
+    """Query Trino for the HOT_READINGS_LIMIT newest sensor readings, timestamps
+    in the hot state's format. Raises trino.exceptions.DatabaseError on failure."""
     try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT timestamp, payload FROM sensor_data "
-            "WHERE sensor_id = ? AND tenant_id = ? "
-            "ORDER BY timestamp DESC LIMIT 100",
-            (sensor_id, tenant_id),
-        )
-        rows = cur.fetchall()
-        cur.close()
-        return [schemas.SensorDataPoint(timestamp=str(row[0]), value=row[1]) for row in rows]
+        with trino_pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT timestamp, payload FROM sensor_data "
+                "WHERE sensor_id = ? AND tenant_id = ? "
+                "ORDER BY timestamp DESC LIMIT ?",
+                (sensor_id, tenant_id, settings.HOT_READINGS_LIMIT),
+            )
+            rows = cur.fetchall()
+            cur.close()
+        return [schemas.SensorDataPoint(timestamp=reading_timestamp(row[0]), value=row[1])
+                for row in rows]
+    except QueryCancelledError:
+        raise
     except Exception as exc:
         raise trino.exceptions.DatabaseError(str(exc)) from exc
-    finally:
-        conn.close()
 
 
 def suspend_tenant_sensors(db: Session, tenant_id: int) -> list[str]:
@@ -406,6 +535,16 @@ def calculate_qu(trino_stats: dict) -> float:
     return round(max(QU_MIN, raw), 4)
 
 
+def prepare_sql(sql: str, tenant_id: int) -> str:
+    """Strip the trailing semicolon and bind current_user_tenant() to tenant_id."""
+    # Trino DBAPI rejects a trailing semicolon — strip it before executing
+    safe_sql = sql.strip().rstrip(";").strip()
+    # tenant_id is stored as STRING in Iceberg — must be a quoted literal, not an integer
+    return re.sub(
+        r"current_user_tenant\s*\(\)", f"'{int(tenant_id)}'", safe_sql, flags=re.IGNORECASE
+    )
+
+
 def run_query(sql: str, tenant_id: int) -> tuple[list[str], list[list[str | None]], dict]:
     """Execute user SQL on Trino. Replaces current_user_tenant() with the real tenant_id.
 
@@ -413,41 +552,188 @@ def run_query(sql: str, tenant_id: int) -> tuple[list[str], list[list[str | None
     trino_stats contains raw Trino query statistics (processedBytes, cpuTimeMillis, etc.).
     Raises ValueError for bad SQL (user error), trino.exceptions.DatabaseError for connectivity.
     """
-    # Trino DBAPI rejects a trailing semicolon — strip it before executing
-    safe_sql = sql.strip().rstrip(";").strip()
-    # tenant_id is stored as STRING in Iceberg — must be a quoted literal, not an integer
-    safe_sql = re.sub(r"current_user_tenant\s*\(\)", f"'{int(tenant_id)}'", safe_sql, flags=re.IGNORECASE)
-    conn = trino.dbapi.connect(
-        host=settings.TRINO_HOST,
-        port=settings.TRINO_PORT,
-        user=settings.TRINO_USER,
-        catalog=settings.TRINO_CATALOG,
-        schema=settings.TRINO_SCHEMA,
-    )
+    safe_sql = prepare_sql(sql, tenant_id)
     try:
-        cur = conn.cursor()
-        cur.execute(safe_sql)
-        rows = cur.fetchmany(1000)
-        columns = [desc[0] for desc in (cur.description or [])]
-        # Capture stats before close; default to {} if unavailable (schema-only queries)
-        trino_stats: dict = dict(cur.stats) if getattr(cur, "stats", None) else {}
-        str_rows: list[list[str | None]] = [
-            [str(cell) if cell is not None else None for cell in row]
-            for row in rows
-        ]
-        cur.close()
+        with trino_pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(safe_sql)
+            rows = cur.fetchmany(1000)
+            columns = [desc[0] for desc in (cur.description or [])]
+            # Capture stats before close; default to {} if unavailable (schema-only queries)
+            trino_stats: dict = dict(cur.stats) if getattr(cur, "stats", None) else {}
+            str_rows: list[list[str | None]] = [
+                [str(cell) if cell is not None else None for cell in row]
+                for row in rows
+            ]
+            cur.close()
         return columns, str_rows, trino_stats
+    except QueryCancelledError:
+        raise
     except trino.exceptions.TrinoUserError as exc:
         raise ValueError(str(exc)) from exc
     except Exception as exc:
         raise trino.exceptions.DatabaseError(str(exc)) from exc
-    finally:
+
+
+# Incremental results: the cursor stays open between calls so rows are pulled
+# from Trino one chunk at a time instead of being materialised up front.
+
+def open_query(sql: str, tenant_id: int) -> tuple[Any, Any, list[str], list[str]]:
+    """Start user SQL and return (conn, cursor, columns, types) once the column
+    metadata is known. The caller must finish with close_query().
+    Raises ValueError for bad SQL, trino.exceptions.DatabaseError for connectivity.
+    """
+    conn = trino_pool.open()
+    try:
+        cur = conn.cursor()
+        cur.execute(prepare_sql(sql, tenant_id))
+    except QueryCancelledError:
         conn.close()
+        raise
+    except trino.exceptions.TrinoUserError as exc:
+        conn.close()
+        raise ValueError(str(exc)) from exc
+    except Exception as exc:
+        conn.close()
+        raise trino.exceptions.DatabaseError(str(exc)) from exc
+    description = cur.description or []
+    return conn, cur, [d[0] for d in description], [str(d[1]) for d in description]
+
+
+def fetch_rows(cur: Any, size: int) -> list[list[Any]]:
+    """Next chunk of up to size rows, as native Python values."""
+    try:
+        return [list(row) for row in cur.fetchmany(size)]
+    except trino.exceptions.TrinoUserError as exc:
+        raise ValueError(str(exc)) from exc
+    except Exception as exc:
+        raise trino.exceptions.DatabaseError(str(exc)) from exc
+
+
+def close_query(conn: Any, cur: Any) -> dict:
+    """Cancel the query if rows remain, close the connection, return Trino stats."""
+    trino_stats: dict = dict(cur.stats) if getattr(cur, "stats", None) else {}
+    try:
+        cur.close()
+    except Exception as exc:
+        # Already finished, or the coordinator dropped it
+        _log.debug("Trino cursor close failed: %s", exc)
+    conn.close()
+    return trino_stats
+
+
+def get_schema_tree(catalog: str) -> dict:
+    """catalog → schemas → tables → columns, shaped like schemas.SchemaTree.
+
+    information_schema returns rows ordered by schema, table, ordinal, so the
+    tree is assembled in one pass. Raises trino.exceptions.DatabaseError.
+    """
+    if not re.fullmatch(r"\w+", catalog):
+        raise ValueError(f"Invalid catalog name: {catalog!r}")
+    # catalog is validated above; Trino cannot bind an identifier
+    sql = (
+        "SELECT table_schema, table_name, column_name, data_type "  # noqa: S608
+        f"FROM {catalog}.information_schema.columns "
+        "WHERE table_schema NOT IN ('information_schema') "
+        "ORDER BY table_schema, table_name, ordinal_position"
+    )
+    try:
+        with trino_pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(sql)
+            rows = cur.fetchall()
+            cur.close()
+    except QueryCancelledError:
+        raise
+    except Exception as exc:
+        raise trino.exceptions.DatabaseError(str(exc)) from exc
+
+    schema_entries: list[dict] = []
+    for schema_name, schema_rows in groupby(rows, key=lambda r: r[0]):
+        tables = [
+            {"name": table_name, "cols": [{"name": r[2], "type": r[3]} for r in table_rows]}
+            for table_name, table_rows in groupby(schema_rows, key=lambda r: r[1])
+        ]
+        schema_entries.append({"name": schema_name, "tables": tables})
+    return {"catalogs": [{"name": catalog, "schemas": schema_entries}]}
+
+
+def get_snapshot_ids(tables: set[str]) -> dict[str, int | None] | None:
+    """Current Iceberg snapshot id per "schema.table" (None for a table with no
+    snapshots yet), read from the main branch in the $refs metadata tables in
+    one query. The newest snapshot is not the current one after a rollback.
+
+    Returns None if any name is not a plain schema.table or any table cannot
+    be resolved, so the caller skips caching.
+    """
+    if not tables:
+        return {}
+    if not all(re.fullmatch(r"\w+\.\w+", name) for name in tables):
+        return None
+    # Identifiers are validated above; Trino cannot bind metadata table names
+    sql = " UNION ALL ".join(
+        f"SELECT '{name}', (SELECT snapshot_id "  # noqa: S608
+        f'FROM {settings.TRINO_CATALOG}.{name.split(".")[0]}."{name.split(".")[1]}$refs" '
+        f"WHERE name = 'main')"
+        for name in sorted(tables)
+    )
+    try:
+        with trino_pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(sql)
+            rows = cur.fetchall()
+            cur.close()
+    except QueryCancelledError:
+        raise
+    except Exception:
+        return None
+    return {name: snapshot_id for name, snapshot_id in rows}
+
+
+def get_rollup_watermarks(catalog: str, schema: str, tables: set[str]) -> dict[str, int]:
+    """Complete-from watermark (epoch seconds) per rollup table, read from the
+    $properties metadata tables in one query; tables without one are left out.
+    Returns {} if the catalog, schema or any table is not a plain identifier.
+    """
+    if not tables:
+        return {}
+    if not all(re.fullmatch(r"\w+", name) for name in (catalog, schema, *tables)):
+        return {}
+    # Identifiers are validated above; Trino cannot bind metadata table names
+    sql = " UNION ALL ".join(
+        f"SELECT '{name}', value "  # noqa: S608
+        f'FROM {catalog}.{schema}."{name}$properties" WHERE key = \'{ROLLUP_COMPLETE_FROM}\''
+        for name in sorted(tables)
+    )
+    try:
+        with trino_pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(sql)
+            rows = cur.fetchall()
+            cur.close()
+    except QueryCancelledError:
+        raise
+    except Exception as exc:
+        raise trino.exceptions.DatabaseError(str(exc)) from exc
+    return {name: int(value) for name, value in rows}
+
+
+# ── Session helper ────────────────────────────────────────────────────────────
+
+def touch_sessions(db: Session, touches: dict[int, datetime]) -> None:
+    """Write coalesced last_active bumps for many sessions in one executemany."""
+    if not touches:
+        return
+    db.execute(
+        update(models.Session),
+        [{"session_id": sid, "last_active": ts} for sid, ts in touches.items()],
+    )
+    db.commit()
 
 
 # ── Role helper ───────────────────────────────────────────────────────────────
 
-def get_user_role(db: Session, user_id: int, tenant_id: int) -> Optional[str]:
+def get_user_role(db: Session, user_id: int, tenant_id: int) -> str | None:
     role = (
         db.query(models.Role)
         .join(models.UserRole, models.Role.role_id == models.UserRole.role_id)
@@ -473,19 +759,14 @@ def create_sensor_storage(db: Session, tenant_id: int, data: schemas.SensorStora
 
 
 def get_sensor_storage_list(
-    db: Session, tenant_id: int, page: int = 1, per_page: int = 20
+    db: Session, tenant_id: int, page: int = 1, per_page: int = 20, cursor: str | None = None
 ) -> schemas.SensorStoragePage:
-    import math
     q = db.query(models.SensorStorage).filter(models.SensorStorage.tenant_id == tenant_id)
-    total = q.count()
-    items = q.order_by(models.SensorStorage.created_at.desc()).offset((page - 1) * per_page).limit(per_page).all()
-    return schemas.SensorStoragePage(
-        items=items,
-        total=total,
-        page=page,
-        per_page=per_page,
-        pages=max(1, math.ceil(total / per_page)),
+    items, meta = _paginate(
+        q, models.SensorStorage.created_at, models.SensorStorage.storage_id,
+        page, per_page, cursor, count_key=f"sensor_storage:{tenant_id}",
     )
+    return schemas.SensorStoragePage(items=items, **meta)
 
 
 def delete_sensor_storage(db: Session, tenant_id: int, storage_id: str) -> bool:
@@ -521,7 +802,7 @@ def create_farm(db: Session, tenant_id: int, data: schemas.FarmCreate) -> models
     return farm
 
 
-def get_farm(db: Session, tenant_id: int, farm_id: str) -> Optional[models.Farm]:
+def get_farm(db: Session, tenant_id: int, farm_id: str) -> models.Farm | None:
     return db.query(models.Farm).filter(
         models.Farm.farm_id == farm_id,
         models.Farm.tenant_id == tenant_id,
@@ -529,23 +810,19 @@ def get_farm(db: Session, tenant_id: int, farm_id: str) -> Optional[models.Farm]
 
 
 def list_farms(
-    db: Session, tenant_id: int, page: int = 1, per_page: int = 20
+    db: Session, tenant_id: int, page: int = 1, per_page: int = 20, cursor: str | None = None
 ) -> schemas.FarmPage:
     q = db.query(models.Farm).filter(models.Farm.tenant_id == tenant_id)
-    total = q.count()
-    items = q.order_by(models.Farm.created_at.desc()).offset((page - 1) * per_page).limit(per_page).all()
-    return schemas.FarmPage(
-        items=items,
-        total=total,
-        page=page,
-        per_page=per_page,
-        pages=max(1, math.ceil(total / per_page)),
+    items, meta = _paginate(
+        q, models.Farm.created_at, models.Farm.farm_id,
+        page, per_page, cursor, count_key=f"farms:{tenant_id}",
     )
+    return schemas.FarmPage(items=items, **meta)
 
 
 def update_farm(
     db: Session, tenant_id: int, farm_id: str, data: schemas.FarmUpdate
-) -> Optional[models.Farm]:
+) -> models.Farm | None:
     farm = get_farm(db, tenant_id, farm_id)
     if not farm:
         return None
@@ -601,7 +878,7 @@ def create_crop(
     return crop
 
 
-def get_crop(db: Session, tenant_id: int, crop_id: str) -> Optional[models.CropManagement]:
+def get_crop(db: Session, tenant_id: int, crop_id: str) -> models.CropManagement | None:
     return db.query(models.CropManagement).filter(
         models.CropManagement.id == crop_id,
         models.CropManagement.tenant_id == tenant_id,
@@ -609,7 +886,7 @@ def get_crop(db: Session, tenant_id: int, crop_id: str) -> Optional[models.CropM
 
 
 def list_crops(
-    db: Session, tenant_id: int, farm_id: Optional[str] = None,
+    db: Session, tenant_id: int, farm_id: str | None = None,
     page: int = 1, per_page: int = 50,
 ) -> schemas.CropManagementPage:
     q = db.query(models.CropManagement).filter(models.CropManagement.tenant_id == tenant_id)
@@ -628,7 +905,7 @@ def list_crops(
 
 def update_crop(
     db: Session, tenant_id: int, crop_id: str, data: schemas.CropManagementUpdate
-) -> Optional[models.CropManagement]:
+) -> models.CropManagement | None:
     crop = get_crop(db, tenant_id, crop_id)
     if not crop:
         return None
@@ -1,32 +1,120 @@
-from contextlib import asynccontextmanager
-from collections import defaultdict
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Query
-from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import text
-from sqlalchemy.orm import Session
-from datetime import datetime, timezone
-from typing import List, Optional
 import asyncio
-import httpx
 import json
 import logging
-import redis.asyncio as aioredis
 import time
+from collections import defaultdict
+from collections.abc import AsyncIterator, Callable
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import UTC, datetime
+from typing import Any
+
+import httpx
+import redis.asyncio as aioredis
 import trino.exceptions
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, status
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import crud
 import models
 import schemas
-import crud
 from authenticate import decode_access_token
-from configs import get_db, settings, Base, engine, ALLOWED_ORIGINS
-
+from cache import (
+    BILLING_INVALIDATE_CHAN,
+    SCHEMA_INVALIDATE_CHAN,
+    SESSION_INVALIDATE_CHAN,
+    HotReadings,
+    SessionCache,
+    TTLCache,
+    listen_for_invalidations,
+    token_hash,
+)
+from configs import ALLOWED_ORIGINS, Base, SessionLocal, engine, get_db, settings
+from http_client import ServiceClient
+from query_cache import QueryResultCache, SchemaTreeCache, normalize_sql, referenced_tables
+from query_engine import QueryCancelledError, QueryRejectedError
+from query_results import (
+    ENCODERS,
+    ArrowEncoder,
+    NdjsonEncoder,
+    OpenResult,
+    ResultBusyError,
+    ResultRegistry,
+    arrow_available,
+    json_cell,
+)
+from rollup_rewrite import ROLLUP_TABLE, rewrite_for_rollups, rollup_tables
 
 _log = logging.getLogger(__name__)
 
+_CURSOR_HELP = "Keyset cursor; pass '' for the first page"
+
 # ── Redis client (initialized in lifespan) ────────────────────────────────────
 _redis: aioredis.Redis | None = None
 
 _HIST_TTL   = 86_400   # 24 hours
 _HIST_MAX   = 20       # keep last 20 queries per tenant
+_HIST_ROWS  = 100      # rows kept per history item (enough to redisplay, not an export)
+
+# /query/ results keyed by tenant + normalized SQL (Redis attached in lifespan)
+_query_cache = QueryResultCache(settings.QUERY_CACHE_MAX_BYTES, settings.QUERY_CACHE_TTL)
+
+# Newest readings per sensor from the data service's Redis hot state
+_hot_readings = HotReadings(settings.HOT_READINGS_LIMIT, settings.HOT_READINGS_TTL)
+
+# /query/schema trees per catalog; rebuilt in the background when marked stale
+_schema_cache = SchemaTreeCache(settings.QUERY_SCHEMA_MAX_AGE)
+_schema_refreshing: set[str] = set()
+# Rollup complete-from watermarks per catalog, loaded with its schema tree
+_rollup_watermarks: dict[str, dict[str, int]] = {}
+
+# Open cursors behind /query/results tokens (this replica only)
+_results = ResultRegistry(settings.QUERY_RESULT_IDLE_SECONDS, settings.QUERY_RESULT_MAX_OPEN)
+# Strong refs for fire-and-forget tasks (charges for streams the client abandoned)
+_background: set[asyncio.Task] = set()
+
+# ── Inter-service HTTP client (pool opened/closed in lifespan) ───────────────
+_http = ServiceClient(
+    timeouts={
+        "tenant":       settings.TENANT_SERVICE_TIMEOUT,
+        "data_service": settings.DATA_SERVICE_TIMEOUT,
+    },
+    max_connections=settings.HTTP_MAX_CONNECTIONS,
+    max_keepalive=settings.HTTP_MAX_KEEPALIVE,
+    keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+    http2=settings.HTTP_HTTP2,
+    retries=settings.HTTP_RETRIES,
+    backoff_base=settings.HTTP_BACKOFF_BASE,
+    backoff_max=settings.HTTP_BACKOFF_MAX,
+)
+
+# ── Session validation cache (Redis tier attached in lifespan) ────────────────
+_session_cache = SessionCache(settings.SESSION_CACHE_MAX, settings.SESSION_CACHE_TTL)
+
+# tenant_id (str) → billing_active; evicted by the tenant service over pub/sub
+_billing_cache = TTLCache(settings.BILLING_CACHE_MAX, settings.BILLING_CACHE_TTL)
+
+
+def _flush_session_touches() -> None:
+    """Write the coalesced last_active bumps recorded by get_current_user."""
+    touches = _session_cache.drain_touches()
+    if not touches:
+        return
+    db = SessionLocal()
+    try:
+        crud.touch_sessions(db, touches)
+    except Exception as exc:
+        _log.warning("Failed to flush %d session touches: %s", len(touches), exc)
+    finally:
+        db.close()
+
+
+async def _session_touch_loop() -> None:
+    while True:
+        await asyncio.sleep(settings.SESSION_TOUCH_FLUSH_SECONDS)
+        await asyncio.to_thread(_flush_session_touches)
 
 
 @asynccontextmanager
@@ -126,6 +214,18 @@ async def lifespan(app: FastAPI):
                 updated_at TIMESTAMP
             )
         """))
+        # 6. Composite indexes backing keyset (cursor) pagination on list endpoints
+        for index_sql in (
+            "ix_sensors_tenant_created ON sensors (tenant_id, created_at DESC, sensor_id DESC)",
+            "ix_sensor_audit_logs_tenant_created"
+            " ON sensor_audit_logs (tenant_id, created_at DESC, id DESC)",
+            "ix_sensor_connection_events_sensor_created"
+            " ON sensor_connection_events (sensor_id, created_at DESC, id DESC)",
+            "ix_sensor_storage_tenant_created"
+            " ON sensor_storage (tenant_id, created_at DESC, storage_id DESC)",
+            "ix_farms_tenant_created ON farms (tenant_id, created_at DESC, farm_id DESC)",
+        ):
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index_sql}"))
         conn.commit()
 
     # ── Redis client ───────────────────────────────────────────────────────────
@@ -138,8 +238,35 @@ async def lifespan(app: FastAPI):
         _log.warning("Redis unavailable — query history disabled: %s", exc)
         _redis = None
 
+    await _http.start()
+
+    # ── Cache background tasks ─────────────────────────────────────────────────
+    _session_cache.redis = _redis
+    _query_cache.redis = _redis
+    _hot_readings.redis = _redis
+    tasks = [asyncio.create_task(_session_touch_loop()), asyncio.create_task(_result_reaper_loop())]
+    if _redis:
+        tasks.append(asyncio.create_task(listen_for_invalidations(_redis, {
+            SESSION_INVALIDATE_CHAN: _session_cache.local,
+            BILLING_INVALIDATE_CHAN: _billing_cache,
+            SCHEMA_INVALIDATE_CHAN:  _schema_cache,
+        })))
+    _schema_cache.on_stale = schedule_schema_refresh
+    schedule_schema_refresh(settings.TRINO_CATALOG)
+
     yield
 
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.to_thread(_flush_session_touches)
+    for result in _results.pop_expired(everything=True):
+        await _finish_result(result)
+    _session_cache.redis = None
+    _query_cache.redis = None
+    _schema_cache.on_stale = None
+    await _http.aclose()
+    crud.trino_pool.close()
     if _redis:
         await _redis.aclose()
 
@@ -163,6 +290,16 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)):
     if not token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No token provided")
     payload = decode_access_token(token)
+    key = token_hash(token)
+
+    # Fast path: a recently validated session needs no database round-trip.
+    # The returned User is transient — routes only read user_id/tenant_id.
+    cached = await _session_cache.get(key)
+    if cached and cached["user"]["user_id"] == payload["user_id"] \
+            and cached["user"]["tenant_id"] == payload["tenant_id"]:
+        _session_cache.touch(cached["session_id"])
+        return models.User(**cached["user"])
+
     user = db.query(models.User).filter(
         models.User.user_id == payload["user_id"],
         models.User.tenant_id == payload["tenant_id"],
@@ -174,23 +311,42 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)):
         models.Session.user_id == user.user_id,
         models.Session.status == models.SessionStatus.active,
     ).first()
-    if not session or session.expires_at < datetime.now(timezone.utc).replace(tzinfo=None):
+    if not session or session.expires_at < datetime.now(UTC).replace(tzinfo=None):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Session expired")
-    session.last_active = datetime.now(timezone.utc).replace(tzinfo=None)
-    db.commit()
+
+    await _session_cache.set(key, {
+        "session_id": session.session_id,
+        "expires_at": session.expires_at.isoformat(),
+        "user": {
+            "user_id":    user.user_id,
+            "tenant_id":  user.tenant_id,
+            "email":      user.email,
+            "first_name": user.first_name,
+            "last_name":  user.last_name,
+            "status":     user.status,
+        },
+    })
+    _session_cache.touch(int(session.session_id))
     return user
 
 
 # ─── Tenant service helpers ───────────────────────────────────────────────────
 
 async def check_billing_active(tenant_id: int) -> bool:
+    cached = _billing_cache.get(str(tenant_id))
+    if cached is not None:
+        return bool(cached)
+    # An invalidation landing while the request is out must not be undone
+    generation = _billing_cache.generation
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(
-                f"{settings.TENANT_SERVICE_URL}/internal/tenants/{tenant_id}/billing-status"
-            )
-            if response.status_code == 200:
-                return response.json().get("billing_active", False)
+        response = await _http.get(
+            f"{settings.TENANT_SERVICE_URL}/internal/tenants/{tenant_id}/billing-status",
+            target="tenant",
+        )
+        if response.status_code == 200:
+            active = bool(response.json().get("billing_active", False))
+            _billing_cache.set(str(tenant_id), active, generation=generation)
+            return active
     except httpx.RequestError:
         pass
     return False
@@ -198,26 +354,42 @@ async def check_billing_active(tenant_id: int) -> bool:
 
 async def notify_sensor_delta(tenant_id: int, delta: int) -> None:
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            await client.patch(
-                f"{settings.TENANT_SERVICE_URL}/internal/billings/sensor-count",
-                json={"tenant_id": tenant_id, "delta": delta},
-            )
+        await _http.patch(
+            f"{settings.TENANT_SERVICE_URL}/internal/billings/sensor-count",
+            target="tenant",
+            json={"tenant_id": tenant_id, "delta": delta},
+        )
     except httpx.RequestError:
         pass
 
 
 async def notify_message_increment(tenant_id: int, increment: int) -> None:
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            await client.patch(
-                f"{settings.TENANT_SERVICE_URL}/internal/billings/message-count",
-                json={"tenant_id": tenant_id, "increment": increment},
-            )
+        await _http.patch(
+            f"{settings.TENANT_SERVICE_URL}/internal/billings/message-count",
+            target="tenant",
+            json={"tenant_id": tenant_id, "increment": increment},
+        )
     except httpx.RequestError:
         pass
 
 
+async def notify_message_increments(per_tenant: dict[int, int]) -> None:
+    """Forward one accounting window's per-tenant message totals in a single call."""
+    if not per_tenant:
+        return
+    try:
+        await _http.patch(
+            f"{settings.TENANT_SERVICE_URL}/internal/billings/message-count/bulk",
+            target="tenant",
+            json={"increments": [
+                {"tenant_id": tid, "increment": inc} for tid, inc in per_tenant.items()
+            ]},
+        )
+    except httpx.RequestError as exc:
+        _log.warning("Failed to forward message counts for %d tenants: %s", len(per_tenant), exc)
+
+
 async def sync_iot_devices(tenant_id: int, db: Session) -> None:
     sensors = crud.get_sensors_by_tenant(db, tenant_id)
     devices = [
@@ -225,15 +397,105 @@ async def sync_iot_devices(tenant_id: int, db: Session) -> None:
         for s in sensors
     ]
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            await client.patch(
-                f"{settings.TENANT_SERVICE_URL}/internal/tenants/{tenant_id}/iot-devices",
-                json={"tenant_id": tenant_id, "devices": devices},
-            )
+        await _http.patch(
+            f"{settings.TENANT_SERVICE_URL}/internal/tenants/{tenant_id}/iot-devices",
+            target="tenant",
+            json={"tenant_id": tenant_id, "devices": devices},
+        )
     except httpx.RequestError:
         pass
 
 
+# ─── Query engine helper ──────────────────────────────────────────────────────
+
+async def run_trino(request: Request, tenant_id: int, fn: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking crud Trino call on the query pool, cancelled if the client leaves."""
+    try:
+        return await crud.trino_pool.run(
+            tenant_id, fn, *args, is_disconnected=request.is_disconnected
+        )
+    except QueryRejectedError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(exc),
+            headers={"Retry-After": str(exc.retry_after)},
+        ) from exc
+    except QueryCancelledError as exc:
+        # nginx convention for "client closed request"; nobody is left to read it
+        raise HTTPException(status_code=499, detail="Client closed request") from exc
+
+
+async def record_query_charge(tenant_id: int, qu: float, sql: str) -> float:
+    """Bill qu to the tenant (best-effort) and return the dollar cost."""
+    cost = round(qu * crud.QUERY_RATE_PER_QU, 6)
+    if qu <= 0:
+        return cost
+    try:
+        await _http.post(
+            f"{settings.TENANT_SERVICE_URL}/internal/billings/query-charge",
+            target="tenant",
+            json={
+                "tenant_id":   tenant_id,
+                "qu":          qu,
+                "cost":        cost,
+                "sql_preview": sql[:120],
+            },
+        )
+    except httpx.RequestError as exc:
+        _log.warning("Failed to record query charge for tenant %s: %s", tenant_id, exc)
+    return cost
+
+
+async def save_query_history(
+    user: models.User, sql: str, ms: int, qu: float, cost: float,
+    columns: list[str], rows: list[list],
+) -> None:
+    """Persist history + last SQL to Redis (non-fatal if Redis is down).
+
+    Only the first _HIST_ROWS rows are kept — history is for redisplay, the
+    full result is one rerun (or cache hit) away.
+    """
+    if not _redis:
+        return
+    try:
+        hist_key = f"viq:query:history:{user.tenant_id}:{user.user_id}"
+        last_key = f"viq:query:last_sql:{user.tenant_id}:{user.user_id}"
+        item = json.dumps({
+            "ts":      datetime.now(UTC).isoformat(),
+            "sql":     sql,
+            "ms":      ms,
+            "qu":      qu,
+            "cost":    cost,
+            "columns": columns,
+            "rows":    rows[:_HIST_ROWS],
+        })
+        await _redis.lpush(hist_key, item)
+        await _redis.ltrim(hist_key, 0, _HIST_MAX - 1)
+        await _redis.expire(hist_key, _HIST_TTL)
+        await _redis.set(last_key, sql, ex=_HIST_TTL)
+    except Exception as exc:
+        _log.warning("Failed to save query history to Redis: %s", exc)
+
+
+async def _finish_result(result: OpenResult) -> tuple[float, float]:
+    """Close an incremental result's cursor and bill what Trino used → (qu, cost)."""
+    try:
+        trino_stats = await crud.trino_pool.call(crud.close_query, result.conn, result.cur)
+    except Exception as exc:
+        _log.warning("Failed to close query result for tenant %s: %s", result.tenant_id, exc)
+        trino_stats = {}
+    qu = crud.calculate_qu(trino_stats)
+    return qu, await record_query_charge(result.tenant_id, qu, result.sql)
+
+
+async def _result_reaper_loop() -> None:
+    """Close result tokens nobody has paged for QUERY_RESULT_IDLE_SECONDS."""
+    while True:
+        await asyncio.sleep(settings.QUERY_RESULT_REAP_SECONDS)
+        for result in _results.pop_expired():
+            await _finish_result(result)
+
+
 # ─── Routes ───────────────────────────────────────────────────────────────────
 
 @app.post("/sensors/", response_model=schemas.SensorResponse, status_code=status.HTTP_201_CREATED)
@@ -260,10 +522,14 @@ async def onboard_sensor(
 async def list_sensor_audit(
     page: int = Query(default=1, ge=1),
     per_page: int = Query(default=20, ge=5, le=100),
+    cursor: str | None = Query(default=None, description=_CURSOR_HELP),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    return crud.get_audit_logs(db, current_user.tenant_id, page, per_page)
+    try:
+        return crud.get_audit_logs(db, int(current_user.tenant_id), page, per_page, cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
 
 
 @app.get("/sensors/", response_model=schemas.SensorPage)
@@ -271,12 +537,16 @@ async def list_sensors(
     tenant_id: int,
     page: int = Query(default=1, ge=1),
     per_page: int = Query(default=10, ge=1, le=100),
+    cursor: str | None = Query(default=None, description=_CURSOR_HELP),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     if current_user.tenant_id != tenant_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized for this tenant")
-    return crud.get_sensors_paginated(db, tenant_id, page, per_page)
+    try:
+        return crud.get_sensors_paginated(db, tenant_id, page, per_page, cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
 
 
 @app.get("/sensors/{sensor_id}", response_model=schemas.SensorResponse)
@@ -370,6 +640,7 @@ async def delete_sensor(
 @app.get("/sensors/{sensor_id}/data", response_model=schemas.SensorDataResponse)
 async def get_sensor_data(
     sensor_id: str,
+    request: Request,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
@@ -378,14 +649,21 @@ async def get_sensor_data(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sensor not found")
     if sensor.tenant_id != current_user.tenant_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    tenant_id = int(sensor.tenant_id)
+    # Served from the Redis hot state; Trino only on a cold miss, which seeds it
+    points = await _hot_readings.latest(tenant_id, sensor_id)
+    if points is not None:
+        data = [schemas.SensorDataPoint(**p) for p in points]
+        return schemas.SensorDataResponse(sensor_id=sensor_id, tenant_id=tenant_id, data=data)
     try:
-        data = crud.get_sensor_data(sensor_id, sensor.tenant_id)
-    except trino.exceptions.DatabaseError:
+        data = await run_trino(request, tenant_id, crud.get_sensor_data, sensor_id, tenant_id)
+    except trino.exceptions.DatabaseError as exc:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Data service temporarily unavailable",
-        )
-    return schemas.SensorDataResponse(sensor_id=sensor_id, tenant_id=sensor.tenant_id, data=data)
+        ) from exc
+    await _hot_readings.fill(tenant_id, sensor_id, [p.model_dump() for p in data])
+    return schemas.SensorDataResponse(sensor_id=sensor_id, tenant_id=tenant_id, data=data)
 
 
 @app.post("/sensors/{sensor_id}/messages", response_model=schemas.SensorResponse)
@@ -425,6 +703,7 @@ async def get_sensor_connection_events(
     sensor_id: str,
     page: int = Query(default=1, ge=1),
     per_page: int = Query(default=20, ge=5, le=100),
+    cursor: str | None = Query(default=None, description=_CURSOR_HELP),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
@@ -433,7 +712,10 @@ async def get_sensor_connection_events(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sensor not found")
     if sensor.tenant_id != current_user.tenant_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
-    return crud.get_connection_events(db, sensor_id, page, per_page)
+    try:
+        return crud.get_connection_events(db, sensor_id, page, per_page, cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
 
 
 @app.post("/sensors/{sensor_id}/connection-events", response_model=schemas.SensorConnectionEventResponse)
@@ -479,10 +761,14 @@ async def create_storage(
 async def list_storage(
     page: int = Query(default=1, ge=1),
     per_page: int = Query(default=20, ge=1, le=100),
+    cursor: str | None = Query(default=None, description=_CURSOR_HELP),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    return crud.get_sensor_storage_list(db, current_user.tenant_id, page, per_page)
+    try:
+        return crud.get_sensor_storage_list(db, int(current_user.tenant_id), page, per_page, cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
 
 
 @app.delete("/storage/{storage_id}", status_code=204)
@@ -515,8 +801,7 @@ async def internal_suspend_tenant(
             f"/{body.tenant_id}/{sensor_id}/disconnect"
         )
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                await client.delete(url)
+            await _http.delete(url, target="data_service")
         except Exception as exc:
             logging.getLogger(__name__).warning(
                 "Failed to disconnect simulator for sensor %s: %s", sensor_id, exc
@@ -541,6 +826,36 @@ async def internal_increment_messages(
     return {"ok": True}
 
 
+@app.post("/internal/sensors/messages/bulk")
+async def internal_bulk_increment_messages(
+    body: schemas.BulkMessageIncrementRequest,
+    db: Session = Depends(get_db),
+) -> dict:
+    """Internal endpoint (no auth) — one accounting window from the data service.
+
+    All sensor counters move in one UPDATE and the tenant service gets one call
+    with the per-tenant totals.
+    """
+    increments: dict[str, int] = defaultdict(int)
+    for item in body.increments:
+        increments[item.sensor_id] += item.increment
+    per_tenant = crud.bulk_increment_sensor_messages(db, increments)
+    await notify_message_increments(per_tenant)
+    return {"ok": True, "sensors": len(increments), "tenants": len(per_tenant)}
+
+
+@app.get("/internal/metrics/http-client")
+async def http_client_metrics() -> dict:
+    """Inter-service HTTP pool occupancy and per-target retry/error counters."""
+    return _http.metrics()
+
+
+@app.get("/internal/metrics/query-engine")
+async def query_engine_metrics() -> dict:
+    """Trino pool saturation, queue depth and rejected/cancelled counters."""
+    return crud.trino_pool.metrics()
+
+
 @app.post("/farms/", response_model=schemas.FarmResponse, status_code=201)
 async def create_farm(
     body: schemas.FarmCreate,
@@ -554,10 +869,14 @@ async def create_farm(
 async def list_farms(
     page: int = Query(default=1, ge=1),
     per_page: int = Query(default=20, ge=1, le=100),
+    cursor: str | None = Query(default=None, description=_CURSOR_HELP),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    return crud.list_farms(db, current_user.tenant_id, page, per_page)
+    try:
+        return crud.list_farms(db, int(current_user.tenant_id), page, per_page, cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
 
 
 @app.get("/farms/{farm_id}", response_model=schemas.FarmResponse)
@@ -607,7 +926,7 @@ async def create_crop(
 
 @app.get("/crop-management/", response_model=schemas.CropManagementPage)
 async def list_crops(
-    farm_id: Optional[str] = None,
+    farm_id: str | None = None,
     page: int = Query(default=1, ge=1),
     per_page: int = Query(default=50, ge=1, le=200),
     current_user: models.User = Depends(get_current_user),
@@ -652,49 +971,126 @@ async def delete_crop(
         raise HTTPException(status_code=404, detail="Crop not found")
 
 
+def _load_schema(catalog: str) -> tuple[dict, dict[str, int]]:
+    """The catalog's tree and its rollups' watermarks; if those cannot be
+    read, no query is routed to a rollup until the next refresh."""
+    tree = crud.get_schema_tree(catalog)
+    tables = rollup_tables(tree, catalog, settings.TRINO_SCHEMA)
+    rollups = {t for t in tables if ROLLUP_TABLE.fullmatch(t)}
+    try:
+        return tree, crud.get_rollup_watermarks(catalog, settings.TRINO_SCHEMA, rollups)
+    except trino.exceptions.DatabaseError as exc:
+        _log.warning("Rollup watermarks for %s unavailable: %s", catalog, exc)
+        return tree, {}
+
+
+async def refresh_schema_tree(catalog: str) -> str:
+    """Rebuild one catalog's tree from information_schema; returns the new ETag.
+
+    Runs under tenant 0's pool slots so console traffic cannot starve it.
+    The rollup watermarks are reloaded with it.
+    """
+    tree, _rollup_watermarks[catalog] = await crud.trino_pool.run(0, _load_schema, catalog)
+    return _schema_cache.set(catalog, tree)
+
+
+async def _refresh_schema_quietly(catalog: str) -> None:
+    try:
+        await refresh_schema_tree(catalog)
+    except Exception as exc:
+        _log.warning("Schema tree refresh for %s failed: %s", catalog, exc)
+    finally:
+        _schema_refreshing.discard(catalog)
+
+
+def schedule_schema_refresh(catalog: str) -> None:
+    """Start a background rebuild unless one is already running."""
+    if catalog in _schema_refreshing:
+        return
+    _schema_refreshing.add(catalog)
+    task = asyncio.create_task(_refresh_schema_quietly(catalog))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
 @app.get("/query/schema", response_model=schemas.SchemaTree)
 async def get_query_schema(
+    request: Request,
+    response: Response,
     current_user: models.User = Depends(get_current_user),
 ):
-    """Return the live Iceberg catalog tree (schemas → tables → columns) from Trino."""
-    _sql = (
-        "SELECT table_schema, table_name, column_name, data_type "
-        "FROM iceberg.information_schema.columns "
-        "WHERE table_schema NOT IN ('information_schema') "
-        "ORDER BY table_schema, table_name, ordinal_position"
-    )
-    try:
-        _, rows, _ = crud.run_query(_sql, current_user.tenant_id)
-    except trino.exceptions.DatabaseError as exc:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"Query engine unavailable: {exc}",
-        )
+    """Return the Iceberg catalog tree (schemas → tables → columns).
 
-    # Build nested tree from flat rows
-    tree: dict[str, dict[str, list[schemas.SchemaColumn]]] = defaultdict(lambda: defaultdict(list))
-    for row in rows:
-        schema_name, table_name, col_name, col_type = row[0], row[1], row[2], row[3]
-        tree[schema_name][table_name].append(schemas.SchemaColumn(name=col_name, type=col_type))
-
-    schema_entries = [
-        schemas.SchemaEntry(
-            name=schema_name,
-            tables=[
-                schemas.SchemaTable(name=tbl, cols=cols)
-                for tbl, cols in sorted(tables.items())
-            ],
-        )
-        for schema_name, tables in sorted(tree.items())
-    ]
-    return schemas.SchemaTree(
-        catalogs=[schemas.CatalogEntry(name="iceberg", schemas=schema_entries)]
-    )
+    Served from memory; Trino is only queried on the first request or after a
+    DDL notification. Clients revalidate with If-None-Match.
+    """
+    catalog = settings.TRINO_CATALOG
+    entry = _schema_cache.get(catalog)
+    if entry is None:
+        try:
+            await refresh_schema_tree(catalog)
+        except QueryRejectedError as exc:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=str(exc),
+                headers={"Retry-After": str(exc.retry_after)},
+            ) from exc
+        except trino.exceptions.DatabaseError as exc:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Query engine unavailable: {exc}",
+            ) from exc
+        entry = _schema_cache.get(catalog)
+        if entry is None:   # reset() raced the rebuild
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Schema tree unavailable, retry shortly",
+            )
+    elif entry["stale"]:
+        schedule_schema_refresh(catalog)
+
+    headers = {"ETag": entry["etag"], "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == entry["etag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return entry["tree"]
+
+
+def route_to_rollups(sql: str) -> str:
+    """sql rewritten onto the rollup tables when eligible (see rollup_rewrite),
+    else unchanged. Uses the schema tree only if it is already loaded."""
+    if not settings.QUERY_ROLLUP_REWRITE:
+        return sql
+    catalog, schema = settings.TRINO_CATALOG, settings.TRINO_SCHEMA
+    entry = _schema_cache.get(catalog)
+    if entry is None:
+        return sql
+    tables = rollup_tables(entry["tree"], catalog, schema)
+    watermarks = _rollup_watermarks.get(catalog, {})
+    return rewrite_for_rollups(sql, tables, watermarks, catalog, schema) or sql
+
+
+@app.post("/internal/query/schema/invalidate", status_code=status.HTTP_202_ACCEPTED)
+async def internal_invalidate_schema(body: schemas.SchemaChangeNotice) -> dict:
+    """Called by the streaming job after it creates or alters an Iceberg table.
+
+    Published to every replica when Redis is up; each one rebuilds its tree in
+    the background and keeps serving the old one until then.
+    """
+    if _redis:
+        try:
+            await _redis.publish(SCHEMA_INVALIDATE_CHAN, body.catalog)
+            return {"catalog": body.catalog, "table": body.table}
+        except Exception as exc:
+            _log.warning("Schema invalidation publish failed: %s", exc)
+    _schema_cache.pop(body.catalog)
+    return {"catalog": body.catalog, "table": body.table}
 
 
 @app.post("/query/", response_model=schemas.QueryResult)
 async def execute_query(
     body: schemas.QueryRequest,
+    request: Request,
     current_user: models.User = Depends(get_current_user),
 ):
     if not body.sql.strip():
@@ -703,8 +1099,31 @@ async def execute_query(
     if not billing_active:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Active billing required to run queries")
     t0 = time.monotonic()
+
+    # ── Result cache: reuse only while every referenced table is unchanged ──
+    # Snapshots are read before the query runs, so a commit that lands mid-query
+    # leaves the stored entry tagged with the older snapshot (never served stale).
+    tenant_id = int(current_user.tenant_id)
+    normalized = normalize_sql(body.sql)
+    sql = route_to_rollups(body.sql)
+    tables = None
+    if _query_cache.redis:
+        # Snapshots of the tables actually read, i.e. the rollup after a rewrite
+        tables = referenced_tables(
+            normalize_sql(sql), settings.TRINO_CATALOG, settings.TRINO_SCHEMA
+        )
+    snapshots, hit = None, None
     try:
-        columns, rows, trino_stats = crud.run_query(body.sql, current_user.tenant_id)
+        if tables is not None:
+            snapshots = await run_trino(request, tenant_id, crud.get_snapshot_ids, tables)
+        if snapshots is not None:
+            entry = await _query_cache.get(tenant_id, normalized)
+            if entry and entry["snapshots"] == snapshots:
+                hit = entry
+        if hit is None:
+            columns, rows, trino_stats = await run_trino(
+                request, tenant_id, crud.run_query, sql, tenant_id
+            )
     except ValueError as exc:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
     except trino.exceptions.DatabaseError as exc:
@@ -715,44 +1134,253 @@ async def execute_query(
     ms = int((time.monotonic() - t0) * 1000)
 
     # ── Compute QU and deduct charge from tenant billing (best-effort) ──────
-    qu   = crud.calculate_qu(trino_stats)
-    cost = round(qu * crud.QUERY_RATE_PER_QU, 6)
+    if hit:
+        columns, rows = hit["columns"], hit["rows"]
+        qu = round(hit["qu"] * settings.QUERY_CACHE_HIT_QU_FACTOR, 4)
+    else:
+        qu = crud.calculate_qu(trino_stats)
+        if snapshots is not None:
+            await _query_cache.set(tenant_id, normalized, {
+                "snapshots": snapshots,
+                "columns":   columns,
+                "rows":      rows,
+                "qu":        qu,
+            })
+    cost = await record_query_charge(tenant_id, qu, body.sql)
+    await save_query_history(current_user, body.sql, ms, qu, cost, columns, rows)
+    return schemas.QueryResult(
+        columns=columns, rows=rows, ms=ms, qu=qu, cost=cost, cached=hit is not None
+    )
+
+
+async def _next_page(
+    request: Request, result: OpenResult, page_size: int, new: bool
+) -> schemas.QueryPage:
+    """Pull one page from an open result and either park it behind its token
+    or, once exhausted, close it and bill the whole query."""
+    t0 = time.monotonic()
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            await client.post(
-                f"{settings.TENANT_SERVICE_URL}/internal/billings/query-charge",
-                json={
-                    "tenant_id":   current_user.tenant_id,
-                    "qu":          qu,
-                    "cost":        cost,
-                    "sql_preview": body.sql[:120],
-                },
+        fetched = await run_trino(
+            request, result.tenant_id, crud.fetch_rows, result.cur,
+            page_size + 1 - len(result.carry),
+        )
+    except HTTPException:
+        # Busy pool or departed client: the result itself is still good
+        if not new:
+            _results.checkin(result)
+        else:
+            await _finish_result(result)
+        raise
+    except (ValueError, trino.exceptions.DatabaseError) as exc:
+        _results.pop(result.token)
+        await _finish_result(result)
+        if isinstance(exc, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Query engine unavailable: {exc}",
+        ) from exc
+    rows = result.carry + fetched
+    page, result.carry = rows[:page_size], rows[page_size:]
+    offset = result.rows_sent
+    result.rows_sent += len(page)
+
+    qu = cost = 0.0
+    next_token = None
+    if result.carry:
+        next_token = result.token
+        if not new:
+            _results.checkin(result)
+        elif not _results.add(result):
+            await _finish_result(result)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many open query results — page through or close one first",
             )
-    except httpx.RequestError as exc:
-        _log.warning("Failed to record query charge for tenant %s: %s", current_user.tenant_id, exc)
+    else:
+        _results.pop(result.token)
+        qu, cost = await _finish_result(result)
+
+    return schemas.QueryPage(
+        columns=result.columns,
+        types=result.types,
+        rows=[[json_cell(cell) for cell in row] for row in page],
+        offset=offset,
+        next_token=next_token,
+        ms=int((time.monotonic() - t0) * 1000),
+        qu=qu,
+        cost=cost,
+    )
+
+
+@app.post("/query/results", response_model=schemas.QueryPage)
+async def open_query_result(
+    body: schemas.QueryPageRequest,
+    request: Request,
+    current_user: models.User = Depends(get_current_user),
+) -> schemas.QueryPage:
+    """Run SQL and return its first page of typed rows. While rows remain, the
+    response carries next_token; the query is billed when the last page is read."""
+    if not body.sql.strip():
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="SQL query cannot be empty"
+        )
+    tenant_id = int(current_user.tenant_id)
+    billing_active = await check_billing_active(tenant_id)
+    if not billing_active:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Active billing required to run queries"
+        )
+    if _results.held(tenant_id) >= _results.max_per_tenant:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many open query results — page through or close one first",
+        )
+    try:
+        conn, cur, columns, types = await run_trino(
+            request, tenant_id, crud.open_query, route_to_rollups(body.sql), tenant_id
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    except trino.exceptions.DatabaseError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Query engine unavailable: {exc}",
+        ) from exc
+    result = OpenResult(
+        tenant_id=tenant_id, user_id=int(current_user.user_id), sql=body.sql,
+        conn=conn, cur=cur, columns=columns, types=types,
+    )
+    return await _next_page(request, result, body.page_size, new=True)
 
-    # ── Persist history + last SQL to Redis (non-fatal if Redis is down) ────
-    if _redis:
-        try:
-            hist_key = f"viq:query:history:{current_user.tenant_id}:{current_user.user_id}"
-            last_key = f"viq:query:last_sql:{current_user.tenant_id}:{current_user.user_id}"
-            item = json.dumps({
-                "ts":      datetime.now(timezone.utc).isoformat(),
-                "sql":     body.sql,
-                "ms":      ms,
-                "qu":      qu,
-                "cost":    cost,
-                "columns": columns,
-                "rows":    rows,
-            })
-            await _redis.lpush(hist_key, item)
-            await _redis.ltrim(hist_key, 0, _HIST_MAX - 1)
-            await _redis.expire(hist_key, _HIST_TTL)
-            await _redis.set(last_key, body.sql, ex=_HIST_TTL)
-        except Exception as exc:
-            _log.warning("Failed to save query history to Redis: %s", exc)
 
-    return schemas.QueryResult(columns=columns, rows=rows, ms=ms, qu=qu, cost=cost)
+def _checkout_result(token: str, user: models.User) -> OpenResult:
+    try:
+        result = _results.checkout(token, int(user.tenant_id), int(user.user_id))
+    except ResultBusyError as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc)) from exc
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Query result not found or expired"
+        )
+    return result
+
+
+@app.get("/query/results/{token}", response_model=schemas.QueryPage)
+async def get_query_result_page(
+    token: str,
+    request: Request,
+    page_size: int = Query(default=1000, ge=1, le=10_000),
+    current_user: models.User = Depends(get_current_user),
+) -> schemas.QueryPage:
+    result = _checkout_result(token, current_user)
+    return await _next_page(request, result, page_size, new=False)
+
+
+@app.delete("/query/results/{token}", status_code=204)
+async def close_query_result(
+    token: str,
+    current_user: models.User = Depends(get_current_user),
+) -> None:
+    """Abandon a paged result: cancels the Trino query and bills what it used."""
+    result = _checkout_result(token, current_user)
+    _results.pop(token)
+    await _finish_result(result)
+
+
+async def _stream_result(
+    result: OpenResult,
+    encoder: NdjsonEncoder | ArrowEncoder,
+    chunk_size: int,
+    stack: AsyncExitStack,
+) -> AsyncIterator[bytes]:
+    finished = False
+    try:
+        yield encoder.header()
+        while True:
+            try:
+                rows = await crud.trino_pool.call(crud.fetch_rows, result.cur, chunk_size)
+            except (ValueError, trino.exceptions.DatabaseError) as exc:
+                yield encoder.error(str(exc))
+                return
+            if not rows:
+                break
+            result.rows_sent += len(rows)
+            yield encoder.encode(rows)
+        finished = True
+        qu, cost = await _finish_result(result)
+        yield encoder.footer({
+            "rows": result.rows_sent,
+            "ms":   int((time.monotonic() - result.started) * 1000),
+            "qu":   qu,
+            "cost": cost,
+        })
+    finally:
+        if not finished:
+            # Client left or Trino failed mid-stream: cancel, close and bill off-request
+            task = asyncio.create_task(_finish_result(result))
+            _background.add(task)
+            task.add_done_callback(_background.discard)
+        await stack.aclose()
+
+
+@app.post("/query/stream")
+async def stream_query(
+    body: schemas.QueryStreamRequest,
+    request: Request,
+    current_user: models.User = Depends(get_current_user),
+) -> StreamingResponse:
+    """Stream a whole result as NDJSON (header line, one array per row, summary
+    line) or an Arrow IPC stream. Rows are forwarded chunk by chunk as Trino
+    produces them, holding one query slot for the duration of the stream."""
+    if not body.sql.strip():
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="SQL query cannot be empty"
+        )
+    if body.format == "arrow" and not arrow_available():
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE, detail="Arrow output is not enabled"
+        )
+    tenant_id = int(current_user.tenant_id)
+    billing_active = await check_billing_active(tenant_id)
+    if not billing_active:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Active billing required to run queries"
+        )
+
+    stack = AsyncExitStack()
+    try:
+        await stack.enter_async_context(crud.trino_pool.slot(tenant_id))
+        conn, cur, columns, types = await crud.trino_pool.call(
+            crud.open_query, route_to_rollups(body.sql), tenant_id,
+            is_disconnected=request.is_disconnected,
+        )
+    except BaseException as exc:
+        await stack.aclose()
+        if isinstance(exc, QueryRejectedError):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=str(exc),
+                headers={"Retry-After": str(exc.retry_after)},
+            ) from exc
+        if isinstance(exc, QueryCancelledError):
+            raise HTTPException(status_code=499, detail="Client closed request") from exc
+        if isinstance(exc, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+        if isinstance(exc, trino.exceptions.DatabaseError):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Query engine unavailable: {exc}",
+            ) from exc
+        raise
+    result = OpenResult(
+        tenant_id=tenant_id, user_id=int(current_user.user_id), sql=body.sql,
+        conn=conn, cur=cur, columns=columns, types=types,
+    )
+    encoder = ENCODERS[body.format](columns, types)
+    return StreamingResponse(
+        _stream_result(result, encoder, body.chunk_size, stack), media_type=encoder.media_type
+    )
 
 
 @app.get("/query/history", response_model=schemas.QueryHistory)
@@ -1,10 +1,24 @@
-from sqlalchemy import Column, Integer, BigInteger, String, Enum, DateTime, Float, ForeignKey, JSON, Date
-from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
-from configs import Base
 import enum
 import uuid
 
+from sqlalchemy import (
+    JSON,
+    BigInteger,
+    Column,
+    Date,
+    DateTime,
+    Enum,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+)
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+
+from configs import Base
+
 
 class SensorStatus(str, enum.Enum):
     pending     = "pending"
@@ -41,6 +55,11 @@ class Sensor(Base):
     audit_logs        = relationship("SensorAuditLog", back_populates="sensor", passive_deletes=True)
     connection_events = relationship("SensorConnectionEvent", back_populates="sensor", passive_deletes=True)
 
+    # Keyset pagination: newest-first listing per tenant
+    __table_args__ = (
+        Index("ix_sensors_tenant_created", "tenant_id", created_at.desc(), sensor_id.desc()),
+    )
+
 
 class SensorAuditLog(Base):
     __tablename__ = "sensor_audit_logs"
@@ -55,6 +74,10 @@ class SensorAuditLog(Base):
 
     sensor = relationship("Sensor", back_populates="audit_logs")
 
+    __table_args__ = (
+        Index("ix_sensor_audit_logs_tenant_created", "tenant_id", created_at.desc(), id.desc()),
+    )
+
 
 class SensorConnectionEvent(Base):
     """Immutable event log tracking the lifecycle of a sensor's data pipeline connection."""
@@ -72,6 +95,12 @@ class SensorConnectionEvent(Base):
 
     sensor = relationship("Sensor", back_populates="connection_events")
 
+    __table_args__ = (
+        Index(
+            "ix_sensor_connection_events_sensor_created", "sensor_id", created_at.desc(), id.desc()
+        ),
+    )
+
 
 # ── Read-only references — auth service owns these tables ─────────────────────
 
@@ -131,6 +160,10 @@ class Farm(Base):
     created_at        = Column(DateTime, server_default=func.now(), nullable=False)
     updated_at        = Column(DateTime, onupdate=func.now())
 
+    __table_args__ = (
+        Index("ix_farms_tenant_created", "tenant_id", created_at.desc(), farm_id.desc()),
+    )
+
 
 class CropManagement(Base):
     __tablename__ = "crop_management"
@@ -162,3 +195,9 @@ class SensorStorage(Base):
     status       = Column(String(20), nullable=False, default="active")
     created_at   = Column(DateTime, server_default=func.now(), nullable=False)
     updated_at   = Column(DateTime, onupdate=func.now())
+
+    __table_args__ = (
+        Index(
+            "ix_sensor_storage_tenant_created", "tenant_id", created_at.desc(), storage_id.desc()
+        ),
+    )
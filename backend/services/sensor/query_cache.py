@@ -0,0 +1,178 @@
+"""Tenant-scoped /query/ result cache.
+
+Entries live in Redis under sha256(tenant, normalized SQL) and carry the
+Iceberg snapshot id of every table the query reads. A hit is only served
+while each of those tables is still on the same snapshot, so a new commit
+from the streaming job invalidates the entry without any explicit purge.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections.abc import Callable
+
+import redis.asyncio as aioredis
+
+_log = logging.getLogger(__name__)
+
+RESULT_KEY_PREFIX = "viq:query:result:"
+
+# String literals / quoted identifiers, or a comment (which is dropped)
+_QUOTED_OR_COMMENT = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|--[^\n]*|/\*.*?\*/", re.S)
+_QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_IDENT = r'(?:\w+|"[^"]+")'
+_CLAUSE = (
+    r"(?:where|group|order|limit|offset|fetch|having|window|union|intersect|except|join|on"
+    r"|using|inner|left|right|full|cross|natural|tablesample|for)\b"
+)
+# A table reference, then an optional alias and the comma of a comma join
+_TABLE_REF = re.compile(
+    rf"\b(?:from|join)\s+({_IDENT}(?:\s*\.\s*{_IDENT}){{0,2}})"
+    rf"(?:\s+(?:as\s+)?(?!{_CLAUSE}){_IDENT})?(\s*,)?"
+)
+_CTE_NAME = re.compile(rf"(?:\bwith|,)\s*({_IDENT})\s+as\s*\(")
+# Results that depend on more than table contents are never reused
+_VOLATILE = re.compile(
+    r"\b(?:now|current_timestamp|current_date|current_time|localtimestamp|localtime"
+    r"|rand|random|uuid|shuffle)\b"
+)
+
+
+def normalize_sql(sql: str) -> str:
+    """Canonical text for cache keys: comments dropped, whitespace collapsed,
+    everything outside quotes lower-cased, trailing semicolon removed."""
+    text = _QUOTED_OR_COMMENT.sub(lambda m: m.group(1) or " ", sql)
+    parts = _QUOTED.split(text)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i].lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def _unquote(ident: str) -> str:
+    return ident[1:-1].replace('""', '"') if ident.startswith('"') else ident
+
+
+def referenced_tables(normalized: str, catalog: str, default_schema: str) -> set[str] | None:
+    """Every table a normalized SELECT reads, as "schema.table".
+
+    Returns None when the query is not safely cacheable: not a SELECT,
+    volatile functions, comma joins, other catalogs or metadata tables.
+    """
+    # Blank out string literals so their contents never look like SQL
+    masked = _QUOTED.sub(lambda m: "''" if m.group(1).startswith("'") else m.group(1), normalized)
+    if not re.match(r"(?:select|with)\b", masked) or _VOLATILE.search(masked):
+        return None
+    ctes = {_unquote(name) for name in _CTE_NAME.findall(masked)}
+    tables: set[str] = set()
+    for ref, comma in _TABLE_REF.findall(masked):
+        if comma:
+            return None
+        parts = [_unquote(p.strip()) for p in ref.split(".")]
+        if len(parts) == 1 and parts[0] in ctes:
+            continue
+        if len(parts) == 3:
+            if parts[0] != catalog:
+                return None
+            parts = parts[1:]
+        schema, table = parts if len(parts) == 2 else (default_schema, parts[0])
+        if schema == "information_schema" or not re.fullmatch(r"\w+", f"{schema}{table}"):
+            return None
+        tables.add(f"{schema}.{table}")
+    return tables
+
+
+class QueryResultCache:
+    """Size-bounded Redis store for query results. A no-op without Redis."""
+
+    def __init__(self, max_bytes: int, ttl: int):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.redis: aioredis.Redis | None = None
+
+    @staticmethod
+    def key(tenant_id: int, normalized: str) -> str:
+        digest = hashlib.sha256(f"{tenant_id}:{normalized}".encode()).hexdigest()
+        return f"{RESULT_KEY_PREFIX}{tenant_id}:{digest}"
+
+    async def get(self, tenant_id: int, normalized: str) -> dict | None:
+        if not self.redis:
+            return None
+        try:
+            raw = await self.redis.get(self.key(tenant_id, normalized))
+        except Exception as exc:
+            _log.warning("Query cache Redis read failed: %s", exc)
+            return None
+        return json.loads(raw) if raw else None
+
+    async def set(self, tenant_id: int, normalized: str, entry: dict) -> bool:
+        """Store entry unless it exceeds max_bytes. Returns whether it was stored."""
+        if not self.redis:
+            return False
+        raw = json.dumps(entry)
+        if len(raw) > self.max_bytes:
+            return False
+        try:
+            await self.redis.set(self.key(tenant_id, normalized), raw, ex=self.ttl)
+        except Exception as exc:
+            _log.warning("Query cache Redis write failed: %s", exc)
+            return False
+        return True
+
+
+# ── Schema tree (/query/schema) ───────────────────────────────────────────────
+
+class SchemaTreeCache:
+    """Catalog → rendered schema tree with its ETag, served from memory.
+
+    Entries are never dropped, only marked stale (by a DDL notification, a
+    pub/sub message or reaching max_age); a stale tree keeps being served
+    while the caller refreshes it in the background. pop()/clear() match
+    TTLCache so listen_for_invalidations() can drive it; on_stale(catalog) is
+    called for every loaded catalog they mark stale.
+    """
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self.on_stale: Callable[[str], None] | None = None
+        self._entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def get(self, catalog: str) -> dict | None:
+        """{"tree", "etag", "stale"} or None if the catalog was never loaded."""
+        with self._lock:
+            entry = self._entries.get(catalog)
+            if entry is None:
+                return None
+            stale = entry["stale"] or time.monotonic() - entry["loaded"] > self.max_age
+            return {"tree": entry["tree"], "etag": entry["etag"], "stale": stale}
+
+    def set(self, catalog: str, tree: dict) -> str:
+        """Store a freshly built tree and return its ETag."""
+        digest = hashlib.sha256(json.dumps(tree, sort_keys=True).encode()).hexdigest()
+        etag = f'"{digest[:32]}"'
+        with self._lock:
+            self._entries[catalog] = {
+                "tree": tree, "etag": etag, "loaded": time.monotonic(), "stale": False,
+            }
+        return etag
+
+    def _mark_stale(self, catalogs: list[str]) -> None:
+        with self._lock:
+            catalogs = [c for c in catalogs if c in self._entries]
+            for catalog in catalogs:
+                self._entries[catalog]["stale"] = True
+        if self.on_stale is not None:
+            for catalog in catalogs:
+                self.on_stale(catalog)
+
+    def pop(self, catalog: str) -> None:
+        self._mark_stale([catalog])
+
+    def clear(self) -> None:
+        self._mark_stale(list(self._entries))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._entries.clear()
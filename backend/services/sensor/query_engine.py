@@ -0,0 +1,287 @@
+"""Pooled, off-loop Trino execution.
+
+The trino DBAPI is blocking, so queries run on a bounded thread pool instead of
+inside async route handlers. Every connection shares one requests.Session, so
+keep-alive HTTP connections to the coordinator are reused across queries.
+Admission is gated by a global slot count (the executor size) plus a per-tenant
+limit; callers beyond the queue bound are rejected instead of piling up. A
+query whose HTTP client disconnects is cancelled on the Trino side.
+"""
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any
+
+import requests
+import trino
+from requests.adapters import HTTPAdapter
+
+_log = logging.getLogger(__name__)
+
+
+class QueryRejectedError(Exception):
+    """Admission refused — queue full or no slot freed up within the timeout."""
+
+    def __init__(self, message: str, retry_after: int = 1) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueryCancelledError(Exception):
+    """The caller went away and the running Trino query was cancelled."""
+
+
+class QueryJob:
+    """Cursors opened on behalf of one query, so they can be cancelled together."""
+
+    def __init__(self) -> None:
+        self.cancelled = False
+        self._cursors: list = []
+        self._lock = threading.Lock()
+
+    def track(self, cursor: Any) -> None:
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelledError("Query cancelled before it started")
+            self._cursors.append(cursor)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            cursors = list(self._cursors)
+        for cur in cursors:
+            try:
+                cur.cancel()
+            except Exception as exc:
+                _log.warning("Trino cancel failed: %s", exc)
+
+
+class _TrackedConnection:
+    """Connection proxy that registers each cursor with the running job.
+
+    trino's Connection.close() closes its http_session, which here is the
+    pool's shared one; close() only closes this connection's cursors instead.
+    """
+
+    def __init__(self, conn: Any, job: QueryJob | None) -> None:
+        self._conn = conn
+        self._job = job
+        self._cursors: list = []
+
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        cur = self._conn.cursor(*args, **kwargs)
+        if self._job is not None:
+            self._job.track(cur)
+        self._cursors.append(cur)
+        return cur
+
+    def close(self) -> None:
+        cursors, self._cursors = self._cursors, []
+        for cur in cursors:
+            try:
+                cur.close()   # cancels the query if it is still running
+            except Exception as exc:
+                _log.warning("Trino cursor close failed: %s", exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+
+class TrinoPool:
+    """Bounded executor + shared HTTP session for trino.dbapi connections."""
+
+    def __init__(
+        self,
+        *,
+        host: str,
+        port: int,
+        user: str,
+        catalog: str,
+        schema: str,
+        max_concurrency: int = 8,
+        tenant_concurrency: int = 2,
+        max_queue: int = 64,
+        queue_timeout: float = 10.0,
+        request_timeout: float = 30.0,
+        disconnect_poll: float = 0.5,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.user = user
+        self.catalog = catalog
+        self.schema = schema
+        self.max_concurrency = max_concurrency
+        self.tenant_concurrency = tenant_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.disconnect_poll = disconnect_poll
+        self._executor = ThreadPoolExecutor(max_concurrency, thread_name_prefix="trino")
+        self._session = self._new_session()
+        self._local = threading.local()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tenant_slots: dict[int, asyncio.Semaphore] = {}
+        self._queued = 0
+        self._running: dict[int, int] = defaultdict(int)
+        self._stats = {"queries": 0, "rejected": 0, "cancelled": 0}
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    # ── connections ──────────────────────────────────────────────────────────
+
+    def open(self) -> Any:
+        """A trino connection on the shared session; cursors join the current job.
+        The caller closes it, which closes its cursors but not the shared session."""
+        conn = trino.dbapi.connect(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            catalog=self.catalog,
+            schema=self.schema,
+            http_session=self._session,
+            request_timeout=self.request_timeout,
+        )
+        return _TrackedConnection(conn, getattr(self._local, "job", None))
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        conn = self.open()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # ── execution ────────────────────────────────────────────────────────────
+
+    def _bind_loop(self) -> None:
+        # asyncio primitives belong to one loop; scripts and tests that run on
+        # a fresh loop get fresh slots.
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._tenant_slots = {}
+
+    def _call(self, job: QueryJob, fn: Callable, args: tuple) -> Any:
+        self._local.job = job
+        try:
+            return fn(*args)
+        finally:
+            self._local.job = None
+
+    async def _admit(self, tenant_id: int) -> asyncio.Semaphore:
+        if self._queued >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise QueryRejectedError("Query queue is full, retry shortly")
+        tenant_slot = self._tenant_slots.get(tenant_id)
+        if tenant_slot is None:
+            tenant_slot = self._tenant_slots[tenant_id] = asyncio.Semaphore(self.tenant_concurrency)
+        self._queued += 1
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await tenant_slot.acquire()
+                try:
+                    await self._slots.acquire()
+                except BaseException:
+                    tenant_slot.release()
+                    raise
+        except TimeoutError as exc:
+            self._stats["rejected"] += 1
+            raise QueryRejectedError("Too many concurrent queries, retry shortly",
+                                     retry_after=max(1, int(self.queue_timeout))) from exc
+        finally:
+            self._queued -= 1
+        return tenant_slot
+
+    @asynccontextmanager
+    async def slot(self, tenant_id: int) -> AsyncIterator[None]:
+        """Hold one of the tenant's query slots. Raises QueryRejectedError when
+        admission fails; used directly by streams that span many calls."""
+        self._bind_loop()
+        tenant_slot = await self._admit(tenant_id)
+        self._stats["queries"] += 1
+        self._running[tenant_id] += 1
+        try:
+            yield
+        finally:
+            self._running[tenant_id] -= 1
+            if not self._running[tenant_id]:
+                del self._running[tenant_id]
+            self._slots.release()
+            tenant_slot.release()
+
+    async def call(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        job: QueryJob | None = None,
+        is_disconnected: Callable[[], Awaitable[bool]] | None = None,
+    ) -> Any:
+        """Run blocking fn(*args) on the executor without admission control.
+
+        Cursors fn opens through connection()/open() are tracked on job. If
+        is_disconnected() turns true first, the job is cancelled and
+        QueryCancelledError is raised.
+        """
+        job = job or QueryJob()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self._call, job, fn, args)
+        try:
+            while True:
+                done, _ = await asyncio.wait({future}, timeout=self.disconnect_poll)
+                if done:
+                    return future.result()
+                if is_disconnected is not None and await is_disconnected():
+                    self._stats["cancelled"] += 1
+                    raise QueryCancelledError("Client disconnected")
+        except BaseException:
+            if not future.done():
+                job.cancel()
+                # The worker still finishes (with a cancellation error); drop it quietly
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            raise
+
+    async def run(
+        self,
+        tenant_id: int,
+        fn: Callable[..., Any],
+        *args: Any,
+        is_disconnected: Callable[[], Awaitable[bool]] | None = None,
+    ) -> Any:
+        """Run blocking fn(*args) on the pool under the tenant's concurrency limit.
+
+        fn opens its connections through connection(). If is_disconnected()
+        turns true while fn runs, its Trino queries are cancelled and
+        QueryCancelledError is raised. Raises QueryRejectedError when admission fails.
+        """
+        async with self.slot(tenant_id):
+            return await self.call(fn, *args, is_disconnected=is_disconnected)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._session.close()
+
+    # ── metrics ──────────────────────────────────────────────────────────────
+
+    def metrics(self) -> dict:
+        running = sum(self._running.values())
+        return {
+            "max_concurrency":    self.max_concurrency,
+            "tenant_concurrency": self.tenant_concurrency,
+            "max_queue":          self.max_queue,
+            "queued":             self._queued,
+            "running":            running,
+            "saturation":         round(running / self.max_concurrency, 3),
+            "tenants":            dict(self._running),
+            **self._stats,
+        }
@@ -0,0 +1,227 @@
+"""Typed, incremental /query/ result delivery.
+
+Large results are never materialised in the sensor service: rows are pulled
+from the open Trino cursor one chunk at a time, either page by page behind a
+result token (ResultRegistry) or as a chunked NDJSON / Arrow IPC stream.
+Result tokens are held in-process, so a token is only valid on the replica
+that issued it.
+"""
+import base64
+import io
+import json
+import math
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from datetime import time as dt_time
+from decimal import Decimal
+from typing import Any
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow streaming is optional (pip install verdantiq-sensor[arrow])
+    pa = None
+
+
+# ── Cell conversion ───────────────────────────────────────────────────────────
+
+def json_cell(cell: Any) -> Any:
+    """JSON-safe value that keeps the Trino type where JSON can express it.
+
+    Numbers, booleans and nulls stay native; decimals become strings so no
+    precision is lost; temporals are ISO-8601; varbinary is base64.
+    """
+    if cell is None or isinstance(cell, (bool, int, str)):
+        return cell
+    if isinstance(cell, float):
+        return cell if math.isfinite(cell) else str(cell)
+    if isinstance(cell, Decimal):
+        return str(cell)
+    if isinstance(cell, (datetime, date, dt_time)):
+        return cell.isoformat()
+    if isinstance(cell, (bytes, bytearray)):
+        return base64.b64encode(cell).decode()
+    if isinstance(cell, dict):
+        return {str(k): json_cell(v) for k, v in cell.items()}
+    if isinstance(cell, (list, tuple)):
+        return [json_cell(v) for v in cell]
+    return str(cell)
+
+
+# ── Stream encoders ───────────────────────────────────────────────────────────
+
+class NdjsonEncoder:
+    """One header line with columns/types, then one JSON array per row."""
+
+    media_type = "application/x-ndjson"
+
+    def __init__(self, columns: list[str], types: list[str]):
+        self.columns = columns
+        self.types = types
+
+    def header(self) -> bytes:
+        return (json.dumps({"columns": self.columns, "types": self.types}) + "\n").encode()
+
+    def encode(self, rows: list[list[Any]]) -> bytes:
+        return "".join(json.dumps([json_cell(c) for c in row]) + "\n" for row in rows).encode()
+
+    def footer(self, summary: dict) -> bytes:
+        return (json.dumps({"summary": summary}) + "\n").encode()
+
+    def error(self, message: str) -> bytes:
+        return (json.dumps({"error": message}) + "\n").encode()
+
+
+def _arrow_type(trino_type: str) -> Any:
+    base = trino_type.split("(", 1)[0].strip().lower()
+    return {
+        "boolean":   pa.bool_(),
+        "tinyint":   pa.int8(),
+        "smallint":  pa.int16(),
+        "integer":   pa.int32(),
+        "bigint":    pa.int64(),
+        "real":      pa.float32(),
+        "double":    pa.float64(),
+        "date":      pa.date32(),
+        "timestamp": pa.timestamp("us"),
+        "varbinary": pa.binary(),
+    }.get(base, pa.string())
+
+
+class ArrowEncoder:
+    """Arrow IPC stream: schema message first, one record batch per chunk.
+
+    Types without a direct Arrow mapping (decimal, json, row, map, ...) are
+    sent as strings using the same conversion as NDJSON.
+    """
+
+    media_type = "application/vnd.apache.arrow.stream"
+
+    def __init__(self, columns: list[str], types: list[str]):
+        self.schema = pa.schema(
+            [pa.field(c, _arrow_type(t)) for c, t in zip(columns, types, strict=True)]
+        )
+        self._sink = io.BytesIO()
+        self._writer = pa.ipc.new_stream(self._sink, self.schema)
+
+    def _drain(self) -> bytes:
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
+
+    def header(self) -> bytes:
+        return self._drain()
+
+    def encode(self, rows: list[list[Any]]) -> bytes:
+        arrays = []
+        for i, f in enumerate(self.schema):
+            values = [row[i] for row in rows]
+            if pa.types.is_string(f.type):
+                values = [None if v is None else str(json_cell(v)) for v in values]
+            arrays.append(pa.array(values, type=f.type))
+        self._writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+        return self._drain()
+
+    def footer(self, summary: dict) -> bytes:
+        self._writer.close()
+        return self._drain()
+
+    def error(self, message: str) -> bytes:
+        # No end-of-stream marker follows, so readers see a truncated stream
+        return b""
+
+
+ENCODERS: dict[str, type[NdjsonEncoder] | type[ArrowEncoder]] = {
+    "ndjson": NdjsonEncoder,
+    "arrow": ArrowEncoder,
+}
+
+
+def arrow_available() -> bool:
+    return pa is not None
+
+
+# ── Paginated results behind a token ──────────────────────────────────────────
+
+@dataclass
+class OpenResult:
+    """A Trino cursor kept open between page requests."""
+
+    tenant_id: int
+    user_id: int
+    sql: str
+    conn: Any
+    cur: Any
+    columns: list[str]
+    types: list[str]
+    token: str = field(default_factory=lambda: secrets.token_urlsafe(24))
+    rows_sent: int = 0
+    started: float = field(default_factory=time.monotonic)
+    expires: float = 0.0
+    busy: bool = False   # a page fetch is in progress; the cursor is not thread-safe
+    carry: list = field(default_factory=list)   # look-ahead row fetched past the last page
+
+
+class ResultBusyError(Exception):
+    """Another request is already fetching a page of this result."""
+
+
+class ResultRegistry:
+    """Open results by token, owned by one user, dropped after idle_timeout."""
+
+    def __init__(self, idle_timeout: float, max_per_tenant: int):
+        self.idle_timeout = idle_timeout
+        self.max_per_tenant = max_per_tenant
+        self._open: dict[str, OpenResult] = {}
+        self._lock = threading.Lock()
+
+    def add(self, result: OpenResult) -> bool:
+        """Register result; False if the tenant already holds max_per_tenant."""
+        with self._lock:
+            held = sum(1 for r in self._open.values() if r.tenant_id == result.tenant_id)
+            if held >= self.max_per_tenant:
+                return False
+            result.expires = time.monotonic() + self.idle_timeout
+            self._open[result.token] = result
+            return True
+
+    def held(self, tenant_id: int) -> int:
+        with self._lock:
+            return sum(1 for r in self._open.values() if r.tenant_id == tenant_id)
+
+    def checkout(self, token: str, tenant_id: int, user_id: int) -> OpenResult | None:
+        """The caller's open result, marked busy until checkin(). None if the
+        token is unknown, expired or owned by someone else."""
+        with self._lock:
+            result = self._open.get(token)
+            if result is None or (result.tenant_id, result.user_id) != (tenant_id, user_id):
+                return None
+            if result.busy:
+                raise ResultBusyError("A page of this result is already being fetched")
+            result.busy = True
+            return result
+
+    def checkin(self, result: OpenResult) -> None:
+        with self._lock:
+            result.busy = False
+            result.expires = time.monotonic() + self.idle_timeout
+
+    def pop(self, token: str) -> OpenResult | None:
+        with self._lock:
+            return self._open.pop(token, None)
+
+    def pop_expired(self, everything: bool = False) -> list[OpenResult]:
+        """Remove and return idle results (all of them on shutdown)."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                t for t, r in self._open.items()
+                if everything or (r.expires < now and not r.busy)
+            ]
+            return [self._open.pop(t) for t in expired]
+
+    def __len__(self) -> int:
+        return len(self._open)
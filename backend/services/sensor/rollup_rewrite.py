@@ -0,0 +1,305 @@
+"""Routes eligible /query/ aggregates over {type}_data to the rollup tables.
+
+The streaming job keeps {type}_rollup_1m, _1h and _1d next to each raw
+table: per (tenant_id, farm_id, sensor_id, bucket_start) the reading count
+and, under the raw table's typed metrics column, a min/max/sum/count/avg/
+last struct per numeric field. A query shaped like
+
+    SELECT sensor_id, date_trunc('hour', event_time), avg(soil_metrics.ph), count(*)
+    FROM soil_data
+    WHERE tenant_id = current_user_tenant() AND event_time >= TIMESTAMP '2024-05-01'
+    GROUP BY 1, 2 ORDER BY 2 LIMIT 500
+
+returns the same rows from the coarsest rollup that its date_trunc unit and
+every event_time bound line up with, reading one row per sensor-bucket
+instead of every reading. Anything else (other columns, joins, subqueries,
+HAVING, OR, DISTINCT, a bound that cuts through a bucket) runs unchanged.
+Buckets are UTC, matching Trino sessions in the service's default UTC zone.
+
+A rollup only holds every reading from its complete-from watermark on
+(earlier readings are added by backfill_rollups.py, which then lowers it to
+0), so a query is only rewritten when every event_time lower bound is at or
+after the chosen table's watermark, and an unbounded one only once it is 0.
+"""
+import re
+from datetime import UTC, datetime, timedelta
+
+from query_cache import normalize_sql
+
+# TBLPROPERTY holding a rollup's watermark, in epoch seconds
+# (shared with data-services/spark/sensor_streaming_job.py)
+ROLLUP_COMPLETE_FROM = "verdantiq.rollup.complete-from"
+ROLLUP_TABLE = re.compile(r"\w+_rollup_(?:1m|1h|1d)")
+
+# Rollup table suffix per date_trunc unit, finest first
+GRAINS = (("minute", "1m"), ("hour", "1h"), ("day", "1d"))
+# Units coarser than a day group daily buckets
+_UNIT_RANK = {"minute": 0, "hour": 1, "day": 2, "week": 3, "month": 3, "quarter": 3, "year": 3}
+
+_KEYS = ("tenant_id", "farm_id", "sensor_id")
+_KEY = r"(?:tenant_id|farm_id|sensor_id)"
+_LIT = r"\x00\d+\x00"                       # a masked string literal
+_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+_UNSUPPORTED = re.compile(
+    r"\b(?:join|union|intersect|except|having|over|distinct|or|filter|offset|fetch|case)\b|\""
+)
+_QUERY = re.compile(
+    r"select (?P<select>.+?) from (?P<table>[\w.]+)"
+    r"(?: where (?P<where>.+?))?(?: group by (?P<group>.+?))?"
+    r"(?: order by (?P<order>.+?))?(?: limit (?P<limit>\d+))?"
+)
+_ORDER_ITEM = re.compile(r"(?P<expr>.+?)(?P<dir>(?: asc| desc)?(?: nulls (?:first|last))?)")
+_ALIAS = re.compile(r"(?P<expr>.+?) as (?P<alias>\w+)")
+_AGG = re.compile(r"(?P<fn>min|max|sum|avg|count) ?\( ?(?P<col>\w+) ?\. ?(?P<field>\w+) ?\)")
+_COUNT_ALL = re.compile(r"count ?\( ?(?:\*|1) ?\)")
+_TRUNC = re.compile(rf"date_trunc ?\( ?(?P<unit>{_LIT}) ?, ?event_time ?\)")
+_KEY_PRED = re.compile(
+    rf"{_KEY} ?(?:=|<>|!=) ?(?:{_LIT}|current_user_tenant ?\( ?\))"
+    rf"|{_KEY} (?:not )?in ?\( ?{_LIT}(?: ?, ?{_LIT})* ?\)"
+    rf"|{_KEY} is (?:not )?null"
+)
+_TIME_PRED = re.compile(r"event_time ?(?P<op>>=|<) ?(?P<bound>.+)")
+_INTERVAL = rf"(?: ?(?P<sign>[-+]) ?interval (?P<n>{_LIT}) (?P<step>day|hour|minute))?"
+_BOUND_LITERAL = re.compile(rf"(?:timestamp |date )?(?P<lit>{_LIT})")
+_BOUND_TODAY = re.compile(rf"current_date{_INTERVAL}")
+_BOUND_TRUNC = re.compile(
+    rf"date_trunc ?\( ?(?P<unit>{_LIT}) ?, ?"
+    rf"(?:current_timestamp|localtimestamp|now ?\( ?\)) ?\){_INTERVAL}"
+)
+_TIMESTAMP = re.compile(
+    r"'\d{4}-\d{2}-\d{2}"
+    r"(?:[ t](?P<h>\d{2})(?::(?P<m>\d{2})(?::(?P<s>\d{2})(?:\.(?P<f>\d+))?)?)?)?'"
+)
+
+
+def _truncate(ts: datetime, unit: str) -> datetime:
+    """Trino's date_trunc(unit, ts) for the units in _UNIT_RANK."""
+    ts = ts.replace(second=0, microsecond=0)
+    if unit != "minute":
+        ts = ts.replace(minute=0)
+    if unit not in ("minute", "hour"):
+        ts = ts.replace(hour=0)
+    if unit == "week":
+        ts -= timedelta(days=ts.weekday())
+    elif unit == "month":
+        ts = ts.replace(day=1)
+    elif unit == "quarter":
+        ts = ts.replace(month=(ts.month - 1) // 3 * 3 + 1, day=1)
+    elif unit == "year":
+        ts = ts.replace(month=1, day=1)
+    return ts
+
+
+def _split(text: str, sep: str) -> list[str]:
+    """text split on sep outside parentheses."""
+    parts, depth, start = [], 0, 0
+    for i, ch in enumerate(text):
+        depth += (ch == "(") - (ch == ")")
+        if depth == 0 and text.startswith(sep, i):
+            parts.append(text[start:i].strip())
+            start = i + len(sep)
+    parts.append(text[start:].strip())
+    return parts
+
+
+def rollup_tables(tree: dict, catalog: str, schema: str) -> dict[str, dict[str, str]]:
+    """Table → {column: type} for one schema of a /query/schema tree."""
+    for cat in tree.get("catalogs", []):
+        if cat["name"] != catalog:
+            continue
+        for sch in cat["schemas"]:
+            if sch["name"] == schema:
+                return {
+                    t["name"]: {c["name"]: c["type"].lower() for c in t["cols"]}
+                    for t in sch["tables"]
+                }
+    return {}
+
+
+class _Rewrite:
+    """One query's mapping onto a rollup table; any failed check returns None."""
+
+    def __init__(self, literals: list[str], columns: dict[str, str]):
+        self.literals = literals
+        self.columns = columns        # stats column → row type of the chosen rollup
+        self.rank = 3                 # coarsest grain every bucket/bound allows
+        self.lower: list[float] = []  # event_time lower bounds, epoch seconds
+
+    def unit(self, masked: str) -> str:
+        return self.literals[int(masked.strip("\x00"))].strip("'").lower()
+
+    def expr(self, text: str) -> tuple[str, bool] | None:
+        """(rollup expression, is_aggregate) for a select/group/order expression."""
+        if text in _KEYS:
+            return text, False
+        if m := _TRUNC.fullmatch(text):
+            unit = self.unit(m["unit"])
+            if unit not in _UNIT_RANK:
+                return None
+            self.rank = min(self.rank, _UNIT_RANK[unit])
+            return f"date_trunc({m['unit']}, bucket_start)", False
+        if _COUNT_ALL.fullmatch(text):
+            return "coalesce(sum(readings), 0)", True
+        if m := _AGG.fullmatch(text):
+            stats = self.columns.get(m["col"], "")
+            if not re.search(rf"[(,] ?\"?{m['field']}\"? row\(", stats):
+                return None
+            path = f"{m['col']}.{m['field']}"
+            return {
+                "min":   f"min({path}.min)",
+                "max":   f"max({path}.max)",
+                "sum":   f"sum({path}.sum)",
+                "count": f"coalesce(sum({path}.count), 0)",
+                "avg":   f"sum({path}.sum) / nullif(sum({path}.count), 0)",
+            }[m["fn"]], True
+        return None
+
+    def bound_rank(self, bound: str) -> int:
+        """Coarsest grain rank a time bound falls on; -1 if it cuts a minute."""
+        if m := _BOUND_LITERAL.fullmatch(bound):
+            ts = _TIMESTAMP.fullmatch(self.literals[int(m["lit"].strip("\x00"))].lower())
+            if not ts or int(ts["s"] or 0) or int(ts["f"] or 0):
+                return -1
+            return 0 if int(ts["m"] or 0) else 1 if int(ts["h"] or 0) else 2
+        if m := _BOUND_TODAY.fullmatch(bound):
+            rank = 2
+        elif m := _BOUND_TRUNC.fullmatch(bound):
+            rank = min(_UNIT_RANK.get(self.unit(m["unit"]), -1), 2)
+        else:
+            return -1
+        if m["n"]:
+            if not re.fullmatch(r"'\d+'", self.literals[int(m["n"].strip("\x00"))]):
+                return -1
+            rank = min(rank, _UNIT_RANK[m["step"]])
+        return rank
+
+    def bound_time(self, bound: str) -> float | None:
+        """A time bound as epoch seconds (UTC), evaluated now for relative ones.
+        Time only moves on, so a relative bound is no earlier when Trino runs it."""
+        if m := _BOUND_LITERAL.fullmatch(bound):
+            try:
+                ts = datetime.fromisoformat(self.literals[int(m["lit"].strip("\x00"))].strip("'"))
+            except ValueError:
+                return None
+            return ts.replace(tzinfo=UTC).timestamp()
+        elif m := _BOUND_TODAY.fullmatch(bound):
+            ts = _truncate(datetime.now(UTC), "day")
+        elif m := _BOUND_TRUNC.fullmatch(bound):
+            ts = _truncate(datetime.now(UTC), self.unit(m["unit"]))
+        else:
+            return None
+        if m["n"]:
+            n = int(self.literals[int(m["n"].strip("\x00"))].strip("'"))
+            step = timedelta(**{m["step"] + "s": n})
+            ts = ts - step if m["sign"] == "-" else ts + step
+        return ts.timestamp()
+
+    def where(self, text: str) -> str | None:
+        conjuncts = []
+        for pred in _split(text, " and "):
+            if _KEY_PRED.fullmatch(pred):
+                conjuncts.append(pred)
+            elif m := _TIME_PRED.fullmatch(pred):
+                self.rank = min(self.rank, self.bound_rank(m["bound"]))
+                if self.rank < 0:
+                    return None
+                if m["op"] == ">=":
+                    lower = self.bound_time(m["bound"])
+                    if lower is None:
+                        return None
+                    self.lower.append(lower)
+                conjuncts.append("bucket_start" + pred[len("event_time"):])
+            else:
+                return None
+        return " and ".join(conjuncts)
+
+
+def rewrite_for_rollups(sql: str, tables: dict[str, dict[str, str]], watermarks: dict[str, int],
+                        catalog: str, default_schema: str) -> str | None:
+    """sql rewritten onto a {type}_rollup_{grain} table in tables (see
+    rollup_tables) whose watermark (table → complete-from) it starts at or
+    after, or None when the query is not eligible."""
+    normalized = normalize_sql(sql)
+    literals: list[str] = []
+
+    def mask(m: re.Match) -> str:
+        literals.append(m.group(0))
+        return f"\x00{len(literals) - 1}\x00"
+
+    masked = _LITERAL.sub(mask, normalized)
+    if _UNSUPPORTED.search(masked) or len(re.findall(r"\b(?:select|from)\b", masked)) != 2:
+        return None
+    query = _QUERY.fullmatch(masked)
+    if not query:
+        return None
+
+    parts = query["table"].split(".")
+    if len(parts) == 3 and parts[0] != catalog or len(parts) >= 2 and parts[-2] != default_schema:
+        return None
+    if len(parts) > 3 or not parts[-1].endswith("_data"):
+        return None
+    sensor_type = parts[-1].removesuffix("_data")
+    # The daily rollup is the reference: bail out unless its stats column exists
+    daily = tables.get(f"{sensor_type}_rollup_1d")
+    if not daily:
+        return None
+    rewrite = _Rewrite(literals, daily)
+
+    select, aliases = [], set()
+    for item in _split(query["select"], ","):
+        m = _ALIAS.fullmatch(item)
+        expr, alias = (m["expr"], m["alias"]) if m else (item, None)
+        mapped = rewrite.expr(expr)
+        # Ungrouped plain columns would return one row per bucket, not per reading
+        if mapped is None or not query["group"] and not mapped[1]:
+            return None
+        select.append(mapped[0] + (f" as {alias}" if alias else ""))
+        if alias:
+            aliases.add(alias)
+
+    clauses = []
+    if query["where"]:
+        where = rewrite.where(query["where"])
+        if where is None:
+            return None
+        clauses.append(f"where {where}")
+    if query["group"]:
+        group = []
+        for item in _split(query["group"], ","):
+            mapped = (item, False) if item.isdigit() else rewrite.expr(item)
+            if mapped is None or mapped[1]:
+                return None
+            group.append(mapped[0])
+        clauses.append("group by " + ", ".join(group))
+    if query["order"]:
+        order = []
+        for item in _split(query["order"], ","):
+            m = _ORDER_ITEM.fullmatch(item)
+            if not m:
+                return None
+            key = m["expr"]
+            if not (key.isdigit() or key in aliases):
+                mapped = rewrite.expr(key)
+                if mapped is None:
+                    return None
+                key = mapped[0]
+            order.append(key + m["dir"])
+        clauses.append("order by " + ", ".join(order))
+    if query["limit"]:
+        clauses.append(f"limit {query['limit']}")
+
+    if rewrite.rank < 0:
+        return None
+    grain = [suffix for unit, suffix in GRAINS if _UNIT_RANK[unit] <= rewrite.rank][-1]
+    target = f"{sensor_type}_rollup_{grain}"
+    if target not in tables:
+        return None
+    start = watermarks.get(target)
+    if start is None or start > 0 and (not rewrite.lower or min(rewrite.lower) < start):
+        return None
+    table = ".".join(parts[:-1] + [target])
+    # Rebuilt from the caller's own query, whose pieces all matched the
+    # patterns above; it runs under the same tenant-scoped Trino session
+    text = f"select {', '.join(select)} from {table} " + " ".join(clauses)  # noqa: S608
+    return re.sub(r"\x00(\d+)\x00", lambda m: literals[int(m.group(1))], text.strip())
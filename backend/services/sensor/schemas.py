@@ -1,23 +1,24 @@
-from pydantic import BaseModel, ConfigDict
-from typing import Any, Optional, List
-from datetime import datetime, date
+from datetime import date, datetime
+from typing import Any, Literal
+
+from pydantic import BaseModel, ConfigDict, Field
+
 from models import SensorStatus
-import math
 
 
 class SensorCreate(BaseModel):
     tenant_id: int
     sensor_name: str
     sensor_type: str
-    location: Optional[str] = None
-    farm_id: Optional[str] = None
-    sensor_metadata: Optional[dict] = None
+    location: str | None = None
+    farm_id: str | None = None
+    sensor_metadata: dict | None = None
     # Hardware / identity fields (stored in sensor_metadata)
-    manufacturer: Optional[str] = None
-    model: Optional[str] = None
-    serial_number: Optional[str] = None
-    operating_system: Optional[str] = None
-    power_type: Optional[str] = None   # "ac" | "dc"
+    manufacturer: str | None = None
+    model: str | None = None
+    serial_number: str | None = None
+    operating_system: str | None = None
+    power_type: str | None = None   # "ac" | "dc"
 
 
 class SensorResponse(BaseModel):
@@ -26,38 +27,40 @@ class SensorResponse(BaseModel):
     user_id: int
     sensor_name: str
     sensor_type: str
-    location: Optional[str] = None
-    sensor_metadata: Optional[dict] = None
+    location: str | None = None
+    sensor_metadata: dict | None = None
     mqtt_token: str
     message_count: int
     storage_bytes: int = 0
-    farm_id: Optional[str] = None
+    farm_id: str | None = None
     status: SensorStatus
-    last_message_at: Optional[datetime] = None
+    last_message_at: datetime | None = None
     created_at: datetime
-    updated_at: Optional[datetime] = None
+    updated_at: datetime | None = None
 
     model_config = {"from_attributes": True}
 
 
 class SensorPage(BaseModel):
-    items: List[SensorResponse]
+    items: list[SensorResponse]
     total: int
     page: int
     per_page: int
     pages: int
+    next_cursor: str | None = None   # pass back as ?cursor= for the next page
+    total_exact: bool = True            # False when total comes from the count cache
 
 
 class SensorUpdate(BaseModel):
-    sensor_name: Optional[str] = None
-    sensor_type: Optional[str] = None
-    location: Optional[str] = None
-    sensor_metadata: Optional[dict] = None
-    manufacturer: Optional[str] = None
-    model: Optional[str] = None
-    serial_number: Optional[str] = None
-    operating_system: Optional[str] = None
-    power_type: Optional[str] = None
+    sensor_name: str | None = None
+    sensor_type: str | None = None
+    location: str | None = None
+    sensor_metadata: dict | None = None
+    manufacturer: str | None = None
+    model: str | None = None
+    serial_number: str | None = None
+    operating_system: str | None = None
+    power_type: str | None = None
 
 
 class SensorRenameRequest(BaseModel):
@@ -71,23 +74,25 @@ class SensorStatusUpdateRequest(BaseModel):
 class SensorAuditLogResponse(BaseModel):
     id: int
     tenant_id: int
-    sensor_id: Optional[str] = None
+    sensor_id: str | None = None
     sensor_name: str
     action: str
     performed_by: int
-    performed_by_name: Optional[str] = None  # first_name of the user
-    details: Optional[dict] = None
+    performed_by_name: str | None = None  # first_name of the user
+    details: dict | None = None
     created_at: datetime
 
     model_config = {"from_attributes": True}
 
 
 class SensorAuditPage(BaseModel):
-    items: List[SensorAuditLogResponse]
+    items: list[SensorAuditLogResponse]
     total: int
     page: int
     per_page: int
     pages: int
+    next_cursor: str | None = None   # pass back as ?cursor= for the next page
+    total_exact: bool = True            # False when total comes from the count cache
 
 
 class SensorConnectionEventResponse(BaseModel):
@@ -96,158 +101,174 @@ class SensorConnectionEventResponse(BaseModel):
     tenant_id: int
     event_type: str
     status: str
-    message: Optional[str] = None
-    details: Optional[dict] = None
+    message: str | None = None
+    details: dict | None = None
     created_at: datetime
 
     model_config = {"from_attributes": True}
 
 
 class SensorConnectionEventPage(BaseModel):
-    items: List[SensorConnectionEventResponse]
+    items: list[SensorConnectionEventResponse]
     total: int
     page: int
     per_page: int
     pages: int
+    next_cursor: str | None = None   # pass back as ?cursor= for the next page
+    total_exact: bool = True            # False when total comes from the count cache
 
 
 class SensorDataPoint(BaseModel):
     timestamp: str
     value: Any
-    unit: Optional[str] = None
+    unit: str | None = None
 
 
 class SensorDataResponse(BaseModel):
     sensor_id: str
     tenant_id: int
-    data: List[SensorDataPoint]
+    data: list[SensorDataPoint]
 
 
 class MessageIncrementRequest(BaseModel):
     message_increment: int = 1
 
 
+class SensorMessageIncrement(BaseModel):
+    sensor_id: str
+    increment: int
+
+
+class BulkMessageIncrementRequest(BaseModel):
+    """One accounting window from the data service, already folded per sensor."""
+    increments: list[SensorMessageIncrement]
+
+
 class ConnectionEventCreate(BaseModel):
     event_type: str
     status: str = "success"
-    message: Optional[str] = None
-    details: Optional[dict] = None
+    message: str | None = None
+    details: dict | None = None
 
 
 class FarmCreate(BaseModel):
     farm_name: str
-    address: Optional[str] = None
-    country: Optional[str] = None
-    farm_size_ha: Optional[float] = None
-    farm_type: Optional[str] = None
-    latitude: Optional[float] = None
-    longitude: Optional[float] = None
-    perimeter_km: Optional[float] = None
-    crops: Optional[List[str]] = None
-    rainfall_avg_mm: Optional[float] = None
-    sunlight_avg_hrs: Optional[float] = None
-    soil_type: Optional[str] = None
-    crop_history: Optional[List[dict]] = None
-    notes: Optional[str] = None
+    address: str | None = None
+    country: str | None = None
+    farm_size_ha: float | None = None
+    farm_type: str | None = None
+    latitude: float | None = None
+    longitude: float | None = None
+    perimeter_km: float | None = None
+    crops: list[str] | None = None
+    rainfall_avg_mm: float | None = None
+    sunlight_avg_hrs: float | None = None
+    soil_type: str | None = None
+    crop_history: list[dict] | None = None
+    notes: str | None = None
 
 
 class FarmUpdate(BaseModel):
-    farm_name: Optional[str] = None
-    address: Optional[str] = None
-    country: Optional[str] = None
-    farm_size_ha: Optional[float] = None
-    farm_type: Optional[str] = None
-    latitude: Optional[float] = None
-    longitude: Optional[float] = None
-    perimeter_km: Optional[float] = None
-    crops: Optional[List[str]] = None
-    rainfall_avg_mm: Optional[float] = None
-    sunlight_avg_hrs: Optional[float] = None
-    soil_type: Optional[str] = None
-    crop_history: Optional[List[dict]] = None
-    notes: Optional[str] = None
+    farm_name: str | None = None
+    address: str | None = None
+    country: str | None = None
+    farm_size_ha: float | None = None
+    farm_type: str | None = None
+    latitude: float | None = None
+    longitude: float | None = None
+    perimeter_km: float | None = None
+    crops: list[str] | None = None
+    rainfall_avg_mm: float | None = None
+    sunlight_avg_hrs: float | None = None
+    soil_type: str | None = None
+    crop_history: list[dict] | None = None
+    notes: str | None = None
 
 
 class FarmResponse(BaseModel):
     farm_id: str
     tenant_id: int
     farm_name: str
-    address: Optional[str] = None
-    country: Optional[str] = None
-    farm_size_ha: Optional[float] = None
-    farm_type: Optional[str] = None
-    latitude: Optional[float] = None
-    longitude: Optional[float] = None
-    perimeter_km: Optional[float] = None
-    crops: Optional[List[str]] = None
-    rainfall_avg_mm: Optional[float] = None
-    sunlight_avg_hrs: Optional[float] = None
-    soil_type: Optional[str] = None
-    crop_history: Optional[List[dict]] = None
-    notes: Optional[str] = None
+    address: str | None = None
+    country: str | None = None
+    farm_size_ha: float | None = None
+    farm_type: str | None = None
+    latitude: float | None = None
+    longitude: float | None = None
+    perimeter_km: float | None = None
+    crops: list[str] | None = None
+    rainfall_avg_mm: float | None = None
+    sunlight_avg_hrs: float | None = None
+    soil_type: str | None = None
+    crop_history: list[dict] | None = None
+    notes: str | None = None
     created_at: datetime
-    updated_at: Optional[datetime] = None
+    updated_at: datetime | None = None
     model_config = ConfigDict(from_attributes=True)
 
 
 class FarmPage(BaseModel):
-    items: List[FarmResponse]
+    items: list[FarmResponse]
     total: int
     page: int
     per_page: int
     pages: int
+    next_cursor: str | None = None   # pass back as ?cursor= for the next page
+    total_exact: bool = True            # False when total comes from the count cache
 
 
 class SensorStorageCreate(BaseModel):
-    sensor_id: Optional[str] = None
+    sensor_id: str | None = None
     allocated_gb: float
 
 
 class SensorStorageResponse(BaseModel):
     storage_id: str
     tenant_id: int
-    sensor_id: Optional[str] = None
+    sensor_id: str | None = None
     allocated_gb: float
     used_bytes: int
     status: str
     created_at: datetime
-    updated_at: Optional[datetime] = None
+    updated_at: datetime | None = None
     model_config = ConfigDict(from_attributes=True)
 
 
 class SensorStoragePage(BaseModel):
-    items: List[SensorStorageResponse]
+    items: list[SensorStorageResponse]
     total: int
     page: int
     per_page: int
     pages: int
+    next_cursor: str | None = None   # pass back as ?cursor= for the next page
+    total_exact: bool = True            # False when total comes from the count cache
 
 
 class CropManagementCreate(BaseModel):
     farm_id: str
     crop_name: str
-    area_ha: Optional[float] = None
-    grain_type: Optional[str] = None
-    grains_planted: Optional[int] = None
-    planting_date: Optional[date] = None
-    expected_harvest_date: Optional[date] = None
-    notes: Optional[str] = None
-    avg_sunlight_hrs: Optional[float] = None
-    soil_ph: Optional[float] = None
-    soil_humidity: Optional[float] = None
+    area_ha: float | None = None
+    grain_type: str | None = None
+    grains_planted: int | None = None
+    planting_date: date | None = None
+    expected_harvest_date: date | None = None
+    notes: str | None = None
+    avg_sunlight_hrs: float | None = None
+    soil_ph: float | None = None
+    soil_humidity: float | None = None
 
 
 class CropManagementUpdate(BaseModel):
-    crop_name: Optional[str] = None
-    area_ha: Optional[float] = None
-    grain_type: Optional[str] = None
-    grains_planted: Optional[int] = None
-    planting_date: Optional[date] = None
-    expected_harvest_date: Optional[date] = None
-    notes: Optional[str] = None
-    avg_sunlight_hrs: Optional[float] = None
-    soil_ph: Optional[float] = None
-    soil_humidity: Optional[float] = None
+    crop_name: str | None = None
+    area_ha: float | None = None
+    grain_type: str | None = None
+    grains_planted: int | None = None
+    planting_date: date | None = None
+    expected_harvest_date: date | None = None
+    notes: str | None = None
+    avg_sunlight_hrs: float | None = None
+    soil_ph: float | None = None
+    soil_humidity: float | None = None
 
 
 class CropManagementResponse(BaseModel):
@@ -255,22 +276,22 @@ class CropManagementResponse(BaseModel):
     farm_id: str
     tenant_id: int
     crop_name: str
-    area_ha: Optional[float] = None
-    grain_type: Optional[str] = None
-    grains_planted: Optional[int] = None
-    planting_date: Optional[date] = None
-    expected_harvest_date: Optional[date] = None
-    notes: Optional[str] = None
-    avg_sunlight_hrs: Optional[float] = None
-    soil_ph: Optional[float] = None
-    soil_humidity: Optional[float] = None
+    area_ha: float | None = None
+    grain_type: str | None = None
+    grains_planted: int | None = None
+    planting_date: date | None = None
+    expected_harvest_date: date | None = None
+    notes: str | None = None
+    avg_sunlight_hrs: float | None = None
+    soil_ph: float | None = None
+    soil_humidity: float | None = None
     created_at: datetime
-    updated_at: Optional[datetime] = None
+    updated_at: datetime | None = None
     model_config = ConfigDict(from_attributes=True)
 
 
 class CropManagementPage(BaseModel):
-    items: List[CropManagementResponse]
+    items: list[CropManagementResponse]
     total: int
     page: int
     per_page: int
@@ -286,11 +307,34 @@ class QueryRequest(BaseModel):
 
 
 class QueryResult(BaseModel):
-    columns: List[str]
-    rows: List[List[Any]]
+    columns: list[str]
+    rows: list[list[Any]]
     ms: int
     qu: float = 0.0     # Query Units consumed
     cost: float = 0.0   # dollar cost = qu × $0.01/QU
+    cached: bool = False  # served from the result cache (snapshots unchanged)
+
+
+class QueryPageRequest(BaseModel):
+    sql: str
+    page_size: int = Field(default=1000, ge=1, le=10_000)
+
+
+class QueryPage(BaseModel):
+    columns: list[str]
+    types: list[str]                 # Trino type per column, e.g. "bigint", "timestamp(3)"
+    rows: list[list[Any]]            # typed JSON values — decimals as strings, temporals ISO-8601
+    offset: int                      # position of this page's first row in the result
+    next_token: str | None = None # GET /query/results/{token} for the next page
+    ms: int
+    qu: float = 0.0                  # billed once, on the page that exhausts the result
+    cost: float = 0.0
+
+
+class QueryStreamRequest(BaseModel):
+    sql: str
+    format: Literal["ndjson", "arrow"] = "ndjson"
+    chunk_size: int = Field(default=5_000, ge=1, le=50_000)
 
 
 class SchemaColumn(BaseModel):
@@ -300,21 +344,26 @@ class SchemaColumn(BaseModel):
 
 class SchemaTable(BaseModel):
     name: str
-    cols: List[SchemaColumn]
+    cols: list[SchemaColumn]
 
 
 class SchemaEntry(BaseModel):
     name: str
-    tables: List[SchemaTable]
+    tables: list[SchemaTable]
 
 
 class CatalogEntry(BaseModel):
     name: str
-    schemas: List[SchemaEntry]
+    schemas: list[SchemaEntry]
 
 
 class SchemaTree(BaseModel):
-    catalogs: List[CatalogEntry]
+    catalogs: list[CatalogEntry]
+
+
+class SchemaChangeNotice(BaseModel):
+    catalog: str
+    table: str | None = None   # informational; the whole catalog tree is rebuilt
 
 
 class QueryHistoryItem(BaseModel):
@@ -323,13 +372,13 @@ class QueryHistoryItem(BaseModel):
     ms: int                     # execution time in ms
     qu: float = 0.0             # Query Units consumed
     cost: float = 0.0           # dollar cost
-    columns: List[str] = []     # result column headers
-    rows: List[List[Any]] = []  # result rows (for display on history click)
+    columns: list[str] = []     # result column headers
+    rows: list[list[Any]] = []  # result rows (for display on history click)
 
 
 class QueryHistory(BaseModel):
-    items: List[QueryHistoryItem]
+    items: list[QueryHistoryItem]
 
 
 class LastSqlResponse(BaseModel):
-    sql: Optional[str] = None
+    sql: str | None = None
@@ -1,4 +1,5 @@
 import os
+from collections.abc import Iterator
 import pytest
 from unittest.mock import AsyncMock
 from fastapi.testclient import TestClient
@@ -50,9 +51,25 @@ def mock_http_calls(monkeypatch):
     """Silence all inter-service HTTP calls — sensor service is tested in isolation."""
     monkeypatch.setattr(_main_module, "notify_sensor_delta", AsyncMock())
     monkeypatch.setattr(_main_module, "notify_message_increment", AsyncMock())
+    monkeypatch.setattr(_main_module, "notify_message_increments", AsyncMock())
     monkeypatch.setattr(_main_module, "sync_iot_devices", AsyncMock())
 
 
+@pytest.fixture(autouse=True)
+def clear_caches() -> Iterator[None]:
+    """Cached sessions / billing status / page counts / schema trees must not
+    leak between tests (ids are reused)."""
+    _main_module._session_cache.clear()
+    _main_module._billing_cache.clear()
+    _main_module.crud._count_cache.clear()
+    _main_module._schema_cache.reset()
+    yield
+    _main_module._session_cache.clear()
+    _main_module._billing_cache.clear()
+    _main_module.crud._count_cache.clear()
+    _main_module._schema_cache.reset()
+
+
 def _override_get_db():
     db = TestingSessionLocal()
     try:
@@ -1,12 +1,25 @@
+import asyncio
+import json
+import threading
+import time
 import uuid
+from collections.abc import AsyncIterator, Callable
+from datetime import UTC, datetime, timedelta, timezone
+from typing import Any
 from unittest.mock import AsyncMock
-from sqlalchemy import text
+
+import pytest
 import trino.exceptions
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.orm import Session
 
+import crud as _crud_module
+import main as _main_module
 import models
 import schemas
-import main as _main_module
-import crud as _crud_module
+from http_client import ServiceClient
+from query_engine import QueryCancelledError, QueryRejectedError, TrinoPool
 
 
 def _create_sensor(client, sensor_payload, monkeypatch):
@@ -218,6 +231,47 @@ def test_list_sensors_pagination(client, mock_user, db_session):
     assert len(r3.json()["items"]) == 5
 
 
+def test_list_sensors_cursor_pagination(
+    client: TestClient, mock_user: models.User, db_session: Session
+) -> None:
+    """Keyset pages cover every sensor exactly once, even with identical created_at."""
+    for i in range(25):
+        db_session.add(
+            models.Sensor(
+                tenant_id=mock_user.tenant_id,
+                user_id=mock_user.user_id,
+                sensor_name=f"Sensor{i:02d}",
+                sensor_type="temp",
+                mqtt_token=str(uuid.uuid4()),
+                message_count=0,
+                status=models.SensorStatus.active,
+            )
+        )
+    db_session.commit()  # one transaction → every row shares created_at
+
+    seen: list[str] = []
+    cursor: str | None = ""
+    pages = 0
+    while cursor is not None:
+        resp = client.get(
+            "/sensors/", params={"tenant_id": mock_user.tenant_id, "per_page": 10, "cursor": cursor}
+        )
+        assert resp.status_code == 200
+        body = resp.json()
+        assert body["total"] == 25
+        seen.extend(s["sensor_id"] for s in body["items"])
+        cursor = body["next_cursor"]
+        pages += 1
+
+    assert pages == 3
+    assert len(seen) == len(set(seen)) == 25
+
+
+def test_list_sensors_invalid_cursor(client: TestClient, mock_user: models.User) -> None:
+    resp = client.get(f"/sensors/?tenant_id={mock_user.tenant_id}&cursor=not-a-cursor")
+    assert resp.status_code == 400
+
+
 # ── 1.2 Sensor data via Trino ─────────────────────────────────────────────────
 
 def test_get_sensor_data_filters_by_tenant(client, sensor_payload, monkeypatch):
@@ -254,6 +308,75 @@ def test_get_sensor_data_handles_trino_unavailable(client, sensor_payload, monke
     assert "unavailable" in response.json()["detail"].lower()
 
 
+class _FakeHotRedis:
+    """Sorted sets and plain keys, behind the pipeline calls HotReadings makes."""
+
+    def __init__(self) -> None:
+        self.zsets: dict[str, dict[str, float]] = {}
+        self.keys: dict[str, str] = {}
+        self._ops: list[Callable[[], Any]] = []
+
+    def pipeline(self, transaction: bool = True) -> "_FakeHotRedis":
+        self._ops = []
+        return self
+
+    def zrevrange(self, key: str, start: int, end: int, withscores: bool = False) -> None:
+        self._ops.append(lambda: sorted(self.zsets.get(key, {}).items(), key=lambda kv: -kv[1]))
+
+    def exists(self, key: str) -> None:
+        self._ops.append(lambda: int(key in self.keys))
+
+    def zadd(self, key: str, mapping: dict[str, float]) -> None:
+        self._ops.append(lambda: self.zsets.setdefault(key, {}).update(mapping))
+
+    def zremrangebyrank(self, key: str, start: int, end: int) -> None:
+        def trim() -> None:
+            ranked = sorted(self.zsets[key].items(), key=lambda kv: kv[1])
+            self.zsets[key] = dict(ranked[end + 1:])   # end is always -(limit + 1)
+        self._ops.append(trim)
+
+    def expire(self, key: str, ttl: int) -> None:
+        self._ops.append(lambda: True)
+
+    def set(self, key: str, value: str, ex: int | None = None) -> None:
+        self._ops.append(lambda: self.keys.__setitem__(key, value))
+
+    async def execute(self) -> list[Any]:
+        return [op() for op in self._ops]
+
+
+def test_get_sensor_data_served_from_hot_state_after_cold_miss(
+    client: TestClient, sensor_payload: dict, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    redis = _FakeHotRedis()
+    monkeypatch.setattr(_main_module._hot_readings, "redis", redis)
+    monkeypatch.setattr(_main_module._hot_readings, "limit", 3)
+    trino_rows = [
+        schemas.SensorDataPoint(timestamp="2025-07-01T12:00:00.000Z", value='{"t": 25.5}'),
+    ]
+    get_data = MagicMock(return_value=trino_rows)
+    monkeypatch.setattr(_crud_module, "get_sensor_data", get_data)
+    sensor = _create_sensor(client, sensor_payload, monkeypatch)
+    sensor_id = sensor["sensor_id"]
+    key = f"viq:hot:readings:{sensor['tenant_id']}:{sensor_id}"
+
+    # Readings the consumer added before anyone asked: too few to trust
+    early = json.dumps({"timestamp": "2025-07-01T12:01:00.000Z", "payload": '{"t": 26.0}'})
+    redis.zsets[key] = {early: 1751371260000.0}
+    cold = client.get(f"/sensors/{sensor_id}/data").json()
+    assert [p["value"] for p in cold["data"]] == ['{"t": 25.5}']
+    assert get_data.call_count == 1
+
+    # Filled from Trino and marked warm: later reads skip Trino, newest first
+    newest = json.dumps({"timestamp": "2025-07-01T12:02:00.000Z", "payload": '{"t": 27.0}'})
+    redis.zsets[key][newest] = 1751371320000.0
+    hot = client.get(f"/sensors/{sensor_id}/data").json()
+    assert [p["timestamp"] for p in hot["data"]] == [
+        "2025-07-01T12:02:00.000Z", "2025-07-01T12:01:00.000Z", "2025-07-01T12:00:00.000Z",
+    ]
+    assert get_data.call_count == 1
+
+
 # ── 1.2 Role enforcement ──────────────────────────────────────────────────────
 
 def test_admin_can_delete_any_sensor_in_tenant(admin_client, admin_user, db_session):
@@ -307,9 +430,7 @@ def test_active_billing_required_before_sensor_onboarding(client, sensor_payload
 # ── Coverage additions ─────────────────────────────────────────────────────────
 
 import jwt as _pyjwt
-import pytest
 import httpx
-from datetime import datetime, timedelta, timezone
 from unittest.mock import patch, MagicMock, AsyncMock as _AsyncMock
 
 
@@ -374,6 +495,24 @@ def test_get_sensor_data_crud_success():
     assert result[0].value == {"temp": 25}
 
 
+def test_get_sensor_data_crud_uses_the_hot_state_timestamp_format() -> None:
+    """Trino rows come back in the format the data service writes to Redis."""
+    from datetime import datetime as _dt
+
+    import crud
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_cursor.fetchall.return_value = [
+        (_dt(2025, 7, 1, 12, 0, 0, 123456), "{}"),
+        ("2025-07-01 11:59:00.000 UTC", "{}"),
+    ]
+    mock_conn.cursor.return_value = mock_cursor
+    with patch("crud.trino.dbapi.connect", return_value=mock_conn):
+        result = crud.get_sensor_data("1", 1)
+    assert [p.timestamp for p in result] == ["2025-07-01T12:00:00.123Z", "2025-07-01T11:59:00.000Z"]
+    assert mock_cursor.execute.call_args[0][1][-1] == crud.settings.HOT_READINGS_LIMIT
+
+
 def test_get_sensor_data_crud_exception_wrapping():
     """Non-trino exceptions in get_sensor_data are re-raised as DatabaseError."""
     import crud
@@ -471,6 +610,81 @@ def test_get_current_user_valid_session(raw_client, mock_user, db_session):
     assert resp.status_code == 200
 
 
+def _valid_session_token(mock_user: models.User, db_session: Session) -> str:
+    token = _pyjwt.encode(
+        {"sub": str(mock_user.user_id), "tenant_id": str(mock_user.tenant_id),
+         "exp": datetime.now(UTC) + timedelta(minutes=30)},
+        _TEST_SECRET, algorithm=_TEST_ALGO,
+    )
+    db_session.add(models.Session(
+        user_id=mock_user.user_id,
+        tenant_id=mock_user.tenant_id,
+        token=token,
+        expires_at=datetime.now(UTC).replace(tzinfo=None) + timedelta(minutes=30),
+        status=models.SessionStatus.active,
+    ))
+    db_session.commit()
+    return token
+
+
+def test_get_current_user_cache_hit_skips_db(
+    raw_client: TestClient,
+    mock_user: models.User,
+    db_session: Session,
+) -> None:
+    """Second request with the same token is served from the session cache."""
+    token = _valid_session_token(mock_user, db_session)
+    raw_client.cookies.set("access_token", token)
+    assert raw_client.get(f"/sensors/?tenant_id={mock_user.tenant_id}").status_code == 200
+
+    # Drop the session row: a DB-backed lookup would now 401
+    db_session.query(models.Session).delete()
+    db_session.commit()
+    resp = raw_client.get(f"/sensors/?tenant_id={mock_user.tenant_id}")
+    assert resp.status_code == 200
+
+
+def test_get_current_user_cache_invalidated_on_logout(
+    raw_client: TestClient,
+    mock_user: models.User,
+    db_session: Session,
+) -> None:
+    """A logout broadcast evicts the cached session so the next request re-validates."""
+    import asyncio
+
+    from cache import token_hash
+    token = _valid_session_token(mock_user, db_session)
+    raw_client.cookies.set("access_token", token)
+    assert raw_client.get(f"/sensors/?tenant_id={mock_user.tenant_id}").status_code == 200
+
+    db_session.query(models.Session).update({"status": models.SessionStatus.logged_out})
+    db_session.commit()
+    asyncio.run(_main_module._session_cache.invalidate(token_hash(token)))
+    resp = raw_client.get(f"/sensors/?tenant_id={mock_user.tenant_id}")
+    assert resp.status_code == 401
+
+
+def test_flush_session_touches_updates_last_active(
+    raw_client: TestClient,
+    mock_user: models.User,
+    db_session: Session,
+) -> None:
+    """last_active is written back in one batch, not per request."""
+    token = _valid_session_token(mock_user, db_session)
+    raw_client.cookies.set("access_token", token)
+    before = db_session.query(models.Session).one().last_active
+    for _ in range(3):
+        raw_client.get(f"/sensors/?tenant_id={mock_user.tenant_id}")
+
+    db_session.expire_all()
+    assert db_session.query(models.Session).one().last_active == before
+    _main_module._flush_session_touches()
+
+    db_session.expire_all()
+    assert db_session.query(models.Session).one().last_active > before
+    assert _main_module._session_cache.drain_touches() == {}
+
+
 # ── sensor/main.py: async helper coverage ────────────────────────────────────
 
 import pytest_asyncio  # noqa: F401 — ensure pytest-asyncio is active
@@ -481,10 +695,7 @@ async def test_check_billing_active_returns_true():
     mock_resp = MagicMock()
     mock_resp.status_code = 200
     mock_resp.json.return_value = {"billing_active": True}
-    with patch("httpx.AsyncClient") as mock_client_cls:
-        mock_client_cls.return_value.__aenter__ = _AsyncMock(return_value=mock_client_cls.return_value)
-        mock_client_cls.return_value.__aexit__ = _AsyncMock(return_value=False)
-        mock_client_cls.return_value.get = _AsyncMock(return_value=mock_resp)
+    with patch.object(_main_module._http, "get", _AsyncMock(return_value=mock_resp)):
         from main import check_billing_active
         result = await check_billing_active(1)
     assert result is True
@@ -494,53 +705,124 @@ async def test_check_billing_active_returns_true():
 async def test_check_billing_active_non_200():
     mock_resp = MagicMock()
     mock_resp.status_code = 404
-    with patch("httpx.AsyncClient") as mock_client_cls:
-        mock_client_cls.return_value.__aenter__ = _AsyncMock(return_value=mock_client_cls.return_value)
-        mock_client_cls.return_value.__aexit__ = _AsyncMock(return_value=False)
-        mock_client_cls.return_value.get = _AsyncMock(return_value=mock_resp)
+    with patch.object(_main_module._http, "get", _AsyncMock(return_value=mock_resp)):
         from main import check_billing_active
         result = await check_billing_active(1)
     assert result is False
 
 
 @pytest.mark.asyncio
-async def test_check_billing_active_request_error():
-    with patch("httpx.AsyncClient") as mock_client_cls:
-        mock_client_cls.return_value.__aenter__ = _AsyncMock(return_value=mock_client_cls.return_value)
-        mock_client_cls.return_value.__aexit__ = _AsyncMock(return_value=False)
-        mock_client_cls.return_value.get = _AsyncMock(side_effect=httpx.RequestError("fail"))
+async def test_check_billing_active_request_error() -> None:
+    failing = _AsyncMock(side_effect=httpx.RequestError("fail"))
+    with patch.object(_main_module._http, "get", failing):
         from main import check_billing_active
         result = await check_billing_active(1)
     assert result is False
 
 
+@pytest.mark.asyncio
+async def test_check_billing_active_is_cached_until_invalidated() -> None:
+    """Billing status is fetched once per tenant; a pushed invalidation forces a refetch."""
+    mock_resp = MagicMock()
+    mock_resp.status_code = 200
+    mock_resp.json.return_value = {"billing_active": True}
+    get = _AsyncMock(return_value=mock_resp)
+    with patch.object(_main_module._http, "get", get):
+        from main import check_billing_active
+        assert await check_billing_active(7) is True
+        assert await check_billing_active(7) is True
+        assert get.await_count == 1
+
+        mock_resp.json.return_value = {"billing_active": False}
+        _main_module._billing_cache.pop("7")  # what the pub/sub listener does
+        assert await check_billing_active(7) is False
+        assert get.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_check_billing_active_does_not_cache_a_read_overtaken_by_invalidation() -> None:
+    """An invalidation published while the status request is in flight wins."""
+    mock_resp = MagicMock()
+    mock_resp.status_code = 200
+    mock_resp.json.return_value = {"billing_active": True}
+
+    async def get(*args: Any, **kwargs: Any) -> MagicMock:
+        _main_module._billing_cache.pop("9")  # billing suspended meanwhile
+        return mock_resp
+
+    with patch.object(_main_module._http, "get", get):
+        from main import check_billing_active
+        assert await check_billing_active(9) is True
+    assert _main_module._billing_cache.get("9") is None
+
+
+@pytest.mark.asyncio
+async def test_check_billing_active_does_not_cache_failures() -> None:
+    failing = _AsyncMock(side_effect=httpx.RequestError("fail"))
+    with patch.object(_main_module._http, "get", failing):
+        from main import check_billing_active
+        assert await check_billing_active(8) is False
+    assert _main_module._billing_cache.get("8") is None
+
+
+@pytest.mark.asyncio
+async def test_invalidation_listener_evicts_published_keys() -> None:
+    """listen_for_invalidations pops the published key from the matching cache."""
+    import asyncio
+
+    from cache import TTLCache, listen_for_invalidations
+
+    billing = TTLCache(10, 60)
+    sessions = TTLCache(10, 60)
+
+    async def messages() -> AsyncIterator[dict]:
+        billing.set("5", True)
+        billing.set("6", True)
+        sessions.set("abc", {})
+        yield {"type": "subscribe", "channel": "viq:billing:invalidate", "data": 1}
+        yield {"type": "message", "channel": "viq:billing:invalidate", "data": "5"}
+        yield {"type": "message", "channel": "viq:session:invalidate", "data": "abc"}
+        await asyncio.sleep(3600)
+
+    pubsub = MagicMock()
+    pubsub.subscribe = _AsyncMock()
+    pubsub.aclose = _AsyncMock()
+    pubsub.listen = messages
+    redis = MagicMock()
+    redis.pubsub.return_value = pubsub
+
+    task = asyncio.create_task(listen_for_invalidations(
+        redis, {"viq:billing:invalidate": billing, "viq:session:invalidate": sessions}
+    ))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    assert billing.get("5") is None
+    assert billing.get("6") is True
+    assert sessions.get("abc") is None
+
+
 @pytest.mark.asyncio
 async def test_notify_sensor_delta_request_error():
     """notify_sensor_delta swallows RequestError (non-critical)."""
-    with patch("httpx.AsyncClient") as mock_client_cls:
-        mock_client_cls.return_value.__aenter__ = _AsyncMock(return_value=mock_client_cls.return_value)
-        mock_client_cls.return_value.__aexit__ = _AsyncMock(return_value=False)
-        mock_client_cls.return_value.patch = _AsyncMock(side_effect=httpx.RequestError("fail"))
+    failing = _AsyncMock(side_effect=httpx.RequestError("fail"))
+    with patch.object(_main_module._http, "patch", failing):
         from main import notify_sensor_delta
         await notify_sensor_delta(1, delta=1)  # should not raise
 
 
 @pytest.mark.asyncio
 async def test_notify_message_increment_request_error():
-    with patch("httpx.AsyncClient") as mock_client_cls:
-        mock_client_cls.return_value.__aenter__ = _AsyncMock(return_value=mock_client_cls.return_value)
-        mock_client_cls.return_value.__aexit__ = _AsyncMock(return_value=False)
-        mock_client_cls.return_value.patch = _AsyncMock(side_effect=httpx.RequestError("fail"))
+    failing = _AsyncMock(side_effect=httpx.RequestError("fail"))
+    with patch.object(_main_module._http, "patch", failing):
         from main import notify_message_increment
         await notify_message_increment(1, increment=100)  # should not raise
 
 
 @pytest.mark.asyncio
 async def test_sync_iot_devices_request_error(db_session, mock_user):
-    with patch("httpx.AsyncClient") as mock_client_cls:
-        mock_client_cls.return_value.__aenter__ = _AsyncMock(return_value=mock_client_cls.return_value)
-        mock_client_cls.return_value.__aexit__ = _AsyncMock(return_value=False)
-        mock_client_cls.return_value.patch = _AsyncMock(side_effect=httpx.RequestError("fail"))
+    failing = _AsyncMock(side_effect=httpx.RequestError("fail"))
+    with patch.object(_main_module._http, "patch", failing):
         from main import sync_iot_devices
         await sync_iot_devices(mock_user.tenant_id, db_session)  # should not raise
 
@@ -660,6 +942,44 @@ def test_subsequent_messages_do_not_duplicate_data_received_event(client, sensor
     assert len(events) == 1
 
 
+def test_bulk_message_increment_applies_window_in_one_call(
+    client: TestClient,
+    sensor_payload: dict,
+    monkeypatch: pytest.MonkeyPatch,
+    db_session: Session,
+) -> None:
+    """A data-service accounting window updates every sensor and reports per-tenant totals."""
+    s1 = _create_sensor(client, sensor_payload, monkeypatch)
+    s2 = _create_sensor(client, {**sensor_payload, "sensor_name": "SoilSensor2"}, monkeypatch)
+    notify = AsyncMock()
+    monkeypatch.setattr(_main_module, "notify_message_increments", notify)
+
+    resp = client.post("/internal/sensors/messages/bulk", json={"increments": [
+        {"sensor_id": s1["sensor_id"], "increment": 7},
+        {"sensor_id": s2["sensor_id"], "increment": 3},
+        {"sensor_id": s1["sensor_id"], "increment": 1},
+        {"sensor_id": str(uuid.uuid4()), "increment": 99},   # unknown — skipped
+    ]})
+    assert resp.status_code == 200
+    assert resp.json()["tenants"] == 1
+    notify.assert_awaited_once_with({sensor_payload["tenant_id"]: 11})
+
+    db_session.expire_all()
+    rows = {
+        s.sensor_id: s for s in db_session.query(models.Sensor).filter(
+            models.Sensor.sensor_id.in_([s1["sensor_id"], s2["sensor_id"]])
+        )
+    }
+    assert rows[s1["sensor_id"]].message_count == 8
+    assert rows[s2["sensor_id"]].message_count == 3
+    assert rows[s1["sensor_id"]].status == models.SensorStatus.active
+    assert rows[s1["sensor_id"]].last_message_at is not None
+    events = db_session.query(models.SensorConnectionEvent).filter(
+        models.SensorConnectionEvent.event_type == "data_received",
+    ).count()
+    assert events == 2
+
+
 def test_initiate_connection_endpoint(client, sensor_payload, monkeypatch, db_session):
     """POST /sensors/{id}/connect creates a connection_initiated event."""
     sensor = _create_sensor(client, sensor_payload, monkeypatch)
@@ -762,6 +1082,30 @@ def test_get_connection_events_pagination(client, sensor_payload, monkeypatch, d
     assert len(r2.json()["items"]) >= 3  # 1 registered + 7 connect = 8 total; page 2 has 3
 
 
+def test_get_connection_events_cursor_matches_offset(
+    client: TestClient,
+    sensor_payload: dict,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Following next_cursor yields the same newest-first order as offset paging."""
+    sensor = _create_sensor(client, sensor_payload, monkeypatch)
+    sensor_id = sensor["sensor_id"]
+    for _ in range(7):
+        client.post(f"/sensors/{sensor_id}/connect")
+
+    url = f"/sensors/{sensor_id}/connection-events"
+    offset_ids = [
+        e["id"]
+        for page in (1, 2)
+        for e in client.get(url, params={"page": page, "per_page": 5}).json()["items"]
+    ]
+
+    first = client.get(url, params={"per_page": 5, "cursor": ""}).json()
+    second = client.get(url, params={"per_page": 5, "cursor": first["next_cursor"]}).json()
+    assert second["next_cursor"] is None
+    assert [e["id"] for e in first["items"] + second["items"]] == offset_ids
+
+
 # ── Audit log with user names ─────────────────────────────────────────────────
 
 def test_audit_log_returns_performed_by_name(client, db_session, mock_user, sensor_payload, monkeypatch):
@@ -852,11 +1196,8 @@ def test_suspend_tenant_marks_active_sensors_inactive(client, mock_user, db_sess
     s2 = _make_active_sensor(db_session, mock_user.tenant_id, mock_user.user_id, "S2")
     s3 = _make_active_sensor(db_session, mock_user.tenant_id, mock_user.user_id, "S3")
 
-    with patch("httpx.AsyncClient") as mock_cls:
-        mock_cls.return_value.__aenter__ = AsyncMock(return_value=mock_cls.return_value)
-        mock_cls.return_value.__aexit__ = AsyncMock(return_value=False)
-        mock_cls.return_value.delete = AsyncMock(return_value=MagicMock(status_code=200))
-
+    ok = AsyncMock(return_value=MagicMock(status_code=200))
+    with patch.object(_main_module._http, "delete", ok):
         resp = client.post(
             "/internal/sensors/suspend-tenant",
             json={"tenant_id": mock_user.tenant_id},
@@ -888,11 +1229,8 @@ def test_suspend_tenant_ignores_already_inactive_sensors(client, mock_user, db_s
     db_session.add(already_inactive)
     db_session.commit()
 
-    with patch("httpx.AsyncClient") as mock_cls:
-        mock_cls.return_value.__aenter__ = AsyncMock(return_value=mock_cls.return_value)
-        mock_cls.return_value.__aexit__ = AsyncMock(return_value=False)
-        mock_cls.return_value.delete = AsyncMock(return_value=MagicMock(status_code=200))
-
+    ok = AsyncMock(return_value=MagicMock(status_code=200))
+    with patch.object(_main_module._http, "delete", ok):
         resp = client.post(
             "/internal/sensors/suspend-tenant",
             json={"tenant_id": mock_user.tenant_id},
@@ -908,11 +1246,8 @@ def test_suspend_tenant_creates_audit_and_connection_events(client, mock_user, d
     s1 = _make_active_sensor(db_session, mock_user.tenant_id, mock_user.user_id, "S1")
     s2 = _make_active_sensor(db_session, mock_user.tenant_id, mock_user.user_id, "S2")
 
-    with patch("httpx.AsyncClient") as mock_cls:
-        mock_cls.return_value.__aenter__ = AsyncMock(return_value=mock_cls.return_value)
-        mock_cls.return_value.__aexit__ = AsyncMock(return_value=False)
-        mock_cls.return_value.delete = AsyncMock(return_value=MagicMock(status_code=200))
-
+    ok = AsyncMock(return_value=MagicMock(status_code=200))
+    with patch.object(_main_module._http, "delete", ok):
         client.post(
             "/internal/sensors/suspend-tenant",
             json={"tenant_id": mock_user.tenant_id},
@@ -948,11 +1283,7 @@ def test_suspend_tenant_calls_data_service_disconnect_per_sensor(client, mock_us
         delete_calls.append(url)
         return MagicMock(status_code=200)
 
-    with patch("httpx.AsyncClient") as mock_cls:
-        mock_cls.return_value.__aenter__ = AsyncMock(return_value=mock_cls.return_value)
-        mock_cls.return_value.__aexit__ = AsyncMock(return_value=False)
-        mock_cls.return_value.delete = mock_delete
-
+    with patch.object(_main_module._http, "delete", mock_delete):
         resp = client.post(
             "/internal/sensors/suspend-tenant",
             json={"tenant_id": mock_user.tenant_id},
@@ -973,14 +1304,10 @@ def test_suspend_tenant_continues_if_data_service_fails(client, mock_user, db_se
     s1 = _make_active_sensor(db_session, mock_user.tenant_id, mock_user.user_id, "S1")
     s2 = _make_active_sensor(db_session, mock_user.tenant_id, mock_user.user_id, "S2")
 
-    with patch("httpx.AsyncClient") as mock_cls:
-        mock_cls.return_value.__aenter__ = AsyncMock(return_value=mock_cls.return_value)
-        mock_cls.return_value.__aexit__ = AsyncMock(return_value=False)
-        # Simulate data service being unreachable
-        mock_cls.return_value.delete = AsyncMock(
-            side_effect=httpx.RequestError("Connection refused")
-        )
-
+    # Simulate data service being unreachable
+    with patch.object(_main_module._http, "delete", AsyncMock(
+        side_effect=httpx.RequestError("Connection refused")
+    )):
         resp = client.post(
             "/internal/sensors/suspend-tenant",
             json={"tenant_id": mock_user.tenant_id},
@@ -1002,11 +1329,8 @@ def test_suspend_tenant_does_not_affect_other_tenants(client, mock_user, other_u
     my_sensor    = _make_active_sensor(db_session, mock_user.tenant_id, mock_user.user_id, "Mine")
     other_sensor = _make_active_sensor(db_session, other_user.tenant_id, other_user.user_id, "Theirs")
 
-    with patch("httpx.AsyncClient") as mock_cls:
-        mock_cls.return_value.__aenter__ = AsyncMock(return_value=mock_cls.return_value)
-        mock_cls.return_value.__aexit__ = AsyncMock(return_value=False)
-        mock_cls.return_value.delete = AsyncMock(return_value=MagicMock(status_code=200))
-
+    ok = AsyncMock(return_value=MagicMock(status_code=200))
+    with patch.object(_main_module._http, "delete", ok):
         resp = client.post(
             "/internal/sensors/suspend-tenant",
             json={"tenant_id": mock_user.tenant_id},
@@ -1025,11 +1349,8 @@ def test_suspend_tenant_does_not_affect_other_tenants(client, mock_user, other_u
 
 def test_suspend_tenant_no_active_sensors(client, mock_user):
     """Suspending a tenant with no active sensors returns suspended=0 and makes no disconnect calls."""
-    with patch("httpx.AsyncClient") as mock_cls:
-        mock_cls.return_value.__aenter__ = AsyncMock(return_value=mock_cls.return_value)
-        mock_cls.return_value.__aexit__ = AsyncMock(return_value=False)
-        mock_cls.return_value.delete = AsyncMock(return_value=MagicMock(status_code=200))
-
+    ok = AsyncMock(return_value=MagicMock(status_code=200))
+    with patch.object(_main_module._http, "delete", ok) as mock_delete:
         resp = client.post(
             "/internal/sensors/suspend-tenant",
             json={"tenant_id": mock_user.tenant_id},
@@ -1037,4 +1358,618 @@ def test_suspend_tenant_no_active_sensors(client, mock_user):
 
     assert resp.status_code == 200
     assert resp.json()["suspended"] == 0
-    mock_cls.return_value.delete.assert_not_called()
+    mock_delete.assert_not_called()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Pooled inter-service HTTP client
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _service_client(
+    handler: Callable[[httpx.Request], httpx.Response], **kwargs: Any
+) -> ServiceClient:
+    return ServiceClient(
+        timeouts={"tenant": 1.0},
+        http2=False,
+        backoff_base=0.0,
+        transport=httpx.MockTransport(handler),
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_service_client_retries_idempotent_on_503() -> None:
+    calls: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.method)
+        return httpx.Response(503 if len(calls) < 3 else 200)
+
+    client = _service_client(handler, retries=2)
+    resp = await client.get("http://tenant/x", target="tenant")
+    assert resp.status_code == 200
+    assert len(calls) == 3
+    assert client.metrics()["targets"]["tenant"]["retries"] == 2
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_service_client_does_not_resend_post_after_read_timeout() -> None:
+    """A POST the peer may already have applied (e.g. a charge) is never resent."""
+    calls: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.method)
+        raise httpx.ReadTimeout("slow", request=request)
+
+    client = _service_client(handler, retries=3)
+    with pytest.raises(httpx.RequestError):
+        await client.post("http://tenant/charge", target="tenant", json={})
+    assert calls == ["POST"]
+    assert client.metrics()["targets"]["tenant"]["errors"] == 1
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_service_client_retries_post_when_connect_fails() -> None:
+    calls: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.method)
+        if len(calls) == 1:
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200)
+
+    client = _service_client(handler, retries=1)
+    resp = await client.post("http://tenant/charge", target="tenant", json={})
+    assert resp.status_code == 200
+    assert len(calls) == 2
+    await client.aclose()
+
+
+def test_http_client_metrics_endpoint(client: TestClient) -> None:
+    resp = client.get("/internal/metrics/http-client")
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["pool"]["max_connections"] > 0
+    assert "targets" in body
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Trino query pool
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _trino_pool(**kwargs: Any) -> TrinoPool:
+    kwargs.setdefault("disconnect_poll", 0.01)
+    return TrinoPool(
+        host="trino", port=8080, user="u", catalog="iceberg", schema="sensors", **kwargs
+    )
+
+
+@pytest.mark.asyncio
+async def test_trino_pool_enforces_per_tenant_limit() -> None:
+    pool = _trino_pool(max_concurrency=4, tenant_concurrency=1, queue_timeout=0.05)
+    release = threading.Event()
+    first = asyncio.create_task(pool.run(1, release.wait, 5))
+    await asyncio.sleep(0.02)
+
+    with pytest.raises(QueryRejectedError):
+        await pool.run(1, lambda: "blocked")
+    assert await pool.run(2, lambda: "other tenant") == "other tenant"
+
+    release.set()
+    assert await first is True
+    metrics = pool.metrics()
+    assert metrics["rejected"] == 1 and metrics["running"] == 0
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_trino_pool_rejects_when_queue_full() -> None:
+    pool = _trino_pool(max_concurrency=1, max_queue=0)
+    with pytest.raises(QueryRejectedError):
+        await pool.run(1, lambda: None)
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_trino_pool_cancels_query_on_disconnect() -> None:
+    pool = _trino_pool()
+    cancelled = threading.Event()
+    mock_cursor = MagicMock()
+    mock_cursor.execute.side_effect = lambda *a: cancelled.wait(5)
+    mock_cursor.cancel.side_effect = cancelled.set
+    mock_conn = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+
+    def long_query() -> None:
+        with pool.connection() as conn:
+            conn.cursor().execute("SELECT 1")
+
+    with patch("query_engine.trino.dbapi.connect", return_value=mock_conn) as connect:
+        with pytest.raises(QueryCancelledError):
+            await pool.run(1, long_query, is_disconnected=AsyncMock(return_value=True))
+    mock_cursor.cancel.assert_called_once()
+    assert connect.call_args.kwargs["http_session"] is pool._session
+    assert pool.metrics()["cancelled"] == 1
+    pool.close()
+
+
+def test_trino_pool_keeps_shared_session_open_across_queries(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    from requests.adapters import HTTPAdapter
+
+    pool = _trino_pool()
+    adapter = pool._session.get_adapter("http://trino:8080")
+    assert isinstance(adapter, HTTPAdapter)
+    adapter.poolmanager.connection_from_host("trino", 8080, scheme="http")
+    cursor = MagicMock(description=[("n", "bigint")], stats={})
+    cursor.fetchmany.return_value = [(1,)]
+    monkeypatch.setattr(_crud_module, "trino_pool", pool)
+
+    with patch("query_engine.trino.dbapi.Connection.cursor", return_value=cursor):
+        assert _crud_module.run_query("SELECT 1", 1)[1] == [["1"]]
+        assert _crud_module.run_query("SELECT 1", 1)[1] == [["1"]]
+    assert len(adapter.poolmanager.pools) == 1
+    assert cursor.close.call_count >= 2
+    pool.close()
+
+
+def test_execute_query_returns_429_when_pool_saturated(
+    client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(_main_module, "check_billing_active", AsyncMock(return_value=True))
+    busy = AsyncMock(side_effect=QueryRejectedError("busy", retry_after=3))
+    monkeypatch.setattr(_main_module.crud.trino_pool, "run", busy)
+    resp = client.post("/query/", json={"sql": "SELECT 1"})
+    assert resp.status_code == 429
+    assert resp.headers["retry-after"] == "3"
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# /query/ result cache
+# ══════════════════════════════════════════════════════════════════════════════
+
+def test_normalize_sql_ignores_layout_but_keeps_literals() -> None:
+    from query_cache import normalize_sql
+    a = normalize_sql("SELECT *\n  FROM Sensor_Data -- latest\nWHERE sensor_id = 'AbC';")
+    b = normalize_sql("select * from sensor_data /* x */ where   sensor_id = 'AbC'")
+    assert a == b == "select * from sensor_data where sensor_id = 'AbC'"
+    assert normalize_sql("SELECT 'AbC'") != normalize_sql("SELECT 'abc'")
+
+
+def test_referenced_tables() -> None:
+    from query_cache import normalize_sql, referenced_tables
+
+    def tables(sql: str) -> set[str] | None:
+        return referenced_tables(normalize_sql(sql), "iceberg", "sensors")
+
+    assert tables("SELECT * FROM sensor_data s JOIN iceberg.ml.features f ON s.id = f.id") == {
+        "sensors.sensor_data", "ml.features",
+    }
+    with_cte = "WITH t AS (SELECT * FROM sensor_data) SELECT * FROM t"
+    assert tables(with_cte) == {"sensors.sensor_data"}
+    assert tables("SELECT 'from nowhere' FROM sensor_data") == {"sensors.sensor_data"}
+    assert tables("SELECT now(), * FROM sensor_data") is None
+    assert tables("SELECT * FROM sensor_data, devices") is None
+    assert tables("SELECT * FROM sensors.a x, sensors.b y WHERE x.id = y.id") is None
+    assert tables("SELECT * FROM a AS x, b") is None
+    join = "SELECT * FROM a x JOIN b ON x.id = b.id WHERE x.n > 1"
+    assert tables(join) == {"sensors.a", "sensors.b"}
+    assert tables("SELECT * FROM a WHERE n IN (1, 2)") == {"sensors.a"}
+    assert tables("SELECT * FROM system.runtime.queries") is None
+    assert tables("SHOW TABLES") is None
+
+
+class _FakeRedis:
+    def __init__(self) -> None:
+        self.data: dict[str, str] = {}
+
+    async def get(self, key: str) -> str | None:
+        return self.data.get(key)
+
+    async def set(self, key: str, value: str, ex: int | None = None) -> None:
+        self.data[key] = value
+
+
+def test_execute_query_serves_cache_hit_until_snapshot_changes(
+    client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(_main_module, "check_billing_active", AsyncMock(return_value=True))
+    monkeypatch.setattr(_main_module._query_cache, "redis", _FakeRedis())
+    snapshot = {"sensors.sensor_data": 1}
+    monkeypatch.setattr(_crud_module, "get_snapshot_ids", lambda tables: dict(snapshot))
+    run_query = MagicMock(return_value=(["n"], [["42"]], {"cpuTimeMillis": 5_000}))  # 10 QU
+    monkeypatch.setattr(_crud_module, "run_query", run_query)
+    monkeypatch.setattr(_main_module.settings, "QUERY_CACHE_HIT_QU_FACTOR", 0.1)
+
+    sql = "SELECT count(*) AS n FROM sensor_data"
+    reformatted = "select count(*) as n\nfrom sensor_data;"
+    with patch.object(_main_module._http, "post", AsyncMock()) as charge:
+        first = client.post("/query/", json={"sql": sql}).json()
+        again = client.post("/query/", json={"sql": reformatted}).json()
+        snapshot["sensors.sensor_data"] = 2
+        after_commit = client.post("/query/", json={"sql": sql}).json()
+
+    assert first["cached"] is False and first["qu"] == 10.0
+    assert again["cached"] is True and again["rows"] == [["42"]]
+    assert again["qu"] == 1.0
+    assert after_commit["cached"] is False
+    assert run_query.call_count == 2
+    assert [c.kwargs["json"]["qu"] for c in charge.call_args_list] == [10.0, 1.0, 10.0]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Rollup rewrite
+# ══════════════════════════════════════════════════════════════════════════════
+
+_STATS_ROW = (
+    "row(moisture_percent row(min double, max double, sum double, count bigint, avg double, "
+    "last double), ph row(min double, max double, sum double, count bigint, avg double, "
+    "last double))"
+)
+
+
+def _rollup_tree(*grains: str) -> dict:
+    tables = [
+        {"name": "soil_data", "cols": [{"name": "soil_metrics", "type": "row(ph double)"}]}
+    ]
+    tables += [
+        {"name": f"soil_rollup_{g}", "cols": [{"name": "soil_metrics", "type": _STATS_ROW}]}
+        for g in grains
+    ]
+    return {"catalogs": [{"name": "iceberg", "schemas": [{"name": "sensors", "tables": tables}]}]}
+
+
+def _rewrite(
+    sql: str, grains: tuple[str, ...] = ("1m", "1h", "1d"), complete_from: int = 0
+) -> str | None:
+    from rollup_rewrite import rewrite_for_rollups, rollup_tables
+    tables = rollup_tables(_rollup_tree(*grains), "iceberg", "sensors")
+    watermarks = {f"soil_rollup_{g}": complete_from for g in grains}
+    return rewrite_for_rollups(sql, tables, watermarks, "iceberg", "sensors")
+
+
+def test_rollup_rewrite_picks_grain_from_bucket_and_bounds() -> None:
+    assert _rewrite(
+        "SELECT sensor_id, date_trunc('hour', event_time) AS h, avg(soil_metrics.ph), count(*)\n"
+        "FROM soil_data WHERE tenant_id = current_user_tenant()\n"
+        "AND event_time >= TIMESTAMP '2024-05-01'\n"
+        "GROUP BY 1, 2 ORDER BY h DESC LIMIT 500;"
+    ) == (
+        "select sensor_id, date_trunc('hour', bucket_start) as h, "
+        "sum(soil_metrics.ph.sum) / nullif(sum(soil_metrics.ph.count), 0), "
+        "coalesce(sum(readings), 0) from soil_rollup_1h "
+        "where tenant_id = current_user_tenant() and bucket_start >= timestamp '2024-05-01' "
+        "group by 1, 2 order by h desc limit 500"
+    )
+    # A bound at 10:30 only lines up with minute buckets
+    assert "from soil_rollup_1m " in str(_rewrite(
+        "select date_trunc('month', event_time), max(soil_metrics.moisture_percent) "
+        "from soil_data where event_time >= timestamp '2024-05-01 10:30' group by 1"
+    ))
+    assert _rewrite(
+        "select farm_id, min(soil_metrics.ph), count(soil_metrics.ph) "
+        "from iceberg.sensors.soil_data "
+        "where farm_id in ('f1', 'f2') and event_time >= current_date - interval '7' day "
+        "and event_time < date_trunc('day', now()) "
+        "group by farm_id order by min(soil_metrics.ph)"
+    ) == (
+        "select farm_id, min(soil_metrics.ph.min), coalesce(sum(soil_metrics.ph.count), 0) "
+        "from iceberg.sensors.soil_rollup_1d where farm_id in ('f1', 'f2') "
+        "and bucket_start >= current_date - interval '7' day "
+        "and bucket_start < date_trunc('day', now()) "
+        "group by farm_id order by min(soil_metrics.ph.min)"
+    )
+
+
+def test_rollup_rewrite_leaves_ineligible_queries_alone() -> None:
+    for sql in (
+        "SELECT * FROM soil_data",
+        "SELECT sensor_id FROM soil_data",                                   # not aggregated
+        "SELECT device_id, avg(soil_metrics.ph) FROM soil_data GROUP BY 1",  # not a rollup key
+        "SELECT avg(soil_metrics.salinity) FROM soil_data",                  # no field stats
+        "SELECT avg(location_fields.latitude) FROM soil_data",
+        "SELECT avg(soil_metrics.ph) FROM weather_data",                     # no rollup table
+        "SELECT avg(soil_metrics.ph) FROM soil_data WHERE event_time > TIMESTAMP '2024-05-01'",
+        "SELECT avg(soil_metrics.ph) FROM soil_data "
+        "WHERE event_time >= TIMESTAMP '2024-05-01 10:30:15'",
+        "SELECT avg(soil_metrics.ph) FROM soil_data WHERE sensor_id = 'a' OR sensor_id = 'b'",
+        "SELECT avg(soil_metrics.ph) FROM soil_data WHERE soil_metrics.ph > 7",
+        "SELECT sensor_id, avg(soil_metrics.ph) FROM soil_data GROUP BY 1 HAVING count(*) > 10",
+        "SELECT avg(soil_metrics.ph) FROM (SELECT * FROM soil_data)",
+        "SELECT avg(soil_metrics.ph) FROM iceberg.other.soil_data",
+    ):
+        assert _rewrite(sql) is None, sql
+    # Minute-aligned bound, but no minute rollup yet
+    assert _rewrite(
+        "SELECT avg(soil_metrics.ph) FROM soil_data "
+        "WHERE event_time >= TIMESTAMP '2024-05-01 10:30'",
+        grains=("1h", "1d"),
+    ) is None
+
+
+def test_rollup_rewrite_waits_for_complete_from_watermark() -> None:
+    from rollup_rewrite import rewrite_for_rollups, rollup_tables
+    may_1 = int(datetime(2024, 5, 1, tzinfo=UTC).timestamp())
+    query = "SELECT sensor_id, avg(soil_metrics.ph) FROM soil_data {} GROUP BY 1"
+    for where in (
+        "",                                                                     # unbounded
+        "WHERE event_time < TIMESTAMP '2024-06-01'",                            # upper bound only
+        "WHERE event_time >= TIMESTAMP '2024-04-30'",                           # starts before it
+        "WHERE event_time >= TIMESTAMP '2024-05-02' AND event_time >= TIMESTAMP '2024-04-30'",
+    ):
+        assert _rewrite(query.format(where), complete_from=may_1) is None, where
+    assert "from soil_rollup_1d " in str(_rewrite(
+        query.format("WHERE event_time >= TIMESTAMP '2024-05-01'"), complete_from=may_1
+    ))
+    assert "from soil_rollup_1h " in str(_rewrite(
+        query.format("WHERE event_time >= date_trunc('hour', now()) - interval '2' hour"),
+        complete_from=may_1,
+    ))
+    assert _rewrite(
+        query.format("WHERE event_time >= current_date - interval '7' day"),
+        complete_from=int(time.time()) + 86_400,
+    ) is None
+    # No watermark read for the table: never rewritten
+    tables = rollup_tables(_rollup_tree("1d"), "iceberg", "sensors")
+    assert rewrite_for_rollups(query.format(""), tables, {}, "iceberg", "sensors") is None
+
+
+def test_execute_query_runs_rewritten_sql_and_caches_on_rollup_snapshot(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(_main_module, "check_billing_active", AsyncMock(return_value=True))
+    monkeypatch.setattr(_main_module._query_cache, "redis", _FakeRedis())
+    _main_module._schema_cache.set("iceberg", _rollup_tree("1h", "1d"))
+    monkeypatch.setitem(
+        _main_module._rollup_watermarks, "iceberg", {"soil_rollup_1h": 0, "soil_rollup_1d": 0}
+    )
+    get_snapshot_ids = MagicMock(return_value={"sensors.soil_rollup_1d": 7})
+    monkeypatch.setattr(_crud_module, "get_snapshot_ids", get_snapshot_ids)
+    run_query = MagicMock(return_value=(["sensor_id", "_col1"], [["s1", "6.5"]], {}))
+    monkeypatch.setattr(_crud_module, "run_query", run_query)
+
+    sql = "SELECT sensor_id, avg(soil_metrics.ph) FROM soil_data GROUP BY sensor_id"
+    with patch.object(_main_module._http, "post", AsyncMock()):
+        resp = client.post("/query/", json={"sql": sql})
+        monkeypatch.setattr(_main_module.settings, "QUERY_ROLLUP_REWRITE", False)
+        client.post("/query/", json={"sql": sql + " ORDER BY 1"})
+
+    assert resp.status_code == 200
+    assert run_query.call_args_list[0].args[0] == (
+        "select sensor_id, sum(soil_metrics.ph.sum) / nullif(sum(soil_metrics.ph.count), 0) "
+        "from soil_rollup_1d group by sensor_id"
+    )
+    get_snapshot_ids.assert_any_call({"sensors.soil_rollup_1d"})
+    assert run_query.call_args_list[1].args[0] == sql + " ORDER BY 1"
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Incremental query results (/query/results, /query/stream)
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _fake_open_query(monkeypatch: pytest.MonkeyPatch, rows: list[list[Any]]) -> list[int]:
+    """Stand-in Trino cursor over rows; returns the fetchmany sizes requested."""
+    pending = list(rows)
+    fetches: list[int] = []
+
+    def fetch_rows(cur: Any, size: int) -> list[list[Any]]:
+        fetches.append(size)
+        chunk = pending[:size]
+        del pending[:size]
+        return chunk
+
+    monkeypatch.setattr(_main_module, "check_billing_active", AsyncMock(return_value=True))
+    columns, types = ["n", "amount"], ["bigint", "decimal(10,2)"]
+    monkeypatch.setattr(
+        _crud_module, "open_query",
+        lambda sql, tenant_id: (MagicMock(), MagicMock(), columns, types),
+    )
+    monkeypatch.setattr(_crud_module, "fetch_rows", fetch_rows)
+    monkeypatch.setattr(_crud_module, "close_query", lambda conn, cur: {"cpuTimeMillis": 1_000})
+    return fetches
+
+
+def test_query_results_pages_through_token(
+    client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    from decimal import Decimal
+    _fake_open_query(monkeypatch, [[i, Decimal(f"{i}.50")] for i in range(5)])
+
+    with patch.object(_main_module._http, "post", AsyncMock()) as charge:
+        body = {"sql": "SELECT n, amount FROM t", "page_size": 2}
+        first = client.post("/query/results", json=body)
+        assert first.status_code == 200
+        pages = [first.json()]
+        while pages[-1]["next_token"]:
+            resp = client.get(f"/query/results/{pages[-1]['next_token']}", params={"page_size": 2})
+            assert resp.status_code == 200
+            pages.append(resp.json())
+
+    assert [p["offset"] for p in pages] == [0, 2, 4]
+    assert pages[0]["types"] == ["bigint", "decimal(10,2)"]
+    assert [row for p in pages for row in p["rows"]] == [[i, f"{i}.50"] for i in range(5)]
+    # Billed once, on the page that exhausted the result
+    assert [p["qu"] for p in pages] == [0.0, 0.0, 2.0]
+    charge.assert_called_once()
+    assert len(_main_module._results) == 0
+
+
+def test_query_results_token_is_private_and_closable(
+    client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+    mock_user: models.User,
+) -> None:
+    _fake_open_query(monkeypatch, [[i, None] for i in range(3)])
+    resp = client.post("/query/results", json={"sql": "SELECT 1", "page_size": 1})
+    token = resp.json()["next_token"]
+
+    tenant_id, user_id = int(mock_user.tenant_id), int(mock_user.user_id)
+    assert _main_module._results.checkout(token, tenant_id, user_id + 1) is None
+    with patch.object(_main_module._http, "post", AsyncMock()):
+        assert client.delete(f"/query/results/{token}").status_code == 204
+    assert client.get(f"/query/results/{token}").status_code == 404
+
+
+def test_query_stream_ndjson(client: TestClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    fetches = _fake_open_query(monkeypatch, [[i, None] for i in range(5)])
+
+    with patch.object(_main_module._http, "post", AsyncMock()):
+        resp = client.post("/query/stream", json={"sql": "SELECT n FROM t", "chunk_size": 2})
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert lines[0] == {"columns": ["n", "amount"], "types": ["bigint", "decimal(10,2)"]}
+    assert lines[1:6] == [[i, None] for i in range(5)]
+    assert lines[6]["summary"]["rows"] == 5 and lines[6]["summary"]["qu"] == 2.0
+    assert fetches == [2, 2, 2, 2]  # pulled chunk by chunk, never the whole result
+
+
+def test_json_cell_keeps_types() -> None:
+    from decimal import Decimal
+
+    from query_results import json_cell
+    assert json_cell(3) == 3 and json_cell(True) is True and json_cell(1.5) == 1.5
+    assert json_cell(Decimal("1.10")) == "1.10"
+    assert json_cell(datetime(2026, 1, 2, 3, 4, 5)) == "2026-01-02T03:04:05"
+    assert json_cell(b"\x00\x01") == "AAE="
+    assert json_cell({"a": [Decimal("2")]}) == {"a": ["2"]}
+    assert json_cell(float("nan")) == "nan"
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Cached /query/schema
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _schema_tree(*tables: str) -> dict:
+    cols = [{"name": "ts", "type": "timestamp"}]
+    return {"catalogs": [{"name": "iceberg", "schemas": [
+        {"name": "sensors", "tables": [{"name": t, "cols": cols} for t in tables]},
+    ]}]}
+
+
+def test_query_schema_is_cached_and_revalidated_by_etag(
+    client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    build = MagicMock(return_value=_schema_tree("sensor_data"))
+    monkeypatch.setattr(_crud_module, "get_schema_tree", build)
+
+    first = client.get("/query/schema")
+    assert first.status_code == 200
+    assert first.json()["catalogs"][0]["schemas"][0]["tables"][0]["name"] == "sensor_data"
+    etag = first.headers["etag"]
+
+    again = client.get("/query/schema", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["etag"] == etag
+    assert client.get("/query/schema").json() == first.json()
+    build.assert_called_once_with("iceberg")
+
+
+def test_schema_change_notice_refreshes_tree(
+    client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    build = MagicMock(
+        side_effect=[_schema_tree("sensor_data"), _schema_tree("sensor_data", "weather_data")]
+    )
+    monkeypatch.setattr(_crud_module, "get_schema_tree", build)
+    monkeypatch.setattr(_main_module, "_redis", None)
+    monkeypatch.setattr(_main_module._schema_cache, "on_stale", None)
+    schedule = MagicMock()
+    monkeypatch.setattr(_main_module, "schedule_schema_refresh", schedule)
+
+    etag = client.get("/query/schema").headers["etag"]
+    notice = {"catalog": "iceberg", "table": "iceberg.sensors.weather_data"}
+    resp = client.post("/internal/query/schema/invalidate", json=notice)
+    assert resp.status_code == 202
+    entry = _main_module._schema_cache.get("iceberg")
+    assert entry is not None and entry["stale"] is True
+
+    # Stale tree is still served, and a background rebuild is scheduled
+    assert client.get("/query/schema", headers={"If-None-Match": etag}).status_code == 304
+    schedule.assert_called_with("iceberg")
+    asyncio.run(_main_module.refresh_schema_tree("iceberg"))
+
+    fresh = client.get("/query/schema", headers={"If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.headers["etag"] != etag
+    tables = fresh.json()["catalogs"][0]["schemas"][0]["tables"]
+    assert [t["name"] for t in tables] == ["sensor_data", "weather_data"]
+    assert build.call_count == 2
+
+
+def test_get_schema_tree_groups_rows(monkeypatch: pytest.MonkeyPatch) -> None:
+    rows = [
+        ("sensors", "sensor_data", "sensor_id", "varchar"),
+        ("sensors", "sensor_data", "ts", "timestamp(6)"),
+        ("sensors", "weather", "temp", "double"),
+    ]
+    cur = MagicMock()
+    cur.fetchall.return_value = rows
+    conn = MagicMock()
+    conn.cursor.return_value = cur
+    monkeypatch.setattr(_crud_module.trino_pool, "open", lambda: conn)
+
+    tree = _crud_module.get_schema_tree("iceberg")
+
+    tables = tree["catalogs"][0]["schemas"][0]["tables"]
+    assert [t["name"] for t in tables] == ["sensor_data", "weather"]
+    assert tables[0]["cols"] == [
+        {"name": "sensor_id", "type": "varchar"}, {"name": "ts", "type": "timestamp(6)"},
+    ]
+    with pytest.raises(ValueError):
+        _crud_module.get_schema_tree("iceberg; DROP")
+
+
+def test_get_snapshot_ids_reads_the_main_branch(monkeypatch: pytest.MonkeyPatch) -> None:
+    cur = MagicMock()
+    cur.fetchall.return_value = [("sensors.soil_data", 42), ("sensors.weather_data", None)]
+    conn = MagicMock()
+    conn.cursor.return_value = cur
+    monkeypatch.setattr(_crud_module.trino_pool, "open", lambda: conn)
+
+    tables = {"sensors.soil_data", "sensors.weather_data"}
+    assert _crud_module.get_snapshot_ids(tables) == {
+        "sensors.soil_data": 42, "sensors.weather_data": None,
+    }
+    # The current snapshot, not the newest: they differ after a rollback
+    sql = cur.execute.call_args.args[0]
+    assert "FROM iceberg.sensors.\"soil_data$refs\" WHERE name = 'main'" in sql
+    assert "committed_at" not in sql
+    cur.execute.side_effect = RuntimeError("table not found")
+    assert _crud_module.get_snapshot_ids(tables) is None
+    assert _crud_module.get_snapshot_ids({"sensors.x' OR '1'='1"}) is None
+
+
+def test_get_rollup_watermarks_reads_table_properties(monkeypatch: pytest.MonkeyPatch) -> None:
+    cur = MagicMock()
+    cur.fetchall.return_value = [("soil_rollup_1d", "0"), ("soil_rollup_1h", "1714521600")]
+    conn = MagicMock()
+    conn.cursor.return_value = cur
+    monkeypatch.setattr(_crud_module.trino_pool, "open", lambda: conn)
+
+    assert _crud_module.get_rollup_watermarks("iceberg", "sensors", set()) == {}
+    tables = {"soil_rollup_1h", "soil_rollup_1d"}
+    assert _crud_module.get_rollup_watermarks("iceberg", "sensors", tables) == {
+        "soil_rollup_1d": 0, "soil_rollup_1h": 1714521600,
+    }
+    sql = cur.execute.call_args.args[0]
+    assert (
+        'FROM iceberg.sensors."soil_rollup_1d$properties" '
+        "WHERE key = 'verdantiq.rollup.complete-from'"
+    ) in sql
+    # Names that are not plain identifiers never reach the SQL
+    cur.execute.reset_mock()
+    assert _crud_module.get_rollup_watermarks("iceberg", "sensors", {"x' OR '1'='1"}) == {}
+    cur.execute.assert_not_called()
+    cur.execute.side_effect = RuntimeError("table not found")
+    with pytest.raises(trino.exceptions.DatabaseError):
+        _crud_module.get_rollup_watermarks("iceberg", "sensors", {"soil_rollup_1h"})
@@ -11,6 +11,16 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ALLOWED_ORIGINS: str =  "http://localhost:5173,http://13.50.234.104:5173"
     SENSOR_SERVICE_URL: str = "http://sensor:8003"
+    REDIS_URL: str = "redis://redis:6379"   # billing-status invalidation broadcasts
+    # Inter-service HTTP client (one pooled client per process)
+    HTTP_MAX_CONNECTIONS: int = 50
+    HTTP_MAX_KEEPALIVE: int = 10
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_HTTP2: bool = True                 # only takes effect when h2 is installed
+    HTTP_RETRIES: int = 2
+    HTTP_BACKOFF_BASE: float = 0.1
+    HTTP_BACKOFF_MAX: float = 2.0
+    SENSOR_SERVICE_TIMEOUT: float = 5.0
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
@@ -1,11 +1,15 @@
-from sqlalchemy.orm import Session
-import models
-import schemas
+import math
+import uuid
 from datetime import datetime, timezone
+from typing import Any
+
 from dateutil.relativedelta import relativedelta
-import uuid
-import math
+from sqlalchemy import Float, Integer, and_, case, column, func, literal, select, update, values
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import ColumnElement, ScalarSelect, Values
 
+import models
+import schemas
 
 SENSOR_MESSAGE_COST = 0.10 / 100000
 SENSOR_ONBOARD_FEE = 1.00
@@ -69,51 +73,113 @@ def create_ml_feature_subscription(
     return db_ml
 
 
-def _auto_suspend_if_overdrawn(billing: "models.Billing") -> bool:
-    """Set billing to SUSPENDED if amount_due exceeds balance. Returns True if newly suspended."""
-    if (
-        billing.status == models.BillingStatus.ACTIVE
-        and billing.amount_due > (billing.balance or 0.0)
-    ):
-        billing.status = models.BillingStatus.SUSPENDED
-        return True
-    return False
+# ── Atomic billing counters ───────────────────────────────────────────────────
+# The counter endpoints run concurrently for the same tenant, so the
+# increment, the amount_due recomputation and the auto-suspend check all
+# happen inside one UPDATE ... RETURNING instead of an ORM read-modify-write.
+
+def _ml_feature_cost() -> ScalarSelect[float]:
+    """Correlated subquery: sum of ML feature subscription costs for the billing row."""
+    return (
+        select(func.coalesce(func.sum(models.MLFeatureSubscription.cost), 0.0))
+        .where(models.MLFeatureSubscription.billing_id == models.Billing.id)
+        .scalar_subquery()
+    )
+
+
+def _atomic_billing_update(
+    db: Session,
+    batch: Values,
+    counters: dict,
+    amount_due: ColumnElement[Any],
+) -> list[tuple["models.Billing", bool]]:
+    """Apply per-tenant deltas from `batch` (a VALUES with a tenant_id column).
+
+    `counters` maps Billing columns to their new values; `amount_due` is the new
+    running total. amount_due only moves while billing is ACTIVE (it is frozen
+    once suspended so the debt survives to cycle end) and an ACTIVE row whose
+    new amount_due exceeds its balance becomes SUSPENDED. Caller commits.
+    Returns (billing, newly_suspended) per matched tenant.
+    """
+    # Lock the rows and remember their pre-update status: RETURNING only sees new values
+    before = (
+        select(models.Billing.id, models.Billing.status)
+        .where(models.Billing.tenant_id.in_(select(batch.c.tenant_id)))
+        .with_for_update()
+        .cte("before")
+    )
+    active = models.Billing.status == models.BillingStatus.ACTIVE
+    overdrawn = and_(active, amount_due > func.coalesce(models.Billing.balance, 0.0))
+    stmt = (
+        update(models.Billing)
+        .where(models.Billing.id == before.c.id, models.Billing.tenant_id == batch.c.tenant_id)
+        .values(
+            **counters,
+            amount_due=case((active, amount_due), else_=models.Billing.amount_due),
+            status=case(
+                (overdrawn, literal(models.BillingStatus.SUSPENDED, models.Billing.status.type)),
+                else_=models.Billing.status,
+            ),
+        )
+        .returning(models.Billing, before.c.status)
+    )
+    rows = db.execute(
+        stmt, execution_options={"synchronize_session": False, "populate_existing": True}
+    ).all()
+    return [
+        (billing, old_status == models.BillingStatus.ACTIVE
+                  and billing.status == models.BillingStatus.SUSPENDED)
+        for billing, old_status in rows
+    ]
+
+
+def _count_batch(items: list[tuple[int, int]], name: str) -> Values:
+    return values(column("tenant_id", Integer), column("delta", Integer), name=name).data(items)
+
+
+def _recomputed_amount_due(
+    message_count: ColumnElement[int], sensor_count: ColumnElement[int]
+) -> ColumnElement[Any]:
+    """SQL-side calculate_amount_due over the given counter expressions."""
+    return (
+        message_count * SENSOR_MESSAGE_COST
+        + sensor_count * SENSOR_ONBOARD_FEE
+        + _ml_feature_cost()
+    )
 
 
 def update_sensor_count(db: Session, tenant_id: int, delta: int) -> tuple["models.Billing | None", bool]:
-    billing = get_billing_by_tenant(db, tenant_id)
-    newly_suspended = False
-    if billing:
-        billing.sensor_count = max(0, billing.sensor_count + delta)
-        # Only recalculate amount_due while billing is active.
-        # Once suspended, amount_due is frozen at the suspension value so the
-        # outstanding debt is preserved for end-of-cycle deduction.
-        if billing.status == models.BillingStatus.ACTIVE:
-            billing.amount_due = calculate_amount_due(
-                billing.message_count, billing.sensor_count, billing.ml_features
-            )
-            newly_suspended = _auto_suspend_if_overdrawn(billing)
-        db.commit()
-        db.refresh(billing)
-    return billing, newly_suspended
+    batch = _count_batch([(tenant_id, delta)], "sensor_delta")
+    sensor_count = func.greatest(0, models.Billing.sensor_count + batch.c.delta)
+    rows = _atomic_billing_update(
+        db, batch,
+        {"sensor_count": sensor_count},
+        _recomputed_amount_due(models.Billing.message_count, sensor_count),
+    )
+    db.commit()
+    return rows[0] if rows else (None, False)
 
 
 def update_message_count(db: Session, tenant_id: int, increment: int) -> tuple["models.Billing | None", bool]:
-    billing = get_billing_by_tenant(db, tenant_id)
-    newly_suspended = False
-    if billing:
-        billing.message_count += increment
-        # Only recalculate amount_due while billing is active.
-        # Once suspended, amount_due is frozen at the suspension value so the
-        # outstanding debt is preserved for end-of-cycle deduction.
-        if billing.status == models.BillingStatus.ACTIVE:
-            billing.amount_due = calculate_amount_due(
-                billing.message_count, billing.sensor_count, billing.ml_features
-            )
-            newly_suspended = _auto_suspend_if_overdrawn(billing)
-        db.commit()
-        db.refresh(billing)
-    return billing, newly_suspended
+    rows = bulk_update_message_counts(db, {tenant_id: increment})
+    return rows[0] if rows else (None, False)
+
+
+def bulk_update_message_counts(
+    db: Session, increments: dict[int, int]
+) -> list[tuple["models.Billing", bool]]:
+    """Apply message-count increments for many tenants in one statement and one commit."""
+    if not increments:
+        return []
+    batch = _count_batch(list(increments.items()), "message_delta")
+    message_count = models.Billing.message_count + batch.c.delta
+    rows = _atomic_billing_update(
+        db, batch,
+        {"message_count": message_count},
+        _recomputed_amount_due(message_count, models.Billing.sensor_count),
+    )
+    db.commit()
+    return rows
 
 
 def _detect_card_brand(card_number: str) -> str:
@@ -280,13 +346,15 @@ def charge_query(
     The balance is only reduced at the end of the billing cycle via process_billing_cycle.
     Returns (billing, newly_suspended).
     """
-    billing = get_billing_by_tenant(db, tenant_id)
-    if not billing:
+    batch = values(
+        column("tenant_id", Integer), column("cost", Float), name="query_charge"
+    ).data([(tenant_id, cost)])
+    rows = _atomic_billing_update(
+        db, batch, {}, func.coalesce(models.Billing.amount_due, 0.0) + batch.c.cost
+    )
+    if not rows:
         return None, False
-    newly_suspended = False
-    if billing.status == models.BillingStatus.ACTIVE:
-        billing.amount_due = (billing.amount_due or 0.0) + cost
-        newly_suspended = _auto_suspend_if_overdrawn(billing)
+    billing, newly_suspended = rows[0]
     now = datetime.now(timezone.utc).replace(tzinfo=None)
     tx = models.Transaction(
         billing_id=billing.id,
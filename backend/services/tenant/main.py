@@ -6,11 +6,35 @@ from sqlalchemy.orm import Session
 from datetime import datetime, timezone
 from typing import List
 import httpx
+import logging
+import redis.asyncio as aioredis
 import models
 import schemas
 import crud
 from authenticate import decode_access_token
 from configs import get_db, Base, engine, ALLOWED_ORIGINS, settings
+from http_client import ServiceClient
+
+
+_log = logging.getLogger(__name__)
+
+# ── Redis client (initialized in lifespan) ────────────────────────────────────
+# The sensor service caches billing status per tenant and listens on this channel.
+_redis: aioredis.Redis | None = None
+
+_BILLING_INVALIDATE_CHAN = "viq:billing:invalidate"
+
+# ── Inter-service HTTP client (pool opened/closed in lifespan) ────────────────
+_http = ServiceClient(
+    timeouts={"sensor": settings.SENSOR_SERVICE_TIMEOUT},
+    max_connections=settings.HTTP_MAX_CONNECTIONS,
+    max_keepalive=settings.HTTP_MAX_KEEPALIVE,
+    keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+    http2=settings.HTTP_HTTP2,
+    retries=settings.HTTP_RETRIES,
+    backoff_base=settings.HTTP_BACKOFF_BASE,
+    backoff_max=settings.HTTP_BACKOFF_MAX,
+)
 
 
 @asynccontextmanager
@@ -87,7 +111,20 @@ async def lifespan(app: FastAPI):
             END $$;
         """))
         conn.commit()
+
+    global _redis
+    try:
+        _redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+        await _redis.ping()
+    except Exception as exc:
+        _log.warning("Redis unavailable — billing invalidation broadcasts disabled: %s", exc)
+        _redis = None
+
+    await _http.start()
     yield
+    await _http.aclose()
+    if _redis:
+        await _redis.aclose()
 
 
 app = FastAPI(title="VerdantIQ Tenant Service", version="1.0.0", lifespan=lifespan)
@@ -172,7 +209,9 @@ async def record_payment(
     billing = crud.get_billing_by_tenant(db, current_user.tenant_id)
     if not billing or billing.id != billing_id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Billing not found or unauthorized")
-    return crud.update_billing_on_payment(db, billing)
+    billing = crud.update_billing_on_payment(db, billing)
+    await publish_billing_invalidation(int(current_user.tenant_id))
+    return billing
 
 
 @app.post("/billings/topup/", response_model=schemas.BillingResponse)
@@ -183,7 +222,9 @@ async def topup_billing(
 ):
     if topup.amount <= 0:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Amount must be positive")
-    return crud.topup_billing(db, current_user.tenant_id, topup)
+    billing = crud.topup_billing(db, int(current_user.tenant_id), topup)
+    await publish_billing_invalidation(int(current_user.tenant_id))
+    return billing
 
 
 @app.patch("/billings/frequency", response_model=schemas.BillingResponse)
@@ -205,9 +246,11 @@ async def process_billing_cycle(
     db: Session = Depends(get_db),
 ):
     try:
-        return crud.process_billing_cycle(db, current_user.tenant_id, body)
+        billing = crud.process_billing_cycle(db, int(current_user.tenant_id), body)
     except ValueError as exc:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(exc))
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(exc)) from exc
+    await publish_billing_invalidation(int(current_user.tenant_id))
+    return billing
 
 
 @app.post("/billings/suspend", response_model=schemas.BillingResponse)
@@ -225,6 +268,7 @@ async def suspend_billing(
         billing.amount_due = body.amount_due
     db.commit()
     db.refresh(billing)
+    await publish_billing_invalidation(int(current_user.tenant_id))
     return billing
 
 
@@ -272,14 +316,28 @@ async def get_transactions(
 
 # ─── Internal helpers ─────────────────────────────────────────────────────────
 
+async def publish_billing_invalidation(tenant_id: int) -> None:
+    """Tell services caching this tenant's billing status to drop it.
+
+    Call after the change is committed, otherwise a listener could re-read the
+    old status before the transaction lands.
+    """
+    if not _redis:
+        return
+    try:
+        await _redis.publish(_BILLING_INVALIDATE_CHAN, str(tenant_id))
+    except Exception as exc:
+        _log.warning("Billing invalidation publish failed for tenant %s: %s", tenant_id, exc)
+
+
 async def notify_sensor_suspend(tenant_id: int) -> None:
     """Tell the sensor service to deactivate all active sensors for this tenant."""
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            await client.post(
-                f"{settings.SENSOR_SERVICE_URL}/internal/sensors/suspend-tenant",
-                json={"tenant_id": tenant_id},
-            )
+        await _http.post(
+            f"{settings.SENSOR_SERVICE_URL}/internal/sensors/suspend-tenant",
+            target="sensor",
+            json={"tenant_id": tenant_id},
+        )
     except httpx.RequestError:
         pass  # best-effort; billing is already suspended in DB
 
@@ -301,6 +359,7 @@ async def get_billing_status(tenant_id: int, db: Session = Depends(get_db)):
 async def update_sensor_count(data: schemas.SensorCountUpdate, db: Session = Depends(get_db)):
     _, newly_suspended = crud.update_sensor_count(db, data.tenant_id, data.delta)
     if newly_suspended:
+        await publish_billing_invalidation(data.tenant_id)
         await notify_sensor_suspend(data.tenant_id)
     return {"status": "ok"}
 
@@ -309,10 +368,31 @@ async def update_sensor_count(data: schemas.SensorCountUpdate, db: Session = Dep
 async def update_message_count(data: schemas.MessageCountUpdate, db: Session = Depends(get_db)):
     _, newly_suspended = crud.update_message_count(db, data.tenant_id, data.increment)
     if newly_suspended:
+        await publish_billing_invalidation(data.tenant_id)
         await notify_sensor_suspend(data.tenant_id)
     return {"status": "ok"}
 
 
+@app.patch("/internal/billings/message-count/bulk")
+async def bulk_update_message_count(
+    data: schemas.BulkMessageCountUpdate,
+    db: Session = Depends(get_db),
+) -> dict:
+    """One accounting window of message counts from the sensor service, folded per tenant."""
+    increments: dict[int, int] = {}
+    for item in data.increments:
+        increments[item.tenant_id] = increments.get(item.tenant_id, 0) + item.increment
+    suspended = [
+        int(billing.tenant_id)
+        for billing, newly_suspended in crud.bulk_update_message_counts(db, increments)
+        if newly_suspended
+    ]
+    for tenant_id in suspended:
+        await publish_billing_invalidation(tenant_id)
+        await notify_sensor_suspend(tenant_id)
+    return {"status": "ok", "suspended": suspended}
+
+
 @app.post("/internal/billings/query-charge")
 async def charge_query(data: schemas.QueryChargeRequest, db: Session = Depends(get_db)):
     """Add a query charge to the tenant's running cost and log a USAGE transaction.
@@ -322,6 +402,7 @@ async def charge_query(data: schemas.QueryChargeRequest, db: Session = Depends(g
         db, data.tenant_id, data.qu, data.cost, data.sql_preview
     )
     if newly_suspended:
+        await publish_billing_invalidation(data.tenant_id)
         await notify_sensor_suspend(data.tenant_id)
     return {"status": "ok"}
 
@@ -358,6 +439,12 @@ async def sync_iot_devices(
     return {"status": "ok"}
 
 
+@app.get("/internal/metrics/http-client")
+async def http_client_metrics() -> dict:
+    """Inter-service HTTP pool occupancy and per-target retry/error counters."""
+    return _http.metrics()
+
+
 @app.get("/health")
 async def health():
     return {"service": "tenant", "status": "ok"}
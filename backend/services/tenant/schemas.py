@@ -151,6 +151,10 @@ class MessageCountUpdate(BaseModel):
     increment: int
 
 
+class BulkMessageCountUpdate(BaseModel):
+    increments: list[MessageCountUpdate]
+
+
 class IoTDeviceSyncRequest(BaseModel):
     tenant_id: int
     devices: list
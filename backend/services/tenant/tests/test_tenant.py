@@ -1,4 +1,9 @@
+import pytest
+from fastapi.testclient import TestClient
 from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import models
 
 
 def test_postgres_connectivity(db_session):
@@ -98,10 +103,15 @@ def test_health(client):
     assert response.json()["service"] == "tenant"
 
 
+def test_http_client_metrics(client: TestClient) -> None:
+    response = client.get("/internal/metrics/http-client")
+    assert response.status_code == 200
+    assert response.json()["pool"]["max_connections"] == 50
+
+
 # ── Coverage additions ─────────────────────────────────────────────────────────
 
 import jwt as _pyjwt
-import pytest
 from datetime import datetime, timedelta, timezone
 from unittest.mock import patch, MagicMock
 
@@ -552,6 +562,79 @@ def test_topup_endpoint_accumulates_balance(client):
     assert resp.json()["balance"] == 100.0
 
 
+def test_topup_endpoint_publishes_billing_invalidation(
+    client: TestClient,
+    mock_user: models.User,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Sensor-side billing caches are told to drop the tenant after a topup."""
+    from unittest.mock import AsyncMock
+
+    import main
+
+    fake_redis = AsyncMock()
+    monkeypatch.setattr(main, "_redis", fake_redis)
+    client.post("/billings/topup/", json=TOPUP_CARD)
+    fake_redis.publish.assert_awaited_once_with(
+        "viq:billing:invalidate", str(mock_user.tenant_id)
+    )
+
+
+def test_auto_suspend_publishes_billing_invalidation(
+    client: TestClient,
+    db_session: Session,
+    mock_user: models.User,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Overdrawing via message counts suspends billing and broadcasts the change."""
+    from unittest.mock import AsyncMock
+
+    import main
+
+    _make_billing(db_session, mock_user.tenant_id, balance=0.10, amount_due=0.0)
+    fake_redis = AsyncMock()
+    monkeypatch.setattr(main, "_redis", fake_redis)
+    monkeypatch.setattr(main, "notify_sensor_suspend", AsyncMock())
+    resp = client.patch(
+        "/internal/billings/message-count",
+        json={"tenant_id": mock_user.tenant_id, "increment": 200_000},
+    )
+    assert resp.status_code == 200
+    fake_redis.publish.assert_awaited_once_with(
+        "viq:billing:invalidate", str(mock_user.tenant_id)
+    )
+
+
+def test_bulk_message_count_endpoint(
+    client: TestClient,
+    db_session: Session,
+    mock_user: models.User,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Per-tenant window totals are applied and overdrawn tenants are suspended."""
+    from unittest.mock import AsyncMock
+
+    import main
+
+    notify = AsyncMock()
+    monkeypatch.setattr(main, "notify_sensor_suspend", notify)
+    _make_billing(db_session, mock_user.tenant_id, balance=0.10, amount_due=0.0)
+    resp = client.patch("/internal/billings/message-count/bulk", json={"increments": [
+        {"tenant_id": mock_user.tenant_id, "increment": 150_000},
+        {"tenant_id": mock_user.tenant_id, "increment": 50_000},
+        {"tenant_id": 999999, "increment": 10},
+    ]})
+    assert resp.status_code == 200
+    assert resp.json()["suspended"] == [mock_user.tenant_id]
+    notify.assert_awaited_once_with(mock_user.tenant_id)
+
+    db_session.expire_all()
+    import crud
+    billing = crud.get_billing_by_tenant(db_session, int(mock_user.tenant_id))
+    assert billing is not None
+    assert billing.message_count == 200_000
+
+
 def test_topup_endpoint_rejects_zero_amount(client):
     resp = client.post("/billings/topup/", json={**TOPUP_CARD, "amount": 0})
     assert resp.status_code == 422
@@ -712,6 +795,58 @@ def test_amount_due_preserved_when_suspended_by_sensors(db_session, mock_user):
     assert updated.amount_due > updated.balance
 
 
+def test_concurrent_message_increments_are_not_lost(
+    db_session: Session,
+    mock_user: models.User,
+) -> None:
+    """Counter updates happen in SQL, so parallel increments never overwrite each other."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    import crud
+    from tests.conftest import TestingSessionLocal
+
+    tenant_id = int(mock_user.tenant_id)
+    _make_billing(db_session, tenant_id, balance=1000.0, amount_due=0.0)
+
+    def bump(_: int) -> None:
+        db = TestingSessionLocal()
+        try:
+            crud.update_message_count(db, tenant_id, increment=10)
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(bump, range(40)))
+
+    db_session.expire_all()
+    billing = crud.get_billing_by_tenant(db_session, tenant_id)
+    assert billing is not None
+    assert billing.message_count == 400
+    assert billing.amount_due == pytest.approx(400 * crud.SENSOR_MESSAGE_COST)
+
+
+def test_bulk_update_message_counts_includes_ml_feature_cost(
+    db_session: Session,
+    mock_user: models.User,
+) -> None:
+    """amount_due recomputed in SQL still includes ML feature subscriptions."""
+    import crud
+
+    tenant_id = int(mock_user.tenant_id)
+    billing = _make_billing(db_session, tenant_id, balance=1000.0, amount_due=0.0)
+    db_session.add(
+        models.MLFeatureSubscription(billing_id=billing.id, feature_name="yield", cost=2.5)
+    )
+    db_session.commit()
+
+    rows = crud.bulk_update_message_counts(db_session, {tenant_id: 100_000, 999999: 5})
+    assert len(rows) == 1
+    updated, newly_suspended = rows[0]
+    assert newly_suspended is False
+    assert updated.message_count == 100_000
+    assert updated.amount_due == pytest.approx(100_000 * crud.SENSOR_MESSAGE_COST + 2.5)
+
+
 def test_amount_due_not_recalculated_while_suspended(db_session, mock_user):
     """After suspension, further message increments must NOT recalculate or clear amount_due
     — the frozen debt value must remain unchanged."""
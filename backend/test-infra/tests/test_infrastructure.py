@@ -1391,6 +1391,63 @@ def test_bridge_mqtt_to_kafka_message_flow():
     assert json.loads(received)["test"] is True
 
 
+def test_bridge_hash_pattern_matches_parent_level():
+    """
+    A trailing '#' also matches zero levels (MQTT 3.1.1 §4.7.1.2): a message
+    on infra/hash/<run> must be routed by infra/hash/<run>/#, with the empty
+    capture rendered away.
+    """
+    base        = f"infra/hash/{_RUN_ID}"
+    kafka_topic = f"infra.hash.{_RUN_ID}"
+
+    admin = AdminClient({"bootstrap.servers": KAFKA_BROKERS})
+    fs = admin.create_topics([NewTopic(kafka_topic, num_partitions=1, replication_factor=1)])
+    for _, f in fs.items():
+        try:
+            f.result()
+        except Exception as exc:
+            if "already exists" not in str(exc).lower():
+                pytest.fail(f"Kafka topic creation failed: {exc}")
+
+    r = requests.post(
+        f"{BRIDGE_URL}/routes",
+        json={"mqtt_topic": f"{base}/#", "kafka_topic": f"{kafka_topic}.{{1}}"},
+        timeout=10,
+    )
+    assert r.status_code == 201, f"Bridge route registration failed: {r.text}"
+
+    time.sleep(0.5)  # allow bridge to subscribe
+
+    consumer = Consumer({
+        "bootstrap.servers": KAFKA_BROKERS,
+        "group.id":          f"infra-bridge-hash-test-{_RUN_ID}",
+        "auto.offset.reset": "latest",
+    })
+    consumer.subscribe([kafka_topic])
+    consumer.poll(0)     # trigger assignment
+
+    time.sleep(0.5)
+
+    pub = mqtt_client.Client(client_id=f"bridge-hash-pub-{_RUN_ID}")
+    pub.connect(MQTT_HOST, MQTT_PORT, keepalive=10)
+    pub.publish(base, payload=json.dumps({"test": True, "ts": _RUN_ID}).encode(), qos=1)
+    pub.disconnect()
+
+    deadline = time.time() + 10
+    received = None
+    while time.time() < deadline:
+        msg = consumer.poll(0.5)
+        if msg and not msg.error():
+            received = msg.value()
+            break
+
+    consumer.close()
+    requests.delete(f"{BRIDGE_URL}/routes/{base.replace('/', '__')}__%23", timeout=10)
+
+    assert received is not None, f"{base}/# did not route a message on {base} within 10 s"
+    assert json.loads(received)["test"] is True
+
+
 def test_bridge_deregisters_route():
     """DELETE /routes/{encoded} must remove the route from the listing."""
     mqtt_topic  = f"infra/bridge/del/{_RUN_ID}"
@@ -0,0 +1,273 @@
+"""
+VerdantIQ sensor payload codec
+==============================
+Optional compact encoding for sensor messages on Kafka. The bridge parses
+each JSON payload once and re-encodes it as schemaless Avro in the
+Confluent wire format:
+
+    0x00 | schema id (4 bytes, big-endian) | Avro body
+
+Schemas are inferred per sensor type from the payloads themselves (every
+leaf nullable, keys sorted so the same shape always yields the same
+schema) and registered under the subject  verdantiq-sensor-{type}. A
+payload with a new key or a new value type registers the widened schema as
+a new version; older messages keep decoding with their own schema id.
+
+Consumers call decode_payload(), which also accepts plain JSON, so topics
+can carry both formats while producers are switched over.
+
+Registry backends
+-----------------
+  SCHEMA_REGISTRY_URL  Confluent-compatible REST registry
+  SCHEMA_DIR           local stand-in: one {id}.avsc file per schema in a
+                       shared directory, id derived from the schema hash,
+                       so concurrent writers never need to coordinate
+
+The registry client only needs the standard library (the Spark driver uses
+it to look up reader schemas); encoding/decoding needs fastavro.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import struct
+import tempfile
+import threading
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+try:
+    import fastavro
+except ImportError:  # registry lookups only (Spark driver)
+    fastavro = None
+
+log = logging.getLogger(__name__)
+
+MAGIC_BYTE     = 0
+SUBJECT_PREFIX = "verdantiq-sensor-"
+# Kafka header on records re-published by migrate_topic_layout.py; the Spark
+# job has already ingested them from their original topic and skips them
+MIGRATED_HEADER = "viq-migrated"
+_NAME          = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_SR_CONTENT    = "application/vnd.schemaregistry.v1+json"
+
+
+class Unrepresentable(ValueError):
+    """Payload shape has no Avro schema here (lists, odd keys, mixed kinds)."""
+
+
+def is_migrated(headers: Optional[Iterable[Tuple[str, Any]]]) -> bool:
+    """True for a record copied by migrate_topic_layout.py. Takes the record's
+    (key, value) header pairs from either Kafka client, or None."""
+    return any(key == MIGRATED_HEADER for key, _ in headers or ())
+
+
+# ── schema registry ───────────────────────────────────────────────────────────
+
+class SchemaRegistry:
+    """register(subject, schema) -> id and schema(id) -> dict, cached."""
+
+    def __init__(self, url: str = "", directory: str = "", timeout: float = 5.0):
+        if not url and not directory:
+            raise ValueError("SchemaRegistry needs a URL or a directory")
+        self.url       = url.rstrip("/")
+        self.directory = Path(directory) if directory else None
+        self.timeout   = timeout
+        self._by_id: Dict[int, dict] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["SchemaRegistry"]:
+        url, directory = os.getenv("SCHEMA_REGISTRY_URL", ""), os.getenv("SCHEMA_DIR", "")
+        return cls(url, directory) if url or directory else None
+
+    def _http(self, method: str, path: str, body: Optional[dict] = None) -> dict:
+        req = urllib.request.Request(
+            f"{self.url}{path}",
+            data=json.dumps(body).encode() if body is not None else None,
+            headers={"Content-Type": _SR_CONTENT, "Accept": _SR_CONTENT},
+            method=method,
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read())
+
+    def register(self, subject: str, schema: dict) -> int:
+        canonical = json.dumps(schema, sort_keys=True, separators=(",", ":"))
+        if self.url:
+            schema_id = int(self._http("POST", f"/subjects/{subject}/versions", {"schema": canonical})["id"])
+        else:
+            schema_id = int(hashlib.sha256(canonical.encode()).hexdigest()[:8], 16) & 0x7FFFFFFF
+            path = self.directory / f"{schema_id}.avsc"
+            if not path.exists():
+                self.directory.mkdir(parents=True, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    f.write(canonical)
+                os.chmod(tmp, 0o644)   # readers (Spark) run as other users
+                os.replace(tmp, path)
+        with self._lock:
+            self._by_id[schema_id] = schema
+        log.info("Registered schema %d for %s", schema_id, subject)
+        return schema_id
+
+    def schema(self, schema_id: int) -> dict:
+        with self._lock:
+            cached = self._by_id.get(schema_id)
+        if cached is not None:
+            return cached
+        if self.url:
+            schema = json.loads(self._http("GET", f"/schemas/ids/{schema_id}")["schema"])
+        else:
+            schema = json.loads((self.directory / f"{schema_id}.avsc").read_text())
+        with self._lock:
+            self._by_id[schema_id] = schema
+        return schema
+
+
+# ── schema inference ──────────────────────────────────────────────────────────
+# A shape is either a frozenset of Avro primitive names (a leaf) or a dict of
+# key → shape (a record).
+
+def _leaf(value: Any) -> frozenset:
+    if value is None:
+        return frozenset({"null"})
+    if isinstance(value, bool):
+        return frozenset({"boolean"})
+    if isinstance(value, int):
+        return frozenset({"long"})
+    if isinstance(value, float):
+        return frozenset({"double"})
+    if isinstance(value, str):
+        return frozenset({"string"})
+    raise Unrepresentable(f"unsupported value type {type(value).__name__}")
+
+
+def infer_shape(payload: Any) -> Any:
+    if isinstance(payload, dict):
+        for key in payload:
+            if not _NAME.fullmatch(key):
+                raise Unrepresentable(f"key {key!r} is not a valid Avro name")
+        return {key: infer_shape(value) for key, value in payload.items()}
+    return _leaf(payload)
+
+
+def merge_shapes(a: Any, b: Any) -> Any:
+    if isinstance(a, dict) and isinstance(b, dict):
+        return {k: merge_shapes(a[k], b[k]) if k in a and k in b else a.get(k, b.get(k))
+                for k in a.keys() | b.keys()}
+    if isinstance(a, dict) or isinstance(b, dict):
+        # a record that is sometimes null stays a record
+        other = b if isinstance(a, dict) else a
+        if other == {"null"}:
+            return a if isinstance(a, dict) else b
+        raise Unrepresentable("a key holds both an object and a scalar")
+    merged = a | b
+    if {"long", "double"} <= merged:
+        merged -= {"long"}     # ints widen to double
+    return frozenset(merged)
+
+
+def conforms(payload: Any, shape: Any) -> bool:
+    """True when payload can be written with the schema rendered from shape."""
+    if isinstance(shape, dict):
+        if payload is None:
+            return True
+        if not isinstance(payload, dict):
+            return False
+        return all(k in shape and conforms(v, shape[k]) for k, v in payload.items())
+    if isinstance(payload, dict):
+        return False
+    try:
+        kinds = _leaf(payload)
+    except Unrepresentable:
+        return False
+    return kinds <= shape or (kinds == {"long"} and "double" in shape)
+
+
+_PRIMITIVE_ORDER = ("null", "boolean", "long", "double", "string")
+
+
+def render_schema(shape: dict, name: str) -> dict:
+    """Avro record for a shape; every field nullable with a null default."""
+    fields = []
+    for key in sorted(shape):
+        sub = shape[key]
+        if isinstance(sub, dict):
+            ftype = ["null", render_schema(sub, f"{name}_{key}")]
+        else:
+            ftype = [t for t in _PRIMITIVE_ORDER if t in sub | {"null"}]
+            if len(ftype) == 1:
+                ftype = "null"
+        fields.append({"name": key, "type": ftype, "default": None})
+    return {"type": "record", "name": name, "fields": fields}
+
+
+# ── encode / decode ───────────────────────────────────────────────────────────
+
+def _subject(payload: dict) -> str:
+    sensor_type = str(payload.get("sensor_type") or "unknown").lower()
+    return SUBJECT_PREFIX + re.sub(r"[^a-z0-9_]", "_", sensor_type)
+
+
+class AvroTranscoder:
+    """JSON bytes → Confluent-framed Avro, one evolving schema per sensor type.
+
+    Not thread-safe; each bridge worker owns one (called from the paho thread).
+    """
+
+    def __init__(self, registry: SchemaRegistry):
+        if fastavro is None:
+            raise RuntimeError("fastavro is required for Avro transcoding")
+        self.registry = registry
+        self._current: Dict[str, Tuple[Any, Any, bytes]] = {}   # subject → (shape, parsed, header)
+
+    def _schema_for(self, subject: str, payload: dict) -> Tuple[Any, bytes]:
+        current = self._current.get(subject)
+        if current is not None and conforms(payload, current[0]):
+            return current[1], current[2]
+        shape = infer_shape(payload)
+        if current is not None:
+            shape = merge_shapes(current[0], shape)
+        schema = render_schema(shape, "SensorPayload")
+        schema_id = self.registry.register(subject, schema)
+        parsed = fastavro.parse_schema(schema)
+        header = struct.pack(">bI", MAGIC_BYTE, schema_id)
+        self._current[subject] = (shape, parsed, header)
+        return parsed, header
+
+    def encode(self, raw: bytes) -> bytes:
+        """Avro-encode a JSON payload.
+
+        Raises ValueError when raw is not a JSON object, Unrepresentable when
+        the payload cannot be expressed with the inferred schemas.
+        """
+        payload = json.loads(raw)
+        if not isinstance(payload, dict):
+            raise ValueError("payload is not a JSON object")
+        parsed, header = self._schema_for(_subject(payload), payload)
+        buf = io.BytesIO()
+        buf.write(header)
+        fastavro.schemaless_writer(buf, parsed, payload)
+        return buf.getvalue()
+
+
+_parsed_by_id: Dict[int, Any] = {}
+
+
+def decode_payload(value: bytes, registry: Optional[SchemaRegistry]) -> Any:
+    """Decode a Kafka value written by the bridge: framed Avro or plain JSON."""
+    if value[:1] == b"\x00" and len(value) > 5:
+        if registry is None or fastavro is None:
+            raise ValueError("Avro payload but no schema registry / fastavro configured")
+        schema_id = struct.unpack(">I", value[1:5])[0]
+        parsed = _parsed_by_id.get(schema_id)
+        if parsed is None:
+            parsed = _parsed_by_id[schema_id] = fastavro.parse_schema(registry.schema(schema_id))
+        return fastavro.schemaless_reader(io.BytesIO(value[5:]), parsed)
+    return json.loads(value.decode("utf-8", errors="replace"))
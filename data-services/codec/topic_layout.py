@@ -0,0 +1,106 @@
+"""
+VerdantIQ Kafka topic layout
+============================
+Which Kafka topic a sensor's messages go to, chosen by TOPIC_LAYOUT:
+
+  sensor   verdantiq.{tenant_id}.{sensor_id}   one topic per sensor (default)
+  tenant   verdantiq.tenant.{tenant_id}        one topic per tenant
+  type     verdantiq.type.{sensor_type}        one topic per sensor type
+
+The shared layouts keep the broker's partition count proportional to
+tenants (or sensor types) instead of sensors. The bridge keys every record
+by sensor id, so a sensor's messages stay in order on one partition and
+readers of a shared topic filter by key. Tenant ids are integers, so the
+literal "tenant" / "type" level can never be mistaken for the tenant level
+of a per-sensor topic.
+
+Shared topics are sized by volume: one partition per SENSORS_PER_PARTITION
+sensors, rounded up to a power of two within [TOPIC_MIN_PARTITIONS,
+TOPIC_MAX_PARTITIONS], grown (never shrunk) as sensors are added. Growing a
+topic moves some keys to new partitions, so per-sensor order is only
+guaranteed between resizes; powers of two keep resizes rare.
+
+Per-sensor message counts of a shared layout live in Redis, as hashes of
+sensor id → records: MSG_COUNT_KEY is kept by the data service's key
+counters (every replica adds the records of its partitions) and
+MSG_COUNT_BASE_KEY holds what a sensor had sent to its own topic before
+migrate_topic_layout.py moved it. A sensor's count is the sum of both.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from typing import Dict, Optional
+
+LAYOUTS = ("sensor", "tenant", "type")
+PREFIX  = "verdantiq"
+
+MSG_COUNT_KEY      = "viq:msg-count"
+MSG_COUNT_BASE_KEY = "viq:msg-count:base"
+
+_UNSAFE = re.compile(r"[^a-z0-9_\-]")
+
+
+def sensor_key(sensor_id: str) -> bytes:
+    return str(sensor_id).encode()
+
+
+def _type_slug(sensor_type: str) -> str:
+    return _UNSAFE.sub("_", sensor_type.strip().lower()) or "unknown"
+
+
+def parse_topic(topic: str) -> Optional[Dict[str, str]]:
+    """Layout and ids encoded in a sensor topic name; None for other topics."""
+    parts = topic.split(".")
+    if len(parts) != 3 or parts[0] != PREFIX:
+        return None
+    if parts[1] == "tenant":
+        return {"layout": "tenant", "tenant_id": parts[2]}
+    if parts[1] == "type":
+        return {"layout": "type", "sensor_type": parts[2]}
+    return {"layout": "sensor", "tenant_id": parts[1], "sensor_id": parts[2]}
+
+
+class TopicLayout:
+    def __init__(self, name: Optional[str] = None):
+        self.name = (name or os.getenv("TOPIC_LAYOUT", "sensor")).lower()
+        if self.name not in LAYOUTS:
+            raise ValueError(f"Unknown TOPIC_LAYOUT {self.name!r} (expected one of {LAYOUTS})")
+        self.sensors_per_partition = int(os.getenv("SENSORS_PER_PARTITION", "50"))
+        self.min_partitions        = int(os.getenv("TOPIC_MIN_PARTITIONS",  "2"))
+        self.max_partitions        = int(os.getenv("TOPIC_MAX_PARTITIONS",  "64"))
+
+    @property
+    def shared(self) -> bool:
+        return self.name != "sensor"
+
+    @property
+    def needs_type(self) -> bool:
+        return self.name == "type"
+
+    @property
+    def subscription(self) -> str:
+        """Regex subscription covering every topic of this layout."""
+        if self.name == "sensor":
+            return rf"^{PREFIX}\.(?!tenant\.|type\.)[^.]+\.[^.]+$"
+        return rf"^{PREFIX}\.{self.name}\..+"
+
+    def topic(self, tenant_id: str, sensor_id: str, sensor_type: Optional[str] = None) -> str:
+        if self.name == "tenant":
+            return f"{PREFIX}.tenant.{tenant_id}"
+        if self.name == "type":
+            if not sensor_type:
+                raise ValueError("The 'type' topic layout needs the sensor type")
+            return f"{PREFIX}.type.{_type_slug(sensor_type)}"
+        return f"{PREFIX}.{tenant_id}.{sensor_id}"
+
+    def partitions(self, sensors: int) -> int:
+        """Partition count for a topic carrying `sensors` sensors."""
+        if not self.shared:
+            return self.min_partitions
+        wanted = max(1, -(-sensors // self.sensors_per_partition))
+        n = self.min_partitions
+        while n < wanted and n < self.max_partitions:
+            n *= 2
+        return min(n, self.max_partitions)
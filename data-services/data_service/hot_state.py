@@ -0,0 +1,160 @@
+"""
+Hot sensor state
+================
+Latest readings and hardware info per sensor, kept in Redis by a consumer of
+the sensor topics so the read paths skip Trino and Kafka:
+
+  viq:hot:readings:{tenant_id}:{sensor_id}  sorted set, score = reading time
+                                            (epoch ms), member = JSON
+                                            {"timestamp", "payload"}; only the
+                                            HOT_READINGS_LIMIT newest are kept
+  viq:hot:hardware:{tenant_id}:{sensor_id}  latest hardware_info (JSON)
+
+The sensor service serves GET /sensors/{id}/data from the readings set and
+GET /sensors/{tenant_id}/{sensor_id}/hardware here reads the hardware key;
+both fall back to Trino / Kafka on a cold miss and fill the key from what
+they found. Keys expire HOT_TTL_S after the sensor's last reading. The
+consumer has its own group (HOT_STATE_GROUP), so data-service replicas split
+the partitions between them, and starts at the latest offsets: older state
+comes from the fallbacks.
+
+The sensor service trusts a full set as the sensor's newest readings, so the
+consumer commits offsets only after a batch is stored and re-reads a batch
+whose write failed: a Redis outage delays readings but leaves no holes.
+Timestamps are written as ISO-8601 UTC with milliseconds
+("2025-07-01T12:00:00.000Z"), the format the sensor service's Trino reads use.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+
+import redis.asyncio as aioredis
+from aiokafka import AIOKafkaConsumer
+
+from sensor_codec import decode_payload, is_migrated
+from topic_layout import parse_topic
+
+log = logging.getLogger("data-service.hot-state")
+
+# Shared with the sensor service (backend/services/sensor/cache.py)
+READINGS_KEY = "viq:hot:readings:{tenant_id}:{sensor_id}"
+HARDWARE_KEY = "viq:hot:hardware:{tenant_id}:{sensor_id}"
+
+
+def iso_timestamp(ms: int) -> str:
+    """Epoch ms as the reading timestamp format shared with the sensor service."""
+    ts = datetime.fromtimestamp(ms / 1000, timezone.utc)
+    return ts.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def reading_ms(payload: dict, fallback_ms: int) -> int:
+    """The reading's own timestamp in epoch ms, else fallback_ms (Kafka time)."""
+    ts = payload.get("timestamp")
+    if isinstance(ts, str):
+        try:
+            dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+        except ValueError:
+            return fallback_ms
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return int(dt.timestamp() * 1000)
+    return fallback_ms
+
+
+class HotStateStore:
+    """Writes the hot keys; every call is one pipelined round trip."""
+
+    def __init__(self, redis: aioredis.Redis, readings: int, ttl: int):
+        self.redis    = redis
+        self.readings = readings
+        self.ttl      = ttl
+
+    async def apply(self, records: list[tuple[str, str, dict, int]]) -> None:
+        """Add (tenant_id, sensor_id, payload, kafka_ms) records, in topic order."""
+        pipe    = self.redis.pipeline(transaction=False)
+        touched = set()
+        for tenant_id, sensor_id, payload, kafka_ms in records:
+            ids    = {"tenant_id": tenant_id, "sensor_id": sensor_id}
+            key    = READINGS_KEY.format(**ids)
+            ms     = reading_ms(payload, kafka_ms)
+            member = json.dumps({"timestamp": iso_timestamp(ms), "payload": json.dumps(payload)})
+            pipe.zadd(key, {member: ms})
+            touched.add(key)
+            hardware = payload.get("hardware_info")
+            if isinstance(hardware, dict):
+                pipe.set(HARDWARE_KEY.format(**ids), json.dumps(hardware), ex=self.ttl)
+        for key in touched:
+            pipe.zremrangebyrank(key, 0, -(self.readings + 1))
+            pipe.expire(key, self.ttl)
+        if touched:
+            await pipe.execute()
+
+    async def hardware(self, tenant_id: str, sensor_id: str) -> dict | None:
+        raw = await self.redis.get(HARDWARE_KEY.format(tenant_id=tenant_id, sensor_id=sensor_id))
+        return json.loads(raw) if raw else None
+
+    async def set_hardware(self, tenant_id: str, sensor_id: str, hardware: dict) -> None:
+        await self.redis.set(HARDWARE_KEY.format(tenant_id=tenant_id, sensor_id=sensor_id),
+                             json.dumps(hardware), ex=self.ttl)
+
+
+def _record(msg, registry) -> tuple[str, str, dict, int] | None:
+    """(tenant_id, sensor_id, payload, kafka_ms) for a sensor record, ids from
+    the payload with the topic name / record key as fallback. Copies made by
+    the layout migration are skipped: they are older than what the sensor has
+    sent since."""
+    if is_migrated(msg.headers):
+        return None
+    try:
+        payload = decode_payload(msg.value, registry)
+    except Exception:
+        return None
+    ids       = parse_topic(msg.topic) or {}
+    tenant_id = payload.get("tenant_id") or ids.get("tenant_id")
+    sensor_id = payload.get("sensor_id") or ids.get("sensor_id") or (msg.key or b"").decode() or None
+    if not tenant_id or not sensor_id:
+        return None
+    return str(tenant_id), str(sensor_id), payload, msg.timestamp
+
+
+async def run_consumer(store: HotStateStore, brokers: str, pattern: str, group: str, registry) -> None:
+    """Consume every sensor topic into store until cancelled. Kafka or Redis
+    outages are logged and retried from the last stored batch."""
+    while True:
+        consumer = AIOKafkaConsumer(
+            bootstrap_servers=brokers,
+            group_id=group,
+            auto_offset_reset="latest",
+            enable_auto_commit=False,
+            metadata_max_age_ms=30_000,   # pick up new sensor topics quickly
+        )
+        try:
+            consumer.subscribe(pattern=pattern)
+            await consumer.start()
+            log.info("Hot state consumer started (group %s)", group)
+            while True:
+                batches = await consumer.getmany(timeout_ms=1000, max_records=2000)
+                if not batches:
+                    continue
+                records = [r for msgs in batches.values() for m in msgs if (r := _record(m, registry))]
+                try:
+                    await store.apply(records)
+                except Exception as exc:
+                    log.warning("Hot state write of %d readings failed, retrying in 5s: %s",
+                                len(records), exc)
+                    for tp, msgs in batches.items():
+                        consumer.seek(tp, msgs[0].offset)
+                    await asyncio.sleep(5)
+                    continue
+                await consumer.commit()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            log.warning("Hot state consumer failed, restarting in 5s: %s", exc)
+            await asyncio.sleep(5)
+        finally:
+            await consumer.stop()
@@ -0,0 +1,162 @@
+"""Shared inter-service HTTP client.
+
+One pooled httpx.AsyncClient per process, opened and closed by the FastAPI
+lifespan, so calls to other services reuse keep-alive connections instead of
+paying a TCP handshake each time. Every call names its target service, which
+selects the timeout and the bucket its counters land in for metrics().
+"""
+from collections import defaultdict
+from typing import Any, Optional
+import asyncio
+import importlib.util
+import logging
+import random
+
+import httpx
+
+
+_log = logging.getLogger(__name__)
+
+# The request never reached the peer — always safe to resend
+_NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Safe to resend even if the peer may have seen the first attempt
+_IDEMPOTENT = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+_RETRY_STATUS = frozenset({502, 503, 504})
+
+
+class ServiceClient:
+    """Pooled httpx client with per-target timeouts and jittered retries.
+
+    POST/PATCH are only retried when the connection was never established, so
+    counters such as message increments and query charges are not applied twice.
+    """
+
+    def __init__(
+        self,
+        *,
+        timeouts: dict[str, float],
+        default_timeout: float = 5.0,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = True,
+        retries: int = 2,
+        backoff_base: float = 0.1,
+        backoff_max: float = 2.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        if http2 and importlib.util.find_spec("h2") is None:
+            _log.warning("h2 not installed — inter-service calls use HTTP/1.1")
+            http2 = False
+        self.timeouts = timeouts
+        self.default_timeout = default_timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._transport = transport
+        self._client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stats: dict[str, dict[str, int]] = defaultdict(
+            lambda: {"requests": 0, "retries": 0, "errors": 0, "in_flight": 0}
+        )
+
+    # ── lifecycle ────────────────────────────────────────────────────────────
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Pooled connections belong to the loop that opened them; a client used
+        # outside the lifespan (scripts, tests) gets rebuilt on a new loop.
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                limits=self.limits,
+                http2=self.http2,
+                timeout=self.default_timeout,
+                transport=self._transport,
+            )
+            self._loop = loop
+        return self._client
+
+    async def start(self) -> None:
+        self._get_client()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+    # ── requests ─────────────────────────────────────────────────────────────
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def request(self, method: str, url: str, *, target: str, **kwargs: Any) -> httpx.Response:
+        method = method.upper()
+        kwargs.setdefault("timeout", self.timeouts.get(target, self.default_timeout))
+        client = self._get_client()
+        stats = self._stats[target]
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        try:
+            attempt = 0
+            while True:
+                last = attempt >= self.retries
+                try:
+                    response = await client.request(method, url, **kwargs)
+                except httpx.TransportError as exc:
+                    if last or not (isinstance(exc, _NOT_SENT) or method in _IDEMPOTENT):
+                        stats["errors"] += 1
+                        raise
+                else:
+                    if last or method not in _IDEMPOTENT or response.status_code not in _RETRY_STATUS:
+                        return response
+                    await response.aclose()
+                stats["retries"] += 1
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+        finally:
+            stats["in_flight"] -= 1
+
+    async def get(self, url: str, *, target: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", url, target=target, **kwargs)
+
+    async def post(self, url: str, *, target: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("POST", url, target=target, **kwargs)
+
+    async def patch(self, url: str, *, target: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("PATCH", url, target=target, **kwargs)
+
+    async def delete(self, url: str, *, target: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("DELETE", url, target=target, **kwargs)
+
+    # ── metrics ──────────────────────────────────────────────────────────────
+
+    def metrics(self) -> dict:
+        """Pool occupancy plus per-target request/retry/error counters."""
+        # httpx keeps the httpcore pool on its default transport; a custom
+        # transport (tests) simply reports no pooled connections.
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []) or [])
+        idle = sum(1 for c in connections if c.is_idle())
+        in_flight = sum(s["in_flight"] for s in self._stats.values())
+        max_connections = self.limits.max_connections or 0
+        return {
+            "pool": {
+                "max_connections":   max_connections,
+                "max_keepalive":     self.limits.max_keepalive_connections,
+                "connections":       len(connections),
+                "idle":              idle,
+                "active":            len(connections) - idle,
+                "in_flight":         in_flight,
+                "saturation":        round(in_flight / max_connections, 3) if max_connections else 0.0,
+                "http2":             self.http2,
+            },
+            "targets": {name: dict(s) for name, s in self._stats.items()},
+        }
@@ -8,6 +8,10 @@ Central orchestrator for the IoT data pipeline. Exposes:
       2. Create the Kafka topic (via AdminClient)
       3. Start a per-sensor MQTT simulator (background asyncio task)
 
+  POST /sensors/connect/bulk
+      The same for many sensors: one topic-creation request, one bulk route
+      registration in the bridge, then a simulator per sensor
+
   DELETE /sensors/{tenant_id}/{sensor_id}/disconnect
       Stop the simulator and unregister the route
 
@@ -15,8 +19,8 @@ Central orchestrator for the IoT data pipeline. Exposes:
       List all currently simulating sensors
 
   GET  /sensors/{tenant_id}/{sensor_id}/hardware
-      Read the latest hardware_info from the sensor's Kafka topic.
-      Used by the frontend to update battery/memory every hour without
+      The latest hardware_info, from the Redis hot state (hot_state.py)
+      or, on a miss, the sensor's Kafka topic. Used by the frontend to update battery/memory every hour without
       requiring the terminal WebSocket to be open.
 
   WS  /ws/{tenant_id}/{sensor_id}
@@ -25,6 +29,14 @@ Central orchestrator for the IoT data pipeline. Exposes:
   GET  /health
       Liveness probe
 
+  GET  /metrics/http-client
+      Pool occupancy and retry/error counters for bridge + sensor calls
+
+Kafka topics follow TOPIC_LAYOUT (see topic_layout.py): one topic per
+sensor, or shared per-tenant / per-type topics keyed by sensor id. With a
+shared layout, readers filter by key and message accounting counts keys
+with its own consumer group instead of reading topic watermarks.
+
 Port: 8090 (exposed on host)
 """
 
@@ -35,21 +47,30 @@ import json
 import logging
 import os
 import sys
+import threading
+from collections import Counter
 from contextlib import asynccontextmanager
 from typing import Dict
 
 import time
 
 import httpx
+import redis
+import redis.asyncio as aioredis
 from aiokafka import AIOKafkaConsumer
 from confluent_kafka import Consumer, TopicPartition
-from confluent_kafka.admin import AdminClient, NewTopic
+from confluent_kafka.admin import AdminClient, NewPartitions, NewTopic
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
+from hot_state import HotStateStore, run_consumer
+from http_client import ServiceClient
+from sensor_codec import SchemaRegistry, decode_payload, is_migrated
+from topic_layout import MSG_COUNT_BASE_KEY, MSG_COUNT_KEY, TopicLayout, sensor_key
+
 # mqtt_publisher lives in the iot package (mounted into the container)
 sys.path.insert(0, "/app/iot")
 from simulator.mqtt_publisher import MQTTSensorPublisher  # noqa: E402
@@ -63,7 +84,33 @@ BRIDGE_URL          = os.getenv("BRIDGE_URL",          "http://mqtt-bridge:8091"
 MQTT_HOST           = os.getenv("MQTT_HOST",           "mosquitto")
 MQTT_PORT           = int(os.getenv("MQTT_PORT",       "1883"))
 SENSOR_SERVICE_URL  = os.getenv("SENSOR_SERVICE_URL",  "http://sensor:8003")
-MSG_FLUSH_EVERY     = int(os.getenv("MSG_FLUSH_EVERY", "5"))
+MSG_COUNT_WINDOW    = float(os.getenv("MSG_COUNT_WINDOW", "10"))  # seconds per accounting window
+
+# Reader schemas for Avro payloads from the bridge (PAYLOAD_FORMAT=avro there)
+_schema_registry = SchemaRegistry.from_env()
+
+# Topic per sensor, or shared per-tenant / per-type topics (TOPIC_LAYOUT)
+_layout = TopicLayout()
+# Records read back per partition when looking for a sensor's latest reading:
+# a dedicated topic only needs the tail, a shared one interleaves many sensors
+HW_SCAN_DEPTH = int(os.getenv("HW_SCAN_DEPTH", "2000" if _layout.shared else "10"))
+
+# Hot state: latest readings / hardware per sensor in Redis; off when REDIS_URL is unset
+REDIS_URL         = os.getenv("REDIS_URL",         "")
+# Newest readings kept per sensor; the sensor service serves a set only once
+# it holds HOT_READINGS_LIMIT readings, so both read the same variable
+HOT_READINGS      = int(os.getenv("HOT_READINGS_LIMIT", "100"))
+HOT_TTL_S         = int(os.getenv("HOT_TTL_S",     str(7 * 86400)))
+HOT_STATE_GROUP   = os.getenv("HOT_STATE_GROUP",   "hot-state")
+HOT_STATE_PATTERN = os.getenv("HOT_STATE_PATTERN", r"verdantiq\..+")
+
+# Inter-service HTTP client (one pooled client per process)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE   = int(os.getenv("HTTP_MAX_KEEPALIVE",   "20"))
+HTTP_HTTP2           = os.getenv("HTTP_HTTP2", "true").lower() == "true"
+HTTP_RETRIES         = int(os.getenv("HTTP_RETRIES",         "2"))
+BRIDGE_TIMEOUT       = float(os.getenv("BRIDGE_TIMEOUT",     "10"))
+SENSOR_TIMEOUT       = float(os.getenv("SENSOR_TIMEOUT",     "5"))
 
 logging.basicConfig(
     level=logging.INFO,
@@ -72,24 +119,225 @@ logging.basicConfig(
 )
 log = logging.getLogger("data-service")
 
+# ── shared HTTP client (pool opened/closed in lifespan) ──────────────────────
+_http = ServiceClient(
+    timeouts={"bridge": BRIDGE_TIMEOUT, "sensor": SENSOR_TIMEOUT},
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive=HTTP_MAX_KEEPALIVE,
+    http2=HTTP_HTTP2,
+    retries=HTTP_RETRIES,
+)
+
+_redis = aioredis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+_hot   = HotStateStore(_redis, HOT_READINGS, HOT_TTL_S) if _redis else None
+
 # ── in-process simulator registry ────────────────────────────────────────────
 # sensor_key → MQTTSensorPublisher
 _active: Dict[str, MQTTSensorPublisher] = {}
 
-# ── per-sensor Kafka message counter ─────────────────────────────────────────
-# Accumulates counts and flushes to sensor service every MSG_FLUSH_EVERY msgs
-_msg_counts: Dict[str, int] = {}
+# ── message accounting — Kafka watermarks, folded per window ─────────────────
+# sensor_key → topic high-watermark total already reported to the sensor
+# service. Counting from the topic itself means billing no longer depends on a
+# browser keeping the terminal WebSocket open.
+_msg_watermarks: Dict[str, int] = {}
+_msg_lock = asyncio.Lock()
+
+
+def _read_watermark_totals(topics: list[str]) -> Dict[str, int]:
+    """Sum of partition high-watermarks per topic, read with a single consumer.
+    Topics that cannot be read are left out rather than reported as 0."""
+    totals: Dict[str, int] = {}
+    if not topics:
+        return totals
+    c = Consumer({
+        "bootstrap.servers": KAFKA_BROKERS,
+        "group.id":          f"msgacct-{int(time.time())}",
+        "enable.auto.commit": False,
+    })
+    try:
+        meta = c.list_topics(timeout=5)
+        for topic in topics:
+            t = meta.topics.get(topic)
+            if t is None or t.error is not None:
+                continue
+            totals[topic] = sum(
+                max(0, c.get_watermark_offsets(TopicPartition(topic, pid), timeout=5)[1])
+                for pid in t.partitions
+            )
+    except Exception as exc:
+        log.warning("Watermark read failed: %s", exc)
+    finally:
+        c.close()
+    return totals
+
+
+class _KeyCounter:
+    """Counts records per key (sensor id) on the shared topics of the layout.
+
+    Watermarks of a shared topic say nothing about one sensor, so a consumer
+    in its own group reads the topics and folds records into per-key counts
+    that _account_messages drains each window. Copies made by the layout
+    migration are not counted again.
+
+    With REDIS_URL set the counts are also added to the MSG_COUNT_KEY hash
+    (see codec/topic_layout.py), and offsets are committed only once a
+    batch's counts are stored there, so totals survive restarts and cover
+    every replica's partitions. Without Redis, total() is this process's
+    own count since startup.
+    """
 
+    def __init__(self, redis_url: str = ""):
+        self._pending: Counter = Counter()   # not yet reported to the sensor service
+        self._totals:  Counter = Counter()   # since this process started
+        self._redis = redis.Redis.from_url(redis_url) if redis_url else None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True, name="key-counter")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        c = Consumer({
+            "bootstrap.servers":     KAFKA_BROKERS,
+            "group.id":              "verdantiq-msg-accounting",
+            "auto.offset.reset":     "latest",
+            "enable.auto.commit":    False,
+            "topic.metadata.refresh.interval.ms": 30000,   # pick up new shared topics
+        })
+        c.subscribe([_layout.subscription])
+        unsaved: Counter = Counter()
+        try:
+            while not self._stop.is_set():
+                batch = [m for m in c.consume(num_messages=1000, timeout=1.0) if not m.error()]
+                if not batch:
+                    continue
+                keys = Counter(m.key().decode() for m in batch
+                               if m.key() and not is_migrated(m.headers()))
+                if keys:
+                    with self._lock:
+                        self._pending.update(keys)
+                        self._totals.update(keys)
+                unsaved.update(keys)
+                if unsaved and not self._save(unsaved):
+                    continue   # offsets stay uncommitted until the counts are stored
+                unsaved.clear()
+                c.commit(asynchronous=False)
+        except Exception as exc:
+            log.error("Message key counter stopped: %s", exc)
+        finally:
+            c.close()
 
-async def _flush_message_count(sensor_id: str, count: int) -> None:
+    def _save(self, counts: Counter) -> bool:
+        if self._redis is None:
+            return True
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for sensor_id, n in counts.items():
+                pipe.hincrby(MSG_COUNT_KEY, sensor_id, n)
+            pipe.execute()
+            return True
+        except Exception as exc:
+            log.warning("Message counts for %d sensors not stored: %s", len(counts), exc)
+            return False
+
+    def take(self) -> Counter:
+        with self._lock:
+            taken, self._pending = self._pending, Counter()
+        return taken
+
+    def restore(self, counts: Counter) -> None:
+        with self._lock:
+            self._pending.update(counts)
+
+    def total(self, sensor_id: str) -> int:
+        with self._lock:
+            return self._totals[sensor_id]
+
+
+_key_counter = _KeyCounter(REDIS_URL)
+
+
+async def _shared_message_counts(sensor_ids: list[str]) -> Dict[str, int]:
+    """Records per sensor under a shared layout: the stored counts plus what
+    the sensor sent before the layout migration, or this process's own
+    counts when Redis is unset or unreachable."""
+    if _redis:
+        try:
+            pipe = _redis.pipeline(transaction=False)
+            pipe.hmget(MSG_COUNT_KEY, sensor_ids)
+            pipe.hmget(MSG_COUNT_BASE_KEY, sensor_ids)
+            counted, base = await pipe.execute()
+            return {s: int(n or 0) + int(b or 0) for s, n, b in zip(sensor_ids, counted, base)}
+        except Exception as exc:
+            log.warning("Stored message counts unavailable: %s", exc)
+    return {s: _key_counter.total(s) for s in sensor_ids}
+
+
+async def _post_increments(increments: list[dict]) -> bool:
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
-            await client.post(
-                f"{SENSOR_SERVICE_URL}/internal/sensors/{sensor_id}/messages",
-                json={"message_increment": count},
-            )
+        resp = await _http.post(
+            f"{SENSOR_SERVICE_URL}/internal/sensors/messages/bulk",
+            target="sensor",
+            json={"increments": increments},
+        )
+        resp.raise_for_status()
+        return True
     except Exception as exc:
-        log.warning("Message count flush failed for sensor %s: %s", sensor_id, exc)
+        log.warning("Message accounting flush failed for %d sensors: %s", len(increments), exc)
+        return False
+
+
+async def _account_messages(keys: list[str] | None = None) -> None:
+    """Report message growth since the last window for `keys` (default: all
+    active sensors) to the sensor service in one bulk call. On failure the
+    watermarks are not advanced, so the growth is re-sent next window.
+
+    With a shared layout every counted sensor is reported (`keys` is
+    ignored); unreported counts are kept for the next window."""
+    async with _msg_lock:
+        if _layout.shared:
+            counts = _key_counter.take()
+            increments = [{"sensor_id": s, "increment": n} for s, n in counts.items()]
+            if increments and not await _post_increments(increments):
+                _key_counter.restore(counts)
+            return
+
+        keys = list(_active) if keys is None else keys
+        if not keys:
+            return
+        totals = await asyncio.get_running_loop().run_in_executor(
+            None, _read_watermark_totals, [f"verdantiq.{k}" for k in keys]
+        )
+        increments, reached = [], {}
+        for key in keys:
+            total = totals.get(f"verdantiq.{key}")
+            if total is None:
+                continue
+            base = _msg_watermarks.get(key)
+            if base is None:
+                # No baseline captured at connect — count from here on
+                _msg_watermarks[key] = total
+            elif total > base:
+                increments.append({"sensor_id": key.split(".", 1)[1], "increment": total - base})
+                reached[key] = total
+        if increments and await _post_increments(increments):
+            _msg_watermarks.update(reached)
+
+
+async def _message_accounting_loop() -> None:
+    while True:
+        await asyncio.sleep(MSG_COUNT_WINDOW)
+        try:
+            await _account_messages()
+        except Exception as exc:
+            log.warning("Message accounting window failed: %s", exc)
 
 
 # ── Kafka admin client ────────────────────────────────────────────────────────
@@ -102,47 +350,111 @@ def _get_admin() -> AdminClient:
     })
 
 
-def _create_kafka_topic(tenant_id: str, sensor_id: str) -> str:
-    topic = f"verdantiq.{tenant_id}.{sensor_id}"
+def _topic_for(tenant_id: str, sensor_id: str, sensor_type: str | None = None) -> str:
+    """The sensor's topic under TOPIC_LAYOUT. The 'type' layout needs the
+    sensor type, taken from the running simulator when not passed in."""
+    if sensor_type is None:
+        publisher = _active.get(f"{tenant_id}.{sensor_id}")
+        sensor_type = publisher.sensor_type if publisher else None
+    try:
+        return _layout.topic(tenant_id, sensor_id, sensor_type)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=f"{exc}; pass ?sensor_type=")
+
+
+def _topic_sizes(new_topics: list[str]) -> Dict[str, int]:
+    """Partition count per topic for the sensors it will carry: the running
+    simulators on it plus the ones being connected."""
+    sensors = Counter(new_topics)
+    for pub in _active.values():
+        topic = _layout.topic(pub.tenant_id, pub.sensor_id, pub.sensor_type)
+        if topic in sensors:
+            sensors[topic] += 1
+    return {topic: _layout.partitions(n) for topic, n in sensors.items()}
+
+
+def _create_kafka_topics(sizes: Dict[str, int]) -> Dict[str, Exception]:
+    """Create topics in one admin request and grow shared topics that now
+    carry more sensors; returns the ones that failed."""
     admin = _get_admin()
     fs = admin.create_topics([
-        NewTopic(topic, num_partitions=2, replication_factor=2,
+        NewTopic(topic, num_partitions=partitions, replication_factor=2,
                  config={"retention.ms": "604800000", "cleanup.policy": "delete",
                          "compression.type": "lz4"})
+        for topic, partitions in sizes.items()
     ])
+    failed: Dict[str, Exception] = {}
+    existing: list[str] = []
     for t, f in fs.items():
         try:
             f.result()
-            log.info("Kafka topic created: %s", t)
+            log.info("Kafka topic created: %s (%d partitions)", t, sizes[t])
         except Exception as exc:
             if "TopicExistsException" in type(exc).__name__ or "already exists" in str(exc).lower():
                 log.info("Kafka topic already exists: %s", t)
+                existing.append(t)
             else:
-                raise
-    return topic
+                failed[t] = exc
+    if _layout.shared and existing:
+        _grow_partitions(admin, {t: sizes[t] for t in existing})
+    return failed
+
+
+def _grow_partitions(admin: AdminClient, sizes: Dict[str, int]) -> None:
+    """Best effort: a shared topic that is too small still works, just slower."""
+    meta = admin.list_topics(timeout=10)
+    grow = [NewPartitions(t, n) for t, n in sizes.items()
+            if t in meta.topics and len(meta.topics[t].partitions) < n]
+    if not grow:
+        return
+    for t, f in admin.create_partitions(grow).items():
+        try:
+            f.result()
+            log.info("Kafka topic %s grown to %d partitions", t, sizes[t])
+        except Exception as exc:
+            log.warning("Could not grow Kafka topic %s: %s", t, exc)
+
+
+def _create_kafka_topic(topic: str) -> int:
+    """Create (or grow) one topic; returns its target partition count."""
+    sizes = _topic_sizes([topic])
+    failed = _create_kafka_topics(sizes)
+    if topic in failed:
+        raise failed[topic]
+    return sizes[topic]
 
 
 # ── bridge integration ────────────────────────────────────────────────────────
 
 async def _register_bridge_route(mqtt_topic: str, kafka_topic: str) -> None:
-    async with httpx.AsyncClient(timeout=10) as client:
-        resp = await client.post(
-            f"{BRIDGE_URL}/routes",
-            json={"mqtt_topic": mqtt_topic, "kafka_topic": kafka_topic},
-        )
-        resp.raise_for_status()
-        log.info("Bridge route registered: %s → %s", mqtt_topic, kafka_topic)
+    resp = await _http.post(
+        f"{BRIDGE_URL}/routes",
+        target="bridge",
+        json={"mqtt_topic": mqtt_topic, "kafka_topic": kafka_topic},
+    )
+    resp.raise_for_status()
+    log.info("Bridge route registered: %s → %s", mqtt_topic, kafka_topic)
+
+
+async def _register_bridge_routes(routes: Dict[str, str]) -> None:
+    """One bridge call for many routes; all or nothing on the bridge side."""
+    resp = await _http.post(
+        f"{BRIDGE_URL}/routes/bulk",
+        target="bridge",
+        json={"routes": [{"mqtt_topic": m, "kafka_topic": k} for m, k in routes.items()]},
+    )
+    resp.raise_for_status()
+    log.info("Bridge routes registered in bulk: %d", len(routes))
 
 
 async def _unregister_bridge_route(mqtt_topic: str) -> None:
     encoded = mqtt_topic.replace("/", "__")
-    async with httpx.AsyncClient(timeout=10) as client:
-        try:
-            resp = await client.delete(f"{BRIDGE_URL}/routes/{encoded}")
-            resp.raise_for_status()
-        except httpx.HTTPStatusError as exc:
-            if exc.response.status_code != 404:
-                raise
+    try:
+        resp = await _http.delete(f"{BRIDGE_URL}/routes/{encoded}", target="bridge")
+        resp.raise_for_status()
+    except httpx.HTTPStatusError as exc:
+        if exc.response.status_code != 404:
+            raise
 
 
 # ── API models ────────────────────────────────────────────────────────────────
@@ -158,6 +470,10 @@ class ConnectRequest(BaseModel):
     model_config = {"coerce_numbers_to_str": True}
 
 
+class BulkConnectRequest(BaseModel):
+    sensors: list[ConnectRequest]
+
+
 class ConnectResponse(BaseModel):
     sensor_id:   str
     tenant_id:   str
@@ -175,10 +491,27 @@ class ConnectResponse(BaseModel):
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     log.info("Data service starting up")
+    await _http.start()
+    if _layout.shared:
+        _key_counter.start()
+    accounting = asyncio.create_task(_message_accounting_loop())
+    hot_state  = None
+    if _hot:
+        hot_state = asyncio.create_task(run_consumer(
+            _hot, KAFKA_BROKERS, HOT_STATE_PATTERN, HOT_STATE_GROUP, _schema_registry))
     yield
     log.info("Data service shutting down — stopping %d simulators", len(_active))
+    accounting.cancel()
+    if hot_state:
+        hot_state.cancel()
     for pub in list(_active.values()):
         pub.stop()
+    if _layout.shared:
+        await asyncio.get_running_loop().run_in_executor(None, _key_counter.stop)
+    await _account_messages()
+    await _http.aclose()
+    if _redis:
+        await _redis.aclose()
 
 
 app = FastAPI(title="VerdantIQ Data Service", version="1.0.0", lifespan=lifespan)
@@ -196,6 +529,12 @@ def health():
     return {"status": "healthy", "active_sensors": len(_active)}
 
 
+@app.get("/metrics/http-client")
+def http_client_metrics():
+    """Pool occupancy and per-target retry/error counters for bridge/sensor calls."""
+    return _http.metrics()
+
+
 @app.get("/kafka/topic-info")
 def kafka_topic_info(topic: str):
     """Return metadata for a Kafka topic — primarily the replication factor."""
@@ -229,11 +568,27 @@ def list_active():
     }
 
 
+def _start_simulator(body: ConnectRequest) -> None:
+    publisher = MQTTSensorPublisher(
+        tenant_id=body.tenant_id,
+        sensor_id=body.sensor_id,
+        sensor_type=body.sensor_type,
+        device_id=body.device_id,
+        location=body.location,
+        farm_id=body.farm_id,
+        interval=0.5,
+        mqtt_host=MQTT_HOST,
+        mqtt_port=MQTT_PORT,
+    )
+    publisher.start()
+    _active[f"{body.tenant_id}.{body.sensor_id}"] = publisher
+
+
 @app.post("/sensors/connect", status_code=201)
 async def connect_sensor(body: ConnectRequest):
     key         = f"{body.tenant_id}.{body.sensor_id}"
     mqtt_topic  = f"verdantiq/{body.tenant_id}/{body.sensor_id}/data"
-    kafka_topic = f"verdantiq.{body.tenant_id}.{body.sensor_id}"
+    kafka_topic = _layout.topic(body.tenant_id, body.sensor_id, body.sensor_type)
 
     if key in _active:
         raise HTTPException(status_code=409, detail=f"Sensor {key} already connected")
@@ -255,10 +610,10 @@ async def connect_sensor(body: ConnectRequest):
 
     # ── Step 1: Create Kafka topic ─────────────────────────────────────────
     try:
-        _create_kafka_topic(body.tenant_id, body.sensor_id)
+        partitions = _create_kafka_topic(kafka_topic)
         steps["kafka_topic_created"] = {
             "status":  "success",
-            "message": f"Kafka topic {kafka_topic} ready (2 partitions, RF=2)",
+            "message": f"Kafka topic {kafka_topic} ready ({partitions} partitions, RF=2)",
         }
     except Exception as exc:
         log.error("Kafka topic creation failed: %s", exc)
@@ -281,20 +636,16 @@ async def connect_sensor(body: ConnectRequest):
         return JSONResponse(status_code=502, content=_base_payload("failed"))
 
     # ── Step 3: Start MQTT simulator ───────────────────────────────────────
-    try:
-        publisher = MQTTSensorPublisher(
-            tenant_id=body.tenant_id,
-            sensor_id=body.sensor_id,
-            sensor_type=body.sensor_type,
-            device_id=body.device_id,
-            location=body.location,
-            farm_id=body.farm_id,
-            interval=0.5,
-            mqtt_host=MQTT_HOST,
-            mqtt_port=MQTT_PORT,
+    # Baseline for message accounting — only growth from here on is counted
+    # (a shared topic is counted per key by _key_counter instead)
+    if not _layout.shared:
+        totals = await asyncio.get_running_loop().run_in_executor(
+            None, _read_watermark_totals, [kafka_topic]
         )
-        publisher.start()
-        _active[key] = publisher
+        if kafka_topic in totals:
+            _msg_watermarks[key] = totals[kafka_topic]
+    try:
+        _start_simulator(body)
         steps["simulator_started"] = {
             "status":  "success",
             "message": f"IoT simulator started (type={body.sensor_type})",
@@ -308,6 +659,73 @@ async def connect_sensor(body: ConnectRequest):
     return JSONResponse(status_code=201, content=_base_payload("streaming"))
 
 
+@app.post("/sensors/connect/bulk")
+async def connect_sensors_bulk(body: BulkConnectRequest):
+    """Connect many sensors with one topic-creation request and one bridge call.
+
+    Returns per-sensor results; sensors already connected are skipped.
+    """
+    results: Dict[str, dict] = {}
+    pending: Dict[str, ConnectRequest] = {}
+    for sensor in body.sensors:
+        key = f"{sensor.tenant_id}.{sensor.sensor_id}"
+        if key in _active or key in pending:
+            results[key] = {"status": "skipped", "message": "already connected"}
+        else:
+            pending[key] = sensor
+
+    topics = {k: _layout.topic(s.tenant_id, s.sensor_id, s.sensor_type) for k, s in pending.items()}
+
+    # ── Step 1: Create Kafka topics (one admin request) ────────────────────
+    loop = asyncio.get_running_loop()
+    try:
+        failed = await loop.run_in_executor(
+            None, _create_kafka_topics, _topic_sizes(list(topics.values()))
+        )
+    except Exception as exc:
+        log.error("Bulk Kafka topic creation failed: %s", exc)
+        failed = {t: exc for t in topics.values()}
+    for key in list(pending):
+        exc = failed.get(topics[key])
+        if exc is not None:
+            results[key] = {"status": "failed", "message": f"Kafka topic: {exc}"}
+            del pending[key]
+
+    # ── Step 2: Register MQTT→Kafka routes (one bridge call) ───────────────
+    routes = {
+        f"verdantiq/{s.tenant_id}/{s.sensor_id}/data": topics[k]
+        for k, s in pending.items()
+    }
+    if routes:
+        try:
+            await _register_bridge_routes(routes)
+        except Exception as exc:
+            log.error("Bulk bridge registration failed: %s", exc)
+            for key in pending:
+                results[key] = {"status": "failed", "message": f"Bridge: {exc}"}
+            pending.clear()
+
+    # ── Step 3: Start simulators ───────────────────────────────────────────
+    totals: Dict[str, int] = {}
+    if not _layout.shared:
+        totals = await loop.run_in_executor(
+            None, _read_watermark_totals, [topics[k] for k in pending]
+        )
+    for key, sensor in pending.items():
+        if topics[key] in totals:
+            _msg_watermarks[key] = totals[topics[key]]
+        try:
+            _start_simulator(sensor)
+            results[key] = {"status": "streaming", "kafka_topic": topics[key]}
+        except Exception as exc:
+            log.error("Simulator start failed for %s: %s", key, exc)
+            results[key] = {"status": "failed", "message": f"Simulator: {exc}"}
+
+    connected = sum(1 for r in results.values() if r["status"] == "streaming")
+    log.info("Bulk connect: %d of %d sensors streaming", connected, len(body.sensors))
+    return {"requested": len(body.sensors), "connected": connected, "sensors": results}
+
+
 @app.delete("/sensors/{tenant_id}/{sensor_id}/disconnect")
 async def disconnect_sensor(tenant_id: str, sensor_id: str):
     key = f"{tenant_id}.{sensor_id}"
@@ -317,7 +735,11 @@ async def disconnect_sensor(tenant_id: str, sensor_id: str):
 
     # publisher.stop() joins a daemon thread — must run in executor to avoid
     # blocking the uvicorn event loop (and failing Docker health checks).
-    await asyncio.get_event_loop().run_in_executor(None, publisher.stop)
+    await asyncio.get_running_loop().run_in_executor(None, publisher.stop)
+
+    # Report whatever the last partial window produced before forgetting the sensor
+    await _account_messages([key])
+    _msg_watermarks.pop(key, None)
 
     mqtt_topic = f"verdantiq/{tenant_id}/{sensor_id}/data"
     await _unregister_bridge_route(mqtt_topic)
@@ -330,14 +752,25 @@ async def disconnect_sensor(tenant_id: str, sensor_id: str):
 
 
 @app.get("/sensors/{tenant_id}/{sensor_id}/hardware")
-async def get_sensor_hardware(tenant_id: str, sensor_id: str):
+async def get_sensor_hardware(tenant_id: str, sensor_id: str, sensor_type: str | None = None):
     """
-    Read the latest hardware_info from the sensor's Kafka topic by seeking
-    to near the end of each partition.  Runs confluent_kafka (blocking) in
-    a thread-pool executor so it does not block the event loop.
+    Serve the latest hardware_info from the Redis hot state. On a miss, read
+    it from the sensor's Kafka topic by seeking to near the end of each
+    partition, and store what was found.  The Kafka read runs confluent_kafka
+    (blocking) in a thread-pool executor so it does not block the event loop.
+    In a shared topic only records keyed by this sensor are considered.
     Returns 404 if the topic is empty or contains no hardware_info yet.
     """
-    topic = f"verdantiq.{tenant_id}.{sensor_id}"
+    if _hot:
+        try:
+            hardware_info = await _hot.hardware(tenant_id, sensor_id)
+            if hardware_info:
+                return {"tenant_id": tenant_id, "sensor_id": sensor_id, "hardware_info": hardware_info}
+        except Exception as exc:
+            log.warning("Hot state read failed for %s.%s: %s", tenant_id, sensor_id, exc)
+
+    topic = _topic_for(tenant_id, sensor_id, sensor_type)
+    key   = sensor_key(sensor_id)
 
     def _read_latest_hardware() -> dict | None:
         conf = {
@@ -355,12 +788,12 @@ async def get_sensor_hardware(tenant_id: str, sensor_id: str):
             if not partition_ids:
                 return None
 
-            # Build TopicPartition objects and seek each to (end - 10)
+            # Build TopicPartition objects and seek each to (end - HW_SCAN_DEPTH)
             tps = []
             for pid in partition_ids:
                 tp    = TopicPartition(topic, pid)
                 lo, hi = c.get_watermark_offsets(tp, timeout=5)
-                seek_to = max(lo, hi - 10)
+                seek_to = max(lo, hi - HW_SCAN_DEPTH)
                 tps.append(TopicPartition(topic, pid, seek_to))
 
             c.assign(tps)
@@ -373,8 +806,10 @@ async def get_sensor_hardware(tenant_id: str, sensor_id: str):
                     continue
                 if msg.error():
                     continue
+                if _layout.shared and msg.key() != key:
+                    continue
                 try:
-                    payload = json.loads(msg.value().decode("utf-8", errors="replace"))
+                    payload = decode_payload(msg.value(), _schema_registry)
                     hw = payload.get("hardware_info")
                     if hw and isinstance(hw, dict):
                         hardware_info = hw  # keep updating; last one wins
@@ -384,7 +819,7 @@ async def get_sensor_hardware(tenant_id: str, sensor_id: str):
         finally:
             c.close()
 
-    hardware_info = await asyncio.get_event_loop().run_in_executor(
+    hardware_info = await asyncio.get_running_loop().run_in_executor(
         None, _read_latest_hardware
     )
     if not hardware_info:
@@ -392,6 +827,11 @@ async def get_sensor_hardware(tenant_id: str, sensor_id: str):
             status_code=404,
             detail="No hardware_info found in recent Kafka messages for this sensor",
         )
+    if _hot:
+        try:
+            await _hot.set_hardware(tenant_id, sensor_id, hardware_info)
+        except Exception as exc:
+            log.warning("Hot state write failed for %s.%s: %s", tenant_id, sensor_id, exc)
     return {"tenant_id": tenant_id, "sensor_id": sensor_id, "hardware_info": hardware_info}
 
 
@@ -427,16 +867,19 @@ async def get_all_message_counts():
     """
     Return Kafka message counts for all active sensors.
     Reads partition high-watermarks in parallel — no terminal/WebSocket needed.
+    With a shared layout these are the per-key counts (see _KeyCounter).
     """
     if not _active:
         return {"counts": {}}
+    if _layout.shared:
+        return {"counts": await _shared_message_counts([k.split(".", 1)[1] for k in list(_active)])}
 
     def _read_one(key: str) -> tuple:
         _, sensor_id = key.split(".", 1)
         topic = f"verdantiq.{key}"
         return sensor_id, _get_topic_message_count(topic)
 
-    loop    = asyncio.get_event_loop()
+    loop    = asyncio.get_running_loop()
     results = await asyncio.gather(
         *[loop.run_in_executor(None, _read_one, k) for k in list(_active)]
     )
@@ -445,26 +888,37 @@ async def get_all_message_counts():
 
 @app.get("/sensors/{tenant_id}/{sensor_id}/message-count")
 async def get_sensor_message_count(tenant_id: str, sensor_id: str):
-    """Return the Kafka message count for a single sensor's topic."""
-    topic = f"verdantiq.{tenant_id}.{sensor_id}"
-    count = await asyncio.get_event_loop().run_in_executor(
-        None, _get_topic_message_count, topic
-    )
+    """Return the Kafka message count for a single sensor's topic
+    (with a shared layout: its per-key count, see _KeyCounter)."""
+    if _layout.shared:
+        count = (await _shared_message_counts([sensor_id]))[sensor_id]
+    else:
+        count = await asyncio.get_running_loop().run_in_executor(
+            None, _get_topic_message_count, f"verdantiq.{tenant_id}.{sensor_id}"
+        )
     return {"tenant_id": tenant_id, "sensor_id": sensor_id, "message_count": count}
 
 
 # ── WebSocket — live Kafka consumer → terminal ────────────────────────────────
 
 @app.websocket("/ws/{tenant_id}/{sensor_id}")
-async def websocket_stream(websocket: WebSocket, tenant_id: str, sensor_id: str):
+async def websocket_stream(websocket: WebSocket, tenant_id: str, sensor_id: str,
+                           sensor_type: str | None = None):
     """
     Consume the sensor's Kafka topic and forward every message to the
-    connected WebSocket client (browser terminal card).
+    connected WebSocket client (browser terminal card). In a shared topic,
+    records keyed by other sensors are skipped.
     Max 20 messages shown (enforced on the frontend); no server-side limit.
+    Message counting happens in _message_accounting_loop, not here.
     """
     await websocket.accept()
-    topic = f"verdantiq.{tenant_id}.{sensor_id}"
-    log.info("WebSocket opened for %s", topic)
+    try:
+        topic = _topic_for(tenant_id, sensor_id, sensor_type)
+    except HTTPException as exc:
+        await websocket.close(code=1008, reason=str(exc.detail))
+        return
+    key = sensor_key(sensor_id)
+    log.info("WebSocket opened for %s (key %s)", topic, sensor_id)
 
     consumer = AIOKafkaConsumer(
         topic,
@@ -474,28 +928,23 @@ async def websocket_stream(websocket: WebSocket, tenant_id: str, sensor_id: str)
         enable_auto_commit=False,
         consumer_timeout_ms=1000,
     )
-    pending_count = 0
     try:
         await consumer.start()
         async for msg in consumer:
+            if _layout.shared and msg.key != key:
+                continue
             try:
-                # msg.value is raw JSON bytes from the bridge
-                text = msg.value.decode("utf-8", errors="replace")
+                # msg.value is JSON or schema-framed Avro from the bridge
+                payload = decode_payload(msg.value, _schema_registry)
                 # Enrich with partition/offset metadata for the terminal
                 envelope = json.dumps({
                     "offset":    msg.offset,
                     "partition": msg.partition,
                     "ts":        msg.timestamp,
-                    "payload":   json.loads(text),
+                    "payload":   payload,
                 })
                 await websocket.send_text(envelope)
 
-                # Count messages and flush to sensor service periodically
-                pending_count += 1
-                if pending_count >= MSG_FLUSH_EVERY:
-                    asyncio.create_task(_flush_message_count(sensor_id, pending_count))
-                    pending_count = 0
-
             except WebSocketDisconnect:
                 log.info("WebSocket closed for %s", topic)
                 break
@@ -505,9 +954,6 @@ async def websocket_stream(websocket: WebSocket, tenant_id: str, sensor_id: str)
     except Exception as exc:
         log.error("Kafka consumer error [%s]: %s", topic, exc)
     finally:
-        # Flush any remaining count on disconnect
-        if pending_count > 0:
-            asyncio.create_task(_flush_message_count(sensor_id, pending_count))
         try:
             await consumer.stop()
         except Exception:
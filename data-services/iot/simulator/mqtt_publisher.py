@@ -8,6 +8,10 @@ Classes
 -------
   SensorDataGenerator  : pure data factory, no I/O.
   MQTTSensorPublisher  : publishes JSON to Mosquitto every 0.5 s.
+
+Publishers honour the bridge's flow-control signal: while any bridge shard
+has an unexpired throttle factor retained on {FLOW_TOPIC}/{shard}, the
+publish interval is stretched by the largest one.
 """
 
 from __future__ import annotations
@@ -18,6 +22,7 @@ import logging
 import os
 import random
 import threading
+import time
 from datetime import datetime, timezone
 from typing import Any
 
@@ -25,6 +30,8 @@ import paho.mqtt.client as mqtt
 
 _log = logging.getLogger(__name__)
 
+FLOW_TOPIC = os.getenv("FLOW_TOPIC", "verdantiq/_bridge/flow")
+
 
 # ── helpers ───────────────────────────────────────────────────────────────────
 
@@ -190,6 +197,8 @@ class MQTTSensorPublisher:
         self._gen    = SensorDataGenerator()
         self._stop   = threading.Event()
         self._thread: threading.Thread | None = None
+        # bridge shard → (throttle factor, expiry epoch), from the flow topic
+        self._throttles: dict[str, tuple[float, float]] = {}
 
         # Hardware identifiers — stable per device, derived deterministically
         self._mac          = _mac_from_id(sensor_id)
@@ -213,6 +222,7 @@ class MQTTSensorPublisher:
         def _on_connect(client, userdata, flags, rc):
             if rc == 0:
                 _log.info("Publisher[%s] connected to MQTT", sensor_id)
+                client.subscribe(f"{FLOW_TOPIC}/+", qos=1)
             else:
                 _log.error("Publisher[%s] MQTT connect failed rc=%s", sensor_id, rc)
 
@@ -220,8 +230,20 @@ class MQTTSensorPublisher:
             if rc != 0:
                 _log.warning("Publisher[%s] unexpected MQTT disconnect rc=%s", sensor_id, rc)
 
+        def _on_flow(client, userdata, msg):
+            shard = msg.topic.rsplit("/", 1)[-1]
+            try:
+                signal = json.loads(msg.payload) if msg.payload else None
+                if signal:
+                    self._throttles[shard] = (float(signal["throttle"]), float(signal["expires"]))
+                else:
+                    self._throttles.pop(shard, None)
+            except (ValueError, KeyError, TypeError):
+                _log.warning("Publisher[%s] ignoring malformed flow signal on %s", sensor_id, msg.topic)
+
         self._client.on_connect    = _on_connect
         self._client.on_disconnect = _on_disconnect
+        self._client.on_message    = _on_flow
 
     def start(self) -> None:
         self._client.connect(self.mqtt_host, self.mqtt_port, keepalive=60)
@@ -238,6 +260,10 @@ class MQTTSensorPublisher:
         self._client.disconnect()
         _log.info("Publisher[%s] stopped", self.sensor_id)
 
+    def _throttle(self) -> float:
+        now = time.time()
+        return max([1.0, *(f for f, expires in list(self._throttles.values()) if expires > now)])
+
     def _run(self) -> None:
         while not self._stop.is_set():
             try:
@@ -261,4 +287,4 @@ class MQTTSensorPublisher:
                     _log.warning("Publisher[%s] publish rc=%s", self.sensor_id, result.rc)
             except Exception as exc:
                 _log.error("Publisher[%s] error: %s", self.sensor_id, exc)
-            self._stop.wait(self.interval)
+            self._stop.wait(self.interval * self._throttle())
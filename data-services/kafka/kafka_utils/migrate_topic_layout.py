@@ -0,0 +1,290 @@
+"""
+Topic layout migration
+======================
+Moves per-sensor topics (verdantiq.{tenant_id}.{sensor_id}) to a shared
+layout (see codec/topic_layout.py):
+
+  1. Plan: map every per-sensor topic to its target topic. The 'type'
+     layout reads the sensor type from the topic's first record. Size each
+     target by the number of sensors it receives.
+  2. Create the targets, or grow them if they already exist.
+  3. With --bridge-url, re-point the bridge's routes to the targets in one
+     bulk call, so new readings stop landing in the old topics.
+  4. Copy each old topic, earliest to latest, keyed by sensor id. Record
+     timestamps and headers are preserved, and every copy gets a
+     viq-migrated header (sensor_codec.MIGRATED_HEADER).
+  5. With --redis-url, store each old topic's record count (the sum of its
+     end offsets) in MSG_COUNT_BASE_KEY, so the data service's per-sensor
+     message counts carry on from there under the shared layout.
+  6. With --delete-source, delete an old topic once its copy is complete.
+
+The Spark job ingested every old record from its original topic already,
+and it reads newly found topics from the earliest offset, so it drops
+records carrying the viq-migrated header: the copies keep the history
+readable in the new topics (e.g. for the data service's hardware lookup)
+without being written to the Iceberg tables or rollups a second time.
+Copied records land after the ones the bridge is already writing, but every
+record keeps its own timestamp. The data service's hot state and message
+counters skip them as well.
+
+--state records finished topics and, for the topic being copied, the next
+offset of every partition, written after each batch is flushed to the
+target. A rerun resumes from there, so at most the batch in flight when a
+run was interrupted is copied twice. Records that expire under retention
+before they are copied are skipped and logged. A copy that gets no records
+for --idle-timeout seconds while records remain is aborted, keeping its
+progress for the rerun. Set TOPIC_LAYOUT=<layout> on the data service when
+the run is done.
+
+  python data-services/kafka/kafka_utils/migrate_topic_layout.py \\
+      --layout tenant --brokers localhost:19092 \\
+      --bridge-url http://localhost:8091 --dry-run
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import urllib.request
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict
+
+from confluent_kafka import Consumer, Producer, TopicPartition
+from confluent_kafka.admin import AdminClient, NewPartitions, NewTopic
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "codec"))
+from sensor_codec import MIGRATED_HEADER, SchemaRegistry, decode_payload  # noqa: E402
+from topic_layout import MSG_COUNT_BASE_KEY, TopicLayout, parse_topic, sensor_key  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s migrate %(levelname)s %(message)s",
+                    datefmt="%Y-%m-%dT%H:%M:%S")
+log = logging.getLogger("migrate")
+
+_TOPIC_CONFIG = {"retention.ms": "604800000", "cleanup.policy": "delete", "compression.type": "lz4"}
+
+
+def _consumer(brokers: str) -> Consumer:
+    return Consumer({
+        "bootstrap.servers":  brokers,
+        "group.id":           f"layout-migration-{int(time.time())}",
+        "enable.auto.commit": False,
+        "auto.offset.reset":  "earliest",   # past records that expired mid-copy
+    })
+
+
+def _first_sensor_type(brokers: str, topic: str, registry) -> str | None:
+    c = _consumer(brokers)
+    try:
+        parts = c.list_topics(topic, timeout=10).topics[topic].partitions
+        c.assign([TopicPartition(topic, p, 0) for p in parts])   # 0 = earliest available
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            msg = c.poll(0.5)
+            if msg is None or msg.error():
+                continue
+            try:
+                return decode_payload(msg.value(), registry).get("sensor_type")
+            except Exception:
+                continue
+        return None
+    finally:
+        c.close()
+
+
+def plan(admin: AdminClient, layout: TopicLayout, brokers: str, registry) -> Dict[str, str]:
+    """Old topic → target topic for every per-sensor topic on the cluster."""
+    mapping: Dict[str, str] = {}
+    for topic in sorted(admin.list_topics(timeout=10).topics):
+        ids = parse_topic(topic)
+        if not ids or ids["layout"] != "sensor":
+            continue
+        sensor_type = _first_sensor_type(brokers, topic, registry) if layout.needs_type else None
+        if layout.needs_type and not sensor_type:
+            log.warning("%s: no readable record with a sensor_type — left in place", topic)
+            continue
+        mapping[topic] = layout.topic(ids["tenant_id"], ids["sensor_id"], sensor_type)
+    return mapping
+
+
+def create_targets(admin: AdminClient, layout: TopicLayout, mapping: Dict[str, str]) -> None:
+    sizes = {t: layout.partitions(n) for t, n in Counter(mapping.values()).items()}
+    existing = admin.list_topics(timeout=10).topics
+    new = [NewTopic(t, num_partitions=n, replication_factor=2, config=_TOPIC_CONFIG)
+           for t, n in sizes.items() if t not in existing]
+    grow = [NewPartitions(t, n) for t, n in sizes.items()
+            if t in existing and len(existing[t].partitions) < n]
+    for t, f in (admin.create_topics(new) if new else {}).items():
+        f.result()
+        log.info("Created %s (%d partitions)", t, sizes[t])
+    for t, f in (admin.create_partitions(grow) if grow else {}).items():
+        f.result()
+        log.info("Grew %s to %d partitions", t, sizes[t])
+
+
+def repoint_routes(bridge_url: str, mapping: Dict[str, str]) -> int:
+    with urllib.request.urlopen(f"{bridge_url}/routes", timeout=30) as resp:
+        routes = json.loads(resp.read())["routes"]
+    moved = [{"mqtt_topic": m, "kafka_topic": mapping[k]} for m, k in routes.items() if k in mapping]
+    if moved:
+        req = urllib.request.Request(
+            f"{bridge_url}/routes/bulk",
+            data=json.dumps({"routes": moved}).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        urllib.request.urlopen(req, timeout=60).close()
+    return len(moved)
+
+
+def _finished(c: Consumer, source: str, ends: Dict[int, int],
+              next_offsets: Dict[int, int]) -> Dict[int, int]:
+    """Partitions with nothing left to copy below their end offset, mapped to
+    the records that expired there before they were copied."""
+    finished = {}
+    for tp in c.position([TopicPartition(source, p) for p in ends]):
+        p = tp.partition
+        lo, _ = c.get_watermark_offsets(TopicPartition(source, p), timeout=10)
+        position = max(tp.offset, next_offsets[p])
+        if max(lo, position) >= ends[p]:
+            finished[p] = max(0, min(lo, ends[p]) - position)
+    return finished
+
+
+def copy_topic(brokers: str, producer: Producer, source: str, target: str,
+               progress: Dict[str, int], save: Callable[[], None],
+               idle_timeout: float) -> tuple[int, int]:
+    """Copy source up to its current end into target, starting each partition
+    at its next offset in progress, which is updated and saved after every
+    flushed batch. Returns (records copied, records ever written to source)."""
+    sensor_id = parse_topic(source)["sensor_id"]
+    c = _consumer(brokers)
+    try:
+        parts = c.list_topics(source, timeout=10).topics[source].partitions
+        ends, start, written = {}, [], 0
+        for p in parts:
+            lo, hi = c.get_watermark_offsets(TopicPartition(source, p), timeout=10)
+            written += max(0, hi)
+            offset = max(lo, progress.get(str(p), 0))
+            if hi > offset:
+                ends[p] = hi
+                start.append(TopicPartition(source, p, offset))
+        next_offsets = {tp.partition: tp.offset for tp in start}
+        failed: list = []
+
+        def delivered(err, _msg) -> None:
+            if err:
+                failed.append(err)
+
+        copied, idle_since = 0, time.monotonic()
+        c.assign(start)
+        while ends:
+            batch = [m for m in c.consume(num_messages=1000, timeout=1)
+                     if not m.error() and m.partition() in ends]
+            if not batch:
+                for p, expired in _finished(c, source, ends, next_offsets).items():
+                    ends.pop(p)
+                    if expired:
+                        log.warning("%s[%d]: %d records expired before they were copied",
+                                    source, p, expired)
+                if ends and time.monotonic() - idle_since > idle_timeout:
+                    raise TimeoutError(f"{source}: no records for {idle_timeout:.0f}s from "
+                                       f"partitions {sorted(ends)}; rerun to resume")
+                continue
+            for msg in batch:
+                p = msg.partition()
+                if p not in ends:
+                    continue
+                if msg.offset() > next_offsets[p]:
+                    log.warning("%s[%d]: %d records expired before they were copied",
+                                source, p, msg.offset() - next_offsets[p])
+                ts_type, ts = msg.timestamp()
+                headers = (msg.headers() or []) + [(MIGRATED_HEADER, b"1")]
+                producer.produce(target, value=msg.value(), key=sensor_key(sensor_id),
+                                 timestamp=ts if ts_type else 0, headers=headers,
+                                 on_delivery=delivered)
+                producer.poll(0)
+                copied += 1
+                next_offsets[p] = msg.offset() + 1
+                if msg.offset() + 1 >= ends[p]:
+                    ends.pop(p)
+            producer.flush()
+            if failed:
+                raise RuntimeError(f"{source}: {len(failed)} records not delivered: {failed[0]}")
+            progress.update({str(p): o for p, o in next_offsets.items()})
+            save()
+            idle_since = time.monotonic()
+        return copied, written
+    finally:
+        c.close()
+
+
+def _store_base_count(redis_url: str, sensor_id: str, written: int) -> None:
+    import redis   # only needed with --redis-url
+
+    redis.Redis.from_url(redis_url).hset(MSG_COUNT_BASE_KEY, sensor_id, written)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move per-sensor Kafka topics to a shared layout")
+    parser.add_argument("--layout",        required=True, choices=("tenant", "type"))
+    parser.add_argument("--brokers",       default=os.getenv("KAFKA_BROKERS", "localhost:19092"))
+    parser.add_argument("--bridge-url",    default=None, help="re-point bridge routes before copying")
+    parser.add_argument("--state",         default="topic-migration.json",
+                        help="finished topics and copy progress, for resuming")
+    parser.add_argument("--idle-timeout",  type=float, default=60,
+                        help="abort a copy that gets no records for this many seconds")
+    parser.add_argument("--redis-url",     default=os.getenv("REDIS_URL"),
+                        help="carry per-sensor message counts over to the shared layout")
+    parser.add_argument("--delete-source", action="store_true")
+    parser.add_argument("--dry-run",       action="store_true")
+    args = parser.parse_args()
+
+    layout   = TopicLayout(args.layout)
+    admin    = AdminClient({"bootstrap.servers": args.brokers})
+    registry = SchemaRegistry.from_env()
+    state    = Path(args.state)
+    saved    = json.loads(state.read_text()) if state.exists() else {}
+    done     = set(saved.get("done", []))
+    progress: Dict[str, Dict[str, int]] = saved.get("progress", {})
+
+    def save() -> None:
+        tmp = state.with_name(state.name + ".tmp")
+        tmp.write_text(json.dumps({"done": sorted(done), "progress": progress}))
+        tmp.replace(state)
+
+    mapping = {s: t for s, t in plan(admin, layout, args.brokers, registry).items() if s not in done}
+    targets = Counter(mapping.values())
+    log.info("%d topics to move into %d %s topics", len(mapping), len(targets), args.layout)
+    for target, n in sorted(targets.items()):
+        log.info("  %s ← %d sensors (%d partitions)", target, n, layout.partitions(n))
+    if args.dry_run or not mapping:
+        return
+
+    create_targets(admin, layout, mapping)
+    if args.bridge_url:
+        log.info("Re-pointed %d bridge routes", repoint_routes(args.bridge_url.rstrip("/"), mapping))
+        time.sleep(5)   # let in-flight messages on the old routes land before snapshotting
+
+    producer = Producer({"bootstrap.servers": args.brokers, "enable.idempotence": True,
+                         "linger.ms": 20, "compression.type": "lz4"})
+    for source, target in mapping.items():
+        copied, written = copy_topic(args.brokers, producer, source, target,
+                                     progress.setdefault(source, {}), save, args.idle_timeout)
+        if args.redis_url:
+            _store_base_count(args.redis_url, parse_topic(source)["sensor_id"], written)
+        done.add(source)
+        progress.pop(source, None)
+        save()
+        log.info("%s → %s: %d records", source, target, copied)
+        if args.delete_source:
+            admin.delete_topics([source])[source].result()
+            log.info("Deleted %s", source)
+
+
+if __name__ == "__main__":
+    main()
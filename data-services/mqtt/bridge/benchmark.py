@@ -0,0 +1,356 @@
+"""
+Bridge throughput benchmark
+===========================
+Drives the real bridge hot path (paho callback → route lookup → produce)
+with synthetic SensorDataGenerator payloads published to a local MQTT
+broker, and writes a machine-readable JSON report:
+
+  throughput, end-to-end latency percentiles + histogram, bridge CPU per
+  message, publish/route/delivery counts and drops.
+
+The bridge runs in this process; the publishers run in a separate process
+so the CPU figure covers the bridge alone. By default Kafka is replaced by
+an in-process MockProducer (latency = MQTT publish → produce()); with
+--kafka the real producer is used and latency is measured by a consumer
+on the target topic (MQTT publish → consumed from Kafka).
+
+  docker run -d -p 1883:1883 eclipse-mosquitto:2.0 mosquitto -c /mosquitto-no-auth.conf
+  python data-services/mqtt/bridge/benchmark.py --rate 5000 --sensors 500 \\
+      --duration 30 --output bench.json
+
+Compare reports across commits to catch regressions; --routes exact
+registers one route per sensor instead of a single pattern route, and
+--payload-format avro measures the transcoding stage (schemas go to a
+temporary SCHEMA_DIR).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import re
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+_HERE = Path(__file__).resolve().parent
+_SIMULATOR_DIR = _HERE.parents[1] / "iot" / "simulator"
+
+TOPIC_PREFIX = "verdantiq/bench"
+_BENCH_TS = re.compile(rb'"bench_ts_ns":\s*(\d+)')
+# Histogram bucket upper bounds, milliseconds
+_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+# ── Kafka stand-in ────────────────────────────────────────────────────────────
+
+class _MockMessage:
+    __slots__ = ("_topic",)
+
+    def __init__(self, topic: str):
+        self._topic = topic
+
+    def topic(self) -> str:
+        return self._topic
+
+
+class MockProducer:
+    """confluent_kafka.Producer stand-in: produce() records the arrival time
+    and a payload prefix, delivery callbacks fire on the next poll()."""
+
+    def __init__(self, keep_bytes: Optional[int] = 48):
+        self.records: List[tuple] = []   # (arrival_ns, payload prefix)
+        self.keep_bytes = keep_bytes     # None keeps whole (Avro) values for decoding
+        self._pending: List[tuple] = []
+
+    def produce(self, topic, value=None, key=None, on_delivery=None, **kwargs):
+        self.records.append((time.time_ns(), value[:self.keep_bytes]))
+        if on_delivery is not None:
+            self._pending.append((on_delivery, topic))
+
+    def poll(self, timeout=None) -> int:
+        pending, self._pending = self._pending, []
+        for callback, topic in pending:
+            callback(None, _MockMessage(topic))
+        return len(pending)
+
+    def flush(self, timeout=None) -> int:
+        self.poll(0)
+        return 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+
+# ── publisher process ─────────────────────────────────────────────────────────
+
+def _publish(host: str, port: int, rate: float, sensors: int, duration: float,
+             qos: int, sensor_type: str, result: "multiprocessing.Queue") -> None:
+    """Publish at a fixed rate spread round-robin over `sensors` topics."""
+    sys.path.insert(0, str(_SIMULATOR_DIR))
+    import paho.mqtt.client as mqtt
+    from mqtt_publisher import SensorDataGenerator
+
+    try:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1,
+                             client_id=f"bridge-bench-{os.getpid()}", clean_session=True)
+    except AttributeError:
+        client = mqtt.Client(client_id=f"bridge-bench-{os.getpid()}",  # type: ignore[call-overload]
+                             clean_session=True)
+    client.max_inflight_messages_set(1000)
+    client.max_queued_messages_set(0)
+    client.connect(host, port, keepalive=60)
+    client.loop_start()
+
+    gen = SensorDataGenerator()
+    # A fixed pool of payloads keeps generator cost out of the send loop
+    templates = [gen.generate(sensor_type, device_id=f"bench_{i:05d}") for i in range(min(sensors, 256))]
+    topics = [f"{TOPIC_PREFIX}/sensor_{i:05d}/data" for i in range(sensors)]
+
+    sent = failed = 0
+    start = time.perf_counter()
+    total = int(rate * duration)
+    for i in range(total):
+        target = start + i / rate
+        delay = target - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        body = json.dumps(templates[i % len(templates)])
+        # bench_ts_ns first so the bridge side only inspects a short prefix
+        payload = '{"bench_ts_ns": %d, %s' % (time.time_ns(), body[1:])
+        if client.publish(topics[i % sensors], payload, qos=qos).rc == mqtt.MQTT_ERR_SUCCESS:
+            sent += 1
+        else:
+            failed += 1
+    elapsed = time.perf_counter() - start
+    client.loop_stop()
+    client.disconnect()
+    result.put({"published": sent, "publish_errors": failed, "publish_seconds": elapsed,
+                "payload_bytes": len(payload) if total else 0})
+
+
+# ── Kafka consumer (real broker mode) ─────────────────────────────────────────
+
+def _consume(brokers: str, topic: str, stop: threading.Event, records: list,
+             keep_bytes: Optional[int]) -> None:
+    from confluent_kafka import Consumer
+
+    consumer = Consumer({
+        "bootstrap.servers":  brokers,
+        "group.id":           f"bridge-bench-{os.getpid()}",
+        "auto.offset.reset":  "latest",
+        "enable.auto.commit": False,
+    })
+    consumer.subscribe([topic])
+    try:
+        while not stop.is_set():
+            for msg in consumer.consume(num_messages=1000, timeout=0.2):
+                if msg.error() is None:
+                    records.append((time.time_ns(), msg.value()[:keep_bytes]))
+    finally:
+        consumer.close()
+
+
+def _ensure_topic(brokers: str, topic: str) -> None:
+    from confluent_kafka.admin import AdminClient, NewTopic
+
+    futures = AdminClient({"bootstrap.servers": brokers}).create_topics(
+        [NewTopic(topic, num_partitions=6, replication_factor=1)])
+    for future in futures.values():
+        try:
+            future.result()
+        except Exception as exc:
+            if "already exists" not in str(exc).lower():
+                raise
+
+
+# ── report ────────────────────────────────────────────────────────────────────
+
+def _percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))], 3)
+
+
+def _sent_ns(value: bytes, registry) -> Optional[int]:
+    if value[:1] == b"\x00":
+        from sensor_codec import decode_payload
+        return decode_payload(value, registry).get("bench_ts_ns")
+    m = _BENCH_TS.search(value)
+    return int(m.group(1)) if m else None
+
+
+def _latency_report(records: list, registry=None) -> Dict:
+    latencies = []
+    for arrival_ns, value in records:
+        sent_ns = _sent_ns(value, registry)
+        if sent_ns:
+            latencies.append((arrival_ns - sent_ns) / 1e6)
+    latencies.sort()
+    counts = [0] * (len(_BUCKETS_MS) + 1)
+    for ms in latencies:
+        for i, bound in enumerate(_BUCKETS_MS):
+            if ms <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return {
+        "samples": len(latencies),
+        "mean":    round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "p50":     _percentile(latencies, 0.50),
+        "p90":     _percentile(latencies, 0.90),
+        "p99":     _percentile(latencies, 0.99),
+        "p999":    _percentile(latencies, 0.999),
+        "max":     round(latencies[-1], 3) if latencies else None,
+        "histogram": [{"le_ms": b, "count": c} for b, c in zip(_BUCKETS_MS, counts)]
+                     + [{"le_ms": "inf", "count": counts[-1]}],
+    }
+
+
+# ── run ───────────────────────────────────────────────────────────────────────
+
+def run(args: argparse.Namespace) -> Dict:
+    os.environ["MQTT_HOST"] = args.mqtt_host
+    os.environ["MQTT_PORT"] = str(args.mqtt_port)
+    state_dir = Path(tempfile.mkdtemp())
+    os.environ["ROUTES_DB"] = str(state_dir / "routes.db")
+    os.environ["ROUTES_FILE"] = str(state_dir / "routes.json")   # absent: no legacy import
+    os.environ["SPILL_DIR"] = str(state_dir / "spill")
+    os.environ["KAFKA_BROKERS"] = args.kafka or "localhost:9092"
+    os.environ["PAYLOAD_FORMAT"] = args.payload_format
+    if args.payload_format == "avro":
+        os.environ["SCHEMA_DIR"] = tempfile.mkdtemp()
+    for var in ("MQTT_SHARE_GROUP", "REDIS_URL", "PATTERN_ROUTES", "SCHEMA_REGISTRY_URL"):
+        os.environ.pop(var, None)
+    keep_bytes = None if args.payload_format == "avro" else 48
+    sys.path[:0] = [str(_HERE), str(_HERE.parents[1] / "codec")]
+    import bridge
+
+    if args.kafka:
+        _ensure_topic(args.kafka, args.kafka_topic)
+        records: list = []
+        stop_consumer = threading.Event()
+        consumer = threading.Thread(target=_consume, args=(args.kafka, args.kafka_topic, stop_consumer, records, keep_bytes),
+                                    daemon=True)
+        consumer.start()
+        time.sleep(3)   # let the consumer join its group before publishing
+    else:
+        bridge._producer = MockProducer(keep_bytes)
+        records = bridge._producer.records
+
+    if args.routes == "exact":
+        routes = {f"{TOPIC_PREFIX}/sensor_{i:05d}/data": args.kafka_topic for i in range(args.sensors)}
+    else:
+        routes = {f"{TOPIC_PREFIX}/+/data": args.kafka_topic}
+    bridge._routes.update(routes)
+    bridge._connect_mqtt_with_retry(max_attempts=5, delay=1.0)
+    bridge._subscribe(bridge._routes.subscriptions())
+    time.sleep(1)   # SUBACK before the first publish
+
+    ctx = multiprocessing.get_context("spawn")
+    result_q = ctx.Queue()
+    publisher = ctx.Process(target=_publish, args=(args.mqtt_host, args.mqtt_port, args.rate, args.sensors,
+                                                   args.duration, args.qos, args.sensor_type, result_q))
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    publisher.start()
+    pub = result_q.get()
+    publisher.join()
+
+    # Drain: wait until forwarding stops making progress
+    deadline = time.monotonic() + args.drain
+    last = -1
+    while time.monotonic() < deadline and len(records) < pub["published"]:
+        if len(records) == last:
+            time.sleep(0.5)
+            if len(records) == last:
+                break
+        last = len(records)
+        time.sleep(0.2)
+    bridge._producer.flush(args.drain)
+    if args.kafka:
+        time.sleep(1)
+        stop_consumer.set()
+        consumer.join(timeout=5)
+    cpu = time.process_time() - cpu0
+    wall = time.perf_counter() - wall0
+    bridge._mqtt_client.loop_stop()
+    bridge._mqtt_client.disconnect()
+
+    delivered = len(records)
+    stats = dict(bridge._stats)
+    return {
+        "config": {
+            "mode":           "kafka" if args.kafka else "mock",
+            "rate":           args.rate,
+            "sensors":        args.sensors,
+            "duration_s":     args.duration,
+            "qos":            args.qos,
+            "routes":         args.routes,
+            "payload_format": args.payload_format,
+            "sensor_type":    args.sensor_type,
+            "payload_bytes":  pub["payload_bytes"],
+        },
+        "environment": {
+            "python":   platform.python_version(),
+            "platform": platform.platform(),
+            "cpus":     os.cpu_count(),
+        },
+        "counts": {
+            "published":      pub["published"],
+            "publish_errors": pub["publish_errors"],
+            "received":       stats["received"],
+            "forwarded":      stats["forwarded"],
+            "delivered":      delivered,
+            "dropped":        max(0, pub["published"] - delivered),
+        },
+        "throughput": {
+            "offered_msgs_per_s":   round(pub["published"] / pub["publish_seconds"], 1) if pub["publish_seconds"] else None,
+            "delivered_msgs_per_s": round(delivered / wall, 1) if wall else None,
+            "wall_seconds":         round(wall, 3),
+        },
+        "cpu": {
+            "bridge_cpu_seconds": round(cpu, 3),
+            "cpu_us_per_msg":     round(cpu / stats["received"] * 1e6, 2) if stats["received"] else None,
+        },
+        "latency_ms": _latency_report(records, getattr(bridge._transcoder, "registry", None)),
+        "bridge_stats": stats,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="MQTT→Kafka bridge benchmark")
+    parser.add_argument("--mqtt-host",   default=os.getenv("MQTT_HOST", "localhost"))
+    parser.add_argument("--mqtt-port",   type=int, default=int(os.getenv("MQTT_PORT", "1883")))
+    parser.add_argument("--kafka",       default=None, help="bootstrap servers; omit for the mock producer")
+    parser.add_argument("--kafka-topic", default="verdantiq.bench")
+    parser.add_argument("--rate",        type=float, default=1000, help="messages per second offered")
+    parser.add_argument("--sensors",     type=int, default=100)
+    parser.add_argument("--duration",    type=float, default=10, help="publish seconds")
+    parser.add_argument("--qos",         type=int, choices=(0, 1), default=1)
+    parser.add_argument("--routes",      choices=("pattern", "exact"), default="pattern")
+    parser.add_argument("--sensor-type", default="soil")
+    parser.add_argument("--payload-format", choices=("json", "avro"), default="json")
+    parser.add_argument("--drain",       type=float, default=10, help="seconds to wait for stragglers")
+    parser.add_argument("--output",      default="-", help="report path, - for stdout")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        Path(args.output).write_text(text + "\n")
+        c, t, l = report["counts"], report["throughput"], report["latency_ms"]
+        print(f"{t['delivered_msgs_per_s']} msg/s delivered, p99 {l['p99']} ms, "
+              f"{c['dropped']} dropped → {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
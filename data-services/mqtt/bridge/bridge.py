@@ -11,17 +11,64 @@ Lightweight async bridge that:
 Topic convention
 ----------------
   MQTT  :  verdantiq/{tenant_id}/{sensor_id}/data
-  Kafka :  verdantiq.{tenant_id}.{sensor_id}
-
-Routes are stored in memory and persisted to /tmp/routes.json so they
-survive a soft restart of this process.
+  Kafka :  verdantiq.{tenant_id}.{sensor_id}, or a shared per-tenant /
+           per-type topic (see topic_layout.py); records are keyed by
+           sensor id either way
+
+Sharded mode
+------------
+Set MQTT_SHARE_GROUP and REDIS_URL to run several workers side by side:
+each connects with MQTT v5 and subscribes through
+$share/{group}/{filter}, so the broker spreads messages across workers,
+each with its own Kafka producer. Routes are kept in Redis (route_store.py)
+and every worker's registrations reach all of them. supervisor.py starts
+BRIDGE_WORKERS such processes in one container, each on BRIDGE_PORT + i.
+
+Payload transcoding
+-------------------
+PAYLOAD_FORMAT=avro re-encodes each JSON payload as schemaless Avro framed
+with its schema id (see sensor_codec.py; needs SCHEMA_REGISTRY_URL or
+SCHEMA_DIR). Invalid JSON is dropped here rather than downstream; payloads
+Avro cannot express are forwarded as JSON unchanged.
+
+Backpressure
+------------
+When librdkafka's queue is full (BufferError) or deliveries to a Kafka
+topic are failing, messages go to that topic's backlog queue (spill.py):
+BRIDGE_QUEUE_MAX records in memory, then append-only segment files under
+SPILL_DIR/{topic}, both budgets shared by all topics. While a topic has a
+backlog its new messages queue behind it, and a drain thread replays each
+topic's backlog in order as Kafka takes it, round-robin across topics, so
+one slow or failing topic never holds up the others. Failed deliveries
+are requeued at the head of their topic's backlog rather than dropped, so
+a sensor's readings keep their order and the process no longer exits when
+the broker is down.
+
+Above FLOW_HIGH_WATERMARK queued records the bridge publishes a retained
+throttle factor on {FLOW_TOPIC}/{shard} until the backlog falls below
+FLOW_LOW_WATERMARK (the simulator stretches its publish interval by it).
+Once the spill budget (SPILL_MAX_MB) is exhausted as well, new messages
+are dropped and counted: the paho thread never waits for room, since
+blocking it would also stall keepalives and drop the MQTT connection.
+Queue depth and spill size are on /health and, in Prometheus format, on
+/metrics.
+
+Routes are exact topics or wildcard patterns (see routing.py); a single
+pattern route such as  verdantiq/+/+/data → verdantiq.{1}.{2}  replaces one
+MQTT subscription per sensor. Set PATTERN_ROUTES (JSON object) to install
+pattern routes at startup. Routes are persisted incrementally to a local
+SQLite database (ROUTES_DB, see route_store.py) so they survive a restart
+of this process; a routes.json left by older versions is imported once.
 
 Endpoints
 ---------
   POST /routes         register a new routing rule
+  POST /routes/bulk    register many rules in one call
   DELETE /routes/{id}  remove a rule
   GET  /routes         list all active rules
-  GET  /health         liveness probe
+  GET  /health         liveness probe + this worker's metrics
+  GET  /health/shards  every worker's last heartbeat, plus totals
+  GET  /metrics        this worker's metrics in Prometheus text format
 """
 
 from __future__ import annotations
@@ -29,19 +76,27 @@ from __future__ import annotations
 import json
 import logging
 import os
-import sys
+import socket
 import threading
 import time
 from pathlib import Path
-from typing import Dict
+from typing import List
 
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import uvicorn
 from confluent_kafka import KafkaException, Producer
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 
+from route_store import LocalRouteStore, RedisRouteStore
+from routing import RouteEngine, validate_route
+from sensor_codec import AvroTranscoder, SchemaRegistry, Unrepresentable
+from spill import Record, TopicBacklogs
+
 load_dotenv(override=True)
 
 # ── config ────────────────────────────────────────────────────────────────────
@@ -50,7 +105,23 @@ MQTT_HOST      = os.getenv("MQTT_HOST",      "mosquitto")
 MQTT_PORT      = int(os.getenv("MQTT_PORT",  "1883"))
 KAFKA_BROKERS  = os.getenv("KAFKA_BROKERS",  "kafka1:9092,kafka2:9093")
 BRIDGE_PORT    = int(os.getenv("BRIDGE_PORT", "8091"))
-ROUTES_FILE    = Path(os.getenv("ROUTES_FILE", "/tmp/routes.json"))
+ROUTES_DB      = Path(os.getenv("ROUTES_DB",   "/tmp/routes.db"))
+ROUTES_FILE    = Path(os.getenv("ROUTES_FILE", "/tmp/routes.json"))   # legacy, imported once
+PATTERN_ROUTES = json.loads(os.getenv("PATTERN_ROUTES", "{}") or "{}")
+# Sharding: workers in one MQTT v5 share group, routes shared through Redis
+SHARE_GROUP    = os.getenv("MQTT_SHARE_GROUP", "")
+REDIS_URL      = os.getenv("REDIS_URL",       "")
+SHARD_ID       = os.getenv("BRIDGE_SHARD_ID", "") or socket.gethostname()
+HEARTBEAT_SECS = float(os.getenv("BRIDGE_HEARTBEAT_SECONDS", "5"))
+PAYLOAD_FORMAT = os.getenv("PAYLOAD_FORMAT", "json").lower()   # json | avro
+# Backpressure: backlog queue with disk spill, publisher flow control
+SPILL_DIR        = os.getenv("SPILL_DIR", "/tmp/bridge-spill")
+QUEUE_MAX        = int(os.getenv("BRIDGE_QUEUE_MAX",          "10000"))
+SPILL_SEGMENT_MB = int(os.getenv("SPILL_SEGMENT_MB",          "64"))
+SPILL_MAX_MB     = int(os.getenv("SPILL_MAX_MB",              "1024"))
+FLOW_TOPIC       = os.getenv("FLOW_TOPIC", "verdantiq/_bridge/flow")
+FLOW_HIGH        = int(os.getenv("FLOW_HIGH_WATERMARK",       "5000"))
+FLOW_LOW         = int(os.getenv("FLOW_LOW_WATERMARK",        "500"))
 
 logging.basicConfig(
     level=logging.INFO,
@@ -61,122 +132,376 @@ log = logging.getLogger("bridge")
 
 # ── shared state ──────────────────────────────────────────────────────────────
 
-# mqtt_topic → kafka_topic
-_routes: Dict[str, str] = {}
-_routes_lock = threading.Lock()
+# mqtt topic filter → kafka topic (template); lock-free reads, see routing.py
+_routes = RouteEngine()
+
+_local = LocalRouteStore(ROUTES_DB)
+_store = RedisRouteStore(REDIS_URL) if REDIS_URL else None
+
+_transcoder = None
+if PAYLOAD_FORMAT == "avro":
+    _registry = SchemaRegistry.from_env()
+    if _registry is None:
+        raise RuntimeError("PAYLOAD_FORMAT=avro needs SCHEMA_REGISTRY_URL or SCHEMA_DIR")
+    _transcoder = AvroTranscoder(_registry)
+elif PAYLOAD_FORMAT != "json":
+    raise RuntimeError(f"Unknown PAYLOAD_FORMAT {PAYLOAD_FORMAT!r}")
+
+# Messages Kafka cannot take right now, per topic, replayed in order by _drain_loop
+_backlog = TopicBacklogs(SPILL_DIR, QUEUE_MAX, SPILL_SEGMENT_MB << 20, SPILL_MAX_MB << 20)
+# Held while producing, so a direct produce never overtakes a topic's backlog
+_forward_lock = threading.RLock()
+
+_started = time.time()
+_mqtt_connected = False
+_degraded: set = set()    # topics whose deliveries are failing; see _delivery_report
+_throttle = 1.0           # factor currently advertised on the flow topic
+# Updated from the paho and drain threads; read by /health and the heartbeat
+_stats = {
+    "received":          0,
+    "forwarded":         0,
+    "unrouted":          0,
+    "invalid_payloads":  0,
+    "passthrough":       0,   # forwarded as JSON because Avro could not express it
+    "bytes_in":          0,
+    "bytes_out":         0,
+    "produce_errors":    0,
+    "delivery_failures": 0,
+    "buffer_full":       0,   # produce() refused by a full librdkafka queue
+    "queued":            0,   # sent to the backlog instead of straight to Kafka
+    "requeued":          0,   # failed deliveries put back for another attempt
+    "replayed":          0,   # backlog records handed to Kafka
+    "dropped":           0,   # lost because the backlog was full
+}
 
 # ── Kafka producer (thread-safe) ─────────────────────────────────────────────
 
-_producer = Producer({
-    "bootstrap.servers":        KAFKA_BROKERS,
-    "enable.idempotence":       True,
-    "message.send.max.retries": 10,
-    "retry.backoff.ms":         500,
-    "linger.ms":                5,   # micro-batch for throughput
-    "batch.size":               16384,
-    "client.id":                "mqtt-kafka-bridge",
-    # Allow more time for broker recovery before giving up
-    "delivery.timeout.ms":      120000,
-    "request.timeout.ms":       30000,
-})
-
-# Track consecutive delivery failures — too many means the broker is down
-# and the producer is in a fatal state; exit so Docker restarts with a fresh one.
-_consecutive_failures = 0
-_MAX_CONSECUTIVE_FAILURES = 100
+def _new_producer() -> Producer:
+    return Producer({
+        "bootstrap.servers":        KAFKA_BROKERS,
+        "enable.idempotence":       True,
+        "message.send.max.retries": 10,
+        "retry.backoff.ms":         500,
+        "linger.ms":                5,   # micro-batch for throughput
+        "batch.size":               16384,
+        "client.id":                "mqtt-kafka-bridge",
+        # Allow more time for broker recovery before giving up
+        "delivery.timeout.ms":      120000,
+        "request.timeout.ms":       30000,
+    })
+
+
+_producer = _new_producer()
+# Set on a fatal (e.g. idempotence) error; the drain thread swaps in a new producer
+_producer_fatal = threading.Event()
+
+
+# A pattern route can name a topic nobody created (auto-create is off); that
+# is a routing miss for one message, not a sign the broker is down.
+_UNKNOWN_TOPIC_ERRORS = {"UNKNOWN_TOPIC_OR_PART", "_UNKNOWN_TOPIC"}
+# Retrying these cannot succeed, so the message is dropped instead of requeued
+_PERMANENT_ERRORS = _UNKNOWN_TOPIC_ERRORS | {
+    "MSG_SIZE_TOO_LARGE", "INVALID_MSG", "TOPIC_AUTHORIZATION_FAILED",
+}
+
+
+def _enqueue(record: Record) -> bool:
+    if not _backlog.put(record):
+        return False
+    _stats["queued"] += 1
+    return True
 
 
 def _delivery_report(err, msg):
-    global _consecutive_failures
-    if err:
-        _consecutive_failures += 1
-        log.error("Kafka delivery failed (%d/%d): %s",
-                  _consecutive_failures, _MAX_CONSECUTIVE_FAILURES, err)
-        if _consecutive_failures >= _MAX_CONSECUTIVE_FAILURES:
-            log.critical("Kafka delivery failed %d times in a row — "
-                         "broker likely down, exiting for container restart",
-                         _MAX_CONSECUTIVE_FAILURES)
-            sys.exit(1)
-    else:
-        _consecutive_failures = 0  # reset on successful delivery
+    topic = msg.topic()
+    if err is None:
+        if topic in _degraded:
+            _degraded.discard(topic)
+            log.info("Kafka deliveries to %s succeeding again — %d records to replay",
+                     topic, _backlog.pending(topic))
+        return
+    _stats["delivery_failures"] += 1
+    if err.name() in _UNKNOWN_TOPIC_ERRORS:
+        log.warning("Kafka topic %s does not exist — message dropped", msg.topic())
+        return
+    if err.name() in _PERMANENT_ERRORS:
+        log.error("Kafka rejected a message for %s: %s — dropped", msg.topic(), err)
+        return
+    if topic not in _degraded:
+        _degraded.add(topic)
+        log.error("Kafka delivery to %s failing (%s) — queueing its messages for replay", topic, err)
+    if err.fatal():
+        _producer_fatal.set()
+    # Back at the head: it goes out again before the readings that came after it
+    _backlog.requeue(Record(topic, msg.key() or b"", msg.value() or b""))
+    _stats["requeued"] += 1
+
+
+def _forward(record: Record) -> bool:
+    """Produce directly, or queue behind the topic's backlog; False if the backlog is full."""
+    with _forward_lock:
+        if not _backlog.pending(record.topic) and record.topic not in _degraded:
+            try:
+                _producer.produce(
+                    topic=record.topic,
+                    value=record.value,
+                    key=record.key,
+                    on_delivery=_delivery_report,
+                )
+                return True
+            except BufferError:
+                _stats["buffer_full"] += 1
+        return _enqueue(record)
+
+
+# Records handed to librdkafka per topic and lock hold, and the most it may
+# hold before failing topics get more (the rest of their backlog stays on disk)
+_DRAIN_BATCH = 500
+
+
+def _reset_producer() -> None:
+    """Replace a producer that hit a fatal error; its unsent messages are requeued."""
+    global _producer
+    with _forward_lock:
+        old, _producer = _producer, _new_producer()
+        _producer_fatal.clear()
+    old.purge()
+    old.poll(0)   # purged messages come back through _delivery_report
+    log.warning("Kafka producer hit a fatal error — replaced it")
+
+
+def _drain_loop(stop: threading.Event) -> None:
+    """Replay each topic's backlog in order whenever librdkafka has room for it."""
+    while not stop.is_set():
+        if _producer_fatal.is_set():
+            _reset_producer()
+        if not _backlog.wait(1.0):
+            _producer.poll(0)
+            continue
+        busy = len(_producer) >= _DRAIN_BATCH
+        blocked = replayed = False
+        for topic, queue in _backlog.active():
+            if topic in _degraded and busy:
+                continue
+            with _forward_lock:
+                for _ in range(_DRAIN_BATCH):
+                    record = queue.peek()
+                    if record is None:
+                        break
+                    try:
+                        _producer.produce(
+                            topic=record.topic,
+                            value=record.value,
+                            key=record.key,
+                            on_delivery=_delivery_report,
+                        )
+                        _stats["replayed"] += 1
+                        replayed = True
+                    except BufferError:
+                        blocked = True
+                        break
+                    except KafkaException as exc:
+                        _stats["produce_errors"] += 1
+                        log.error("Kafka produce error replaying to %s: %s — dropped", record.topic, exc)
+                    _backlog.pop(topic)
+            if blocked:
+                break
+        # waiting on delivery events is the backoff while Kafka is not keeping up
+        _producer.poll(0.2 if blocked or not replayed else 0)
 
 
 # ── MQTT client ───────────────────────────────────────────────────────────────
 
-def _on_connect(client, userdata, flags, rc):
+# MQTT v5 (sharded mode) passes an extra properties argument to both callbacks
+def _on_connect(client, userdata, flags, rc, properties=None):
+    global _mqtt_connected
     if rc == 0:
+        _mqtt_connected = True
         log.info("Connected to Mosquitto @ %s:%s", MQTT_HOST, MQTT_PORT)
         # Re-subscribe to all persisted routes on reconnect
-        with _routes_lock:
-            for topic in _routes:
-                client.subscribe(topic, qos=1)
-                log.info("Re-subscribed: %s", topic)
+        _subscribe(_routes.subscriptions())
     else:
         log.error("MQTT connect failed rc=%s", rc)
 
 
-def _on_disconnect(client, userdata, rc):
+def _on_disconnect(client, userdata, rc, properties=None):
+    global _mqtt_connected
+    _mqtt_connected = False
     if rc != 0:
         log.warning("MQTT disconnected unexpectedly (rc=%s) — paho will retry", rc)
 
 
+def _message_key(mqtt_topic: str) -> bytes:
+    """Sensor id for verdantiq/{tenant}/{sensor}/data, else the MQTT topic.
+
+    Keying by sensor keeps each sensor on one partition of a shared topic,
+    which is what lets consumers of per-tenant/per-type topics filter by key.
+    """
+    levels = mqtt_topic.split("/")
+    if len(levels) == 4 and levels[0] == "verdantiq" and levels[3] == "data":
+        return levels[2].encode()
+    return mqtt_topic.encode()
+
+
 def _on_message(client, userdata, msg: mqtt.MQTTMessage):
+    _stats["received"] += 1
     mqtt_topic = msg.topic
-    with _routes_lock:
-        kafka_topic = _routes.get(mqtt_topic)
+    kafka_topic = _routes.resolve(mqtt_topic)
 
     if not kafka_topic:
+        _stats["unrouted"] += 1
         return  # no route registered for this topic
 
+    value = msg.payload
+    if _transcoder is not None:
+        try:
+            value = _transcoder.encode(value)
+        except Unrepresentable:
+            _stats["passthrough"] += 1
+        except ValueError:
+            _stats["invalid_payloads"] += 1
+            return
+        except Exception as exc:   # registry unreachable — keep the data flowing as JSON
+            _stats["passthrough"] += 1
+            log.warning("Avro transcoding failed, forwarding JSON: %s", exc)
+    _stats["bytes_in"] += len(msg.payload)
+    _stats["bytes_out"] += len(value)
+
+    record = Record(kafka_topic, _message_key(mqtt_topic), value)
     try:
-        _producer.produce(
-            topic=kafka_topic,
-            value=msg.payload,
-            key=mqtt_topic.encode(),
-            on_delivery=_delivery_report,
-        )
+        if not _forward(record):
+            # Backlog and spill budget both full; waiting here would block the
+            # paho network thread and its keepalives
+            _stats["dropped"] += 1
+            if _stats["dropped"] % 1000 == 1:
+                log.error("Backlog full — dropping messages (%d so far)", _stats["dropped"])
+            return
         _producer.poll(0)   # non-blocking flush of delivery events
+        _stats["forwarded"] += 1
     except KafkaException as exc:
+        _stats["produce_errors"] += 1
         log.error("Kafka produce error [%s]: %s", kafka_topic, exc)
 
 
+# Shared subscriptions need MQTT v5, where the persistent session is
+# requested at connect time (clean_start) instead of in the constructor.
+if SHARE_GROUP:
+    _client_kwargs = {"client_id": f"verdantiq-bridge-{SHARD_ID}", "protocol": mqtt.MQTTv5}
+else:
+    _client_kwargs = {"client_id": "verdantiq-bridge", "clean_session": False}
+
 # paho 2.x requires CallbackAPIVersion as the first arg; fall back to 1.x API
 try:
-    _mqtt_client = mqtt.Client(
-        mqtt.CallbackAPIVersion.VERSION1,
-        client_id="verdantiq-bridge",
-        clean_session=False,
-    )
+    _mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, **_client_kwargs)
 except AttributeError:
-    _mqtt_client = mqtt.Client(  # type: ignore[call-overload]
-        client_id="verdantiq-bridge",
-        clean_session=False,
-    )
+    _mqtt_client = mqtt.Client(**_client_kwargs)  # type: ignore[call-overload]
 _mqtt_client.on_connect    = _on_connect
 _mqtt_client.on_disconnect = _on_disconnect
 _mqtt_client.on_message    = _on_message
 
 
+def _share(topic: str) -> str:
+    return f"$share/{SHARE_GROUP}/{topic}" if SHARE_GROUP else topic
+
+
+# Filters per SUBSCRIBE/UNSUBSCRIBE packet, so a bulk registration or a
+# resync of thousands of routes does not become one huge packet
+_SUBSCRIBE_CHUNK = 500
+
+
+def _subscribe(topics) -> None:
+    topics = sorted(topics)
+    for i in range(0, len(topics), _SUBSCRIBE_CHUNK):
+        _mqtt_client.subscribe([(_share(t), 1) for t in topics[i:i + _SUBSCRIBE_CHUNK]])
+    if topics:
+        log.info("Subscribed to %d topic filter(s)", len(topics))
+
+
+def _apply_subscriptions(diff) -> None:
+    subscribe, unsubscribe = diff
+    _subscribe(subscribe)
+    for i in range(0, len(unsubscribe), _SUBSCRIBE_CHUNK):
+        _mqtt_client.unsubscribe([_share(t) for t in unsubscribe[i:i + _SUBSCRIBE_CHUNK]])
+
+
 # ── route persistence ─────────────────────────────────────────────────────────
 
 def _load_routes() -> None:
     if ROUTES_FILE.exists():
         try:
-            data = json.loads(ROUTES_FILE.read_text())
-            with _routes_lock:
-                _routes.update(data)
-            log.info("Loaded %d persisted routes", len(data))
+            log.info("Imported %d routes from %s", _local.import_json(ROUTES_FILE), ROUTES_FILE)
         except Exception as exc:
-            log.warning("Could not load routes file: %s", exc)
+            log.warning("Could not import routes file: %s", exc)
+    try:
+        data = _local.load()
+        _routes.replace(data)
+        log.info("Loaded %d persisted routes", len(data))
+    except Exception as exc:
+        log.warning("Could not load persisted routes: %s", exc)
+
+
+def _persist(write) -> None:
+    """Apply one incremental change to the local route database."""
+    try:
+        write()
+    except Exception as exc:
+        log.warning("Could not persist routes: %s", exc)
+
 
+# ── shared route store (sharded mode) ────────────────────────────────────────
 
-def _save_routes() -> None:
+def _publish_change(write) -> None:
+    """Write a route change to the shared store before applying it locally,
+    so a change that cannot reach the other workers is refused outright."""
+    if _store is None:
+        return
     try:
-        with _routes_lock:
-            snapshot = dict(_routes)
-        ROUTES_FILE.write_text(json.dumps(snapshot, indent=2))
+        write()
     except Exception as exc:
-        log.warning("Could not save routes: %s", exc)
+        log.error("Route store write failed: %s", exc)
+        raise HTTPException(status_code=503, detail="Route store unavailable")
+
+
+def _on_store_change(added: dict, removed: list) -> None:
+    if added:
+        _apply_subscriptions(_routes.update(added))
+        _persist(lambda: _local.put(added))
+    if removed:
+        _apply_subscriptions(_routes.remove(removed))
+        _persist(lambda: _local.delete(removed))
+
+
+def _on_store_resync(routes: dict) -> None:
+    _apply_subscriptions(_routes.replace(routes))
+    _persist(lambda: _local.replace(routes))
+    log.info("Synchronised %d routes from the shared store", len(routes))
+
+
+def _flow_loop(stop: threading.Event, interval: float = 2.0, max_throttle: float = 10.0) -> None:
+    """Advertise a retained throttle factor while the backlog is too deep."""
+    global _throttle
+    topic = f"{FLOW_TOPIC}/{SHARD_ID}"
+    while not stop.wait(interval):
+        depth = len(_backlog)
+        if depth >= FLOW_HIGH or (_throttle > 1 and depth > FLOW_LOW):
+            if _throttle == 1:
+                log.warning("Backlog at %d records — asking publishers to slow down", depth)
+            _throttle = min(max_throttle, round(1 + depth / FLOW_HIGH, 1))
+            signal = {"shard": SHARD_ID, "throttle": _throttle, "queue_depth": depth,
+                      "expires": time.time() + interval * 3}
+            _mqtt_client.publish(topic, json.dumps(signal), qos=1, retain=True)
+        elif _throttle > 1:
+            _throttle = 1.0
+            _mqtt_client.publish(topic, b"", qos=1, retain=True)   # clears the retained signal
+            log.info("Backlog down to %d records — publishers back to normal rate", depth)
+
+
+def _heartbeat_loop(stop: threading.Event) -> None:
+    while not stop.wait(HEARTBEAT_SECS):
+        try:
+            _store.heartbeat(SHARD_ID, _shard_status(), ttl=int(HEARTBEAT_SECS * 3))
+        except Exception as exc:
+            log.warning("Shard heartbeat failed: %s", exc)
 
 
 # ── FastAPI ───────────────────────────────────────────────────────────────────
@@ -185,8 +510,8 @@ app = FastAPI(title="VerdantIQ MQTT-Kafka Bridge", version="1.0.0")
 
 
 class RouteRequest(BaseModel):
-    mqtt_topic:  str   # e.g. "verdantiq/tenant_abc/soil_001/data"
-    kafka_topic: str   # e.g. "verdantiq.tenant_abc.soil_001"
+    mqtt_topic:  str   # e.g. "verdantiq/tenant_abc/soil_001/data" or "verdantiq/+/+/data"
+    kafka_topic: str   # e.g. "verdantiq.tenant_abc.soil_001" or "verdantiq.{1}.{2}"
 
 
 class RouteResponse(BaseModel):
@@ -195,12 +520,24 @@ class RouteResponse(BaseModel):
     status:      str
 
 
+class BulkRouteRequest(BaseModel):
+    routes: List[RouteRequest]
+
+
+class BulkRouteResponse(BaseModel):
+    count:  int
+    status: str
+
+
 @app.post("/routes", response_model=RouteResponse, status_code=201)
 def register_route(body: RouteRequest) -> RouteResponse:
-    with _routes_lock:
-        _routes[body.mqtt_topic] = body.kafka_topic
-    _mqtt_client.subscribe(body.mqtt_topic, qos=1)
-    _save_routes()
+    try:
+        validate_route(body.mqtt_topic, body.kafka_topic)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    _publish_change(lambda: _store.put({body.mqtt_topic: body.kafka_topic}))
+    _apply_subscriptions(_routes.update({body.mqtt_topic: body.kafka_topic}))
+    _persist(lambda: _local.put({body.mqtt_topic: body.kafka_topic}))
     log.info("Route added: %s → %s", body.mqtt_topic, body.kafka_topic)
     return RouteResponse(
         mqtt_topic=body.mqtt_topic,
@@ -209,44 +546,113 @@ def register_route(body: RouteRequest) -> RouteResponse:
     )
 
 
+@app.post("/routes/bulk", response_model=BulkRouteResponse, status_code=201)
+def register_routes(body: BulkRouteRequest) -> BulkRouteResponse:
+    """Register many routes at once: one validation pass, one table swap, one
+    store write and chunked subscriptions. Nothing is applied if any is invalid."""
+    routes = {r.mqtt_topic: r.kafka_topic for r in body.routes}
+    for mqtt_topic, kafka_topic in routes.items():
+        try:
+            validate_route(mqtt_topic, kafka_topic)
+        except ValueError as exc:
+            raise HTTPException(status_code=422, detail=f"{mqtt_topic}: {exc}")
+    _publish_change(lambda: _store.put(routes))
+    _apply_subscriptions(_routes.update(routes))
+    _persist(lambda: _local.put(routes))
+    log.info("Routes added in bulk: %d", len(routes))
+    return BulkRouteResponse(count=len(routes), status="active")
+
+
 @app.delete("/routes/{encoded_topic}")
 def remove_route(encoded_topic: str):
     mqtt_topic = encoded_topic.replace("__", "/")
-    with _routes_lock:
-        if mqtt_topic not in _routes:
-            raise HTTPException(status_code=404, detail="Route not found")
-        del _routes[mqtt_topic]
-    _mqtt_client.unsubscribe(mqtt_topic)
-    _save_routes()
+    if mqtt_topic not in _routes:
+        raise HTTPException(status_code=404, detail="Route not found")
+    _publish_change(lambda: _store.delete([mqtt_topic]))
+    _apply_subscriptions(_routes.remove([mqtt_topic]))
+    _persist(lambda: _local.delete([mqtt_topic]))
     log.info("Route removed: %s", mqtt_topic)
     return {"status": "removed", "mqtt_topic": mqtt_topic}
 
 
 @app.get("/routes")
 def list_routes() -> dict:
-    with _routes_lock:
-        snapshot = dict(_routes)
+    snapshot = _routes.snapshot()
     return {"count": len(snapshot), "routes": snapshot}
 
 
+def _shard_status() -> dict:
+    table = _routes.table
+    return {
+        "shard_id":       SHARD_ID,
+        "share_group":    SHARE_GROUP or None,
+        "payload_format": PAYLOAD_FORMAT,
+        "mqtt_connected": _mqtt_connected,
+        "route_count":    len(table),
+        "pattern_count":  len(table.patterns),
+        "uptime_s":       round(time.time() - _started),
+        "kafka_queue":    len(_producer),
+        "kafka_degraded": bool(_degraded),
+        "failing_topics": len(_degraded),
+        "throttle":       _throttle,
+        **_backlog.stats(),
+        **_stats,
+    }
+
+
 @app.get("/health")
 def health() -> dict:
-    with _routes_lock:
-        route_count = len(_routes)
     return {
-        "status":      "healthy",
-        "route_count": route_count,
-        "mqtt_host":   MQTT_HOST,
-        "kafka":       KAFKA_BROKERS,
+        "status":    "healthy",
+        "mqtt_host": MQTT_HOST,
+        "kafka":     KAFKA_BROKERS,
+        **_shard_status(),
     }
 
 
+_TOTALS = (*_stats, "queue_depth", "queue_spilled", "spill_bytes")
+
+
+@app.get("/health/shards")
+def health_shards() -> dict:
+    """Aggregate view over every worker's heartbeat (just this one when unsharded)."""
+    if _store is None:
+        shards = {SHARD_ID: _shard_status()}
+    else:
+        try:
+            shards = _store.shards()
+        except Exception as exc:
+            raise HTTPException(status_code=503, detail=f"Route store unavailable: {exc}")
+    live = [s for s in shards.values() if s]
+    return {
+        "shards":  shards,
+        "live":    len(live),
+        "total":   len(shards),
+        "totals":  {k: sum(s.get(k, 0) for s in live) for k in _TOTALS},
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> str:
+    lines = []
+    for name, value in _shard_status().items():
+        if isinstance(value, (bool, int, float)):
+            lines.append(f'verdantiq_bridge_{name}{{shard="{SHARD_ID}"}} {float(value)}')
+    return "\n".join(lines) + "\n"
+
+
 # ── startup ───────────────────────────────────────────────────────────────────
 
 def _connect_mqtt_with_retry(max_attempts: int = 20, delay: float = 3.0) -> None:
     for attempt in range(1, max_attempts + 1):
         try:
-            _mqtt_client.connect(MQTT_HOST, MQTT_PORT, keepalive=60)
+            if SHARE_GROUP:
+                props = Properties(PacketTypes.CONNECT)
+                props.SessionExpiryInterval = 3600   # keep the shared session across restarts
+                _mqtt_client.connect(MQTT_HOST, MQTT_PORT, keepalive=60,
+                                     clean_start=False, properties=props)
+            else:
+                _mqtt_client.connect(MQTT_HOST, MQTT_PORT, keepalive=60)
             _mqtt_client.loop_start()
             log.info("MQTT connection attempt %d succeeded", attempt)
             return
@@ -257,21 +663,43 @@ def _connect_mqtt_with_retry(max_attempts: int = 20, delay: float = 3.0) -> None
 
 
 def main() -> None:
+    stop = threading.Event()
     _load_routes()
+    if PATTERN_ROUTES:
+        _routes.update(PATTERN_ROUTES)
+        log.info("Installed %d pattern route(s) from PATTERN_ROUTES", len(PATTERN_ROUTES))
+
+    if _store is not None:
+        try:
+            _store.seed(_routes.snapshot())
+            _store.put(PATTERN_ROUTES)
+        except Exception as exc:
+            log.warning("Could not seed shared route store: %s", exc)
+        threading.Thread(target=_store.watch, args=(_on_store_change, _on_store_resync, stop),
+                         daemon=True, name="route-store").start()
+        threading.Thread(target=_heartbeat_loop, args=(stop,),
+                         daemon=True, name="heartbeat").start()
+
+    if len(_backlog):
+        log.info("Replaying %d records left in the backlog", len(_backlog))
+    threading.Thread(target=_drain_loop, args=(stop,), daemon=True, name="drain").start()
+    threading.Thread(target=_flow_loop, args=(stop,), daemon=True, name="flow").start()
 
     # Connect to MQTT in a background thread so uvicorn (and the health
     # endpoint) starts immediately — the health check passes as soon as
     # the HTTP server is up, regardless of MQTT status.
     def _mqtt_init():
         _connect_mqtt_with_retry()
-        with _routes_lock:
-            for topic in _routes:
-                _mqtt_client.subscribe(topic, qos=1)
+        _subscribe(_routes.subscriptions())
 
     threading.Thread(target=_mqtt_init, daemon=True, name="mqtt-init").start()
 
     uvicorn.run(app, host="0.0.0.0", port=BRIDGE_PORT, log_level="info")
 
+    stop.set()
+    _producer.flush(10)
+    _backlog.close()
+
 
 if __name__ == "__main__":
     main()
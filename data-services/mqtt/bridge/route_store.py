@@ -0,0 +1,166 @@
+"""
+Route stores for the bridge
+===========================
+LocalRouteStore keeps one worker's routes on local disk so they survive a
+restart. It is a SQLite database in WAL mode, so each change is an atomic
+upsert or delete of just the rows involved, and a cold start is a single
+SELECT.
+
+RedisRouteStore is the shared store for sharded bridges.
+With MQTT shared subscriptions any worker may receive any message, so every
+worker must hold the same routes. The store keeps them in one Redis hash and
+announces each change on a pub/sub channel; workers apply the delta to their
+own RouteEngine and reload the full hash whenever they (re)subscribe, so a
+missed announcement is repaired on reconnect.
+
+Workers also publish a heartbeat with their metrics, which is what the
+aggregate /health/shards view reads.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+import redis
+
+log = logging.getLogger("bridge")
+
+ROUTES_KEY       = "viq:bridge:routes"
+ROUTES_CHAN      = "viq:bridge:routes:changed"
+SHARDS_KEY       = "viq:bridge:shards"
+SHARD_KEY_PREFIX = "viq:bridge:shard:"
+
+
+class LocalRouteStore:
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # NORMAL in WAL mode: a process crash loses nothing, power loss at
+        # most the last commits, and the file is never left corrupt
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS routes ("
+            " mqtt_topic TEXT PRIMARY KEY, kafka_topic TEXT NOT NULL) WITHOUT ROWID"
+        )
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._db.execute("SELECT mqtt_topic, kafka_topic FROM routes"))
+
+    def put(self, routes: Dict[str, str]) -> None:
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO routes VALUES (?, ?)"
+                " ON CONFLICT(mqtt_topic) DO UPDATE SET kafka_topic = excluded.kafka_topic",
+                routes.items(),
+            )
+
+    def delete(self, mqtt_topics: Iterable[str]) -> None:
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM routes WHERE mqtt_topic = ?",
+                                 [(t,) for t in mqtt_topics])
+
+    def replace(self, routes: Dict[str, str]) -> None:
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM routes")
+            self._db.executemany("INSERT INTO routes VALUES (?, ?)", routes.items())
+
+    def import_json(self, path: Path) -> int:
+        """One-off migration from the old routes.json; the file is renamed after."""
+        routes = json.loads(path.read_text())
+        self.put(routes)
+        path.rename(path.with_name(path.name + ".migrated"))
+        return len(routes)
+
+
+class RedisRouteStore:
+    def __init__(self, url: str):
+        self._redis = redis.Redis.from_url(url, decode_responses=True,
+                                           socket_timeout=5, socket_connect_timeout=5)
+
+    # ── routes ────────────────────────────────────────────────────────────────
+
+    def load(self) -> Dict[str, str]:
+        return self._redis.hgetall(ROUTES_KEY)
+
+    def put(self, routes: Dict[str, str]) -> None:
+        if not routes:
+            return
+        pipe = self._redis.pipeline()
+        pipe.hset(ROUTES_KEY, mapping=routes)
+        pipe.publish(ROUTES_CHAN, json.dumps({"set": routes}))
+        pipe.execute()
+
+    def delete(self, mqtt_topics: Iterable[str]) -> None:
+        mqtt_topics = list(mqtt_topics)
+        if not mqtt_topics:
+            return
+        pipe = self._redis.pipeline()
+        pipe.hdel(ROUTES_KEY, *mqtt_topics)
+        pipe.publish(ROUTES_CHAN, json.dumps({"del": mqtt_topics}))
+        pipe.execute()
+
+    def seed(self, routes: Dict[str, str]) -> None:
+        """Repopulate an empty store (e.g. after a Redis restart) from local routes."""
+        if routes and not self._redis.exists(ROUTES_KEY):
+            self.put(routes)
+            log.info("Seeded shared route store with %d local routes", len(routes))
+
+    def watch(
+        self,
+        on_change: Callable[[Dict[str, str], list], None],
+        on_resync: Callable[[Dict[str, str]], None],
+        stop: threading.Event,
+        retry_delay: float = 3.0,
+    ) -> None:
+        """Blocking loop: on_resync(all routes) after each (re)subscribe, then
+        on_change(added, removed) for every announced change, until stop is set."""
+        while not stop.is_set():
+            pubsub = None
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(ROUTES_CHAN)
+                on_resync(self.load())
+                while not stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get("type") == "message":
+                        delta = json.loads(message["data"])
+                        on_change(delta.get("set", {}), delta.get("del", []))
+            except Exception as exc:
+                log.warning("Route store watch dropped: %s", exc)
+                stop.wait(retry_delay)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    # ── shard heartbeats ─────────────────────────────────────────────────────
+
+    def heartbeat(self, shard_id: str, status: dict, ttl: int) -> None:
+        pipe = self._redis.pipeline()
+        pipe.sadd(SHARDS_KEY, shard_id)
+        pipe.set(f"{SHARD_KEY_PREFIX}{shard_id}", json.dumps(status), ex=ttl)
+        pipe.execute()
+
+    def shards(self) -> Dict[str, Optional[dict]]:
+        """Last heartbeat of every known shard; None once a shard's has expired."""
+        shard_ids = sorted(self._redis.smembers(SHARDS_KEY))
+        if not shard_ids:
+            return {}
+        raw = self._redis.mget([f"{SHARD_KEY_PREFIX}{s}" for s in shard_ids])
+        return {s: json.loads(r) if r else None for s, r in zip(shard_ids, raw)}
+
+    def forget(self, shard_id: str) -> None:
+        pipe = self._redis.pipeline()
+        pipe.srem(SHARDS_KEY, shard_id)
+        pipe.delete(f"{SHARD_KEY_PREFIX}{shard_id}")
+        pipe.execute()
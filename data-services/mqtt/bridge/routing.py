@@ -0,0 +1,263 @@
+"""
+Routing engine for the MQTT-Kafka bridge
+========================================
+Routes map an MQTT topic filter to a Kafka topic template:
+
+  verdantiq/t1/soil_001/data  →  verdantiq.t1.soil_001     (exact)
+  verdantiq/+/+/data          →  verdantiq.{1}.{2}         (pattern)
+
+In a pattern, ``+`` matches one topic level and a trailing ``#`` matches the
+rest, including no levels at all (``a/#`` matches ``a``, MQTT 3.1.1
+§4.7.1.2). ``{n}`` in the template is the n-th wildcard capture; a ``#``
+capture is its levels joined with ``.``, and an empty capture drops the
+``.`` before it (``a/#`` → ``k.{1}`` routes ``a`` to ``k``). An exact route
+wins over any pattern; among patterns a literal level beats ``+``, which
+beats ``#``.
+
+Writers change the current RouteTable in place under a lock, one dict or
+attribute store per step (atomic under the GIL), so the paho callback
+resolves topics without locking. Adding or removing a route costs O(1) plus
+its topic levels, and the engine keeps the subscription set up to date from
+the routes that changed; only a pattern add or remove scans the exact
+routes, for the topics that one pattern covers. A full replace() builds a
+new table and swaps the reference.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+_PLACEHOLDER = re.compile(r"\{(\d+)\}")
+_RENDER      = re.compile(r"(\.?)\{(\d+)\}")
+
+
+def is_pattern(mqtt_topic: str) -> bool:
+    return "+" in mqtt_topic or "#" in mqtt_topic
+
+
+def validate_route(mqtt_topic: str, kafka_topic: str) -> None:
+    """Raise ValueError for a malformed filter or template."""
+    levels = mqtt_topic.split("/")
+    if not mqtt_topic or mqtt_topic.startswith("$"):
+        raise ValueError(f"Invalid MQTT topic: {mqtt_topic!r}")
+    wildcards = 0
+    for i, level in enumerate(levels):
+        if level in ("+", "#"):
+            if level == "#" and i != len(levels) - 1:
+                raise ValueError("'#' must be the last topic level")
+            wildcards += 1
+        elif "+" in level or "#" in level:
+            raise ValueError("Wildcards must occupy a whole topic level")
+    refs = [int(n) for n in _PLACEHOLDER.findall(kafka_topic)]
+    if any(n < 1 or n > wildcards for n in refs):
+        raise ValueError(f"Template {kafka_topic!r} refers to a missing wildcard capture")
+    if not re.fullmatch(r"[A-Za-z0-9._\-]+", _PLACEHOLDER.sub("x", kafka_topic)):
+        raise ValueError(f"Invalid Kafka topic: {kafka_topic!r}")
+
+
+class _Node:
+    __slots__ = ("children", "plus", "hash", "template")
+
+    def __init__(self):
+        self.children: Dict[str, _Node] = {}
+        self.plus:     Optional[_Node] = None
+        self.hash:     Optional[str] = None    # template of a trailing '#'
+        self.template: Optional[str] = None    # template of a filter ending here
+
+
+def _filter_matches(mqtt_filter: str, mqtt_topic: str) -> bool:
+    """True when one topic filter matches a (wildcard-free) topic."""
+    levels = mqtt_topic.split("/")
+    for i, level in enumerate(mqtt_filter.split("/")):
+        if level == "#":
+            return True
+        if i == len(levels) or level not in ("+", levels[i]):
+            return False
+    return len(levels) == len(mqtt_filter.split("/"))
+
+
+def _render(template: str, captures: List[str]) -> str:
+    def capture(m: re.Match) -> str:
+        value = captures[int(m.group(2)) - 1]
+        return m.group(1) + value if value else ""
+    return _RENDER.sub(capture, template)
+
+
+class RouteTable:
+    """Exact topics in a dict, patterns in a level trie. Changed only by
+    RouteEngine, under its lock."""
+
+    def __init__(self, exact: Dict[str, str], patterns: Dict[str, str]):
+        self.exact    = exact
+        self.patterns = patterns
+        self._root    = _Node()
+        for mqtt_topic, template in patterns.items():
+            self._set_pattern(mqtt_topic, template)
+
+    def _set_pattern(self, mqtt_topic: str, template: Optional[str]) -> None:
+        """Point a pattern's trie slot at template (None clears it)."""
+        node = self._root
+        for level in mqtt_topic.split("/"):
+            if level == "#":
+                node.hash = template
+                return
+            if level == "+":
+                node.plus = node.plus or _Node()
+                node = node.plus
+            else:
+                node = node.children.setdefault(level, _Node())
+        node.template = template
+
+    def add(self, mqtt_topic: str, template: str) -> None:
+        if is_pattern(mqtt_topic):
+            self._set_pattern(mqtt_topic, template)
+            self.patterns[mqtt_topic] = template
+        else:
+            self.exact[mqtt_topic] = template
+
+    def discard(self, mqtt_topic: str) -> None:
+        if self.exact.pop(mqtt_topic, None) is None and self.patterns.pop(mqtt_topic, None) is not None:
+            self._set_pattern(mqtt_topic, None)
+
+    def __len__(self) -> int:
+        return len(self.exact) + len(self.patterns)
+
+    def _match(self, node: _Node, levels: List[str], i: int, captures: List[str]) -> Optional[str]:
+        if i == len(levels):
+            if node.template is not None:
+                return _render(node.template, captures)
+        else:
+            child = node.children.get(levels[i])
+            if child is not None:
+                found = self._match(child, levels, i + 1, captures)
+                if found:
+                    return found
+            if node.plus is not None:
+                found = self._match(node.plus, levels, i + 1, captures + [levels[i]])
+                if found:
+                    return found
+        if node.hash is not None:
+            # At i == len(levels) the '#' matches the parent level itself
+            return _render(node.hash, captures + [".".join(levels[i:])])
+        return None
+
+    def resolve(self, mqtt_topic: str) -> Optional[str]:
+        """Kafka topic for an inbound MQTT topic, or None if nothing routes it."""
+        kafka_topic = self.exact.get(mqtt_topic)
+        if kafka_topic is not None or not self.patterns:
+            return kafka_topic
+        return self._match(self._root, mqtt_topic.split("/"), 0, [])
+
+    def covered(self, mqtt_topic: str) -> bool:
+        """True when a pattern subscription already delivers this topic."""
+        return bool(self.patterns) and self._match(self._root, mqtt_topic.split("/"), 0, []) is not None
+
+    def subscriptions(self) -> Set[str]:
+        """Minimal filter set: every pattern, plus exact topics no pattern covers."""
+        return set(self.patterns) | {t for t in self.exact if not self.covered(t)}
+
+
+class RouteEngine:
+    """Holder of the current RouteTable and its subscription set.
+
+    resolve() never blocks. Mutations are serialised and return the
+    (subscribe, unsubscribe) filter diff for the MQTT client.
+    """
+
+    def __init__(self, routes: Optional[Dict[str, str]] = None):
+        self._table = RouteTable({}, {})
+        self._subs: Set[str] = set()
+        self._write_lock = threading.Lock()
+        if routes:
+            self.update(routes)
+
+    @property
+    def table(self) -> RouteTable:
+        return self._table
+
+    def resolve(self, mqtt_topic: str) -> Optional[str]:
+        return self._table.resolve(mqtt_topic)
+
+    def snapshot(self) -> Dict[str, str]:
+        with self._write_lock:
+            table = self._table
+            return {**table.exact, **table.patterns}
+
+    def subscriptions(self) -> List[str]:
+        """Current minimal filter set (see RouteTable.subscriptions)."""
+        with self._write_lock:
+            return sorted(self._subs)
+
+    def __contains__(self, mqtt_topic: str) -> bool:
+        table = self._table
+        return mqtt_topic in table.exact or mqtt_topic in table.patterns
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def _swap(self, exact: Dict[str, str], patterns: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        old_subs = self._subs
+        self._table = RouteTable(exact, patterns)
+        self._subs = self._table.subscriptions()
+        return sorted(self._subs - old_subs), sorted(old_subs - self._subs)
+
+    def _apply(self, added: Dict[str, str], removed: Iterable[str]) -> Tuple[List[str], List[str]]:
+        """Change the table in place and the subscription set with it (lock held)."""
+        table, subs = self._table, self._subs
+        before: Dict[str, bool] = {}   # filter → subscribed before this change
+
+        def toggle(mqtt_filter: str, on: bool) -> None:
+            before.setdefault(mqtt_filter, mqtt_filter in subs)
+            (subs.add if on else subs.discard)(mqtt_filter)
+
+        for mqtt_topic in removed:
+            if mqtt_topic in table.exact:
+                table.discard(mqtt_topic)
+                toggle(mqtt_topic, False)
+            elif mqtt_topic in table.patterns:
+                table.discard(mqtt_topic)
+                toggle(mqtt_topic, False)
+                # exact topics this pattern was delivering need their own filter again
+                for topic in table.exact:
+                    if topic not in subs and _filter_matches(mqtt_topic, topic) and not table.covered(topic):
+                        toggle(topic, True)
+        for mqtt_topic, kafka_topic in added.items():
+            new = mqtt_topic not in table.exact and mqtt_topic not in table.patterns
+            table.add(mqtt_topic, kafka_topic)
+            if not new:
+                continue
+            if not is_pattern(mqtt_topic):
+                if not table.covered(mqtt_topic):
+                    toggle(mqtt_topic, True)
+                continue
+            toggle(mqtt_topic, True)
+            for topic in table.exact:
+                if topic in subs and _filter_matches(mqtt_topic, topic):
+                    toggle(topic, False)
+        changed = [f for f, was in before.items() if was != (f in subs)]
+        return sorted(f for f in changed if f in subs), sorted(f for f in changed if f not in subs)
+
+    def update(self, routes: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """Add or replace routes; ValueError (nothing applied) if any is invalid."""
+        for mqtt_topic, kafka_topic in routes.items():
+            validate_route(mqtt_topic, kafka_topic)
+        with self._write_lock:
+            return self._apply(routes, ())
+
+    def replace(self, routes: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """Make routes the complete table (invalid entries are skipped)."""
+        exact, patterns = {}, {}
+        for mqtt_topic, kafka_topic in routes.items():
+            try:
+                validate_route(mqtt_topic, kafka_topic)
+            except ValueError:
+                continue
+            (patterns if is_pattern(mqtt_topic) else exact)[mqtt_topic] = kafka_topic
+        with self._write_lock:
+            return self._swap(exact, patterns)
+
+    def remove(self, mqtt_topics: Iterable[str]) -> Tuple[List[str], List[str]]:
+        with self._write_lock:
+            return self._apply({}, mqtt_topics)
@@ -0,0 +1,433 @@
+"""
+Backlog queue for the MQTT-Kafka bridge
+=======================================
+Holds messages the Kafka producer cannot take right now and hands them back
+in arrival order. The first BRIDGE_QUEUE_MAX records are kept in memory;
+beyond that, records are appended to a spill log on disk made of numbered
+segment files:
+
+  {spill_dir}/000000000001.seg   sealed, fsynced when rolled
+  {spill_dir}/000000000002.seg   active, appended to
+  {spill_dir}/cursor             "segment offset" of the next unread record
+
+Each record is  crc32 | topic len | key len | value len | topic | key | value
+(big-endian header, 12 bytes). Memory always holds the oldest records: once
+anything is on disk, new records go to disk too until it has drained, so the
+order survives the hand-off between the two.
+
+requeue() puts a record back at the head instead, behind any records
+requeued before it: a send that failed goes out again before the ones that
+arrived after it.
+
+Fully read segments are deleted. On startup, segments still on disk are
+replayed from the checkpointed cursor, and a record torn by a crash at the
+tail of the last segment is truncated away. The cursor is checkpointed every
+CURSOR_EVERY records, so a crash can re-deliver up to that many records.
+Delivery is at-least-once, the same guarantee MQTT QoS 1 gives the bridge.
+Records still in memory, requeued ones included, are lost if the process
+dies; BRIDGE_QUEUE_MAX=0 sends the rest of the backlog through the log.
+
+The bridge keeps one queue per Kafka topic (TopicBacklogs), each in
+{spill_dir}/{topic}/, so a topic Kafka keeps refusing backs up on its own
+while the others keep flowing. Order is kept per topic, which is all Kafka
+keeps anyway. The queues share one memory and disk budget (Budget), so the
+limits hold for the bridge as a whole however many topics are backed up.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import struct
+import threading
+import zlib
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote, unquote
+
+log = logging.getLogger("bridge")
+
+_HEADER       = struct.Struct(">IHHI")   # crc32, topic len, key len, value len
+CURSOR_EVERY  = 256
+
+
+class Record(NamedTuple):
+    topic: str
+    key:   bytes
+    value: bytes
+
+
+def _encode(record: Record) -> bytes:
+    topic = record.topic.encode()
+    body = topic + record.key + record.value
+    return _HEADER.pack(zlib.crc32(body), len(topic), len(record.key), len(record.value)) + body
+
+
+def _read_record(f) -> Optional[Record]:
+    """Next record from f, or None at the end or at a torn/corrupt record."""
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    crc, tlen, klen, vlen = _HEADER.unpack(header)
+    body = f.read(tlen + klen + vlen)
+    if len(body) < tlen + klen + vlen or zlib.crc32(body) != crc:
+        return None
+    return Record(body[:tlen].decode(), body[tlen:tlen + klen], body[tlen + klen:])
+
+
+class Budget:
+    """Memory and disk allowance shared by a set of queues."""
+
+    def __init__(self, memory_max: int, max_bytes: int):
+        self.memory_max = memory_max
+        self.max_bytes  = max_bytes
+        self.memory     = 0   # records held in memory
+        self.spilled    = 0   # unread records on disk
+        self.disk_bytes = 0   # bytes of unread segments
+        self._lock      = threading.Lock()
+
+    def add(self, memory: int = 0, spilled: int = 0, disk_bytes: int = 0) -> None:
+        with self._lock:
+            self.memory     += memory
+            self.spilled    += spilled
+            self.disk_bytes += disk_bytes
+
+
+class SpillQueue:
+    """Bounded FIFO of Kafka records: memory first, then append-only segments.
+
+    Thread-safe. put() returns False when both memory and the spill budget
+    are full, and the caller drops the record. requeue() always succeeds:
+    the record was held in memory (by the producer) already. The limits
+    apply to budget when one is shared with other queues.
+    """
+
+    def __init__(self, directory: str, memory_max: int = 10000,
+                 segment_bytes: int = 64 << 20, max_bytes: int = 1 << 30,
+                 budget: Optional[Budget] = None):
+        self.directory     = Path(directory)
+        self.memory_max    = memory_max
+        self.segment_bytes = segment_bytes
+        self.max_bytes     = max_bytes
+        self.budget        = budget or Budget(memory_max, max_bytes)
+
+        self._retry:  Deque[Record] = deque()   # requeued, ahead of everything else
+        self._memory: Deque[Record] = deque()
+        self._peeked: Optional[Record] = None  # what pop() removes
+        self._lock     = threading.Lock()
+        self._nonempty = threading.Condition(self._lock)
+
+        self._segments: List[int] = []     # seqs on disk, oldest first
+        self._spilled    = 0               # unread records on disk
+        self._disk_bytes = 0               # bytes of unread segments
+        self._read_seq   = 0
+        self._read_off   = 0
+        self._reader     = None
+        self._head: Optional[Record] = None   # disk record returned by peek()
+        self._head_size  = 0
+        self._writer     = None
+        self._writer_size = 0
+        self._next_seq   = 1
+        self._since_checkpoint = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._recover()
+
+    # ── recovery ──────────────────────────────────────────────────────────────
+
+    def _seg_path(self, seq: int) -> Path:
+        return self.directory / f"{seq:012d}.seg"
+
+    def _recover(self) -> None:
+        cursor_seq, cursor_off = 1, 0
+        try:
+            cursor_seq, cursor_off = map(int, (self.directory / "cursor").read_text().split())
+        except (OSError, ValueError):
+            pass
+        seqs = sorted(int(p.stem) for p in self.directory.glob("*.seg"))
+        for seq in seqs:
+            if seq < cursor_seq:
+                self._seg_path(seq).unlink(missing_ok=True)
+        seqs = [s for s in seqs if s >= cursor_seq]
+        self._next_seq = max([cursor_seq, *(s + 1 for s in seqs)])
+        if seqs and seqs[0] != cursor_seq:
+            cursor_off = 0
+
+        for i, seq in enumerate(seqs):
+            path = self._seg_path(seq)
+            start = end = cursor_off if i == 0 else 0
+            with open(path, "rb") as f:
+                f.seek(start)
+                while _read_record(f) is not None:
+                    self._account(spilled=1)
+                    end = f.tell()
+            if path.stat().st_size > end:
+                log.warning("Spill segment %s has a torn or corrupt record — truncating at %d",
+                            path.name, end)
+                os.truncate(path, end)
+            self._account(disk_bytes=end - start)
+
+        self._segments = seqs
+        self._read_seq = seqs[0] if seqs else self._next_seq
+        self._read_off = cursor_off if seqs else 0
+        if self._spilled:
+            log.info("Recovered %d spilled records from %s", self._spilled, self.directory)
+        else:
+            self._reset_disk()
+
+    # ── disk side (lock held) ─────────────────────────────────────────────────
+
+    def _account(self, spilled: int = 0, disk_bytes: int = 0) -> None:
+        self._spilled    += spilled
+        self._disk_bytes += disk_bytes
+        self.budget.add(spilled=spilled, disk_bytes=disk_bytes)
+
+    def _checkpoint(self) -> None:
+        tmp = self.directory / "cursor.tmp"
+        tmp.write_text(f"{self._read_seq} {self._read_off}")
+        os.replace(tmp, self.directory / "cursor")
+        self._since_checkpoint = 0
+
+    def _reset_disk(self) -> None:
+        """Delete every segment once the disk part has drained."""
+        for f in (self._reader, self._writer):
+            if f is not None:
+                f.close()
+        self._reader = self._writer = None
+        for seq in self._segments:
+            self._seg_path(seq).unlink(missing_ok=True)
+        self._segments   = []
+        self._account(disk_bytes=-self._disk_bytes)
+        self._read_seq, self._read_off = self._next_seq, 0
+        self._checkpoint()
+
+    def _roll(self) -> None:
+        if self._writer is not None:
+            os.fsync(self._writer.fileno())
+            self._writer.close()
+        seq = self._next_seq
+        self._next_seq += 1
+        if not self._segments:
+            self._read_seq, self._read_off = seq, 0
+        self._segments.append(seq)
+        # unbuffered: every record is one write(), visible to the reader at once
+        self._writer = open(self._seg_path(seq), "ab", buffering=0)
+        self._writer_size = 0
+
+    def _append(self, data: bytes) -> None:
+        if self._writer is None or self._writer_size >= self.segment_bytes:
+            self._roll()
+        self._writer.write(data)
+        self._writer_size += len(data)
+        self._account(spilled=1, disk_bytes=len(data))
+
+    def _read_next(self) -> Optional[Record]:
+        while True:
+            if self._reader is None:
+                self._reader = open(self._seg_path(self._read_seq), "rb")
+                self._reader.seek(self._read_off)
+            record = _read_record(self._reader)
+            if record is not None:
+                self._head_size = self._reader.tell() - self._read_off
+                return record
+            if self._read_seq == self._segments[-1]:
+                log.error("Spill log ends %d records early — resetting it", self._spilled)
+                self._account(spilled=-self._spilled)
+                self._reset_disk()
+                return None
+            self._reader.close()
+            self._reader = None
+            self._seg_path(self._segments.pop(0)).unlink(missing_ok=True)
+            self._read_seq, self._read_off = self._segments[0], 0
+            self._checkpoint()
+
+    # ── queue API ─────────────────────────────────────────────────────────────
+
+    def put(self, record: Record, memory: bool = True) -> bool:
+        """Append at the tail; False when memory and the spill budget are full.
+        memory=False writes the record straight to the spill log."""
+        with self._lock:
+            if memory and not self._spilled and self.budget.memory < self.budget.memory_max:
+                self._memory.append(record)
+                self.budget.add(memory=1)
+            else:
+                data = _encode(record)
+                if self.budget.disk_bytes + len(data) > self.budget.max_bytes:
+                    return False
+                self._append(data)
+            self._nonempty.notify()
+            return True
+
+    def requeue(self, record: Record) -> None:
+        """Put a record back at the head, after those requeued before it."""
+        with self._lock:
+            self._retry.append(record)
+            self.budget.add(memory=1)
+            self._nonempty.notify()
+
+    def peek(self) -> Optional[Record]:
+        """Oldest record, left in place until pop()."""
+        with self._lock:
+            if self._retry:
+                self._peeked = self._retry[0]
+            elif self._memory:
+                self._peeked = self._memory[0]
+            else:
+                if self._spilled and self._head is None:
+                    self._head = self._read_next()
+                self._peeked = self._head
+            return self._peeked
+
+    def pop(self) -> None:
+        """Remove the record last returned by peek(), even if a requeue() has
+        put another one ahead of it since."""
+        with self._lock:
+            peeked, self._peeked = self._peeked, None
+            if peeked is None:
+                return
+            if self._retry and self._retry[0] is peeked:
+                self._retry.popleft()
+                self.budget.add(memory=-1)
+            elif self._memory and self._memory[0] is peeked:
+                self._memory.popleft()
+                self.budget.add(memory=-1)
+            elif self._head is peeked:
+                self._head = None
+                self._read_off += self._head_size
+                self._account(spilled=-1, disk_bytes=-self._head_size)
+                self._since_checkpoint += 1
+                if not self._spilled:
+                    self._reset_disk()
+                elif self._since_checkpoint >= CURSOR_EVERY:
+                    self._checkpoint()
+
+    def wait(self, timeout: float) -> bool:
+        """Block until the queue holds something; False on timeout."""
+        with self._lock:
+            if not len(self):
+                self._nonempty.wait(timeout)
+            return bool(len(self))
+
+    def __len__(self) -> int:
+        return len(self._retry) + len(self._memory) + self._spilled
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth":    len(self),
+                "queue_memory":   len(self._retry) + len(self._memory),
+                "queue_spilled":  self._spilled,
+                "spill_bytes":    self._disk_bytes,
+                "spill_segments": len(self._segments),
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._writer is not None:
+                os.fsync(self._writer.fileno())
+                self._writer.close()
+                self._writer = None
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+            self._checkpoint()
+
+
+class TopicBacklogs:
+    """One SpillQueue per Kafka topic under {directory}/{topic}/, on one Budget.
+
+    Thread-safe. Topics with records waiting are "active"; the drain thread
+    walks active() and replays each queue through peek()/pop(topic).
+    """
+
+    def __init__(self, directory: str, memory_max: int = 10000,
+                 segment_bytes: int = 64 << 20, max_bytes: int = 1 << 30):
+        self.directory     = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.budget        = Budget(memory_max, max_bytes)
+
+        self._queues: Dict[str, SpillQueue] = {}
+        self._active: Dict[str, None] = {}   # topics with a backlog, oldest first
+        self._lock     = threading.Lock()
+        self._nonempty = threading.Condition(self._lock)
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path in sorted(p for p in self.directory.iterdir() if p.is_dir()):
+            topic = unquote(path.name)
+            queue = self._queues[topic] = self._open(topic)
+            if len(queue):
+                self._active[topic] = None
+
+    def _open(self, topic: str) -> SpillQueue:
+        return SpillQueue(str(self.directory / quote(topic, safe="")), self.budget.memory_max,
+                          self.segment_bytes, self.budget.max_bytes, budget=self.budget)
+
+    # ── queue API ─────────────────────────────────────────────────────────────
+
+    def _queue(self, topic: str) -> SpillQueue:
+        queue = self._queues.get(topic)
+        if queue is None:
+            queue = self._queues[topic] = self._open(topic)
+        return queue
+
+    def put(self, record: Record, memory: bool = True) -> bool:
+        """Append to the record's topic queue; False when the budget is full."""
+        with self._lock:
+            if not self._queue(record.topic).put(record, memory):
+                return False
+            self._active[record.topic] = None
+            self._nonempty.notify()
+            return True
+
+    def requeue(self, record: Record) -> None:
+        """Put a failed send back at the head of its topic's queue."""
+        with self._lock:
+            self._queue(record.topic).requeue(record)
+            self._active[record.topic] = None
+            self._nonempty.notify()
+
+    def pending(self, topic: str) -> int:
+        """Records waiting for topic."""
+        queue = self._queues.get(topic)
+        return len(queue) if queue is not None else 0
+
+    def active(self) -> List[Tuple[str, SpillQueue]]:
+        """(topic, queue) for every topic with a backlog."""
+        with self._lock:
+            return [(topic, self._queues[topic]) for topic in self._active]
+
+    def pop(self, topic: str) -> None:
+        """Remove the record last returned by peek() on topic's queue."""
+        queue = self._queues[topic]
+        queue.pop()
+        with self._lock:
+            if not len(queue):
+                self._active.pop(topic, None)
+
+    def wait(self, timeout: float) -> bool:
+        """Block until some topic has a backlog; False on timeout."""
+        with self._lock:
+            if not self._active:
+                self._nonempty.wait(timeout)
+            return bool(self._active)
+
+    def __len__(self) -> int:
+        return self.budget.memory + self.budget.spilled
+
+    def stats(self) -> dict:
+        with self._lock:
+            segments = sum(self._queues[t].stats()["spill_segments"] for t in self._active)
+            return {
+                "queue_depth":    self.budget.memory + self.budget.spilled,
+                "queue_memory":   self.budget.memory,
+                "queue_spilled":  self.budget.spilled,
+                "queue_topics":   len(self._active),
+                "spill_bytes":    self.budget.disk_bytes,
+                "spill_segments": segments,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            for queue in self._queues.values():
+                queue.close()
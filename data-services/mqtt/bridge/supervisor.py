@@ -0,0 +1,92 @@
+"""
+Bridge worker supervisor
+========================
+Runs BRIDGE_WORKERS copies of bridge.py in one container, each a separate
+process (own paho client, own Kafka producer, own GIL) in the same MQTT
+shared-subscription group. Worker i listens on BRIDGE_PORT + i, so worker 0
+keeps the public port; /health/shards on any worker shows all of them.
+Each worker also gets its own route database and spill directory: ROUTES_DB
+routes.db becomes routes-i.db and SPILL_DIR gets a -i suffix.
+
+A worker that exits is restarted after a short delay. SIGTERM/SIGINT stop
+all workers.
+
+  MQTT_SHARE_GROUP=bridge REDIS_URL=redis://redis:6379 BRIDGE_WORKERS=4 \\
+      python supervisor.py
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+WORKERS       = int(os.getenv("BRIDGE_WORKERS", "2"))
+BASE_PORT     = int(os.getenv("BRIDGE_PORT", "8091"))
+BASE_SHARD_ID = os.getenv("BRIDGE_SHARD_ID", "") or socket.gethostname()
+RESTART_DELAY = float(os.getenv("BRIDGE_RESTART_DELAY", "3"))
+BRIDGE_SCRIPT = Path(__file__).with_name("bridge.py")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s supervisor %(levelname)s %(message)s",
+    datefmt="%Y-%m-%dT%H:%M:%S",
+)
+log = logging.getLogger("supervisor")
+
+
+def _spawn(index: int) -> subprocess.Popen:
+    routes_db = Path(os.getenv("ROUTES_DB", "/tmp/routes.db"))
+    env = {
+        **os.environ,
+        "BRIDGE_SHARD_ID": f"{BASE_SHARD_ID}-{index}",
+        "BRIDGE_PORT":     str(BASE_PORT + index),
+        # a route cache and a spill log each have exactly one writer
+        "ROUTES_DB":       str(routes_db.with_name(f"{routes_db.stem}-{index}{routes_db.suffix}")),
+        "SPILL_DIR":       f"{os.getenv('SPILL_DIR', '/tmp/bridge-spill')}-{index}",
+    }
+    proc = subprocess.Popen([sys.executable, str(BRIDGE_SCRIPT)], env=env)
+    log.info("Worker %d started (pid %d, port %d)", index, proc.pid, BASE_PORT + index)
+    return proc
+
+
+def main() -> None:
+    if not os.getenv("MQTT_SHARE_GROUP") or not os.getenv("REDIS_URL"):
+        sys.exit("supervisor.py needs MQTT_SHARE_GROUP and REDIS_URL — workers "
+                 "outside a share group would each receive every message")
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    workers = {i: _spawn(i) for i in range(WORKERS)}
+    while not stopping:
+        time.sleep(1)
+        for i, proc in list(workers.items()):
+            if proc.poll() is not None and not stopping:
+                log.warning("Worker %d exited with %s — restarting in %.0fs",
+                            i, proc.returncode, RESTART_DELAY)
+                time.sleep(RESTART_DELAY)
+                workers[i] = _spawn(i)
+
+    for proc in workers.values():
+        proc.terminate()
+    for proc in workers.values():
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+VerdantIQ rollup backfill
+=========================
+Rebuilds the {type}_rollup_1m / _1h / _1d buckets the streaming job could
+not fill from the raw {type}_data table: readings that were there before
+the rollup was created, and batches whose MERGE never went through. Every
+rollup carries a verdantiq.rollup.complete-from TBLPROPERTY (epoch seconds,
+see sensor_streaming_job.py); the sensor service only routes queries that
+start at or after it.
+
+For each rollup with a watermark above 0, the raw rows before it are
+aggregated exactly as the streaming job aggregates a batch, MERGEd over the
+stored buckets (replacing them, not adding to them) and the watermark is
+set to 0. Readings up to EVENT_TIME_MAX_LATE_S late still land in buckets
+before the watermark, so a table is only rebuilt once its watermark is that
+far in the past; the job logs when to come back otherwise. --late-s
+overrides the wait, e.g. while the streaming job is stopped. Run
+backfill_typed_metrics.py first if the raw tables predate their typed
+columns. Re-running it is safe:
+    spark-submit --master spark://spark-master:7077 \\
+        /opt/spark/jobs/backfill_rollups.py [--table soil_data] [--dry-run]
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import time
+from datetime import datetime, timezone
+
+from pyspark import StorageLevel
+from pyspark.sql.functions import col, timestamp_seconds
+
+from sensor_schemas import rollup_columns
+from sensor_streaming_job import (
+    EVENT_TIME_MAX_LATE_S,
+    ROLLUP_GRAINS,
+    build_spark,
+    canonical_type,
+    coarsen,
+    ensure_namespace,
+    ensure_rollup_table,
+    ensure_table,
+    minute_partials,
+    rollup_complete_from,
+    set_rollup_complete_from,
+)
+
+log = logging.getLogger("rollup-backfill")
+
+
+def _replace_sql(table: str, source: str, start: int) -> str:
+    """MERGE overwriting every stored bucket before start with the rebuilt one."""
+    return f"""
+        MERGE INTO {table} t
+        USING {source} s
+        ON  t.tenant_id = s.tenant_id
+        AND t.sensor_id = s.sensor_id
+        AND t.farm_id <=> s.farm_id
+        AND t.bucket_start = s.bucket_start
+        AND t.bucket_start < timestamp_seconds({start})
+        WHEN MATCHED THEN UPDATE SET *
+        WHEN NOT MATCHED THEN INSERT *
+    """
+
+
+def _utc(epoch_s: float) -> str:
+    return datetime.fromtimestamp(epoch_s, timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+
+def backfill(spark, table_name: str, late_s: int, dry_run: bool) -> None:
+    sensor_type = canonical_type(table_name.removesuffix("_data"))
+    if not rollup_columns(sensor_type):
+        log.info("%s: no numeric metrics for sensor type %r — skipped", table_name, sensor_type)
+        return
+    raw     = ensure_table(spark, sensor_type)
+    settled = time.time() - late_s
+    targets = {}
+    for grain in ROLLUP_GRAINS:
+        full_name = ensure_rollup_table(spark, sensor_type, grain)
+        start     = rollup_complete_from(spark, full_name)
+        if not start:
+            log.info("%s: complete", full_name)
+        elif start > settled:
+            log.info("%s: complete from %s; late readings can reach it until %s — run again then",
+                     full_name, _utc(start), _utc(start + late_s))
+        else:
+            targets[grain] = (full_name, start)
+    if not targets:
+        return
+
+    until    = max(start for _, start in targets.values())
+    rows     = spark.table(raw).filter(col("event_time") < timestamp_seconds(until))
+    partials = minute_partials(rows, sensor_type).persist(StorageLevel.MEMORY_AND_DISK)
+    try:
+        for grain, (full_name, start) in targets.items():
+            unit, _ = ROLLUP_GRAINS[grain]
+            source  = partials.filter(col("bucket_start") < timestamp_seconds(start))
+            if unit != "minute":
+                source = coarsen(source, sensor_type, unit)
+            if dry_run:
+                log.info("%s: %d buckets to rebuild before %s", full_name, source.count(), _utc(start))
+                continue
+            view = f"backfill_{canonical_type(sensor_type)}_{grain}"
+            source.createOrReplaceTempView(view)
+            spark.sql(_replace_sql(full_name, view, start))
+            if set_rollup_complete_from(spark, full_name, 0, expected=start):
+                log.info("%s: rebuilt before %s, now complete", full_name, _utc(start))
+            else:
+                log.warning("%s: rebuilt before %s, but its watermark moved meanwhile — run again",
+                            full_name, _utc(start))
+    finally:
+        partials.unpersist()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild rollup buckets from the raw sensor tables")
+    parser.add_argument("--table",   action="append", help="raw table in iceberg.sensors (repeatable); default all")
+    parser.add_argument("--late-s",  type=int, default=EVENT_TIME_MAX_LATE_S,
+                        help="how late readings may still arrive (default EVENT_TIME_MAX_LATE_S)")
+    parser.add_argument("--dry-run", action="store_true", help="only count the buckets that would be rebuilt")
+    args = parser.parse_args()
+
+    spark = build_spark("VerdantIQ-RollupBackfill")
+    spark.sparkContext.setLogLevel("WARN")
+    # Buckets are cut in UTC, as in the streaming job
+    spark.conf.set("spark.sql.session.timeZone", "UTC")
+    ensure_namespace(spark)
+    tables = args.table or [r.tableName for r in spark.sql("SHOW TABLES IN iceberg.sensors").collect()
+                            if r.tableName.endswith("_data")]
+    for table_name in sorted(tables):
+        try:
+            backfill(spark, table_name, args.late_s, args.dry_run)
+        except Exception as exc:
+            log.error("Rollup backfill failed for %s: %s", table_name, exc, exc_info=True)
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+VerdantIQ typed-column backfill
+===============================
+Fills the typed struct columns (sensor_schemas.py) of rows written before
+those columns or fields existed, by parsing the raw JSON `location` and
+`metrics` strings every row still carries. It first brings each table's schema
+up to date (the same ALTERs the streaming job applies). Then it runs one
+Iceberg UPDATE per typed column, limited to rows whose struct is NULL or
+has a field that is NULL although the JSON string carries it, so re-running
+it only touches what is left. Fields a sensor never sends stay NULL without
+making its rows stale.
+
+Run alongside the streaming job; Iceberg's optimistic commits retry around
+its appends:
+    spark-submit --master spark://spark-master:7077 \\
+        /opt/spark/jobs/backfill_typed_metrics.py [--table soil_data] [--dry-run]
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+
+from sensor_schemas import struct_ddl, typed_columns
+from sensor_streaming_job import build_spark, canonical_type, ensure_namespace, ensure_table
+
+log = logging.getLogger("typed-backfill")
+
+
+def _stale_predicate(column: str, source: str, fields) -> str:
+    missing = [f"`{column}` IS NULL"] + [
+        f"(`{column}`.`{name}` IS NULL AND get_json_object({source}, '$.{name}') IS NOT NULL)"
+        for name, _ in fields
+    ]
+    return f"{source} IS NOT NULL AND ({' OR '.join(missing)})"
+
+
+def backfill(spark, table_name: str, dry_run: bool) -> None:
+    sensor_type = canonical_type(table_name.removesuffix("_data"))
+    columns     = typed_columns(sensor_type)
+    if not columns:
+        log.info("%s: no typed columns for sensor type %r — skipped", table_name, sensor_type)
+        return
+    full_name = ensure_table(spark, sensor_type)
+    for column, (source, fields) in columns.items():
+        where = _stale_predicate(column, source, fields)
+        if dry_run:
+            stale = spark.sql(f"SELECT count(*) AS n FROM {full_name} WHERE {where}").first().n
+            log.info("%s.%s: %d rows to backfill", full_name, column, stale)
+            continue
+        spark.sql(f"UPDATE {full_name} SET `{column}` = from_json({source}, '{struct_ddl(fields)}') "
+                  f"WHERE {where}")
+        log.info("%s.%s: backfilled", full_name, column)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backfill typed metric columns from their JSON strings")
+    parser.add_argument("--table",   action="append", help="table in iceberg.sensors (repeatable); default all")
+    parser.add_argument("--dry-run", action="store_true", help="only count the rows that would change")
+    args = parser.parse_args()
+
+    spark = build_spark("VerdantIQ-TypedBackfill")
+    spark.sparkContext.setLogLevel("WARN")
+    ensure_namespace(spark)
+    tables = args.table or [r.tableName for r in spark.sql("SHOW TABLES IN iceberg.sensors").collect()]
+    for table_name in sorted(tables):
+        try:
+            backfill(spark, table_name, args.dry_run)
+        except Exception as exc:
+            log.error("Backfill failed for %s: %s", table_name, exc, exc_info=True)
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
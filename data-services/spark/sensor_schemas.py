@@ -0,0 +1,181 @@
+"""
+VerdantIQ typed sensor columns
+==============================
+Typed Iceberg columns per canonical sensor type, kept next to the raw JSON
+`location` / `metrics` strings so existing queries keep working:
+
+  {metrics key}     soil_metrics STRUCT<moisture_percent: DOUBLE, ...>
+  location_fields   STRUCT<latitude: DOUBLE, longitude: DOUBLE, ...>
+
+Field lists follow the payloads the data service's simulators publish
+(_generate_* in iot/simulator/mqtt_publisher.py): a field listed here that
+no producer sends would only ever read as NULL. Queries read soil_metrics.moisture_percent as
+a column of its own instead of json_extract()-ing a string: only the fields
+used are scanned, and each has min/max statistics for file pruning.
+
+Evolution is additive: a field added here is added to existing tables on the
+next write (ALTER TABLE ... ADD COLUMN struct.field), and older rows read it
+as NULL until backfill_typed_metrics.py fills them from the JSON strings.
+Renaming a field or changing its type needs a new field name.
+
+Rollup tables ({type}_rollup_1m/_1h/_1d) reuse the metrics column name, with
+a ROLLUP_STATS struct per numeric field:
+
+  soil_metrics STRUCT<moisture_percent: STRUCT<min, max, sum, count, avg, last>, ...>
+"""
+
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+
+Fields = List[Tuple[str, str]]
+
+# Payload key holding each type's metric object
+METRICS_PATHS: Dict[str, str] = {
+    "soil":        "soil_metrics",
+    "co2":         "air_quality",
+    "weather":     "weather_data",
+    "temperature": "temperature_data",
+    "environment": "pollution_metrics",
+    "humidity":    "humidity_data",
+    "pressure":    "pressure_data",
+    "light":       "light_data",
+    "flow":        "flow_data",
+}
+
+LOCATION_COLUMN = "location_fields"
+
+_LAT_LON: Fields = [("latitude", "DOUBLE"), ("longitude", "DOUBLE")]
+
+METRIC_FIELDS: Dict[str, Fields] = {
+    "soil": [
+        ("moisture_percent",              "DOUBLE"),
+        ("temperature_c",                 "DOUBLE"),
+        ("ph",                            "DOUBLE"),
+        ("electrical_conductivity_us_cm", "DOUBLE"),
+        ("nitrogen_mg_kg",                "DOUBLE"),
+        ("phosphorus_mg_kg",              "DOUBLE"),
+        ("potassium_mg_kg",               "DOUBLE"),
+        ("organic_matter_percent",        "DOUBLE"),
+    ],
+    "co2": [
+        ("co2_ppm",           "DOUBLE"),
+        ("temperature_c",     "DOUBLE"),
+        ("humidity_percent",  "DOUBLE"),
+        ("pressure_hpa",      "DOUBLE"),
+        ("voc_ppb",           "DOUBLE"),
+        ("air_quality_index", "DOUBLE"),
+    ],
+    "weather": [
+        ("temperature_c",        "DOUBLE"),
+        ("humidity_percent",     "DOUBLE"),
+        ("pressure_hpa",         "DOUBLE"),
+        ("wind_speed_m_s",       "DOUBLE"),
+        ("wind_direction_deg",   "DOUBLE"),
+        ("rainfall_mm",          "DOUBLE"),
+        ("uv_index",             "DOUBLE"),
+        ("solar_radiation_w_m2", "DOUBLE"),
+    ],
+    "temperature": [
+        ("current_temperature_c", "DOUBLE"),
+        ("min_last_24h_c",        "DOUBLE"),
+        ("max_last_24h_c",        "DOUBLE"),
+    ],
+    "environment": [
+        ("pm2_5_ug_m3", "DOUBLE"),
+        ("pm10_ug_m3",  "DOUBLE"),
+        ("co_ppm",      "DOUBLE"),
+        ("no2_ppb",     "DOUBLE"),
+        ("so2_ppb",     "DOUBLE"),
+        ("o3_ppb",      "DOUBLE"),
+    ],
+    "humidity": [
+        ("humidity_percent", "DOUBLE"),
+        ("temperature_c",    "DOUBLE"),
+        ("dew_point_c",      "DOUBLE"),
+        ("heat_index_c",     "DOUBLE"),
+    ],
+    "pressure": [
+        ("atmospheric_hpa", "DOUBLE"),
+        ("sea_level_hpa",   "DOUBLE"),
+        ("pressure_trend",  "STRING"),
+        ("temperature_c",   "DOUBLE"),
+    ],
+    "light": [
+        ("lux",           "DOUBLE"),
+        ("par_umol_m2_s", "DOUBLE"),
+        ("uv_index",      "DOUBLE"),
+        ("infrared_w_m2", "DOUBLE"),
+    ],
+    "flow": [
+        ("flow_rate_l_min",     "DOUBLE"),
+        ("cumulative_volume_l", "DOUBLE"),
+        ("velocity_m_s",        "DOUBLE"),
+        ("pressure_bar",        "DOUBLE"),
+        ("temperature_c",       "DOUBLE"),
+    ],
+}
+
+LOCATION_FIELDS: Dict[str, Fields] = {
+    "soil":        _LAT_LON + [("field_id", "STRING")],
+    "co2":         _LAT_LON + [("site", "STRING")],
+    "weather":     _LAT_LON + [("elevation_m", "DOUBLE")],
+    "temperature": [("building", "STRING"), ("zone", "STRING")],
+    "environment": _LAT_LON,
+    "humidity":    _LAT_LON,
+    "pressure":    _LAT_LON,
+    "light":       _LAT_LON,
+    "flow":        [("site", "STRING"), ("zone", "STRING")],
+}
+
+
+# Per-field aggregates kept in the rollup tables, in column order
+ROLLUP_STATS: Fields = [
+    ("min",   "DOUBLE"),
+    ("max",   "DOUBLE"),
+    ("sum",   "DOUBLE"),
+    ("count", "BIGINT"),
+    ("avg",   "DOUBLE"),
+    ("last",  "DOUBLE"),
+]
+
+
+def struct_ddl(fields: Fields) -> str:
+    return "STRUCT<" + ", ".join(f"`{name}`: {dtype}" for name, dtype in fields) + ">"
+
+
+def typed_columns(sensor_type: str) -> Dict[str, Tuple[str, Fields]]:
+    """Typed column → (JSON source column, struct fields); empty for unknown types."""
+    columns: Dict[str, Tuple[str, Fields]] = {}
+    if sensor_type in METRIC_FIELDS:
+        columns[METRICS_PATHS[sensor_type]] = ("metrics", METRIC_FIELDS[sensor_type])
+    if sensor_type in LOCATION_FIELDS:
+        columns[LOCATION_COLUMN] = ("location", LOCATION_FIELDS[sensor_type])
+    return columns
+
+
+def rollup_columns(sensor_type: str) -> Dict[str, Tuple[str, Fields]]:
+    """Rollup stats column → (JSON source column, one stats struct per numeric
+    metric field); empty for types without numeric metrics."""
+    fields = [(name, struct_ddl(ROLLUP_STATS))
+              for name, dtype in METRIC_FIELDS.get(sensor_type, []) if dtype == "DOUBLE"]
+    return {METRICS_PATHS[sensor_type]: ("metrics", fields)} if fields else {}
+
+
+def missing_ddl(full_name: str, sensor_type: str, schema,
+                columns: Dict[str, Tuple[str, Fields]] | None = None) -> List[str]:
+    """ALTER statements bringing a table's Spark schema up to the typed columns
+    (or to columns, e.g. rollup_columns(sensor_type))."""
+    existing = {f.name: f.dataType for f in schema.fields}
+    statements = []
+    if columns is None:
+        columns = typed_columns(sensor_type)
+    for column, (_, fields) in columns.items():
+        if column not in existing:
+            statements.append(f"ALTER TABLE {full_name} ADD COLUMN `{column}` {struct_ddl(fields)}")
+            continue
+        present = set(existing[column].fieldNames())
+        for name, dtype in fields:
+            if name not in present:
+                statements.append(f"ALTER TABLE {full_name} ADD COLUMN `{column}`.`{name}` {dtype}")
+    return statements
@@ -3,16 +3,74 @@ VerdantIQ Spark Structured Streaming — Sensor → Iceberg
 =========================================================
 Consumes all sensor Kafka topics (via subscribePattern), parses the JSON
 payloads, and writes partitioned Avro-format Iceberg tables in MinIO.
+Messages the bridge transcoded to schema-framed Avro (PAYLOAD_FORMAT=avro)
+are decoded with from_avro using reader schemas from the schema registry
+(SCHEMA_REGISTRY_URL or SCHEMA_DIR, see sensor_codec.py), skipping JSON
+parsing entirely.
 
 Topic naming convention
-    Kafka:   verdantiq.{tenant_id}.{sensor_id}
+    Kafka:   verdantiq.{tenant_id}.{sensor_id}  (TOPIC_LAYOUT=sensor)
+             verdantiq.tenant.{tenant_id}       (tenant; record key = sensor_id)
+             verdantiq.type.{sensor_type}       (type;   record key = sensor_id)
     Iceberg: iceberg.sensors.{sensor_type}_data
+    Records with a viq-migrated header are copies migrate_topic_layout.py
+    made of readings already ingested from their old topic, and are skipped.
+
+Tables keep location and metrics as raw JSON strings, plus typed struct
+columns per sensor type (e.g. soil_metrics.moisture_percent DOUBLE, see
+sensor_schemas.py). Typed columns and fields added there are applied to
+existing tables automatically.
+
+Each micro-batch is decoded in one pass: the canonical sensor type is
+looked up per row from SENSOR_TYPE_MAP, the decoded rows are persisted, and
+every sensor-type table gets exactly one append. Rows are routed by their
+own sensor_type, not by topic, so topics that mix sensors (and types) need
+no special handling.
 
 Partition scheme
-    (tenant_id, year, month, day, hour)
+    (hours(event_time), bucket(TENANT_BUCKETS, tenant_id)), hidden: Trino
+    prunes on event_time / tenant_id predicates, no year= / hour= needed.
+    Writes are hash-distributed by partition and sorted by
+    (tenant_id, sensor_id, event_time), so a micro-batch writes one file
+    per touched partition. Older tables are moved to this spec in place;
+    their existing files keep the spec they were written with.
+
+event_time
+    The device timestamp, unless it is missing, unparseable, more than
+    EVENT_TIME_MAX_AHEAD_S ahead of the Kafka record timestamp (clock skew)
+    or more than EVENT_TIME_MAX_LATE_S behind it (a reset clock); then the
+    Kafka timestamp, which is also kept as ingest_time. Readings buffered
+    on a device and sent late within that window keep their device time.
 
 File format
-    Avro  (set per-table via TBLPROPERTIES)
+    TABLE_FORMAT (default parquet; orc or avro), set per table via
+    TBLPROPERTIES and re-applied to existing tables. Parquet is written
+    with ZSTD, bloom filters on sensor_id / device_id, full min/max
+    metrics for both ids, and page indexes, so Trino prunes files, row
+    groups and pages and reads only the columns a query uses. Switching
+    the format affects new files only; table_maintenance_job.py rewrites
+    the old ones in the background.
+
+Rollups
+    Next to each {type}_data table the job keeps {type}_rollup_1m, _1h and
+    _1d: per (tenant_id, farm_id, sensor_id, bucket_start) the reading
+    count, the latest event_time and, for every numeric metric, min, max,
+    sum, count, avg and last value (soil_metrics.moisture_percent.avg ...).
+    Each batch is aggregated to 1-minute partials once, the hourly and daily
+    partials are derived from those, and each is MERGEd into its table, so
+    late readings update the bucket they belong to. Buckets are UTC. The
+    rollups are committed after the raw append, so they can trail it by one
+    batch. ROLLUPS_ENABLED=false turns them off. The sensor service rewrites
+    eligible /query/ aggregates onto them (backend/services/sensor/rollup_rewrite.py).
+
+    Each rollup's verdantiq.rollup.complete-from TBLPROPERTY (epoch seconds)
+    is where it starts holding every reading: set to the bucket after the
+    one the table was created in, since readings already in the raw table
+    are not in it, and lowered to 0 by backfill_rollups.py once it has
+    rebuilt what came before. A MERGE is retried ROLLUP_MERGE_ATTEMPTS times;
+    if it still fails its partials are merged with a later batch and the
+    watermark is moved past them until then. The sensor service only
+    rewrites queries that start at or after the watermark.
 
 Iceberg catalog
     REST catalog at http://iceberg-rest:8181  (warehouse in MinIO)
@@ -27,23 +85,47 @@ from __future__ import annotations
 import json
 import logging
 import os
+import re
+import time
+import urllib.request
+from functools import reduce
+from itertools import chain
+from typing import Callable
 
-from pyspark.sql import DataFrame, SparkSession
+from pyspark import StorageLevel
+from pyspark.errors import AnalysisException
+from pyspark.sql import Column, DataFrame, SparkSession
+from pyspark.sql.avro.functions import from_avro
 from pyspark.sql.functions import (
     coalesce,
     col,
+    count as count_,
+    create_map,
+    date_trunc,
+    expr,
     from_json,
     get_json_object,
     hour,
     lit,
+    lower,
+    max as max_,
+    max_by,
+    min as min_,
     month,
     split,
+    struct,
+    sum as sum_,
+    to_json,
     to_timestamp,
+    when,
     year,
     dayofmonth,
 )
 from pyspark.sql.types import StringType, StructField, StructType
 
+from sensor_codec import MIGRATED_HEADER, SchemaRegistry
+from sensor_schemas import METRICS_PATHS, missing_ddl, rollup_columns, struct_ddl, typed_columns
+
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s %(levelname)s %(message)s")
 log = logging.getLogger("sensor-streaming")
@@ -58,6 +140,20 @@ ICEBERG_REST_URI     = os.getenv("ICEBERG_REST_URI",     "http://iceberg-rest:81
 ICEBERG_WAREHOUSE    = os.getenv("ICEBERG_WAREHOUSE",    "s3a://iceberg/")
 CHECKPOINT_BASE      = os.getenv("CHECKPOINT_BASE",      "s3a://bronze/checkpoints/sensor-streaming")
 KAFKA_TOPIC_PATTERN  = os.getenv("KAFKA_TOPIC_PATTERN",  r"verdantiq\..+")
+# Sensor service endpoint told about DDL so the query console's schema tree refreshes
+SCHEMA_CHANGE_URL    = os.getenv("SCHEMA_CHANGE_URL",
+                                 "http://sensor:8003/internal/query/schema/invalidate")
+
+# Hidden partitioning and event-time sanity bounds (see module docstring)
+TABLE_FORMAT           = os.getenv("TABLE_FORMAT", "parquet").lower()
+TENANT_BUCKETS         = int(os.getenv("TENANT_BUCKETS",         "16"))
+EVENT_TIME_MAX_AHEAD_S = int(os.getenv("EVENT_TIME_MAX_AHEAD_S", "300"))
+EVENT_TIME_MAX_LATE_S  = int(os.getenv("EVENT_TIME_MAX_LATE_S",  str(7 * 86400)))
+ROLLUPS_ENABLED        = os.getenv("ROLLUPS_ENABLED", "true").lower() == "true"
+ROLLUP_MERGE_ATTEMPTS  = int(os.getenv("ROLLUP_MERGE_ATTEMPTS",  "4"))
+
+# Reader schemas for bridge-transcoded Avro payloads; None when JSON only
+SCHEMA_REGISTRY      = SchemaRegistry.from_env()
 
 # Valid sensor types — maps canonical names used in Iceberg table names
 SENSOR_TYPE_MAP: dict[str, str] = {
@@ -93,10 +189,10 @@ SENSOR_TYPE_MAP: dict[str, str] = {
 
 # ── SparkSession ──────────────────────────────────────────────────────────────
 
-def build_spark() -> SparkSession:
+def build_spark(app_name: str = "VerdantIQ-SensorStreaming") -> SparkSession:
     return (
         SparkSession.builder
-        .appName("VerdantIQ-SensorStreaming")
+        .appName(app_name)
         # ── Iceberg extensions + REST catalog ──────────────────────────────
         .config("spark.sql.extensions",
                 "org.apache.iceberg.spark.extensions.IcebergSparkSessionExtensions")
@@ -137,42 +233,381 @@ CREATE TABLE IF NOT EXISTS iceberg.sensors.{table_name} (
     farm_id     STRING  COMMENT 'Farm identifier',
     sensor_id   STRING  COMMENT 'Sensor identifier',
     device_id   STRING  COMMENT 'Physical device ID',
-    event_time  TIMESTAMP COMMENT 'Event timestamp from device',
+    event_time  TIMESTAMP COMMENT 'Device timestamp, or ingest_time when missing or skewed',
+    ingest_time TIMESTAMP COMMENT 'Kafka record timestamp',
     location    STRING  COMMENT 'JSON location metadata',
-    metrics     STRING  COMMENT 'JSON sensor-specific metric payload',
+    metrics     STRING  COMMENT 'JSON sensor-specific metric payload',{typed_columns}
     raw_topic   STRING  COMMENT 'Source Kafka topic',
-    year        INT,
+    year        INT     COMMENT 'Derived from event_time; not a partition column',
     month       INT,
     day         INT,
     hour        INT
 )
 USING iceberg
-PARTITIONED BY (tenant_id, farm_id, year, month, day, hour)
-TBLPROPERTIES (
-    'write.format.default'        = 'avro',
-    'write.delete.format.default' = 'avro',
-    'write.update.format.default' = 'avro',
-    'write.avro.compression-codec' = 'snappy',
+PARTITIONED BY ({partitioning})
+TBLPROPERTIES ({format_properties}
     'write.metadata.compression-codec' = 'gzip',
     'history.expire.max-snapshot-age-ms' = '604800000'
 )
 """
 
 
+def notify_schema_change(full_name: str) -> None:
+    """Best-effort: tell the sensor service a table was created or altered."""
+    if not SCHEMA_CHANGE_URL:
+        return
+    catalog, _, table = full_name.partition(".")
+    req = urllib.request.Request(
+        SCHEMA_CHANGE_URL,
+        data=json.dumps({"catalog": catalog, "table": table}).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        urllib.request.urlopen(req, timeout=2).close()
+    except Exception as exc:
+        log.warning("Schema change notification failed for %s: %s", full_name, exc)
+
+
+def canonical_type(sensor_type: str) -> str:
+    return SENSOR_TYPE_MAP.get(sensor_type.lower(), sensor_type.lower())
+
+
+def table_name_for(sensor_type: str) -> str:
+    return f"{canonical_type(sensor_type)}_data"
+
+
+def _typed_columns_ddl(sensor_type: str) -> str:
+    return "".join(
+        f"\n    `{column}` {struct_ddl(fields)} COMMENT 'Typed {source}',"
+        for column, (source, fields) in typed_columns(sensor_type).items()
+    )
+
+
+# Columns added after the first release, migrated onto older tables
+_ADDED_COLUMNS = (("farm_id", "STRING"), ("ingest_time", "TIMESTAMP"))
+
+_SORT_ORDER = "tenant_id, sensor_id, event_time"
+
+
+def format_properties(fmt: str = TABLE_FORMAT) -> dict[str, str]:
+    """Write-format TBLPROPERTIES for fmt; kept in sync on existing tables."""
+    if fmt not in ("parquet", "orc", "avro"):
+        raise ValueError(f"Unsupported TABLE_FORMAT {fmt!r} (expected parquet, orc or avro)")
+    props = {
+        "write.format.default":        fmt,
+        "write.delete.format.default": fmt,
+        "write.update.format.default": fmt,
+    }
+    if fmt == "parquet":
+        props.update({
+            "write.parquet.compression-codec":                     "zstd",
+            "write.parquet.compression-level":                     "3",
+            "write.parquet.bloom-filter-enabled.column.sensor_id": "true",
+            "write.parquet.bloom-filter-enabled.column.device_id": "true",
+            # Untruncated bounds so sensor_id = / device_id = prune exactly
+            "write.metadata.metrics.column.sensor_id":             "full",
+            "write.metadata.metrics.column.device_id":             "full",
+        })
+    elif fmt == "orc":
+        props.update({
+            "write.orc.compression-codec":    "zstd",
+            "write.orc.bloom.filter.columns": "sensor_id,device_id",
+        })
+    else:
+        props["write.avro.compression-codec"] = "snappy"
+    return props
+
+
+def _properties_ddl(props: dict[str, str]) -> str:
+    return "".join(f"\n    '{k}' = '{v}'," for k, v in props.items())
+
+
+def _partition_fields() -> list[str]:
+    """Target spec, spelled the way DESCRIBE TABLE reports it."""
+    return ["hours(event_time)", f"bucket({TENANT_BUCKETS}, tenant_id)"]
+
+
+def _pending_ddl(spark: SparkSession, full_name: str, sensor_type: str) -> list[str]:
+    """ALTERs a table still needs: added columns, typed columns/fields,
+    partition spec, write format, then write distribution and sort order."""
+    schema = spark.table(full_name).schema
+    pending = [f"ALTER TABLE {full_name} ADD COLUMN {name} {dtype}"
+               for name, dtype in _ADDED_COLUMNS if name not in schema.fieldNames()]
+    pending += missing_ddl(full_name, sensor_type, schema)
+
+    described = spark.sql(f"DESCRIBE TABLE {full_name}").collect()
+    current   = [r.data_type for r in described if r.col_name.startswith("Part ")]
+    target    = _partition_fields()
+    pending  += [f"ALTER TABLE {full_name} ADD PARTITION FIELD {f}" for f in target if f not in current]
+    pending  += [f"ALTER TABLE {full_name} DROP PARTITION FIELD {f}" for f in current if f not in target]
+
+    return pending + _write_ddl(spark, full_name, format_properties(), _SORT_ORDER)
+
+
+def _write_ddl(spark: SparkSession, full_name: str, target: dict[str, str], sort_order: str) -> list[str]:
+    """ALTERs for stale write properties and a missing write distribution/order."""
+    props = {r.key: r.value for r in spark.sql(f"SHOW TBLPROPERTIES {full_name}").collect()}
+    stale = {k: v for k, v in target.items() if props.get(k) != v}
+    pending = []
+    if stale:
+        pending.append(f"ALTER TABLE {full_name} SET TBLPROPERTIES ("
+                       + ", ".join(f"'{k}' = '{v}'" for k, v in stale.items()) + ")")
+    if "sort-order" not in props or props.get("write.distribution-mode") != "hash":
+        pending.append(f"ALTER TABLE {full_name} WRITE DISTRIBUTED BY PARTITION "
+                       f"LOCALLY ORDERED BY {sort_order}")
+    return pending
+
+
 def ensure_table(spark: SparkSession, sensor_type: str) -> str:
-    canonical   = SENSOR_TYPE_MAP.get(sensor_type.lower(), sensor_type.lower())
-    table_name  = f"{canonical}_data"
+    canonical   = canonical_type(sensor_type)
+    table_name  = table_name_for(canonical)
     full_name   = f"iceberg.sensors.{table_name}"
-    spark.sql(_TABLE_DDL_TEMPLATE.format(table_name=table_name))
-    # Migrate existing tables that predate the farm_id column.
-    try:
-        spark.sql(f"ALTER TABLE {full_name} ADD COLUMN IF NOT EXISTS farm_id STRING")
-    except Exception:
-        pass  # column already exists or table just created — safe to ignore
+    create_sql  = _TABLE_DDL_TEMPLATE.format(table_name=table_name,
+                                             typed_columns=_typed_columns_ddl(canonical),
+                                             partitioning=", ".join(_partition_fields()),
+                                             format_properties=_properties_ddl(format_properties()))
+    # Evolve the table: columns and typed fields added since it was created,
+    # the current partition spec, and the write order (CREATE cannot set it)
+    return _create_and_evolve(spark, full_name, create_sql,
+                              lambda: _pending_ddl(spark, full_name, canonical))
+
+
+def _create_and_evolve(spark: SparkSession, full_name: str, create_sql: str,
+                       pending: Callable[[], list[str]]) -> str:
+    existed     = spark.catalog.tableExists(full_name)
+    spark.sql(create_sql)
+    changed     = not existed
+    for statement in pending():
+        try:
+            spark.sql(statement)
+            changed = True
+        except Exception as exc:
+            # Usually a concurrent writer applied it first; a real mismatch
+            # fails the write and invalidates the table in TableRegistry.
+            log.warning("Schema evolution skipped (%s): %s", statement, exc)
+    if changed:
+        notify_schema_change(full_name)
     log.info("Ensured table: %s", full_name)
     return full_name
 
 
+# ── rollup DDL ────────────────────────────────────────────────────────────────
+
+# Rollup table suffix → (date_trunc unit, partition transform on bucket_start)
+ROLLUP_GRAINS: dict[str, tuple[str, str]] = {
+    "1m": ("minute", "days"),
+    "1h": ("hour",   "months"),
+    "1d": ("day",    "years"),
+}
+
+_ROLLUP_TABLE = re.compile(r"(\w+)_rollup_(" + "|".join(ROLLUP_GRAINS) + ")")
+
+# Epoch seconds from which a rollup holds every reading (read by the sensor service)
+ROLLUP_COMPLETE_FROM = "verdantiq.rollup.complete-from"
+_UNIT_SECONDS = {"minute": 60, "hour": 3600, "day": 86400}
+
+_ROLLUP_DDL_TEMPLATE = """
+CREATE TABLE IF NOT EXISTS iceberg.sensors.{table_name} (
+    tenant_id    STRING    COMMENT 'Tenant identifier',
+    farm_id      STRING    COMMENT 'Farm identifier',
+    sensor_id    STRING    COMMENT 'Sensor identifier',
+    bucket_start TIMESTAMP COMMENT 'Start of the {unit} bucket (UTC)',
+    readings     BIGINT    COMMENT 'Readings in the bucket',
+    last_time    TIMESTAMP COMMENT 'event_time of the latest reading in the bucket',{stats_columns}
+)
+USING iceberg
+PARTITIONED BY ({transform}(bucket_start), bucket({buckets}, tenant_id))
+TBLPROPERTIES ({format_properties}
+    'write.metadata.compression-codec' = 'gzip',
+    'history.expire.max-snapshot-age-ms' = '604800000'
+)
+"""
+
+_ROLLUP_SORT_ORDER = "tenant_id, sensor_id, bucket_start"
+
+
+def rollup_table_for(sensor_type: str, grain: str) -> str:
+    return f"{canonical_type(sensor_type)}_rollup_{grain}"
+
+
+def next_bucket(unit: str, epoch_s: float) -> int:
+    """Start (epoch seconds) of the unit bucket after the one holding epoch_s."""
+    step = _UNIT_SECONDS[unit]
+    return (int(epoch_s) // step + 1) * step
+
+
+def rollup_complete_from(spark: SparkSession, full_name: str) -> int | None:
+    props = {r.key: r.value for r in spark.sql(f"SHOW TBLPROPERTIES {full_name}").collect()}
+    value = props.get(ROLLUP_COMPLETE_FROM)
+    return int(value) if value is not None else None
+
+
+def _complete_from_ddl(full_name: str, start: int) -> str:
+    return f"ALTER TABLE {full_name} SET TBLPROPERTIES ('{ROLLUP_COMPLETE_FROM}' = '{start}')"
+
+
+def set_rollup_complete_from(spark: SparkSession, full_name: str, start: int,
+                             expected: int | None) -> bool:
+    """Move the watermark to start unless another job moved it off expected."""
+    if rollup_complete_from(spark, full_name) != expected:
+        return False
+    spark.sql(_complete_from_ddl(full_name, start))
+    notify_schema_change(full_name)
+    return True
+
+
+def _rollup_properties() -> dict[str, str]:
+    """format_properties() minus the device_id settings (rollups have no
+    device_id column), with merge-on-read so each MERGE writes delete files
+    instead of rewriting the data files it touches."""
+    props = {k: v.replace(",device_id", "") for k, v in format_properties().items()
+             if not k.endswith(".device_id")}
+    props.update({
+        "format-version":    "2",
+        "write.merge.mode":  "merge-on-read",
+        "write.update.mode": "merge-on-read",
+        "write.delete.mode": "merge-on-read",
+    })
+    return props
+
+
+def _rollup_pending_ddl(spark: SparkSession, full_name: str, sensor_type: str, unit: str) -> list[str]:
+    """ALTERs a rollup table still needs: stats for metric fields added since
+    it was created, its complete-from watermark, write format, then write
+    distribution and sort order."""
+    schema  = spark.table(full_name).schema
+    pending = missing_ddl(full_name, sensor_type, schema, rollup_columns(sensor_type))
+    if rollup_complete_from(spark, full_name) is None:
+        # Readings already in the raw table (device clocks may run ahead) are
+        # not in the rollup: it is complete from the next bucket on
+        pending.append(_complete_from_ddl(full_name, next_bucket(unit, time.time() + EVENT_TIME_MAX_AHEAD_S)))
+    return pending + _write_ddl(spark, full_name, _rollup_properties(), _ROLLUP_SORT_ORDER)
+
+
+def ensure_rollup_table(spark: SparkSession, sensor_type: str, grain: str) -> str:
+    canonical   = canonical_type(sensor_type)
+    table_name  = rollup_table_for(canonical, grain)
+    full_name   = f"iceberg.sensors.{table_name}"
+    unit, transform = ROLLUP_GRAINS[grain]
+    stats       = "".join(
+        f"\n    `{column}` {struct_ddl(fields)} COMMENT 'min/max/sum/count/avg/last per metric',"
+        for column, (_, fields) in rollup_columns(canonical).items()
+    ).rstrip(",")
+    create_sql  = _ROLLUP_DDL_TEMPLATE.format(table_name=table_name, unit=unit,
+                                              stats_columns=stats, transform=transform,
+                                              buckets=TENANT_BUCKETS,
+                                              format_properties=_properties_ddl(_rollup_properties()))
+    return _create_and_evolve(spark, full_name, create_sql,
+                              lambda: _rollup_pending_ddl(spark, full_name, canonical, unit))
+
+
+class TableRegistry:
+    """Driver-side set of tables whose DDL is settled for this job's lifetime.
+
+    Every micro-batch used to pay a catalog round-trip per table for CREATE
+    IF NOT EXISTS / ALTER. Now ensure_table runs once per table. The set is
+    warmed from the catalog at startup, and a table is dropped from it only
+    when a write fails on its schema, so the next batch re-runs its DDL.
+    """
+
+    def __init__(self, spark: SparkSession):
+        self.spark  = spark
+        self._ready: set[str] = set()
+        # Rollup → partials whose MERGE failed, for the next batch (see hold)
+        self._held: dict[str, dict] = {}
+
+    def warm(self) -> None:
+        ensure_namespace(self.spark)
+        for row in self.spark.sql("SHOW TABLES IN iceberg.sensors").collect():
+            full_name = f"iceberg.sensors.{row.tableName}"
+            # Tables still needing an ALTER are left for ensure_table to evolve
+            rollup = _ROLLUP_TABLE.fullmatch(row.tableName)
+            if rollup:
+                pending = _rollup_pending_ddl(self.spark, full_name, rollup.group(1),
+                                              ROLLUP_GRAINS[rollup.group(2)][0])
+            else:
+                pending = _pending_ddl(self.spark, full_name, row.tableName.removesuffix("_data"))
+            if not pending:
+                self._ready.add(full_name)
+        log.info("Table registry warmed with %d tables", len(self._ready))
+
+    def ensure(self, sensor_type: str) -> str:
+        full_name = f"iceberg.sensors.{table_name_for(sensor_type)}"
+        if full_name not in self._ready:
+            ensure_table(self.spark, sensor_type)
+            self._ready.add(full_name)
+        return full_name
+
+    def ensure_rollup(self, sensor_type: str, grain: str) -> str:
+        full_name = f"iceberg.sensors.{rollup_table_for(sensor_type, grain)}"
+        if full_name not in self._ready:
+            ensure_rollup_table(self.spark, sensor_type, grain)
+            self._ready.add(full_name)
+        return full_name
+
+    def invalidate(self, full_name: str) -> None:
+        self._ready.discard(full_name)
+
+    # ── rollup partials a MERGE failed on ────────────────────────────────────
+
+    def hold(self, full_name: str, until: int, source: DataFrame | None = None) -> None:
+        """Keep a failed MERGE's partials (collected to the driver) for the
+        next batch, and move the rollup's watermark to until meanwhile.
+        Without source the readings are gone: the watermark stays up until
+        backfill_rollups.py rebuilds them."""
+        entry = self._held.setdefault(full_name, {"rows": None, "lost": False, "until": 0,
+                                                  "restore": None, "raised": None})
+        entry["until"] = max(entry["until"], until)
+        if source is not None:
+            try:
+                entry["rows"], entry["schema"] = source.collect(), source.schema
+            except Exception as exc:
+                log.error("Could not keep the rollup partials for %s: %s", full_name, exc)
+                source = None
+        if source is None:
+            entry["rows"], entry["lost"] = None, True
+        self._raise_watermark(full_name)
+
+    def held(self, full_name: str) -> DataFrame | None:
+        """Partials held for full_name, to merge with this batch's."""
+        entry = self._held.get(full_name)
+        if entry is None:
+            return None
+        if entry["raised"] is None:
+            self._raise_watermark(full_name)
+        if entry["rows"] is None:
+            if entry["raised"] is not None:
+                del self._held[full_name]
+            return None
+        return self.spark.createDataFrame(entry["rows"], entry["schema"])
+
+    def release(self, full_name: str) -> None:
+        """The held partials are merged: put the watermark back."""
+        entry = self._held.pop(full_name, None)
+        if entry is None or entry["lost"] or entry["raised"] is None or entry["restore"] is None:
+            return
+        try:
+            set_rollup_complete_from(self.spark, full_name, entry["restore"], expected=entry["raised"])
+        except Exception as exc:
+            log.warning("Could not restore the watermark of %s: %s", full_name, exc)
+
+    def _raise_watermark(self, full_name: str) -> None:
+        entry = self._held[full_name]
+        try:
+            current = rollup_complete_from(self.spark, full_name)
+            if entry["raised"] is None:
+                entry["restore"] = current
+            if current is None or current < entry["until"]:
+                set_rollup_complete_from(self.spark, full_name, entry["until"], expected=current)
+            entry["raised"] = max(current or 0, entry["until"])
+            log.warning("%s is incomplete before %d until its held partials are merged",
+                        full_name, entry["raised"])
+        except Exception as exc:
+            # Retried by the next held() call
+            log.error("Could not move the watermark of %s: %s", full_name, exc)
+
+
 # ── micro-batch processor ─────────────────────────────────────────────────────
 
 # Minimal schema to parse the envelope fields we always expect
@@ -185,114 +620,364 @@ _ENVELOPE_SCHEMA = StructType([
     StructField("sensor_type", StringType()),
 ])
 
-# Metric key → JSON path for each sensor type
-_METRICS_PATHS: dict[str, str] = {
-    "soil":        "soil_metrics",
-    "co2":         "air_quality",
-    "weather":     "weather_data",
-    "temperature": "temperature_data",
-    "environment": "pollution_metrics",
-    "humidity":    "humidity_data",
-    "pressure":    "pressure_data",
-    "light":       "light_data",
-    "flow":        "flow_data",
-}
 
+def _canonical_type(raw: Column) -> Column:
+    """SENSOR_TYPE_MAP lookup per row; unmapped or missing types become 'unknown'.
 
-def _process_batch(df: DataFrame, batch_id: int, spark: SparkSession) -> None:
-    if df.isEmpty():
-        return
+    The map is a literal in the plan, so it ships to every executor with the
+    task: a broadcast lookup with no join and no Python UDF.
+    """
+    lookup = create_map(*chain.from_iterable((lit(k), lit(v)) for k, v in SENSOR_TYPE_MAP.items()))
+    return coalesce(lookup.getItem(lower(raw)), lit("unknown"))
+
+
+def _metrics_column(sensor_type: Column, field: Callable[[str], Column]) -> Column:
+    """Each row's metrics object, picked by its canonical type; field(key) reads a payload key."""
+    metrics = None
+    for canonical, key in METRICS_PATHS.items():
+        matches = sensor_type == canonical
+        metrics = when(matches, field(key)) if metrics is None else metrics.when(matches, field(key))
+    return metrics
+
+
+# Columns every decoder produces, ahead of the time partitions
+_ROW_COLUMNS = ("tenant_id", "farm_id", "sensor_id", "device_id", "timestamp_str",
+                "kafka_time", "location", "metrics", "kafka_topic", "sensor_type")
 
-    log.info("Processing batch %d (%d rows)", batch_id, df.count())
 
-    # ── 1. Parse raw Kafka message ──────────────────────────────────────────
+def _sensor_ids(tenant_fallback: Column, sensor_fallback: Column) -> tuple[Column, Column]:
+    """tenant_id and sensor_id for a row under any topic layout.
+
+    verdantiq.{tenant}.{sensor} names both; verdantiq.tenant.{tenant} names
+    the tenant and the record key the sensor; verdantiq.type.{type} only the
+    key. Whatever the topic does not carry comes from the payload.
+    """
+    level  = col("topic_parts").getItem(1)
+    tenant = (when(level == "tenant", col("topic_parts").getItem(2))
+              .when(level == "type", lit(None).cast(StringType()))
+              .otherwise(level))
+    sensor = (when(level.isin("tenant", "type"), col("key").cast("string"))
+              .otherwise(col("topic_parts").getItem(2)))
+    return coalesce(tenant, tenant_fallback), coalesce(sensor, sensor_fallback)
+
+
+def _json_rows(df: DataFrame) -> DataFrame:
     parsed = (
         df
         .withColumn("json_str",    col("value").cast("string"))
         .withColumn("kafka_topic", col("topic").cast("string"))
+        .withColumn("kafka_time",  col("timestamp"))
         .withColumn("env",         from_json(col("json_str"), _ENVELOPE_SCHEMA))
         .withColumn("device_id",   col("env.device_id"))
         .withColumn("timestamp_str", col("env.timestamp"))
-        # Derive tenant_id / sensor_id from topic first, fall back to envelope
-        # Topic format: verdantiq.{tenant_id}.{sensor_id}
+        # Derive tenant_id / sensor_id from topic (and key) first, fall back to envelope
         .withColumn("topic_parts", split(col("kafka_topic"), r"\."))
-        .withColumn("tenant_id",
-                    coalesce(col("topic_parts").getItem(1), col("env.tenant_id")))
-        .withColumn("sensor_id",
-                    coalesce(col("topic_parts").getItem(2), col("env.sensor_id")))
-        .withColumn("farm_id", col("env.farm_id"))
+    )
+    tenant_id, sensor_id = _sensor_ids(col("env.tenant_id"), col("env.sensor_id"))
+    return (
+        parsed
+        .withColumn("tenant_id", tenant_id)
+        .withColumn("sensor_id", sensor_id)
+        .withColumn("farm_id",   col("env.farm_id"))
+        # Primary: env.sensor_type (parsed from envelope schema — zero extra scan).
+        # Fallback: get_json_object for older payloads that predate the envelope fix.
+        .withColumn("sensor_type",
+                    _canonical_type(coalesce(col("env.sensor_type"),
+                                             get_json_object(col("json_str"), "$.sensor_type"))))
+        .withColumn("location", get_json_object(col("json_str"), "$.location"))
+        .withColumn("metrics",
+                    _metrics_column(col("sensor_type"),
+                                    lambda key: get_json_object(col("json_str"), f"$.{key}")))
+        .select(*_ROW_COLUMNS)
     )
 
-    # ── 2. Group by topic (= per sensor) ───────────────────────────────────
-    topics = [row.kafka_topic for row in parsed.select("kafka_topic").distinct().collect()]
 
-    for topic in topics:
-        parts = topic.split(".")   # verdantiq, tenant_id, sensor_id
-        if len(parts) < 3:
-            log.warning("Unexpected topic format: %s — skipping", topic)
-            continue
+def _avro_field(schema: dict, name: str) -> Column:
+    """A decoded payload field; records become JSON strings like the JSON path."""
+    field = next((f for f in schema["fields"] if f["name"] == name), None)
+    if field is None:
+        return lit(None).cast(StringType())
+    types = field["type"] if isinstance(field["type"], list) else [field["type"]]
+    if any(isinstance(t, dict) and t.get("type") == "record" for t in types):
+        return to_json(col(f"payload.{name}"))
+    if types == ["null"]:
+        return lit(None).cast(StringType())
+    return col(f"payload.{name}").cast(StringType())
 
-        tenant_id = parts[1]
-        sensor_id = parts[2]
 
-        # ── 3. Determine sensor_type ────────────────────────────────────────
-        # Primary: env.sensor_type (parsed from envelope schema — zero extra scan).
-        # Fallback: get_json_object for older payloads that predate the envelope fix.
-        topic_df = parsed.filter(col("kafka_topic") == topic)
-        types_found = [
-            r.sensor_type
-            for r in topic_df
-            .withColumn("sensor_type",
-                        coalesce(col("env.sensor_type"),
-                                 get_json_object(col("json_str"), "$.sensor_type")))
-            .select("sensor_type").distinct().collect()
-            if r.sensor_type
-        ]
-        sensor_type = SENSOR_TYPE_MAP.get(
-            (types_found[0] or "").lower(), "unknown"
-        ) if types_found else "unknown"
-
-        metrics_key = _METRICS_PATHS.get(sensor_type, "")
-
-        # ── 4. Build the row to write ───────────────────────────────────────
-        rows_df = (
-            topic_df
-            .withColumn("event_time",
-                        to_timestamp(col("timestamp_str"), "yyyy-MM-dd'T'HH:mm:ss'Z'"))
-            .withColumn("location",
-                        get_json_object(col("json_str"), "$.location"))
+def _avro_rows(df: DataFrame) -> list[DataFrame]:
+    """Decode Confluent-framed Avro (0x00 | schema id | body), one plan per schema id."""
+    framed = df.withColumn("schema_id",
+                           expr("conv(hex(substring(value, 2, 4)), 16, 10)").cast("int"))
+    schema_ids = [r.schema_id for r in framed.select("schema_id").distinct().collect()]
+    decoded = []
+    for schema_id in schema_ids:
+        try:
+            schema = SCHEMA_REGISTRY.schema(schema_id)
+        except Exception as exc:
+            log.error("No reader schema for id %s — skipping its rows: %s", schema_id, exc)
+            continue
+        tenant_id, sensor_id = _sensor_ids(_avro_field(schema, "tenant_id"),
+                                           _avro_field(schema, "sensor_id"))
+        decoded.append(
+            framed
+            .filter(col("schema_id") == schema_id)
+            .withColumn("payload", from_avro(expr("substring(value, 6, length(value) - 5)"),
+                                             json.dumps(schema), {"mode": "PERMISSIVE"}))
+            .withColumn("kafka_topic", col("topic").cast("string"))
+            .withColumn("kafka_time",  col("timestamp"))
+            .withColumn("topic_parts", split(col("kafka_topic"), r"\."))
+            .withColumn("tenant_id",     tenant_id)
+            .withColumn("sensor_id",     sensor_id)
+            .withColumn("farm_id",       _avro_field(schema, "farm_id"))
+            .withColumn("device_id",     _avro_field(schema, "device_id"))
+            .withColumn("timestamp_str", _avro_field(schema, "timestamp"))
+            # The bridge keeps one schema lineage per sensor type, but a schema
+            # id is not guaranteed to map to one type, so map it per row.
+            .withColumn("sensor_type",   _canonical_type(_avro_field(schema, "sensor_type")))
+            .withColumn("location",      _avro_field(schema, "location"))
             .withColumn("metrics",
-                        get_json_object(col("json_str"),
-                                        f"$.{metrics_key}") if metrics_key
-                        else lit(None).cast(StringType()))
-            .withColumn("year",  year(col("event_time")))
-            .withColumn("month", month(col("event_time")))
-            .withColumn("day",   dayofmonth(col("event_time")))
-            .withColumn("hour",  hour(col("event_time")))
-            .select(
-                col("tenant_id"),
-                col("farm_id"),
-                col("sensor_id"),
-                col("device_id"),
-                col("event_time"),
-                col("location"),
-                col("metrics"),
-                col("kafka_topic").alias("raw_topic"),
-                col("year"),
-                col("month"),
-                col("day"),
-                col("hour"),
-            )
+                        _metrics_column(col("sensor_type"), lambda key: _avro_field(schema, key)))
+            .select(*_ROW_COLUMNS)
+        )
+    return decoded
+
+
+def _event_time() -> Column:
+    """Device timestamp, or the Kafka timestamp when it is missing or skewed."""
+    device = to_timestamp(col("timestamp_str"))   # any ISO-8601: fractions, offsets
+    lag    = col("kafka_time").cast("long") - device.cast("long")
+    sane   = device.isNotNull() & lag.between(-EVENT_TIME_MAX_AHEAD_S, EVENT_TIME_MAX_LATE_S)
+    return when(sane, device).otherwise(col("kafka_time"))
+
+
+def _table_rows(rows: DataFrame) -> DataFrame:
+    """Resolve event_time and its derived columns; sensor_type is kept for routing."""
+    return (
+        rows
+        .withColumn("event_time", _event_time())
+        .withColumn("year",  year(col("event_time")))
+        .withColumn("month", month(col("event_time")))
+        .withColumn("day",   dayofmonth(col("event_time")))
+        .withColumn("hour",  hour(col("event_time")))
+        .select(
+            col("tenant_id"),
+            col("farm_id"),
+            col("sensor_id"),
+            col("device_id"),
+            col("event_time"),
+            col("kafka_time").alias("ingest_time"),
+            col("location"),
+            col("metrics"),
+            col("kafka_topic").alias("raw_topic"),
+            col("year"),
+            col("month"),
+            col("day"),
+            col("hour"),
+            col("sensor_type"),
+        )
+    )
+
+
+def _with_typed_columns(rows: DataFrame, sensor_type: str) -> DataFrame:
+    """Parse the JSON location/metrics strings into the type's struct columns."""
+    for column, (source, fields) in typed_columns(sensor_type).items():
+        rows = rows.withColumn(column, from_json(col(source), struct_ddl(fields)))
+    return rows
+
+
+# ── rollups ───────────────────────────────────────────────────────────────────
+
+_ROLLUP_KEYS = ("tenant_id", "farm_id", "sensor_id")
+
+
+def _stats(field: str, lo: Column, hi: Column, total: Column, n: Column, last: Column) -> Column:
+    """One metric's rollup struct, fields in sensor_schemas.ROLLUP_STATS order."""
+    return struct(lo.alias("min"), hi.alias("max"), total.alias("sum"), n.alias("count"),
+                  (total / n).alias("avg"), last.alias("last")).alias(field)
+
+
+def minute_partials(rows: DataFrame, sensor_type: str) -> DataFrame:
+    """The batch's typed rows aggregated per sensor and minute."""
+    column, (_, fields) = next(iter(rollup_columns(sensor_type).items()))
+    stats = []
+    for field, _ in fields:
+        v = col(column).getField(field)
+        stats.append(_stats(field, min_(v), max_(v), sum_(v), count_(v), max_by(v, col("event_time"))))
+    return (
+        rows
+        .groupBy(*_ROLLUP_KEYS, date_trunc("minute", col("event_time")).alias("bucket_start"))
+        .agg(count_(lit(1)).alias("readings"),
+             max_(col("event_time")).alias("last_time"),
+             struct(*stats).alias(column))
+    )
+
+
+def coarsen(partials: DataFrame, sensor_type: str, unit: str) -> DataFrame:
+    """Finer partials merged into unit-sized buckets; avg is re-derived from
+    sum / count and last comes from the partial with the latest reading."""
+    column, (_, fields) = next(iter(rollup_columns(sensor_type).items()))
+    stats = []
+    for field, _ in fields:
+        s = col(column).getField(field)
+        stats.append(_stats(field, min_(s.getField("min")), max_(s.getField("max")),
+                            sum_(s.getField("sum")), sum_(s.getField("count")),
+                            max_by(s.getField("last"), col("last_time"))))
+    return (
+        partials
+        .groupBy(*_ROLLUP_KEYS, date_trunc(unit, col("bucket_start")).alias("bucket_start"))
+        .agg(sum_(col("readings")).alias("readings"),
+             max_(col("last_time")).alias("last_time"),
+             struct(*stats).alias(column))
+    )
+
+
+def _merge_sql(table: str, source: str, sensor_type: str, unit: str, lo: int, hi: int) -> str:
+    """MERGE combining a batch's partials with the stored buckets.
+
+    The bucket_start range (epoch seconds of the batch's first and last
+    minute) is constant, so Iceberg only scans the partitions it covers.
+    """
+    column, (_, fields) = next(iter(rollup_columns(sensor_type).items()))
+    merged = []
+    for field, _ in fields:
+        t, s = f"t.`{column}`.`{field}`", f"s.`{column}`.`{field}`"
+        n     = f"(coalesce({t}.`count`, 0) + {s}.`count`)"
+        total = f"CASE WHEN {n} = 0 THEN NULL ELSE coalesce({t}.`sum`, 0) + coalesce({s}.`sum`, 0) END"
+        merged.append(
+            f"'{field}', named_struct("
+            f"'min', least({t}.`min`, {s}.`min`), "
+            f"'max', greatest({t}.`max`, {s}.`max`), "
+            f"'sum', {total}, "
+            f"'count', {n}, "
+            f"'avg', ({total}) / {n}, "
+            f"'last', CASE WHEN t.last_time IS NULL OR s.last_time >= t.last_time "
+            f"THEN {s}.`last` ELSE {t}.`last` END)"
         )
+    return f"""
+        MERGE INTO {table} t
+        USING {source} s
+        ON  t.tenant_id = s.tenant_id
+        AND t.sensor_id = s.sensor_id
+        AND t.farm_id <=> s.farm_id
+        AND t.bucket_start = s.bucket_start
+        AND t.bucket_start BETWEEN date_trunc('{unit}', timestamp_seconds({lo})) AND timestamp_seconds({hi})
+        WHEN MATCHED THEN UPDATE SET
+            readings    = t.readings + s.readings,
+            last_time   = greatest(t.last_time, s.last_time),
+            `{column}`  = named_struct({", ".join(merged)})
+        WHEN NOT MATCHED THEN INSERT *
+    """
+
 
-        # ── 5. Ensure Iceberg table exists + write ──────────────────────────
+def _merge_rollup(tables: TableRegistry, sensor_type: str, grain: str,
+                  source: DataFrame, lo: int, hi: int) -> bool:
+    """MERGE source into one rollup, up to ROLLUP_MERGE_ATTEMPTS times (commit
+    conflicts with table maintenance are the usual failure); False if none
+    succeeded."""
+    unit, _ = ROLLUP_GRAINS[grain]
+    view    = f"rollup_{canonical_type(sensor_type)}_{grain}"
+    source.createOrReplaceTempView(view)
+    for attempt in range(1, ROLLUP_MERGE_ATTEMPTS + 1):
+        table = None
         try:
-            ensure_namespace(spark)
-            table = ensure_table(spark, sensor_type)
-            rows_df.writeTo(table).using("iceberg").append()
-            log.info("Wrote %d rows to %s", rows_df.count(), table)
+            table = tables.ensure_rollup(sensor_type, grain)
+            source.sparkSession.sql(_merge_sql(table, view, sensor_type, unit, lo, hi))
+            log.info("Merged rollups into %s", table)
+            return True
         except Exception as exc:
-            log.error("Failed writing to Iceberg [%s]: %s", sensor_type, exc, exc_info=True)
+            if isinstance(exc, AnalysisException) and table:
+                # Re-run the rollup table's DDL before the next attempt
+                tables.invalidate(table)
+            log.warning("Rollup MERGE [%s %s] attempt %d/%d failed: %s",
+                        sensor_type, grain, attempt, ROLLUP_MERGE_ATTEMPTS, exc)
+            if attempt < ROLLUP_MERGE_ATTEMPTS:
+                time.sleep(2 ** (attempt - 1))
+    return False
+
+
+def _write_rollups(rows: DataFrame, sensor_type: str, tables: TableRegistry) -> None:
+    """MERGE the batch into the type's 1-minute, hourly and daily rollups.
+
+    Partials a rollup could not take are held and merged with the next
+    batch's; its watermark keeps queries off them until then. The raw
+    append stands either way.
+    """
+    if not ROLLUPS_ENABLED or not rollup_columns(sensor_type):
+        return
+    partials = minute_partials(rows, sensor_type).persist(StorageLevel.MEMORY_AND_DISK)
+    try:
+        bounds = partials.agg(min_(col("bucket_start").cast("long")).alias("lo"),
+                              max_(col("bucket_start").cast("long")).alias("hi")).first()
+        for grain, (unit, _) in ROLLUP_GRAINS.items():
+            full_name = f"iceberg.sensors.{rollup_table_for(sensor_type, grain)}"
+            try:
+                source = partials if unit == "minute" else coarsen(partials, sensor_type, unit)
+                lo, hi = bounds.lo, bounds.hi
+                held   = tables.held(full_name)
+                if held is not None:
+                    source = coarsen(source.unionByName(held), sensor_type, unit)
+                    lo, hi = source.agg(min_(col("bucket_start").cast("long")),
+                                        max_(col("bucket_start").cast("long"))).first()
+                if _merge_rollup(tables, sensor_type, grain, source, lo, hi):
+                    tables.release(full_name)
+                else:
+                    tables.hold(full_name, next_bucket(unit, hi), source)
+            except Exception as exc:
+                log.error("Failed writing rollups [%s %s]: %s", sensor_type, grain, exc, exc_info=True)
+                tables.hold(full_name, next_bucket(unit, time.time() + EVENT_TIME_MAX_AHEAD_S))
+    finally:
+        partials.unpersist()
+
+
+def _write_table(rows: DataFrame, sensor_type: str, count: int, tables: TableRegistry) -> None:
+    table = None
+    try:
+        table = tables.ensure(sensor_type)
+        rows  = _with_typed_columns(rows, sensor_type)
+        rows.writeTo(table).using("iceberg").append()
+        log.info("Wrote %d rows to %s", count, table)
+        _write_rollups(rows, sensor_type, tables)
+    except AnalysisException as exc:
+        # The table's schema no longer matches what we write: re-run its DDL next batch
+        if table:
+            tables.invalidate(table)
+        log.error("Schema mismatch writing to Iceberg [%s]: %s", sensor_type, exc)
+    except Exception as exc:
+        log.error("Failed writing to Iceberg [%s]: %s", sensor_type, exc, exc_info=True)
+
+
+def _process_batch(df: DataFrame, batch_id: int, tables: TableRegistry) -> None:
+    """Decode the whole batch in one pass, then append once per sensor-type table.
+
+    The decoded rows are persisted so the per-type count and the table writes
+    read them from memory instead of re-reading and re-parsing Kafka.
+    """
+    # Copies made by migrate_topic_layout.py were ingested from their old topic
+    df = df.filter(expr(f"NOT coalesce(exists(headers, h -> h.key = '{MIGRATED_HEADER}'), false)"))
+    # The bridge frames Avro with a 0x00 magic byte; JSON always starts with '{'
+    is_avro = expr("substring(value, 1, 1) = X'00'")
+    decoded = []
+    if SCHEMA_REGISTRY is not None:
+        decoded += _avro_rows(df.filter(is_avro))
+        df = df.filter(~is_avro)
+    decoded.append(_json_rows(df))
+
+    rows = _table_rows(reduce(DataFrame.unionByName, decoded)).persist(StorageLevel.MEMORY_AND_DISK)
+    try:
+        # One job for the whole batch: which tables it touches and how many rows each
+        counts = {r["sensor_type"]: r["count"]
+                  for r in rows.groupBy("sensor_type").count().collect()}
+        if not counts:
+            return
+        log.info("Processing batch %d (%d rows, %d sensor types)",
+                 batch_id, sum(counts.values()), len(counts))
+
+        for sensor_type, count in sorted(counts.items()):
+            _write_table(rows.filter(col("sensor_type") == sensor_type).drop("sensor_type"),
+                         sensor_type, count, tables)
+    finally:
+        rows.unpersist()
 
 
 # ── main streaming query ──────────────────────────────────────────────────────
@@ -307,6 +992,12 @@ def main() -> None:
     log.info("  Iceberg: %s", ICEBERG_REST_URI)
     log.info("  MinIO:   %s", MINIO_ENDPOINT)
 
+    # Rollup buckets (and year/month/day/hour) are cut in UTC
+    spark.conf.set("spark.sql.session.timeZone", "UTC")
+
+    tables = TableRegistry(spark)
+    tables.warm()
+
     # ── Kafka source — subscribePattern auto-discovers new topics ─────────
     kafka_df = (
         spark.readStream
@@ -319,19 +1010,22 @@ def main() -> None:
         .option("kafka.consumer.metadata.max.age.ms", "30000")
         .option("failOnDataLoss",                "false")
         .option("maxOffsetsPerTrigger",          "10000")
+        .option("includeHeaders",                "true")
         .load()
         .select(
             col("topic"),
+            col("key"),
             col("value"),
             col("partition"),
             col("offset"),
             col("timestamp"),
+            col("headers"),
         )
     )
 
     query = (
         kafka_df.writeStream
-        .foreachBatch(lambda df, bid: _process_batch(df, bid, spark))
+        .foreachBatch(lambda df, bid: _process_batch(df, bid, tables))
         .option("checkpointLocation", CHECKPOINT_BASE)
         .trigger(processingTime="5 seconds")
         .start()
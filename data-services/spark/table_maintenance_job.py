@@ -0,0 +1,300 @@
+"""
+VerdantIQ Iceberg table maintenance
+===================================
+Runs next to sensor_streaming_job.py. Its 5-second micro-batches leave many
+small files and one snapshot per append on every table. Every
+MAINTENANCE_INTERVAL_S, for each table in iceberg.sensors:
+
+  0. format migration    rewrite data files not yet in the table's
+                          write.format.default (Avro files from before the
+                          switch to Parquet), MAINTENANCE_FORMAT_DAYS days of
+                          data per run, oldest first, until none are left
+  1. rewrite_data_files   bin-pack small files per partition up to the
+                          table's target file size; only hours that are no
+                          longer being written (event_time < current hour;
+                          bucket_start < current hour, or day for _rollup_1d),
+                          applying the delete files rollup MERGEs leave
+  2. rewrite_manifests    regroup manifests by partition for faster planning
+  3. expire_snapshots     drop snapshots older than the table's
+                          history.expire.max-snapshot-age-ms (keeping the
+                          last MAINTENANCE_RETAIN_SNAPSHOTS) and the files
+                          only they referenced
+  4. remove_orphan_files  delete files no snapshot references, e.g. from
+                          failed writes, once older than MAINTENANCE_ORPHAN_AGE_S
+
+Target file size: the table's write.target-file-size-bytes if set (which
+also steers the streaming writes), else MAINTENANCE_TARGET_FILE_MB. Set it
+per table with
+    ALTER TABLE iceberg.sensors.soil_data
+        SET TBLPROPERTIES ('write.target-file-size-bytes' = '67108864')
+
+Data files, bytes, manifests and snapshots are measured before and after
+each run and served in Prometheus text format on MAINTENANCE_METRICS_PORT.
+
+Run:
+    spark-submit --master spark://spark-master:7077 \\
+        /opt/spark/jobs/table_maintenance_job.py [--once] [--table soil_data]
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+from pyspark.sql import SparkSession
+
+from sensor_streaming_job import build_spark, ensure_namespace
+
+log = logging.getLogger("table-maintenance")
+
+# ── env config ────────────────────────────────────────────────────────────────
+
+INTERVAL_S          = int(os.getenv("MAINTENANCE_INTERVAL_S",          "3600"))
+TARGET_FILE_MB      = int(os.getenv("MAINTENANCE_TARGET_FILE_MB",      "128"))
+MIN_INPUT_FILES     = int(os.getenv("MAINTENANCE_MIN_INPUT_FILES",     "5"))
+SNAPSHOT_MAX_AGE_MS = int(os.getenv("MAINTENANCE_SNAPSHOT_MAX_AGE_MS", "604800000"))
+RETAIN_SNAPSHOTS    = int(os.getenv("MAINTENANCE_RETAIN_SNAPSHOTS",    "10"))
+# Must exceed the longest write in flight, or its uncommitted files go too
+ORPHAN_AGE_S        = int(os.getenv("MAINTENANCE_ORPHAN_AGE_S",        str(3 * 86400)))
+METRICS_PORT        = int(os.getenv("MAINTENANCE_METRICS_PORT",        "9108"))
+FORMAT_DAYS         = int(os.getenv("MAINTENANCE_FORMAT_DAYS",         "7"))
+
+NAMESPACE = "iceberg.sensors"
+
+# ── metrics ───────────────────────────────────────────────────────────────────
+
+_metrics_lock = threading.Lock()
+# (metric, table, phase) → value; phase is "" for metrics without one
+_gauges: Dict[Tuple[str, str, str], float] = {}
+_failures: Dict[str, int] = {}
+
+_HELP = {
+    "iceberg_table_data_files":                   "Data files in the current snapshot",
+    "iceberg_table_data_bytes":                   "Bytes of data files in the current snapshot",
+    "iceberg_table_manifests":                    "Manifests in the current snapshot",
+    "iceberg_table_snapshots":                    "Snapshots retained in table metadata",
+    "iceberg_table_stale_format_files":           "Data files not yet in the table's write format",
+    "iceberg_maintenance_rewritten_files":        "Data files replaced by compaction in the last run",
+    "iceberg_maintenance_expired_files":          "Files deleted with expired snapshots in the last run",
+    "iceberg_maintenance_orphan_files":           "Orphan files removed in the last run",
+    "iceberg_maintenance_duration_seconds":       "Duration of the last maintenance run",
+    "iceberg_maintenance_last_success_timestamp": "Unix time the last run finished",
+}
+
+
+def _set(metric: str, table: str, value: float, phase: str = "") -> None:
+    with _metrics_lock:
+        _gauges[(metric, table, phase)] = value
+
+
+def render_metrics() -> str:
+    with _metrics_lock:
+        gauges, failures = dict(_gauges), dict(_failures)
+    lines = []
+    for metric, help_text in _HELP.items():
+        series = sorted((k, v) for k, v in gauges.items() if k[0] == metric)
+        if not series:
+            continue
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        for (_, table, phase), value in series:
+            labels = f'table="{table}"' + (f',phase="{phase}"' if phase else "")
+            lines.append(f"{metric}{{{labels}}} {value}")
+    lines += ["# HELP iceberg_maintenance_failures_total Failed maintenance runs",
+              "# TYPE iceberg_maintenance_failures_total counter"]
+    lines += [f'iceberg_maintenance_failures_total{{table="{t}"}} {n}' for t, n in sorted(failures.items())]
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):   # keep scrapes out of the job log
+        pass
+
+
+# ── maintenance ───────────────────────────────────────────────────────────────
+
+def _footprint(spark: SparkSession, full_name: str, fmt: str) -> Dict[str, int]:
+    files = spark.sql(f"SELECT count(*) AS n, coalesce(sum(file_size_in_bytes), 0) AS bytes, "
+                      f"count_if(lower(file_format) <> '{fmt}') AS stale "
+                      f"FROM {full_name}.files WHERE content = 0").first()
+    return {
+        "data_files":         files.n,
+        "data_bytes":         files.bytes,
+        "stale_format_files": files.stale,
+        "manifests":  spark.sql(f"SELECT count(*) AS n FROM {full_name}.manifests").first().n,
+        "snapshots":  spark.sql(f"SELECT count(*) AS n FROM {full_name}.snapshots").first().n,
+    }
+
+
+def _record_footprint(table: str, phase: str, footprint: Dict[str, int]) -> None:
+    for key, value in footprint.items():
+        _set(f"iceberg_table_{key}", table, value, phase)
+
+
+def _procedure_sum(rows, column: str) -> int:
+    return sum(getattr(r, column, 0) or 0 for r in rows)
+
+
+def _stale_format_filters(spark: SparkSession, full_name: str, fmt: str) -> list[str]:
+    """One rewrite filter per day holding data files not in fmt, oldest first.
+
+    Files keep the partition spec they were written with: files from before
+    hours(event_time) partitioning are found by their year/month/day
+    partition values, later ones by their event_time hour.
+    """
+    fields = set(spark.table(f"{full_name}.files").schema["partition"].dataType.fieldNames())
+    legacy = ("make_date(partition.year, partition.month, partition.day)"
+              if {"year", "month", "day"} <= fields else "CAST(NULL AS DATE)")
+    hourly = ("to_date(timestamp_seconds(CAST(partition.event_time_hour AS BIGINT) * 3600))"
+              if "event_time_hour" in fields else "CAST(NULL AS DATE)")
+    rows = spark.sql(f"SELECT DISTINCT {legacy} AS legacy_day, {hourly} AS hour_day "
+                     f"FROM {full_name}.files WHERE content = 0 AND lower(file_format) <> '{fmt}'").collect()
+
+    filters = []
+    for r in rows:
+        if r.legacy_day is not None:
+            d = r.legacy_day
+            filters.append((d, f"year = {d.year} AND month = {d.month} AND day = {d.day}"))
+        elif r.hour_day is not None:
+            d = r.hour_day
+            filters.append((d, f"event_time >= TIMESTAMP '{d:%Y-%m-%d}' "
+                               f"AND event_time < TIMESTAMP '{d + timedelta(days=1):%Y-%m-%d}'"))
+    return [where for _, where in sorted(set(filters))]
+
+
+def maintain(spark: SparkSession, table: str) -> None:
+    full_name = f"{NAMESPACE}.{table}"
+    ident     = full_name.split(".", 1)[1]     # procedures take namespace.table
+    props     = {r.key: r.value for r in spark.sql(f"SHOW TBLPROPERTIES {full_name}").collect()}
+    target    = int(props.get("write.target-file-size-bytes", TARGET_FILE_MB << 20))
+    max_age   = int(props.get("history.expire.max-snapshot-age-ms", SNAPSHOT_MAX_AGE_MS))
+    fmt       = props.get("write.format.default", "parquet").lower()
+    now       = datetime.now(timezone.utc)
+    open_hour = now.replace(minute=0, second=0, microsecond=0)
+    # Rollup tables (sensor_streaming_job.ROLLUP_GRAINS) are keyed by bucket
+    # and keep being MERGEd into until their bucket closes
+    time_col, cutoff = "event_time", open_hour
+    if "_rollup_" in table:
+        time_col = "bucket_start"
+        if table.endswith("_1d"):
+            cutoff = open_hour.replace(hour=0)
+
+    started = time.monotonic()
+    before  = _footprint(spark, full_name, fmt)
+    _record_footprint(table, "before", before)
+
+    migrated = []
+    if before["stale_format_files"]:
+        filters = _stale_format_filters(spark, full_name, fmt)
+        for where in filters[:FORMAT_DAYS]:
+            migrated += spark.sql(f"""
+                CALL iceberg.system.rewrite_data_files(
+                    table   => '{ident}',
+                    where   => "{where}",
+                    options => map(
+                        'rewrite-all',              'true',
+                        'target-file-size-bytes',   '{target}',
+                        'partial-progress.enabled', 'true'))
+            """).collect()
+        log.info("%s: rewrote %d of %d days still holding non-%s files",
+                 full_name, min(len(filters), FORMAT_DAYS), len(filters), fmt)
+
+    rewritten = migrated + spark.sql(f"""
+        CALL iceberg.system.rewrite_data_files(
+            table    => '{ident}',
+            strategy => 'binpack',
+            where    => "{time_col} < TIMESTAMP '{cutoff:%Y-%m-%d %H:%M:%S}'",
+            options  => map(
+                'target-file-size-bytes',   '{target}',
+                'min-input-files',          '{MIN_INPUT_FILES}',
+                'delete-file-threshold',    '1',
+                'partial-progress.enabled', 'true'))
+    """).collect()
+    spark.sql(f"CALL iceberg.system.rewrite_manifests('{ident}')").collect()
+    expired = spark.sql(f"""
+        CALL iceberg.system.expire_snapshots(
+            table       => '{ident}',
+            older_than  => TIMESTAMP '{now - timedelta(milliseconds=max_age):%Y-%m-%d %H:%M:%S}',
+            retain_last => {RETAIN_SNAPSHOTS})
+    """).collect()
+    orphans = spark.sql(f"""
+        CALL iceberg.system.remove_orphan_files(
+            table      => '{ident}',
+            older_than => TIMESTAMP '{now - timedelta(seconds=ORPHAN_AGE_S):%Y-%m-%d %H:%M:%S}')
+    """).collect()
+
+    after   = _footprint(spark, full_name, fmt)
+    elapsed = time.monotonic() - started
+    _record_footprint(table, "after", after)
+    _set("iceberg_maintenance_rewritten_files", table,
+         _procedure_sum(rewritten, "rewritten_data_files_count"))
+    _set("iceberg_maintenance_expired_files", table,
+         _procedure_sum(expired, "deleted_data_files_count")
+         + _procedure_sum(expired, "deleted_manifest_files_count")
+         + _procedure_sum(expired, "deleted_manifest_lists_count"))
+    _set("iceberg_maintenance_orphan_files", table, len(orphans))
+    _set("iceberg_maintenance_duration_seconds", table, round(elapsed, 3))
+    _set("iceberg_maintenance_last_success_timestamp", table, time.time())
+    log.info("%s: files %d → %d, bytes %d → %d, manifests %d → %d, snapshots %d → %d, "
+             "orphans %d (%.1fs)", full_name,
+             before["data_files"], after["data_files"], before["data_bytes"], after["data_bytes"],
+             before["manifests"], after["manifests"], before["snapshots"], after["snapshots"],
+             len(orphans), elapsed)
+
+
+def run_once(spark: SparkSession, tables: list[str] | None) -> None:
+    names = tables or [r.tableName for r in spark.sql(f"SHOW TABLES IN {NAMESPACE}").collect()]
+    for table in sorted(names):
+        try:
+            maintain(spark, table)
+        except Exception as exc:
+            with _metrics_lock:
+                _failures[table] = _failures.get(table, 0) + 1
+            log.error("Maintenance failed for %s: %s", table, exc, exc_info=True)
+
+
+# ── main ──────────────────────────────────────────────────────────────────────
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compact and expire Iceberg sensor tables")
+    parser.add_argument("--once",  action="store_true", help="run one pass and exit")
+    parser.add_argument("--table", action="append", help="table in iceberg.sensors (repeatable); default all")
+    args = parser.parse_args()
+
+    spark = build_spark("VerdantIQ-TableMaintenance")
+    spark.sparkContext.setLogLevel("WARN")
+    spark.conf.set("spark.sql.session.timeZone", "UTC")   # TIMESTAMP literals below are UTC
+    ensure_namespace(spark)
+
+    if args.once:
+        run_once(spark, args.table)
+        spark.stop()
+        return
+
+    server = ThreadingHTTPServer(("0.0.0.0", METRICS_PORT), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    log.info("Table maintenance every %ds; metrics on :%d/metrics", INTERVAL_S, METRICS_PORT)
+    while True:
+        started = time.monotonic()
+        run_once(spark, args.table)
+        time.sleep(max(0.0, INTERVAL_S - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Iceberg file-format benchmark
+=============================
+Copies a sensor table into one table per file format and runs the same
+representative queries against each copy through Trino. The report records
+bytes scanned and the Query Units each query would be billed:
+
+  point      latest 100 readings of one sensor (get_sensor_data's shape)
+  device     readings of one device over the whole table
+  metric     hourly average of one typed metric for a tenant, last 7 days
+  tenant     row count per tenant (full scan of one column)
+  raw        the JSON metrics string for one sensor-day (/query/ console style)
+
+The copies are written by Trino (CREATE TABLE ... WITH (format = ...)) with
+the streaming job's partitioning and sort order; Trino writes Parquet with
+ZSTD and column statistics but not bloom filters, so point/device figures
+for Parquet are conservative compared with tables written by Spark.
+
+  pip install trino
+  python data-services/trino/format_benchmark.py --table soil_data \\
+      --formats avro parquet --runs 5 --output format-bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import trino
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "spark"))
+from sensor_schemas import METRIC_FIELDS, METRICS_PATHS  # noqa: E402
+
+BENCH_SCHEMA = "format_bench"
+
+# Mirrors backend/services/sensor/crud.calculate_qu
+QU_MIN          = 1.0
+QU_BYTES_WEIGHT = 1.0
+QU_CPU_WEIGHT   = 2.0
+QU_MEM_WEIGHT   = 0.5
+
+
+def calculate_qu(stats: dict) -> float:
+    bytes_gb = stats.get("processedBytes", 0) / (1024 ** 3)
+    cpu_s    = stats.get("cpuTimeMillis", 0) / 1_000
+    mem_gb_s = stats.get("peakMemoryBytes", 0) / (1024 ** 3) * stats.get("wallTimeMillis", 0) / 1_000
+    return round(max(QU_MIN, QU_BYTES_WEIGHT * bytes_gb + QU_CPU_WEIGHT * cpu_s
+                     + QU_MEM_WEIGHT * mem_gb_s), 4)
+
+
+def _run(cur, sql: str) -> dict:
+    started = time.perf_counter()
+    cur.execute(sql)
+    cur.fetchall()
+    stats = dict(cur.stats)
+    stats["clientMillis"] = round((time.perf_counter() - started) * 1000, 1)
+    return stats
+
+
+def _copy(cur, source: str, target: str, fmt: str) -> None:
+    cur.execute(f"DROP TABLE IF EXISTS {target}")
+    cur.fetchall()
+    cur.execute(f"""
+        CREATE TABLE {target}
+        WITH (format       = '{fmt.upper()}',
+              partitioning = ARRAY['hour(event_time)', 'bucket(tenant_id, 16)'],
+              sorted_by    = ARRAY['tenant_id', 'sensor_id', 'event_time'])
+        AS SELECT * FROM {source}
+    """)
+    cur.fetchall()
+
+
+def _queries(cur, source: str, sensor_type: str) -> Dict[str, str]:
+    """Representative queries, parameterised with a real sensor from the source."""
+    cur.execute(f"SELECT tenant_id, sensor_id, device_id, date(event_time) "
+                f"FROM {source} ORDER BY event_time DESC LIMIT 1")
+    row = cur.fetchall()
+    if not row:
+        raise SystemExit(f"{source} is empty — nothing to benchmark")
+    tenant, sensor, device, day = row[0]
+    queries = {
+        "point":  f"SELECT event_time, metrics FROM {{t}} WHERE sensor_id = '{sensor}' "
+                  f"AND tenant_id = '{tenant}' ORDER BY event_time DESC LIMIT 100",
+        "device": f"SELECT count(*), max(event_time) FROM {{t}} WHERE device_id = '{device}'",
+        "tenant": "SELECT tenant_id, count(*) FROM {t} GROUP BY tenant_id",
+        "raw":    f"SELECT event_time, metrics FROM {{t}} WHERE sensor_id = '{sensor}' "
+                  f"AND event_time >= DATE '{day}' AND event_time < DATE '{day}' + INTERVAL '1' DAY",
+    }
+    if sensor_type in METRIC_FIELDS:
+        column, field = METRICS_PATHS[sensor_type], METRIC_FIELDS[sensor_type][0][0]
+        queries["metric"] = (
+            f"SELECT date_trunc('hour', event_time), avg({column}.{field}) FROM {{t}} "
+            f"WHERE tenant_id = '{tenant}' AND event_time >= current_timestamp - INTERVAL '7' DAY "
+            f"GROUP BY 1")
+    return queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare Iceberg file formats through Trino")
+    parser.add_argument("--host",    default=os.getenv("TRINO_HOST", "localhost"))
+    parser.add_argument("--port",    type=int, default=int(os.getenv("TRINO_PORT", "8085")))
+    parser.add_argument("--user",    default=os.getenv("TRINO_USER", "benchmark"))
+    parser.add_argument("--table",   default="soil_data", help="table in iceberg.sensors")
+    parser.add_argument("--formats", nargs="+", default=["avro", "parquet"])
+    parser.add_argument("--runs",    type=int, default=5)
+    parser.add_argument("--keep",    action="store_true", help="keep the copies afterwards")
+    parser.add_argument("--output",  default=None)
+    args = parser.parse_args()
+
+    cur = trino.dbapi.connect(host=args.host, port=args.port, user=args.user,
+                              catalog="iceberg").cursor()
+    source      = f"iceberg.sensors.{args.table}"
+    sensor_type = args.table.removesuffix("_data")
+    queries     = _queries(cur, source, sensor_type)
+    cur.execute(f"CREATE SCHEMA IF NOT EXISTS iceberg.{BENCH_SCHEMA}")
+    cur.fetchall()
+
+    report: Dict[str, Dict[str, dict]] = {}
+    for fmt in args.formats:
+        target = f"iceberg.{BENCH_SCHEMA}.{args.table}_{fmt}"
+        _copy(cur, source, target, fmt)
+        report[fmt] = {}
+        for name, sql in queries.items():
+            runs: List[dict] = [_run(cur, sql.format(t=target)) for _ in range(args.runs)]
+            report[fmt][name] = {
+                "processed_bytes":      statistics.median(r.get("processedBytes", 0) for r in runs),
+                "physical_input_bytes": statistics.median(r.get("physicalInputBytes", 0) for r in runs),
+                "cpu_ms":               statistics.median(r.get("cpuTimeMillis", 0) for r in runs),
+                "wall_ms":              statistics.median(r.get("wallTimeMillis", 0) for r in runs),
+                "qu":                   statistics.median(calculate_qu(r) for r in runs),
+            }
+        if not args.keep:
+            cur.execute(f"DROP TABLE {target}")
+            cur.fetchall()
+
+    baseline = args.formats[0]
+    print(f"{'query':8} {'format':8} {'bytes scanned':>15} {'vs ' + baseline:>10} {'QU':>8}")
+    for name in queries:
+        base = report[baseline][name]["physical_input_bytes"] or 1
+        for fmt in args.formats:
+            r = report[fmt][name]
+            print(f"{name:8} {fmt:8} {r['physical_input_bytes']:>15,.0f} "
+                  f"{r['physical_input_bytes'] / base:>10.2f} {r['qu']:>8.4f}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            "table": source, "runs": args.runs, "queries": queries, "results": report,
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()